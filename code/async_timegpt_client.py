@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+异步并发TimeGPT客户端
+- 并发上限（asyncio.Semaphore）和令牌桶限流
+- 可重试错误（429/5xx/连接错误）按带抖动的指数退避重试
+- 相同的在途请求合并为一次调用（按序列指纹、预测时长、频率合并）
+- 重试耗尽后可回退到NixtlaTimeGPTIntegration的本地预测后端
+
+传输层可替换：
+- SDKTransport: 在线程池中调用nixtla SDK（生产环境）
+- HTTPJSONTransport: 调用简化JSON协议的HTTP服务（本地桩服务 timegpt_stub_server.py）
+
+用法（对本地桩服务做吞吐测试，无需网络）:
+    python async_timegpt_client.py --series 200 --concurrency 16 --rate 50
+"""
+
+import time
+import random
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, Hashable
+
+import numpy as np
+import pandas as pd
+import requests
+
+from nixtla_timegpt_integration import (NixtlaTimeGPTIntegration, simulate_anomaly_frame,
+                                        split_timegpt_forecast)
+from result_cache import forecast_cache_key
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TimeGPTRequestError(Exception):
+    """TimeGPT请求失败（带HTTP状态码和服务端建议的重试等待时间）"""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRYABLE_STATUS
+
+
+class AsyncRateLimiter:
+    """异步令牌桶限流器"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        Args:
+            rate: 每秒补充的令牌数（<=0表示不限流）
+            burst: 桶容量，默认为max(1, rate)
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """获取一个令牌，不足时等待"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SDKTransport:
+    """nixtla SDK传输层（SDK为同步接口，放到线程池中执行）"""
+
+    def __init__(self, client):
+        """
+        Args:
+            client: nixtla.NixtlaClient实例
+        """
+        self.client = client
+
+    def forecast(self, df: pd.DataFrame, horizon: int, freq: str) -> pd.DataFrame:
+        series = df.copy()
+        series.columns = ['ds', 'y']
+        series['unique_id'] = 'series_1'
+        return self.client.forecast(df=series, h=horizon, freq=freq, level=[80, 95])
+
+    def detect_anomalies(self, df: pd.DataFrame, freq: str) -> pd.DataFrame:
+        series = df.copy()
+        series.columns = ['ds', 'y']
+        series['unique_id'] = 'series_1'
+        return self.client.detect_anomalies(df=series, freq=freq)
+
+
+class HTTPJSONTransport:
+    """简化JSON协议的HTTP传输层（对接本地桩服务）"""
+
+    def __init__(self, base_url: str, timeout: float = 30, pool_size: int = 32):
+        """
+        Args:
+            base_url: 服务地址
+            timeout: 请求超时（秒）
+            pool_size: 连接池大小（应不小于客户端并发上限）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = self.session.post(f"{self.base_url}{path}", json=payload,
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            raise TimeGPTRequestError(f"连接失败: {e}") from e
+
+        if response.status_code != 200:
+            retry_after = response.headers.get('Retry-After')
+            raise TimeGPTRequestError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                status=response.status_code,
+                retry_after=float(retry_after) if retry_after else None,
+            )
+        return response.json()
+
+    @staticmethod
+    def _series_payload(df: pd.DataFrame) -> Dict[str, Any]:
+        return {'ds': df.iloc[:, 0].astype(str).tolist(),
+                'y': df.iloc[:, 1].astype(float).tolist()}
+
+    def forecast(self, df: pd.DataFrame, horizon: int, freq: str) -> pd.DataFrame:
+        payload = {**self._series_payload(df), 'h': horizon, 'freq': freq, 'level': [80, 95]}
+        forecast = pd.DataFrame(self._post('/forecast', payload))
+        forecast['ds'] = pd.to_datetime(forecast['ds'])
+        forecast.insert(0, 'unique_id', 'series_1')
+        return forecast
+
+    def detect_anomalies(self, df: pd.DataFrame, freq: str) -> pd.DataFrame:
+        payload = {**self._series_payload(df), 'freq': freq}
+        anomalies = pd.DataFrame(self._post('/anomaly_detection', payload))
+        anomalies['timestamp'] = pd.to_datetime(anomalies['timestamp'])
+        return anomalies
+
+
+class AsyncTimeGPTClient:
+    """异步并发TimeGPT客户端"""
+
+    def __init__(self,
+                 transport,
+                 max_concurrency: int = 8,
+                 rate_limit: float = 10.0,
+                 max_retries: int = 4,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 20.0,
+                 fallback: Optional[NixtlaTimeGPTIntegration] = None):
+        """
+        Args:
+            transport: 传输层（SDKTransport或HTTPJSONTransport）
+            max_concurrency: 最大并发请求数
+            rate_limit: 每秒最多发出的请求数（<=0表示不限流）
+            max_retries: 最大重试次数
+            backoff_base: 退避基数（秒）
+            backoff_max: 单次退避上限（秒）
+            fallback: 重试耗尽后使用其本地预测后端，为None时抛出异常
+        """
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fallback = fallback
+
+        # 信号量和限流器绑定事件循环，每个事件循环各建一份
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiter: Optional[AsyncRateLimiter] = None
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # 传输层为同步调用，线程数与并发上限一致（默认线程池在少核机器上会先成为瓶颈）
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='timegpt')
+
+        self.stats = {
+            'requests': 0,
+            'calls': 0,
+            'retries': 0,
+            'coalesced': 0,
+            'fallbacks': 0,
+            'failures': 0,
+        }
+
+    def _ensure_primitives(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._inflight.clear()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._limiter = AsyncRateLimiter(self.rate_limit)
+
+    def close(self):
+        """释放线程池"""
+        self._executor.shutdown(wait=False)
+
+    def _backoff(self, attempt: int, error: TimeGPTRequestError) -> float:
+        """带抖动的指数退避（full jitter），服务端给出Retry-After时不早于该时间"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if error.retry_after:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    async def _call(self, func: Callable, *args) -> Any:
+        """限流 + 并发控制 + 重试"""
+        self._ensure_primitives()
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            async with self._semaphore:
+                self.stats['calls'] += 1
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        self._executor, func, *args)
+                except TimeGPTRequestError as e:
+                    error = e
+                except (ValueError, TypeError, KeyError):
+                    raise
+                except Exception as e:
+                    # SDK抛出的网络/服务端异常统一按可重试处理
+                    error = TimeGPTRequestError(str(e))
+
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._backoff(attempt, error))
+            attempt += 1
+
+    async def _coalesced(self, key: Hashable, factory: Callable) -> Any:
+        """相同key的在途请求共享同一个任务"""
+        self._ensure_primitives()
+        self.stats['requests'] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+        # shield：某个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+
+    async def forecast(self, df: pd.DataFrame, horizon: int = 168,
+                       freq: str = 'H') -> pd.DataFrame:
+        """
+        单序列预测
+
+        Args:
+            df: 历史数据DataFrame（时间戳列、数值列）
+            horizon: 预测时长
+            freq: 数据频率
+
+        Returns:
+            预测结果DataFrame，列为timestamp/forecast/lower_80/upper_80/lower_95/upper_95
+        """
+        async def run():
+            try:
+                raw = await self._call(self.transport.forecast, df, horizon, freq)
+                return next(iter(split_timegpt_forecast(raw).values()))
+            except TimeGPTRequestError as e:
+                return self._fallback_or_raise(e, lambda: self.fallback.fallback_forecast(
+                    df, horizon, freq))
+
+        key = ('forecast',) + forecast_cache_key(df, horizon, freq, 'timegpt')
+        return (await self._coalesced(key, run)).copy()
+
+    async def detect_anomalies(self, df: pd.DataFrame, freq: str = 'H') -> pd.DataFrame:
+        """单序列异常检测"""
+        async def run():
+            try:
+                return await self._call(self.transport.detect_anomalies, df, freq)
+            except TimeGPTRequestError as e:
+                return self._fallback_or_raise(e, lambda: simulate_anomaly_frame(df))
+
+        key = ('anomaly',) + forecast_cache_key(df, 0, freq, 'timegpt')
+        return (await self._coalesced(key, run)).copy()
+
+    def _fallback_or_raise(self, error: TimeGPTRequestError, local: Callable) -> pd.DataFrame:
+        if self.fallback is None:
+            self.stats['failures'] += 1
+            raise error
+        self.stats['fallbacks'] += 1
+        print(f"⚠️  TimeGPT请求重试耗尽，使用本地预测: {error}")
+        return local()
+
+    async def forecast_many(self, frames: Dict[str, pd.DataFrame], horizon: int = 168,
+                            freq: str = 'H') -> Dict[str, Any]:
+        """
+        并发预测多条序列
+
+        Args:
+            frames: {序列标识: 历史数据DataFrame}
+            horizon: 预测时长
+            freq: 数据频率
+
+        Returns:
+            {序列标识: 预测结果DataFrame或异常对象}（单条失败不影响其他序列）
+        """
+        keys = list(frames)
+        results = await asyncio.gather(*(self.forecast(frames[k], horizon, freq) for k in keys),
+                                       return_exceptions=True)
+        return dict(zip(keys, results))
+
+    async def detect_anomalies_many(self, frames: Dict[str, pd.DataFrame],
+                                    freq: str = 'H') -> Dict[str, Any]:
+        """并发检测多条序列的异常"""
+        keys = list(frames)
+        results = await asyncio.gather(*(self.detect_anomalies(frames[k], freq) for k in keys),
+                                       return_exceptions=True)
+        return dict(zip(keys, results))
+
+
+def _make_frames(n_series: int, length: int, duplicate_ratio: float, seed: int = 0):
+    """生成测试序列，其中一部分与其他序列完全相同（用于验证请求合并）"""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2025-01-01', periods=length, freq='h')
+    t = np.arange(length)
+    n_unique = max(1, int(n_series * (1 - duplicate_ratio)))
+    unique = [
+        pd.DataFrame({'timestamp': timestamps,
+                      'value': 90 - 0.01 * t + 2 * np.sin(2 * np.pi * t / 24)
+                      + rng.normal(0, 0.5, length)})
+        for _ in range(n_unique)
+    ]
+    return {f"tractor_{i:04d}": unique[i % n_unique] for i in range(n_series)}
+
+
+def main():
+    from timegpt_stub_server import TimeGPTStubServer
+
+    parser = argparse.ArgumentParser(description="异步TimeGPT客户端吞吐测试（本地桩服务）")
+    parser.add_argument("--url", default=None, help="已运行的桩服务地址，默认在进程内启动")
+    parser.add_argument("--series", type=int, default=200, help="序列数")
+    parser.add_argument("--length", type=int, default=720, help="每条序列长度")
+    parser.add_argument("--horizon", type=int, default=168, help="预测时长")
+    parser.add_argument("--duplicates", type=float, default=0.25, help="重复序列占比")
+    parser.add_argument("--concurrency", type=int, default=16, help="最大并发数")
+    parser.add_argument("--rate", type=float, default=50.0, help="客户端限流（请求/秒）")
+    parser.add_argument("--latency", type=float, default=0.2, help="桩服务响应延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="桩服务随机503概率")
+
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = TimeGPTStubServer(latency=args.latency, error_rate=args.error_rate).start()
+        url = server.url
+        print(f"✓ 已启动本地桩服务: {url}")
+
+    frames = _make_frames(args.series, args.length, args.duplicates)
+    client = AsyncTimeGPTClient(HTTPJSONTransport(url),
+                                max_concurrency=args.concurrency,
+                                rate_limit=args.rate,
+                                backoff_base=0.1,
+                                fallback=NixtlaTimeGPTIntegration(seed=0))
+
+    start = time.perf_counter()
+    results = asyncio.run(client.forecast_many(frames, horizon=args.horizon))
+    elapsed = time.perf_counter() - start
+
+    failed = sum(isinstance(r, Exception) for r in results.values())
+    print(f"\n[信息] 序列数: {len(frames)}，失败: {failed}")
+    print(f"[信息] 耗时: {elapsed:.2f}s，吞吐: {len(frames) / elapsed:.1f} 序列/秒")
+    print(f"[信息] 客户端统计: {client.stats}")
+    serial = client.stats['calls'] * args.latency
+    print(f"[信息] 串行调用预计耗时: {serial:.1f}s（加速 {serial / elapsed:.1f}x）")
+
+    client.close()
+    if server is not None:
+        print(f"[信息] 桩服务统计: {server.stats}")
+        server.stop()
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+离线模拟预测性能基准
+对比逐步循环的旧实现与向量化实现（单序列、以及多序列堆叠的二维输入），
+展示预测时长扩展到一年（horizon=8760小时）时的耗时变化
+
+用法:
+    python benchmark_fallback_forecast.py
+    python benchmark_fallback_forecast.py --horizons 168 720 8760 --series 1 100 1000
+"""
+
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from nixtla_timegpt_integration import NixtlaTimeGPTIntegration
+
+
+def legacy_simulate_forecast(values: np.ndarray, horizon: int) -> np.ndarray:
+    """旧实现的预测循环（每一步重新计算标准差），仅用于对比"""
+    x = np.arange(len(values))
+    trend = np.polyfit(x, values, 1)[0]
+    seasonal = values[-24:] if len(values) >= 24 else values
+
+    forecast_values = []
+    for i in range(horizon):
+        trend_component = values[-1] + trend * (i + 1)
+        seasonal_component = seasonal[i % len(seasonal)] - np.mean(seasonal)
+        noise = np.random.normal(0, np.std(values) * 0.1)
+        forecast_values.append(trend_component + seasonal_component * 0.3 + noise)
+
+    return np.array([
+        forecast_values,
+        [v - np.std(values) * 1.28 for v in forecast_values],
+        [v + np.std(values) * 1.28 for v in forecast_values],
+        [v - np.std(values) * 1.96 for v in forecast_values],
+        [v + np.std(values) * 1.96 for v in forecast_values],
+    ])
+
+
+def make_history(n_series: int, length: int, seed: int = 0) -> np.ndarray:
+    """生成(序列数, 长度)的带日周期历史数据"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(length)
+    base = rng.uniform(80, 95, size=(n_series, 1))
+    return (base + 0.01 * t + 2 * np.sin(2 * np.pi * t / 24)
+            + rng.normal(0, 0.5, size=(n_series, length)))
+
+
+def timed(func, repeat: int = 3) -> float:
+    """取多次运行的最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_equivalence(values: np.ndarray, horizon: int = 168) -> bool:
+    """扣除噪声项后，向量化结果应与旧实现一致"""
+    std = np.std(values)
+
+    vectorized = NixtlaTimeGPTIntegration(seed=0).simulate_forecast_values(values, horizon)
+    vectorized_noise = np.random.default_rng(0).standard_normal(horizon) * std * 0.1
+
+    np.random.seed(0)
+    legacy = legacy_simulate_forecast(values, horizon)
+    np.random.seed(0)
+    legacy_noise = np.array([np.random.normal(0, std * 0.1) for _ in range(horizon)])
+
+    diff = np.max(np.abs((vectorized['forecast'] - vectorized_noise) - (legacy[0] - legacy_noise)))
+    print(f"  扣除噪声后与旧实现的最大偏差: {diff:.2e}")
+    return diff < 1e-6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线模拟预测性能基准")
+    parser.add_argument("--history", type=int, default=720, help="历史长度（小时）")
+    parser.add_argument("--horizons", type=int, nargs='+', default=[168, 720, 2160, 8760],
+                        help="预测时长列表")
+    parser.add_argument("--series", type=int, nargs='+', default=[1, 100, 1000],
+                        help="堆叠序列数列表")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数")
+
+    args = parser.parse_args()
+
+    timegpt = NixtlaTimeGPTIntegration(seed=42)
+    max_series = max(args.series)
+    history = make_history(max_series, args.history)
+
+    print("=" * 70)
+    print("离线模拟预测性能基准")
+    print("=" * 70)
+
+    print("\n[1] 正确性检查")
+    print(f"  {'✓' if check_equivalence(history[0]) else '✗'} 向量化实现与旧实现一致")
+
+    print("\n[2] 单序列：旧循环 vs 向量化")
+    print(f"  {'horizon':>8} {'旧实现(ms)':>12} {'向量化(ms)':>12} {'加速比':>8}")
+    for horizon in args.horizons:
+        legacy = timed(lambda: legacy_simulate_forecast(history[0], horizon), args.repeat)
+        vectorized = timed(lambda: timegpt.simulate_forecast_values(history[0], horizon),
+                           args.repeat)
+        print(f"  {horizon:>8} {legacy * 1000:>12.2f} {vectorized * 1000:>12.2f} "
+              f"{legacy / vectorized:>7.1f}x")
+
+    print("\n[3] 多序列堆叠（二维输入，一次调用）")
+    print(f"  {'序列数':>6} {'horizon':>8} {'耗时(ms)':>10} {'每序列(µs)':>12}")
+    for n_series in args.series:
+        for horizon in args.horizons:
+            elapsed = timed(lambda: timegpt.simulate_forecast_values(history[:n_series], horizon),
+                            args.repeat)
+            print(f"  {n_series:>6} {horizon:>8} {elapsed * 1000:>10.2f} "
+                  f"{elapsed / n_series * 1e6:>12.1f}")
+
+    print("\n[4] DataFrame接口（含时间戳生成）")
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=args.history, freq='h'),
+        'value': history[0],
+    })
+    for horizon in args.horizons:
+        elapsed = timed(lambda: timegpt.fallback_forecast(df, horizon, 'H'), args.repeat)
+        print(f"  horizon={horizon:>5}: {elapsed * 1000:.2f} ms")
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
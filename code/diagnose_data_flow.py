@@ -4,11 +4,15 @@
 检查T-BOX → MQTT → VictoriaMetrics的数据流是否正常
 """
 
-import requests
 import json
 import subprocess
 import time
 
+from vm_query_client import VictoriaMetricsClient
+
+# 各检查步骤共用一个客户端（连接复用、统一超时和重试）
+vm_client = VictoriaMetricsClient(timeout=5)
+
 def check_docker_containers():
     """检查Docker容器状态"""
     print("=" * 60)
@@ -89,26 +93,15 @@ def check_victoriametrics():
     
     try:
         # 检查vmselect查询接口
-        response = requests.get(
-            "http://localhost:8481/select/0/prometheus/api/v1/query",
-            params={"query": "up"},
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            print("✓ VictoriaMetrics查询接口可访问")
-            data = response.json()
-            print(f"  查询结果: {len(data.get('data', {}).get('result', []))} 个指标")
-        else:
-            print(f"✗ VictoriaMetrics查询接口返回错误: HTTP {response.status_code}")
-            return False
+        result = vm_client.query("up")
+        print("✓ VictoriaMetrics查询接口可访问")
+        print(f"  查询结果: {len(result)} 个指标")
         
         # 检查vminsert写入接口
-        response = requests.get("http://localhost:8480/health", timeout=5)
-        if response.status_code == 200:
+        if vm_client.health('insert'):
             print("✓ VictoriaMetrics写入接口可访问")
         else:
-            print(f"✗ VictoriaMetrics写入接口返回错误: HTTP {response.status_code}")
+            print("✗ VictoriaMetrics写入接口不可访问")
             return False
         
         print()
@@ -133,31 +126,23 @@ def check_tractor_data():
             "tractor_operation_hours"
         ]
         
+        # 一个正则查询取回所有指标
+        latest = vm_client.query_many(queries)
+        
         has_data = False
         for query in queries:
-            response = requests.get(
-                "http://localhost:8481/select/0/prometheus/api/v1/query",
-                params={"query": query},
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get('data', {}).get('result', [])
-                if results:
-                    print(f"✓ {query}: {len(results)} 个数据点")
-                    has_data = True
-                    # 显示第一个数据点的详细信息
-                    if results:
-                        first_result = results[0]
-                        labels = first_result.get('metric', {})
-                        value = first_result.get('value', [None, None])[1]
-                        print(f"  标签: {labels}")
-                        print(f"  值: {value}")
-                else:
-                    print(f"✗ {query}: 无数据")
+            results = latest.get(query, [])
+            if results:
+                print(f"✓ {query}: {len(results)} 个数据点")
+                has_data = True
+                # 显示第一个数据点的详细信息
+                first_result = results[0]
+                labels = first_result.get('metric', {})
+                value = first_result.get('value', [None, None])[1]
+                print(f"  标签: {labels}")
+                print(f"  值: {value}")
             else:
-                print(f"✗ {query}: 查询失败 (HTTP {response.status_code})")
+                print(f"✗ {query}: 无数据")
         
         print()
         return has_data
@@ -173,27 +158,16 @@ def check_vehicle_ids():
     print("=" * 60)
     
     try:
-        response = requests.get(
-            "http://localhost:8481/select/0/prometheus/api/v1/label/vehicle_id/values",
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            vehicle_ids = data.get('data', [])
-            if vehicle_ids:
-                print(f"✓ 找到 {len(vehicle_ids)} 个车辆ID:")
-                for vid in vehicle_ids:
-                    print(f"  - {vid}")
-            else:
-                print("✗ 未找到车辆ID")
-                print("  这意味着没有数据写入VictoriaMetrics")
-            print()
-            return len(vehicle_ids) > 0
+        vehicle_ids = vm_client.label_values("vehicle_id")
+        if vehicle_ids:
+            print(f"✓ 找到 {len(vehicle_ids)} 个车辆ID:")
+            for vid in vehicle_ids:
+                print(f"  - {vid}")
         else:
-            print(f"✗ 查询车辆ID失败: HTTP {response.status_code}")
-            print()
-            return False
+            print("✗ 未找到车辆ID")
+            print("  这意味着没有数据写入VictoriaMetrics")
+        print()
+        return len(vehicle_ids) > 0
     except Exception as e:
         print(f"✗ 检查车辆ID失败: {e}")
         print()
@@ -1,142 +1,305 @@
 #!/usr/bin/env python3
 """
 诊断VictoriaMetrics中的指标
-列出所有可用的指标名称和最新值
+一次批量查询得到 指标 × 车辆 的在线矩阵（每个格子为最后一个样本距今的时间），事故处理时几秒内给出结果：
+
+- 所有指标按正则分组（通常只有一组），每组一个 max by (__name__, vehicle_id) (tlast_over_time(...)) 查询，
+  各组并发执行
+- 某组查询失败（超时、序列过多）时，该组改为逐指标查询，通过有界线程池并发执行
+- 仪表板需要的指标直接从 grafana/grafana_dashboard.json 的查询表达式中提取
+
+用法:
+    python diagnose_metrics.py
+    python diagnose_metrics.py --window 1h --stale 60 --workers 8 --timeout 5
 """
 
-import requests
 import json
-from datetime import datetime
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from recording_rules import DEFAULT_DASHBOARD_PATH, dashboard_uses, selectors
+from vm_query_client import VictoriaMetricsClient, VMQueryError, batch_names, regex_selector
+
+# 在线检查的回看窗口（窗口内没有样本视为缺失）
+DEFAULT_WINDOW = '1h'
+
+# 超过该秒数没有新样本视为数据中断
+DEFAULT_STALE_SECONDS = 60
+
+# 并发查询数
+DEFAULT_WORKERS = 8
+
+# 矩阵最多显示的车辆列数（其余车辆只计入汇总列）
+MAX_VEHICLE_COLUMNS = 8
+
+
+def presence_query(selector: str, window: str, by_name: bool = True) -> str:
+    """
+    最后样本时间查询（tlast_over_time为MetricsQL函数，返回窗口内最后一个样本的时间戳）
+
+    Args:
+        selector: 指标选择器
+        window: 回看窗口
+        by_name: 是否按指标名分组（逐指标查询时不需要）
+    """
+    labels = '__name__, vehicle_id' if by_name else 'vehicle_id'
+    return f"max by ({labels}) (tlast_over_time({selector}[{window}]) keep_metric_names)"
+
+
+def collect_presence(client: VictoriaMetricsClient, names: Sequence[str], window: str = DEFAULT_WINDOW,
+                     workers: int = DEFAULT_WORKERS, at: Optional[float] = None
+                     ) -> Tuple[Dict[str, Dict[str, float]], Dict[str, int], Dict[str, str]]:
+    """
+    查询每个指标在每辆车上的最后样本时间
+
+    Args:
+        client: VictoriaMetrics客户端
+        names: 指标名列表
+        window: 回看窗口
+        workers: 最大并发查询数
+        at: 查询时间点（Unix秒），默认当前
+
+    Returns:
+        ({指标名: {车辆ID: 最后样本时间}}, 查询统计, {查询失败的指标名: 错误信息})
+    """
+    presence: Dict[str, Dict[str, float]] = {name: {} for name in names}
+    stats = {'batch_queries': 0, 'fallback_queries': 0, 'failed_batches': 0}
+    errors: Dict[str, str] = {}
+
+    def run_batch(batch: List[str]):
+        return client.query(presence_query(regex_selector(batch), window), at)
+
+    def run_single(name: str):
+        return client.query(presence_query(name, window, by_name=False), at)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        batches = {pool.submit(run_batch, batch): batch for batch in batch_names(names)}
+        fallbacks = {}
+        for future in as_completed(batches):
+            stats['batch_queries'] += 1
+            try:
+                for series in future.result():
+                    metric = series.get('metric', {})
+                    presence.setdefault(metric.get('__name__'), {})[
+                        metric.get('vehicle_id', 'N/A')] = float(series['value'][1])
+            except (requests.RequestException, VMQueryError) as e:
+                # 批量查询失败时逐指标重试（单个指标的序列少，不容易超时）
+                stats['failed_batches'] += 1
+                print(f"⚠️  批量查询失败（{len(batches[future])}个指标），改为逐指标查询: {e}")
+                for name in batches[future]:
+                    fallbacks[pool.submit(run_single, name)] = name
+
+        for future in as_completed(fallbacks):
+            name = fallbacks[future]
+            stats['fallback_queries'] += 1
+            try:
+                for series in future.result():
+                    presence[name][series.get('metric', {}).get('vehicle_id', 'N/A')] = float(series['value'][1])
+            except (requests.RequestException, VMQueryError) as e:
+                errors[name] = str(e)
+
+    return presence, stats, errors
+
+
+def dashboard_metrics() -> Dict[str, List[str]]:
+    """仪表板各面板需要的指标 {面板: [指标名]}（读取失败时返回空dict）"""
+    try:
+        with open(DEFAULT_DASHBOARD_PATH, 'r', encoding='utf-8') as f:
+            dashboard = json.load(f)
+    except Exception as e:
+        print(f"⚠️  读取仪表板失败: {e}")
+        return {}
+
+    required: Dict[str, List[str]] = {}
+    for use in dashboard_uses(dashboard):
+        for name, _ in selectors(use.expr):
+            if name not in required.setdefault(use.source, []):
+                required[use.source].append(name)
+    return required
+
+
+def format_age(seconds: Optional[float]) -> str:
+    """样本时间距今（缺失为 —）"""
+    if seconds is None:
+        return '—'
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
 
-def diagnose_metrics():
-    """诊断VictoriaMetrics中的指标"""
-    
+
+def print_presence_matrix(presence: Dict[str, Dict[str, float]], now: float,
+                          stale_seconds: float = DEFAULT_STALE_SECONDS,
+                          max_columns: int = MAX_VEHICLE_COLUMNS):
+    """输出 指标 × 车辆 在线矩阵（格子为最后样本距今的时间，超过stale_seconds标记!）"""
+    vehicles = sorted({vehicle for seen in presence.values() for vehicle in seen})
+    shown = vehicles[:max_columns]
+    width = max([len(name) for name in presence] + [10]) + 2
+
+    header = f"{'指标名称':<{width - 4}}" + ''.join(f"{vehicle[-11:]:>12}" for vehicle in shown)
+    header += f"{'在线车辆':>8}{'最大延迟':>8}"
+    print(header)
+    print("-" * (width + 12 * (len(shown) + 2)))
+    for name in sorted(presence):
+        seen = presence[name]
+        ages = {vehicle: now - last for vehicle, last in seen.items()}
+        cells = []
+        for vehicle in shown:
+            age = ages.get(vehicle)
+            cell = format_age(age) + ('!' if age is not None and age > stale_seconds else '')
+            cells.append(f"{cell:>12}")
+        fresh = sum(1 for age in ages.values() if age <= stale_seconds)
+        worst = format_age(max(ages.values())) if ages else '—'
+        print(f"{name:<{width}}" + ''.join(cells) + f"{f'{fresh}/{len(vehicles)}':>12}{worst:>12}")
+    if len(vehicles) > len(shown):
+        print(f"（共 {len(vehicles)} 辆车，只显示前 {len(shown)} 列）")
+
+
+def diagnose_metrics(client: VictoriaMetricsClient = None, prefix: str = '', window: str = DEFAULT_WINDOW,
+                     stale_seconds: float = DEFAULT_STALE_SECONDS, workers: int = DEFAULT_WORKERS):
+    """
+    诊断VictoriaMetrics中的指标
+
+    Args:
+        client: VictoriaMetrics客户端（为None时新建）
+        prefix: 只检查以此开头的指标
+        window: 回看窗口
+        stale_seconds: 超过该秒数没有新样本视为数据中断
+        workers: 最大并发查询数
+
+    Returns:
+        {指标名: {车辆ID: 最后样本时间}}，失败时为None
+    """
     print("="*80)
     print("VictoriaMetrics指标诊断")
     print("="*80)
     print()
-    
-    # VictoriaMetrics配置（集群版本）
-    VM_URL = "http://localhost:8481/select/0/prometheus"
-    
-    # 步骤1: 获取所有指标名称
-    print("[步骤1] 获取所有指标名称...")
+
+    # VictoriaMetrics客户端（集群版本，连接复用）
+    client = client or VictoriaMetricsClient(pool_maxsize=workers)
+    started = time.time()
+
     try:
-        # 查询所有以tractor_开头的指标
-        query_url = f"{VM_URL}/api/v1/label/__name__/values"
-        response = requests.get(query_url, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            all_metrics = result.get('data', [])
-            tractor_metrics = [m for m in all_metrics if m.startswith('tractor_')]
-            
-            print(f"[成功] 找到 {len(tractor_metrics)} 个拖拉机相关指标")
-            print()
-            
-            if not tractor_metrics:
-                print("[警告] 未找到任何拖拉机指标！")
-                print("[提示] 请确保:")
-                print("  1. T-BOX模拟器正在运行")
-                print("  2. MQTT桥接服务正在运行")
-                print("  3. VictoriaMetrics容器正在运行")
-                return
-            
-            # 步骤2: 查询每个指标的最新值
-            print("[步骤2] 查询每个指标的最新值...")
-            print()
-            print("="*80)
-            print(f"{'指标名称':<50} {'最新值':<15} {'车辆ID':<15}")
-            print("="*80)
-            
-            for metric in sorted(tractor_metrics):
-                try:
-                    # 查询最新值
-                    query = metric
-                    query_url = f"{VM_URL}/api/v1/query?query={query}"
-                    resp = requests.get(query_url, timeout=5)
-                    
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        results = data.get('data', {}).get('result', [])
-                        
-                        if results:
-                            for result in results:
-                                vehicle_id = result.get('metric', {}).get('vehicle_id', 'N/A')
-                                value = result.get('value', [None, 'N/A'])[1]
-                                print(f"{metric:<50} {value:<15} {vehicle_id:<15}")
-                        else:
-                            print(f"{metric:<50} {'No data':<15} {'N/A':<15}")
-                    else:
-                        print(f"{metric:<50} {'Query failed':<15} {'N/A':<15}")
-                        
-                except Exception as e:
-                    print(f"{metric:<50} {'Error: {str(e)}':<15} {'N/A':<15}")
-            
-            print("="*80)
-            print()
-            
-            # 步骤3: 检查CSS Electronics仪表板需要的指标
-            print("[步骤3] 检查CSS Electronics仪表板需要的指标...")
+        # 步骤1: 获取所有指标名称
+        print("[步骤1] 获取所有指标名称...")
+        metric_names = client.metric_names(prefix=prefix)
+        print(f"[成功] 找到 {len(metric_names)} 个指标")
+        print()
+
+        if not metric_names:
+            print("[警告] 未找到任何拖拉机指标！")
+            print("[提示] 请确保:")
+            print("  1. T-BOX模拟器正在运行")
+            print("  2. MQTT桥接服务正在运行")
+            print("  3. VictoriaMetrics容器正在运行")
+            return None
+
+        # 步骤2: 批量查询每个指标在每辆车上的最后样本时间
+        print(f"[步骤2] 查询指标 × 车辆在线矩阵（回看 {window}）...")
+        required = dashboard_metrics()
+        names = sorted(set(metric_names) | {name for names in required.values() for name in names
+                                             if name.startswith(prefix)})
+        presence, stats, errors = collect_presence(client, names, window, workers)
+        now = time.time()
+        print(f"[成功] {stats['batch_queries']} 个批量查询 + {stats['fallback_queries']} 个逐指标查询，"
+              f"耗时 {now - started:.2f}s")
+        print()
+        print("="*80)
+        print_presence_matrix(presence, now, stale_seconds)
+        print("="*80)
+        print()
+
+        for name, error in sorted(errors.items()):
+            print(f"[错误] {name}: {error}")
+        if errors:
             print()
-            
-            required_metrics = {
-                'Speed': 'tractor_vehicle_speed',
-                'Distance': 'tractor_odometer',
-                'RPM': 'tractor_engine_rpm',
-                'Fuel (%)': 'tractor_fuel_level',
-                'Load (%)': 'tractor_engine_torque',
-                'Torque (%)': 'tractor_engine_torque',
-                'Altitude': 'tractor_gps_altitude',
-                'Satellites': 'tractor_gps_satellites',
-                'Fix': 'tractor_gps_fix',
-            }
-            
-            print(f"{'面板名称':<20} {'需要的指标':<35} {'状态':<10}")
-            print("-"*80)
-            
-            for panel_name, metric_name in required_metrics.items():
-                if metric_name in tractor_metrics:
-                    print(f"{panel_name:<20} {metric_name:<35} {'✅ 有数据':<10}")
+
+        # 步骤3: 检查仪表板需要的指标
+        print("[步骤3] 检查仪表板需要的指标...")
+        print()
+        print(f"{'面板名称':<30} {'需要的指标':<30} {'状态':<10}")
+        print("-"*80)
+
+        missing_metrics = []
+        for panel_name, panel_metrics in required.items():
+            for metric_name in panel_metrics:
+                seen = presence.get(metric_name, {})
+                if not seen:
+                    status = '❌ 无数据'
+                    missing_metrics.append(metric_name)
+                elif max(now - last for last in seen.values()) > stale_seconds:
+                    status = '⚠️  部分车辆中断'
                 else:
-                    print(f"{panel_name:<20} {metric_name:<35} {'❌ 无数据':<10}")
-            
-            print()
-            print("="*80)
-            print()
-            
-            # 步骤4: 提供修复建议
-            print("[步骤4] 修复建议...")
+                    status = '✅ 有数据'
+                print(f"{panel_name:<30} {metric_name:<30} {status:<10}")
+
+        print()
+        print("="*80)
+        print()
+
+        # 步骤4: 提供修复建议
+        print("[步骤4] 修复建议...")
+        print()
+
+        missing_metrics = sorted(set(missing_metrics))
+        stale = sorted(name for name, seen in presence.items()
+                       if seen and min(now - last for last in seen.values()) > stale_seconds)
+
+        if missing_metrics:
+            print(f"[警告] 缺少 {len(missing_metrics)} 个指标:")
+            for metric in missing_metrics:
+                print(f"  - {metric}")
             print()
-            
-            missing_metrics = [m for m in required_metrics.values() if m not in tractor_metrics]
-            
-            if missing_metrics:
-                print(f"[警告] 缺少 {len(missing_metrics)} 个指标:")
-                for metric in missing_metrics:
-                    print(f"  - {metric}")
-                print()
-                print("[建议] 请检查:")
-                print("  1. T-BOX模拟器是否发送了这些数据字段")
-                print("  2. MQTT桥接服务是否正确映射了这些字段")
-                print("  3. 数据字段名称是否匹配")
-            else:
-                print("[成功] 所有需要的指标都存在！")
-                print("[提示] 如果仪表板仍显示'No data'，请:")
-                print("  1. 检查时间范围（默认是最近5分钟）")
-                print("  2. 检查车辆ID过滤器是否正确")
-                print("  3. 强制刷新浏览器（Ctrl+F5）")
-            
-        else:
-            print(f"[错误] 查询失败: {response.status_code}")
-            print(f"[响应] {response.text}")
-            
+            print("[建议] 请检查:")
+            print("  1. T-BOX模拟器是否发送了这些数据字段")
+            print("  2. MQTT桥接服务是否正确映射了这些字段")
+            print("  3. 数据字段名称是否匹配")
+        if stale:
+            print(f"[警告] {len(stale)} 个指标在所有车辆上超过 {stale_seconds:g}s 没有新数据:")
+            for metric in stale:
+                print(f"  - {metric}")
+            print("[建议] 检查MQTT桥接服务和vminsert是否正常写入")
+        if not missing_metrics and not stale:
+            print("[成功] 所有需要的指标都存在！")
+            print("[提示] 如果仪表板仍显示'No data'，请:")
+            print("  1. 检查时间范围（默认是最近5分钟）")
+            print("  2. 检查车辆ID过滤器是否正确")
+            print("  3. 强制刷新浏览器（Ctrl+F5）")
+
+        return presence
+
+    except VMQueryError as e:
+        print(f"[错误] 查询失败: {e}")
     except requests.exceptions.ConnectionError:
         print("[错误] 无法连接到VictoriaMetrics")
         print("[提示] 请确保VictoriaMetrics容器正在运行")
         print("       docker ps | grep vmselect")
     except Exception as e:
         print(f"[错误] {str(e)}")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="诊断VictoriaMetrics中的指标（指标 × 车辆在线矩阵）")
+    parser.add_argument("--prefix", default="", help="只检查以此开头的指标")
+    parser.add_argument("--window", default=DEFAULT_WINDOW, help="回看窗口")
+    parser.add_argument("--stale", type=float, default=DEFAULT_STALE_SECONDS,
+                        help="超过该秒数没有新样本视为数据中断")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="最大并发查询数")
+    parser.add_argument("--timeout", type=float, default=5.0, help="单个查询超时（秒）")
+
+    args = parser.parse_args()
+
+    # 事故处理时要尽快给出结果：短超时、只重试一次，失败的批次交给逐指标查询
+    with VictoriaMetricsClient(timeout=args.timeout, retries=1, pool_maxsize=args.workers) as client:
+        presence = diagnose_metrics(client, args.prefix, args.window, args.stale, args.workers)
+    return 0 if presence is not None else 1
+
 
 if __name__ == "__main__":
-    diagnose_metrics()
+    raise SystemExit(main())
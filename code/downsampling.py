@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+多分辨率降采样
+预测和RUL模型不需要原始采样率（1Hz的SOH喂给polyfit或TimeGPT毫无意义且代价高），
+先按时间桶聚合到与预测时长相称的分辨率，并限制每个模型的输入长度
+
+- bucket_aggregate: 时间桶聚合（均值/最小/最大/计数），纯NumPy向量化
+- BucketAggregator: 分块流式聚合，内存只与桶数有关，无需加载完整历史
+- lttb: Largest-Triangle-Three-Buckets，保留形状特征的可视化降采样
+- choose_resolution: 按预测时长和历史跨度选择分辨率
+- downsample_frame / downsample_long_frame: 单序列/多序列长格式按桶均值降采样并截断
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 1_000_000_000
+
+# 候选分辨率（秒）
+RESOLUTION_LADDER = (1, 10, 60, 300, 900, 3600, 6 * 3600, 86400)
+
+# 各预测后端的输入长度上限（点数）
+MODEL_MAX_POINTS = {
+    'timegpt': 24 * 90,
+    'ets': 24 * 56,
+    'simulated': 24 * 30,
+    'rul': 2000,
+}
+
+
+def to_ns(timestamps) -> np.ndarray:
+    """时间戳转换为int64纳秒"""
+    return pd.to_datetime(pd.Series(timestamps)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def choose_resolution(horizon_seconds: float,
+                      history_seconds: float = 0.0,
+                      steps_per_horizon: int = 168,
+                      max_points: int = 2000) -> int:
+    """
+    选择分辨率：预测时长内约steps_per_horizon步，且历史不超过max_points个桶
+
+    Args:
+        horizon_seconds: 预测时长（秒）
+        history_seconds: 历史跨度（秒）
+        steps_per_horizon: 预测期内的目标步数
+        max_points: 历史桶数上限
+
+    Returns:
+        分辨率（秒），取自RESOLUTION_LADDER
+    """
+    needed = max(horizon_seconds / max(steps_per_horizon, 1),
+                 history_seconds / max(max_points, 1))
+    for resolution in RESOLUTION_LADDER:
+        if resolution >= needed:
+            return resolution
+    return RESOLUTION_LADDER[-1]
+
+
+def bucket_aggregate(timestamps_ns: np.ndarray, values: np.ndarray,
+                     bucket_seconds: float) -> Dict[str, np.ndarray]:
+    """
+    按时间桶聚合（输入无需有序，NaN值不参与统计）
+
+    Args:
+        timestamps_ns: int64纳秒时间戳
+        values: 数值
+        bucket_seconds: 桶宽（秒）
+
+    Returns:
+        {'bucket': 桶起始纳秒, 'mean', 'min', 'max', 'count', 'sum'}，按时间升序
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    timestamps_ns, values = timestamps_ns[valid], values[valid]
+
+    width = int(bucket_seconds * NS_PER_SECOND)
+    buckets = timestamps_ns // width * width
+    order = np.argsort(buckets, kind='stable')
+    buckets, values = buckets[order], values[order]
+
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]) if len(buckets) else \
+        np.zeros(0, dtype=np.int64)
+    if not len(starts):
+        empty = np.zeros(0)
+        return {'bucket': np.zeros(0, dtype=np.int64), 'mean': empty, 'min': empty,
+                'max': empty, 'count': empty, 'sum': empty}
+
+    count = np.diff(np.r_[starts, len(values)]).astype(np.float64)
+    total = np.add.reduceat(values, starts)
+    return {
+        'bucket': buckets[starts],
+        'mean': total / count,
+        'min': np.minimum.reduceat(values, starts),
+        'max': np.maximum.reduceat(values, starts),
+        'count': count,
+        'sum': total,
+    }
+
+
+class BucketAggregator:
+    """分块流式时间桶聚合（可处理任意长、任意切分的历史数据）"""
+
+    def __init__(self, bucket_seconds: float, max_buckets: Optional[int] = None):
+        """
+        Args:
+            bucket_seconds: 桶宽（秒）
+            max_buckets: 只保留最新的若干个桶（None为不限）
+        """
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets
+        self.bucket = np.zeros(0, dtype=np.int64)
+        self.sum = np.zeros(0)
+        self.count = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        self.raw_points = 0
+
+    def update(self, timestamps, values):
+        """
+        合并一个数据块（块之间可以共享同一个桶）
+
+        Args:
+            timestamps: 时间戳（datetime类或int64纳秒）
+            values: 数值
+        """
+        timestamps = np.asarray(timestamps)
+        ts_ns = timestamps.astype(np.int64) if timestamps.dtype == np.int64 else to_ns(timestamps)
+        self.raw_points += len(ts_ns)
+        part = bucket_aggregate(ts_ns, values, self.bucket_seconds)
+
+        bucket = np.concatenate([self.bucket, part['bucket']])
+        order = np.argsort(bucket, kind='stable')
+        bucket = bucket[order]
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+        def merge(old, new, ufunc):
+            return ufunc.reduceat(np.concatenate([old, new])[order], starts)
+
+        self.sum = merge(self.sum, part['sum'], np.add)
+        self.count = merge(self.count, part['count'], np.add)
+        self.min = merge(self.min, part['min'], np.minimum)
+        self.max = merge(self.max, part['max'], np.maximum)
+        self.bucket = bucket[starts]
+
+        if self.max_buckets is not None and len(self.bucket) > self.max_buckets:
+            keep = slice(len(self.bucket) - self.max_buckets, None)
+            self.bucket, self.sum, self.count = self.bucket[keep], self.sum[keep], self.count[keep]
+            self.min, self.max = self.min[keep], self.max[keep]
+
+    def to_frame(self) -> pd.DataFrame:
+        """聚合结果（列为timestamp/mean/min/max/count）"""
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(self.bucket),
+            'mean': self.sum / np.maximum(self.count, 1),
+            'min': self.min,
+            'max': self.max,
+            'count': self.count,
+        })
+
+
+def downsample_chunks(chunks: Iterable, bucket_seconds: float,
+                      max_buckets: Optional[int] = None) -> pd.DataFrame:
+    """
+    分块降采样
+
+    Args:
+        chunks: 数据块迭代器，每块为(时间戳列, 数值列)的DataFrame或(timestamps, values)元组
+        bucket_seconds: 桶宽（秒）
+        max_buckets: 只保留最新的若干个桶
+
+    Returns:
+        聚合结果DataFrame
+    """
+    aggregator = BucketAggregator(bucket_seconds, max_buckets)
+    for chunk in chunks:
+        if isinstance(chunk, pd.DataFrame):
+            aggregator.update(chunk.iloc[:, 0].to_numpy(), chunk.iloc[:, 1].to_numpy())
+        else:
+            aggregator.update(*chunk)
+    return aggregator.to_frame()
+
+
+def downsample_frame(df: pd.DataFrame, bucket_seconds: float,
+                     max_points: Optional[int] = None) -> pd.DataFrame:
+    """
+    将(时间戳, 数值)两列的DataFrame按桶均值降采样，保持原列名
+
+    采样间隔已不小于桶宽时只做长度截断
+    """
+    if len(df) < 2:
+        return df
+    ts_ns = to_ns(df.iloc[:, 0])
+    spacing = np.median(np.diff(ts_ns)) / NS_PER_SECOND
+    if spacing < bucket_seconds:
+        agg = bucket_aggregate(ts_ns, df.iloc[:, 1].to_numpy(dtype=np.float64), bucket_seconds)
+        df = pd.DataFrame({df.columns[0]: pd.to_datetime(agg['bucket']),
+                           df.columns[1]: agg['mean']})
+    if max_points is not None and len(df) > max_points:
+        df = df.iloc[-max_points:]
+    return df.reset_index(drop=True)
+
+
+def downsample_long_frame(long_df: pd.DataFrame, bucket_seconds: float,
+                          max_points: Optional[int] = None) -> pd.DataFrame:
+    """
+    多序列长格式（unique_id, ds, y）按桶均值降采样，并截取每条序列最新的max_points个桶
+    """
+    if long_df.empty:
+        return long_df
+    width = pd.Timedelta(seconds=bucket_seconds)
+    ds = pd.to_datetime(long_df['ds'])
+    spacing = ds.groupby(long_df['unique_id'], sort=False).diff().median()
+    if pd.notna(spacing) and spacing < width:
+        long_df = (long_df.assign(ds=ds.dt.floor(width))
+                   .groupby(['unique_id', 'ds'], sort=False, as_index=False)['y'].mean())
+    if max_points is not None:
+        long_df = long_df.groupby('unique_id', sort=False).tail(max_points)
+    return long_df.reset_index(drop=True)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets降采样（保留峰谷等视觉特征，用于仪表板展示）
+
+    Args:
+        x: 横坐标（升序，数值型，如纳秒时间戳）
+        y: 纵坐标
+        n_out: 输出点数
+
+    Returns:
+        选中点的下标
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 首尾固定，中间n-2个点均分为n_out-2个桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # 下一个桶的均值点（最后一个桶用末点）
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        next_x = x[next_start:max(next_end, next_start + 1)].mean()
+        next_y = y[next_start:max(next_end, next_start + 1)].mean()
+
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample_for_display(df: pd.DataFrame, n_out: int = 1000) -> pd.DataFrame:
+    """用LTTB把(时间戳, 数值)两列的DataFrame降到n_out个点"""
+    indices = lttb(to_ns(df.iloc[:, 0]).astype(np.float64),
+                   df.iloc[:, 1].to_numpy(dtype=np.float64), n_out)
+    return df.iloc[indices].reset_index(drop=True)
+
+
+def series_span_seconds(timestamps) -> Tuple[float, float]:
+    """时间戳序列的(跨度, 中位采样间隔)，单位秒"""
+    ts_ns = to_ns(timestamps)
+    if len(ts_ns) < 2:
+        return 0.0, 0.0
+    return ((ts_ns[-1] - ts_ns[0]) / NS_PER_SECOND,
+            float(np.median(np.diff(ts_ns))) / NS_PER_SECOND)
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+离线统计预测后端：加法Holt-Winters / ETS(A,Ad,A)，纯NumPy实现
+- 日周期季节性（小时数据周期为24）
+- 阻尼趋势（phi<1时长期预测趋于平稳，避免线性外推过冲）
+- 批量拟合：时间方向递推，序列 × 参数网格方向全部向量化
+- 解析预测区间（ETS状态空间模型的h步方差公式）
+
+- 增量模式：每条序列的状态（水平、趋势、季节分量、误差方差）持久化，
+  每个新样本O(1)更新，随时可以在不读取历史数据的情况下给出h步预测
+
+无外网的场站可以用它替代TimeGPT，结果确定、可复现，足够每小时刷新全车队
+"""
+
+import itertools
+import warnings
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# 数据频率对应的季节周期（小时数据按日周期，日数据按周周期）
+SEASON_LENGTHS = {'H': 24, 'h': 24, 'D': 7}
+
+# 预测区间对应的正态分位数（与模拟预测保持一致）
+INTERVAL_Z = {80: 1.28, 95: 1.96}
+
+# 默认参数网格
+DEFAULT_ALPHAS = (0.05, 0.1, 0.2, 0.4, 0.7)
+DEFAULT_BETAS = (0.0, 0.01, 0.05)
+DEFAULT_GAMMAS = (0.0, 0.05, 0.15)
+DEFAULT_PHIS = (0.9, 0.98, 1.0)
+
+# 拟合后的逐序列参数和状态（增量模型追加序列、持久化时逐项处理）
+STATE_FIELDS = ('alpha', 'beta', 'gamma', 'phi', 'level', 'trend', 'season',
+                'season_pos', 'sigma2', 'sse', 'nobs')
+
+
+def season_length_for_freq(freq: str) -> int:
+    """数据频率对应的季节周期"""
+    return SEASON_LENGTHS.get(freq, 24)
+
+
+class BatchHoltWinters:
+    """
+    批量加法Holt-Winters（误差修正形式的ETS(A,Ad,A)）
+
+        预测:   ŷ_t = l_{t-1} + φ·b_{t-1} + s_{t-m}
+        误差:   e_t = y_t - ŷ_t
+        水平:   l_t = l_{t-1} + φ·b_{t-1} + α·e_t
+        趋势:   b_t = φ·b_{t-1} + β·e_t
+        季节:   s_t = s_{t-m} + γ·e_t
+
+    每条序列在参数网格上选取一步预测误差平方和最小的参数（等价于高斯似然最大）
+    """
+
+    def __init__(self,
+                 season_length: int = 24,
+                 damped: bool = True,
+                 alphas: Sequence[float] = DEFAULT_ALPHAS,
+                 betas: Sequence[float] = DEFAULT_BETAS,
+                 gammas: Sequence[float] = DEFAULT_GAMMAS,
+                 phis: Sequence[float] = DEFAULT_PHIS,
+                 chunk_size: int = 256):
+        """
+        Args:
+            season_length: 季节周期m
+            damped: 是否使用阻尼趋势（否则phi固定为1）
+            alphas/betas/gammas/phis: 参数网格（自动剔除β>α、γ>1-α的组合）
+            chunk_size: 拟合时每批处理的序列数（控制 序列数×网格大小 的内存占用）
+        """
+        self.season_length = season_length
+        self.chunk_size = chunk_size
+
+        grid = [
+            (alpha, beta, gamma, phi)
+            for alpha, beta, gamma, phi in itertools.product(
+                alphas, betas, gammas, phis if damped else (1.0,))
+            if beta <= alpha and gamma <= 1 - alpha
+        ]
+        self.grid = np.array(grid, dtype=np.float64)
+
+        # 拟合后的逐序列参数和状态
+        self.alpha = self.beta = self.gamma = self.phi = None
+        self.level = self.trend = None
+        self.season = None
+        self.season_pos = None
+        self.sigma2 = None
+        self.sse = None
+        self.nobs = None
+
+    @staticmethod
+    def _starts(Y: np.ndarray) -> np.ndarray:
+        """每条序列第一个有效值所在的列（右对齐填充的序列左侧为NaN）"""
+        valid = ~np.isnan(Y)
+        return np.where(valid.any(axis=1), valid.argmax(axis=1), Y.shape[1])
+
+    def _initial_states(self, Y: np.ndarray, starts: np.ndarray):
+        """用每条序列开头两个季节周期的数据初始化水平、趋势和季节分量"""
+        m = self.season_length
+        n_series, length = Y.shape
+        cols = starts[:, None] + np.arange(2 * m)[None, :]
+        head = np.take_along_axis(Y, np.minimum(cols, length - 1), axis=1)
+        head[cols >= length] = np.nan
+
+        # 序列短于两个周期时趋势初始化为0，短于一个周期时季节分量初始化为0
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            first = np.nanmean(head[:, :m], axis=1)
+            second = np.nanmean(head[:, m:], axis=1)
+            level = np.nan_to_num(first)
+            trend = np.nan_to_num((second - first) / m)
+            season = np.nan_to_num(head[:, :m] - first[:, None])
+        return level, trend, season
+
+    @staticmethod
+    def _step(level: np.ndarray, trend: np.ndarray, season: np.ndarray, pos: np.ndarray,
+              y: np.ndarray, alpha: np.ndarray, beta: np.ndarray, gamma: np.ndarray,
+              phi: np.ndarray, active: np.ndarray):
+        """
+        所有行同时推进一步（season原地更新）
+
+        缺失值处按预测值推进（误差记为0），active为False的行状态保持不变
+
+        Returns:
+            (level, trend, error, observed)
+        """
+        rows = np.arange(len(level))
+        s_old = season[rows, pos]
+
+        error = y - (level + phi * trend + s_old)
+        observed = active & ~np.isnan(y)
+        error = np.where(observed, error, 0.0)
+
+        level = np.where(active, level + phi * trend + alpha * error, level)
+        trend = np.where(active, phi * trend + beta * error, trend)
+        season[rows, pos] = np.where(active, s_old + gamma * error, s_old)
+        return level, trend, error, observed
+
+    def _run(self, Y: np.ndarray, starts: np.ndarray, params: np.ndarray,
+             level: np.ndarray, trend: np.ndarray, season: np.ndarray):
+        """
+        沿时间方向递推（所有行同时更新）
+
+        Args:
+            Y: (n, T) 观测矩阵
+            starts: (n,) 每行起始列
+            params: (n, 4) 每行的 α, β, γ, φ
+            level/trend/season: 初始状态（season原地更新）
+
+        Returns:
+            (level, trend, season, sse, nobs)：最终状态，以及跳过第一个季节周期后的
+            一步误差平方和与观测数
+        """
+        m = self.season_length
+        alpha, beta, gamma, phi = params.T
+        sse = np.zeros(len(Y))
+        nobs = np.zeros(len(Y))
+
+        for t in range(int(starts.min()) if len(starts) else 0, Y.shape[1]):
+            active = t >= starts
+            level, trend, error, observed = self._step(
+                level, trend, season, (t - starts) % m, Y[:, t],
+                alpha, beta, gamma, phi, active)
+
+            scored = observed & (t >= starts + m)
+            sse += np.where(scored, error * error, 0.0)
+            nobs += scored
+
+        return level, trend, season, sse, nobs
+
+    def fit(self, values: np.ndarray) -> 'BatchHoltWinters':
+        """
+        批量拟合
+
+        Args:
+            values: 一维序列，或(序列数, 长度)的二维矩阵（右对齐，左侧缺失填NaN）
+
+        Returns:
+            self
+        """
+        Y = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        n_series = len(Y)
+        n_grid = len(self.grid)
+        m = self.season_length
+
+        self.alpha, self.beta, self.gamma, self.phi = (np.zeros(n_series) for _ in range(4))
+        self.level = np.zeros(n_series)
+        self.trend = np.zeros(n_series)
+        self.season = np.zeros((n_series, m))
+        self.sigma2 = np.zeros(n_series)
+        self.sse = np.zeros(n_series)
+        self.nobs = np.zeros(n_series)
+
+        starts = self._starts(Y)
+        self.season_pos = (Y.shape[1] - starts) % m
+
+        for begin in range(0, n_series, self.chunk_size):
+            chunk = slice(begin, begin + self.chunk_size)
+            Y_chunk, starts_chunk = Y[chunk], starts[chunk]
+            n_chunk = len(Y_chunk)
+            level0, trend0, season0 = self._initial_states(Y_chunk, starts_chunk)
+
+            # 展开为 (序列 × 网格) 行，一次递推评估所有参数组合
+            level, trend, season, sse, nobs = self._run(
+                np.repeat(Y_chunk, n_grid, axis=0),
+                np.repeat(starts_chunk, n_grid),
+                np.tile(self.grid, (n_chunk, 1)),
+                np.repeat(level0, n_grid),
+                np.repeat(trend0, n_grid),
+                np.repeat(season0, n_grid, axis=0),
+            )
+
+            best = np.argmin(sse.reshape(n_chunk, n_grid), axis=1)
+            picked = np.arange(n_chunk) * n_grid + best
+
+            self.alpha[chunk], self.beta[chunk], self.gamma[chunk], self.phi[chunk] = \
+                self.grid[best].T
+            self.level[chunk] = level[picked]
+            self.trend[chunk] = trend[picked]
+            self.season[chunk] = season[picked]
+            self.sse[chunk] = sse[picked]
+            self.nobs[chunk] = nobs[picked]
+            self.sigma2[chunk] = sse[picked] / np.maximum(nobs[picked] - 4, 1)
+
+        # 数据不足一个季节周期、没有可评估的一步误差时，用序列方差作为保守估计
+        short = self.nobs == 0
+        if short.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                self.sigma2[short] = np.nan_to_num(np.nanvar(Y[short], axis=1))
+
+        return self
+
+    def forecast(self, horizon: int,
+                 levels: Sequence[int] = (80, 95),
+                 rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        预测并给出解析预测区间
+
+        h步方差: σ²_h = σ²·(1 + Σ_{j=1}^{h-1} c_j²)，c_j = α + β·φ_j + γ·[j mod m = 0]，
+        其中 φ_j = φ + φ² + … + φ^j
+
+        Args:
+            horizon: 预测时长
+            levels: 预测区间置信水平（百分比）
+            rows: 只预测这些行（序列下标），默认全部
+
+        Returns:
+            {'forecast', 'lower_80', 'upper_80', 'lower_95', 'upper_95'}，每项形状为(序列数, horizon)
+        """
+        if self.level is None:
+            raise RuntimeError("模型尚未拟合，请先调用fit()")
+        if rows is None:
+            rows = slice(None)
+
+        m = self.season_length
+        steps = np.arange(1, horizon + 1)
+        alpha, beta, gamma, phi = (self.alpha[rows, None], self.beta[rows, None],
+                                   self.gamma[rows, None], self.phi[rows, None])
+        # φ_h = φ + φ² + … + φ^h（逐步累加，φ=1时退化为h）
+        phi_h = np.cumsum(phi ** steps[None, :], axis=1)
+
+        season_cols = (self.season_pos[rows, None] + steps[None, :] - 1) % m
+        seasonal = np.take_along_axis(self.season[rows], season_cols, axis=1)
+        forecast = self.level[rows, None] + phi_h * self.trend[rows, None] + seasonal
+
+        c = alpha + beta * phi_h + gamma * (steps[None, :] % m == 0)
+        variance = self.sigma2[rows, None] * (1.0 + np.cumsum(c * c, axis=1) - c * c)
+        std = np.sqrt(variance)
+
+        result = {'forecast': forecast}
+        for level in levels:
+            z = INTERVAL_Z[level]
+            result[f'lower_{level}'] = forecast - z * std
+            result[f'upper_{level}'] = forecast + z * std
+        return result
+
+
+def forecast_holt_winters(values: np.ndarray,
+                          horizon: int,
+                          freq: str = 'H',
+                          damped: bool = True) -> Dict[str, np.ndarray]:
+    """
+    拟合并预测（便捷函数）
+
+    Args:
+        values: 一维序列，或(序列数, 长度)的右对齐二维矩阵
+        horizon: 预测时长
+        freq: 数据频率（决定季节周期）
+        damped: 是否使用阻尼趋势
+
+    Returns:
+        预测结果字典；一维输入时每项形状为(horizon,)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    model = BatchHoltWinters(season_length_for_freq(freq), damped=damped).fit(values)
+    result = model.forecast(horizon)
+    if values.ndim == 1:
+        result = {key: value[0] for key, value in result.items()}
+    return result
+
+
+class IncrementalHoltWinters(BatchHoltWinters):
+    """
+    增量Holt-Winters：首次用历史数据批量拟合参数和状态，
+    之后每个新样本只做一步状态更新（参数保持不变，误差方差在线累计）
+    """
+
+    def __init__(self, season_length: int = 24, freq: str = 'H', **kwargs):
+        """
+        Args:
+            season_length: 季节周期m
+            freq: 数据频率（决定时间戳到步数的换算）
+            **kwargs: 传给BatchHoltWinters的参数网格等配置
+        """
+        super().__init__(season_length=season_length, **kwargs)
+        self.freq = freq
+        self.step_ns = (pd.Timedelta(days=1) if freq == 'D' else pd.Timedelta(hours=1)).value
+
+        self.series_ids: List[str] = []
+        self.series_index: Dict[str, int] = {}
+        # 每条序列最近一个样本的时间戳（纳秒）
+        self.last_timestamp = np.zeros(0, dtype=np.int64)
+        self.stats = {'updates': 0, 'stale': 0, 'gap_steps': 0, 'unknown': 0, 'added': 0}
+
+    def initialize(self, series_ids: Sequence[str], values: np.ndarray,
+                   last_timestamps: Sequence) -> 'IncrementalHoltWinters':
+        """
+        用历史数据初始化（批量拟合一次）
+
+        Args:
+            series_ids: 序列标识
+            values: (序列数, 长度) 右对齐的历史矩阵
+            last_timestamps: 每条序列最后一个样本的时间戳
+        """
+        self.fit(values)
+        self.series_ids = list(series_ids)
+        self.series_index = {sid: i for i, sid in enumerate(self.series_ids)}
+        self.last_timestamp = pd.to_datetime(pd.Series(last_timestamps)).to_numpy(
+            dtype='datetime64[ns]').astype(np.int64)
+        return self
+
+    def add_series(self, series_ids: Sequence[str], values: np.ndarray,
+                   last_timestamps: Sequence) -> 'IncrementalHoltWinters':
+        """
+        追加新序列（如新接入的车辆）：只对新序列批量拟合，已有序列的状态不变
+
+        Args:
+            series_ids: 新序列标识（已存在的序列被忽略）
+            values: (序列数, 长度) 右对齐的历史矩阵
+            last_timestamps: 每条序列最后一个样本的时间戳
+        """
+        if self.level is None:
+            return self.initialize(series_ids, values, last_timestamps)
+
+        keep = np.array([sid not in self.series_index for sid in series_ids], dtype=bool)
+        if not keep.any():
+            return self
+        series_ids = [sid for sid, k in zip(series_ids, keep) if k]
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))[keep]
+        last_timestamps = pd.to_datetime(pd.Series(last_timestamps)[keep]).to_numpy(
+            dtype='datetime64[ns]').astype(np.int64)
+
+        existing = {name: getattr(self, name) for name in STATE_FIELDS}
+        self.fit(values)
+        for name in STATE_FIELDS:
+            setattr(self, name, np.concatenate([existing[name], getattr(self, name)]))
+
+        offset = len(self.series_ids)
+        self.series_ids.extend(series_ids)
+        self.series_index.update({sid: offset + i for i, sid in enumerate(series_ids)})
+        self.last_timestamp = np.concatenate([self.last_timestamp, last_timestamps])
+        self.stats['added'] += len(series_ids)
+        return self
+
+    def update(self, series_ids: Sequence[str], values: np.ndarray,
+               timestamps: Sequence) -> List[str]:
+        """
+        每条序列加入一个新样本（批量、O(1)/样本）
+
+        时间戳早于等于上次样本的数据被忽略；中间缺失的步数按预测值推进；
+        未初始化的序列被跳过并返回，调用方用其历史调用add_series后再更新
+
+        Args:
+            series_ids: 序列标识
+            values: 新样本值
+            timestamps: 新样本时间戳
+
+        Returns:
+            被跳过的未知序列标识
+        """
+        known = np.array([sid in self.series_index for sid in series_ids], dtype=bool)
+        unknown = [sid for sid, k in zip(series_ids, known) if not k]
+        self.stats['unknown'] += len(unknown)
+
+        rows = np.fromiter((self.series_index[sid] for sid, k in zip(series_ids, known) if k),
+                           dtype=np.int64, count=int(known.sum()))
+        values = np.asarray(values, dtype=np.float64)[known]
+        ts = pd.to_datetime(pd.Series(timestamps)).to_numpy(dtype='datetime64[ns]').astype(np.int64)[known]
+
+        steps = np.rint((ts - self.last_timestamp[rows]) / self.step_ns).astype(np.int64)
+        fresh = steps >= 1
+        self.stats['stale'] += int((~fresh).sum())
+        rows, values, ts, steps = rows[fresh], values[fresh], ts[fresh], steps[fresh]
+        if not len(rows):
+            return unknown
+
+        m = self.season_length
+        params = (self.alpha[rows], self.beta[rows], self.gamma[rows], self.phi[rows])
+        level, trend = self.level[rows], self.trend[rows]
+        season = self.season[rows]
+        pos = self.season_pos[rows]
+
+        # 补齐缺失的步（通常为0），再用新样本更新一步
+        gaps = steps - 1
+        missing = np.full(len(rows), np.nan)
+        for k in range(int(gaps.max())):
+            active = gaps > k
+            level, trend, _, _ = self._step(level, trend, season, pos, missing, *params, active)
+            pos = np.where(active, (pos + 1) % m, pos)
+        self.stats['gap_steps'] += int(gaps.sum())
+
+        level, trend, error, observed = self._step(level, trend, season, pos, values, *params,
+                                                   np.ones(len(rows), dtype=bool))
+
+        self.level[rows], self.trend[rows] = level, trend
+        self.season[rows] = season
+        self.season_pos[rows] = (pos + 1) % m
+        self.sse[rows] += np.where(observed, error * error, 0.0)
+        self.nobs[rows] += observed
+        scored = self.nobs[rows] > 4
+        self.sigma2[rows] = np.where(scored, self.sse[rows] / np.maximum(self.nobs[rows] - 4, 1),
+                                     self.sigma2[rows])
+        self.last_timestamp[rows] = ts
+        self.stats['updates'] += len(rows)
+        return unknown
+
+    def forecast_series(self, horizon: int,
+                        series_ids: Optional[Sequence[str]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        按当前状态给出h步预测（不读取历史数据）
+
+        Args:
+            horizon: 预测时长
+            series_ids: 要预测的序列，默认全部
+
+        Returns:
+            {序列标识: 预测DataFrame}，列为timestamp/forecast/lower_80/upper_80/lower_95/upper_95
+        """
+        if series_ids is None:
+            series_ids = self.series_ids
+        rows = np.array([self.series_index[sid] for sid in series_ids], dtype=np.int64)
+        bands = self.forecast(horizon, rows=rows)
+        offsets = np.arange(1, horizon + 1, dtype=np.int64) * self.step_ns
+
+        return {
+            sid: pd.DataFrame({
+                'timestamp': pd.to_datetime(self.last_timestamp[row] + offsets),
+                **{key: value[i] for key, value in bands.items()},
+            })
+            for i, (sid, row) in enumerate(zip(series_ids, rows))
+        }
+
+    def save(self, path: str):
+        """持久化所有序列的参数和状态（.npz，先写临时文件再原子替换）"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path,
+                 series_ids=np.array(self.series_ids, dtype=str),
+                 season_length=self.season_length, freq=self.freq,
+                 alpha=self.alpha, beta=self.beta, gamma=self.gamma, phi=self.phi,
+                 level=self.level, trend=self.trend, season=self.season,
+                 season_pos=self.season_pos, sigma2=self.sigma2, sse=self.sse, nobs=self.nobs,
+                 last_timestamp=self.last_timestamp)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IncrementalHoltWinters':
+        """从磁盘恢复"""
+        with np.load(path) as data:
+            model = cls(season_length=int(data['season_length']), freq=str(data['freq']))
+            model.series_ids = [str(sid) for sid in data['series_ids']]
+            model.series_index = {sid: i for i, sid in enumerate(model.series_ids)}
+            for name in STATE_FIELDS + ('last_timestamp',):
+                setattr(model, name, data[name].copy())
+        return model
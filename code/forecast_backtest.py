@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+预测后端回测与性能基准
+滚动起点（rolling-origin）回测：在每条序列末尾取若干预测起点，
+用起点之前的数据预测之后horizon步，与真实值比较
+
+- 精度：MAE、MAPE、80%/95%预测区间覆盖率
+- 成本：墙钟时间、峰值内存（tracemalloc）、后端调用次数和调用速率
+- 序列来源：合成序列（复用demo_nixtla_integration的SOH退化模式、
+  TractorDataSimulator的发动机退化/液压泄漏故障模式），或录制的CSV
+- 按序列分块多进程并行
+
+用法:
+    python forecast_backtest.py --series 200 --backends simulated ets
+    python forecast_backtest.py --csv recorded.csv --backends ets --horizon 24
+    python forecast_backtest.py --history-cache ./history_cache --metric battery_soh
+    python forecast_backtest.py --backends timegpt --api-key $NIXTLA_API_KEY
+"""
+
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from nixtla_timegpt_integration import NixtlaTimeGPTIntegration
+from history_cache import HistoryCache
+
+BACKENDS = ('simulated', 'ets', 'timegpt')
+SERIES_KINDS = ('battery_soh', 'coolant_temp', 'hydraulic_pressure')
+
+
+def generate_battery_soh(length: int, rng: np.random.Generator) -> np.ndarray:
+    """电池SOH：线性退化 + 日周期 + 噪声 + 一段异常下降（同demo_nixtla_integration）"""
+    t = np.arange(length)
+    values = (100 - np.linspace(0, rng.uniform(5, 15), length)
+              + 2 * np.sin(2 * np.pi * t / 24)
+              + rng.normal(0, 0.5, length))
+    start = rng.integers(length // 4, length // 2)
+    values[start:start + 10] -= rng.uniform(2, 6)
+    return values
+
+
+def generate_simulator_series(kind: str, length: int, seed: int) -> np.ndarray:
+    """
+    用TractorDataSimulator按小时采样生成序列，并在随机时刻开启对应故障模式
+
+    Args:
+        kind: coolant_temp（发动机退化）或 hydraulic_pressure（液压泄漏）
+        length: 序列长度（小时）
+        seed: 随机种子（模拟器内部使用全局随机数）
+    """
+    from tbox_simulator import TractorDataSimulator
+
+    np.random.seed(seed)
+    simulator = TractorDataSimulator(f"backtest_{seed}")
+    simulator.timestamp = 0.0
+    fault = 'engine_degradation' if kind == 'coolant_temp' else 'hydraulic_leak'
+    onset = np.random.randint(length // 3, length)
+
+    values = np.empty(length)
+    for i in range(length):
+        simulator.fault_modes[fault] = i >= onset
+        simulator.timestamp = i * 3600.0
+        if kind == 'coolant_temp':
+            simulator.fill_engine_data()
+            values[i] = simulator.packet['engine_coolant_temp']
+        else:
+            simulator.fill_hydraulic_data()
+            values[i] = simulator.packet['hydraulic_pressure']
+    return values
+
+
+def generate_series(n_series: int, length: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """按类型轮流生成合成序列"""
+    rng = np.random.default_rng(seed)
+    series = {}
+    for i in range(n_series):
+        kind = SERIES_KINDS[i % len(SERIES_KINDS)]
+        if kind == 'battery_soh':
+            series[f"{kind}_{i:04d}"] = generate_battery_soh(length, rng)
+        else:
+            series[f"{kind}_{i:04d}"] = generate_simulator_series(kind, length, seed + i)
+    return series
+
+
+def load_recorded_series(path: str, min_length: int) -> Dict[str, np.ndarray]:
+    """
+    加载录制序列（长格式CSV，列为 unique_id, ds, y）
+
+    Args:
+        path: CSV路径
+        min_length: 最短长度，不足的序列被跳过
+    """
+    df = pd.read_csv(path, parse_dates=['ds']).sort_values(['unique_id', 'ds'], kind='mergesort')
+    series = {
+        str(uid): group['y'].to_numpy(dtype=np.float64)
+        for uid, group in df.groupby('unique_id', sort=False)
+    }
+    return {uid: values for uid, values in series.items() if len(values) >= min_length}
+
+
+def load_cached_series(root: str, metric: str, min_length: int,
+                       bucket_seconds: int = 3600) -> Dict[str, np.ndarray]:
+    """
+    从本地历史缓存加载每辆车的一个指标，按桶均值降采样为等间隔序列
+
+    Args:
+        root: 历史缓存目录
+        metric: 指标名
+        min_length: 最短长度，不足的序列被跳过
+        bucket_seconds: 桶宽（秒），默认按小时
+    """
+    cache = HistoryCache(root)
+    series = {}
+    for vehicle_id in cache.vehicles():
+        # 按天分区分块聚合，不把几个月的原始样本一次读入内存
+        buckets = cache.read_downsampled(vehicle_id, metric, bucket_seconds)
+        if len(buckets) >= min_length:
+            series[vehicle_id] = buckets['mean'].to_numpy()
+    return series
+
+
+def _forecast_matrix(timegpt: NixtlaTimeGPTIntegration, backend: str,
+                     train: np.ndarray, horizon: int, freq: str) -> Dict[str, np.ndarray]:
+    """
+    用指定后端预测一批等长序列
+
+    Returns:
+        (序列数, horizon)的预测和区间，以及'fallback'：(序列数,)布尔数组，
+        标记TimeGPT请求失败、改用本地预测的序列
+    """
+    n_series, length = train.shape
+    if backend != 'timegpt':
+        bands = timegpt.fallback_forecast_values(train, horizon, freq)
+        return {**bands, 'fallback': np.zeros(n_series, dtype=bool)}
+
+    if timegpt.client is None:
+        raise RuntimeError("TimeGPT客户端未初始化，无法回测timegpt后端")
+
+    long_df = pd.DataFrame({
+        'unique_id': np.repeat(np.arange(n_series), length),
+        'ds': np.tile(pd.date_range('2025-01-01', periods=length, freq='h'), n_series),
+        'y': train.ravel(),
+    })
+    results = timegpt.forecast_batch_with_timegpt(long_df, horizon=horizon, freq=freq)
+    bands = {
+        column: np.stack([results[i][column].to_numpy() for i in range(n_series)])
+        for column in ('forecast', 'lower_80', 'upper_80', 'lower_95', 'upper_95')
+    }
+    fallback = np.zeros(n_series, dtype=bool)
+    fallback[np.asarray(timegpt.last_fallback_ids, dtype=np.int64)] = True
+    bands['fallback'] = fallback
+    return bands
+
+
+def backtest_chunk(task: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    回测一块序列（在子进程中运行）
+
+    Returns:
+        误差累计量、调用次数、耗时和峰值内存；改用本地预测的序列不计入误差，
+        只计入 fallback_forecasts
+    """
+    backend = task['backend']
+    horizon = task['horizon']
+    values = task['values']
+    timegpt = NixtlaTimeGPTIntegration(api_key=task.get('api_key'), seed=task['seed'],
+                                       fallback_backend='ets' if backend == 'ets' else 'simulated')
+
+    totals = {'abs_error': 0.0, 'pct_error': 0.0, 'pct_count': 0, 'covered_80': 0,
+              'covered_95': 0, 'points': 0, 'calls': 0, 'forecasts': 0,
+              'fallback_forecasts': 0}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    length = values.shape[1]
+    for k in range(task['origins']):
+        origin = length - horizon - k * task['origin_step']
+        if origin < task['min_train']:
+            break
+        train, actual = values[:, :origin], values[:, origin:origin + horizon]
+        bands = _forecast_matrix(timegpt, backend, train, horizon, task['freq'])
+        totals['calls'] += 1
+        totals['forecasts'] += len(values)
+
+        # 改用本地预测的序列不能算作该后端的结果，只计数
+        keep = ~bands['fallback']
+        totals['fallback_forecasts'] += int((~keep).sum())
+        actual = actual[keep]
+        bands = {column: band[keep] for column, band in bands.items() if column != 'fallback'}
+
+        error = bands['forecast'] - actual
+        totals['abs_error'] += float(np.abs(error).sum())
+        nonzero = np.abs(actual) > 1e-9
+        totals['pct_error'] += float((np.abs(error[nonzero]) / np.abs(actual[nonzero])).sum())
+        totals['pct_count'] += int(nonzero.sum())
+        totals['covered_80'] += int(((actual >= bands['lower_80']) & (actual <= bands['upper_80'])).sum())
+        totals['covered_95'] += int(((actual >= bands['lower_95']) & (actual <= bands['upper_95'])).sum())
+        totals['points'] += actual.size
+
+    totals['seconds'] = time.perf_counter() - start
+    totals['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return totals
+
+
+def run_backtest(series: Dict[str, np.ndarray], backend: str, horizon: int = 168,
+                 origins: int = 4, origin_step: int = 24, freq: str = 'H',
+                 workers: Optional[int] = None, chunk_size: int = 50,
+                 api_key: Optional[str] = None, seed: int = 0) -> Dict[str, Any]:
+    """
+    对一个后端做滚动起点回测
+
+    Args:
+        series: {序列标识: 数值数组}（长度不同时按最短长度截取末尾）
+        backend: simulated / ets / timegpt
+        horizon: 预测时长
+        origins: 每条序列的预测起点数
+        origin_step: 相邻起点间隔
+        freq: 数据频率
+        workers: 进程数，默认为CPU核数
+        chunk_size: 每个任务包含的序列数
+        api_key: TimeGPT API密钥（backend=timegpt时使用）
+        seed: 随机种子
+
+    Returns:
+        汇总指标
+
+    Raises:
+        RuntimeError: backend=timegpt但TimeGPT客户端无法初始化
+    """
+    if backend == 'timegpt' and NixtlaTimeGPTIntegration(api_key=api_key).client is None:
+        # 否则每个子进程都会静默改用本地预测，结果却仍标为timegpt
+        raise RuntimeError("TimeGPT客户端未初始化（检查API密钥和nixtla包），无法回测timegpt后端")
+
+    length = min(len(v) for v in series.values())
+    values = np.stack([v[-length:] for v in series.values()])
+    tasks = [
+        {'backend': backend, 'values': values[i:i + chunk_size], 'horizon': horizon,
+         'origins': origins, 'origin_step': origin_step, 'freq': freq,
+         'min_train': 48, 'api_key': api_key, 'seed': seed + i}
+        for i in range(0, len(values), chunk_size)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(backtest_chunk, tasks))
+    else:
+        parts = [backtest_chunk(task) for task in tasks]
+    wall = time.perf_counter() - start
+
+    total = {key: sum(part[key] for part in parts) for key in parts[0] if key != 'peak_bytes'}
+    points = max(total['points'], 1)
+    return {
+        'backend': backend,
+        'series': len(values),
+        'horizon': horizon,
+        'origins': origins,
+        'mae': total['abs_error'] / points,
+        'mape': 100 * total['pct_error'] / max(total['pct_count'], 1),
+        'coverage_80': total['covered_80'] / points,
+        'coverage_95': total['covered_95'] / points,
+        'wall_seconds': wall,
+        'cpu_seconds': total['seconds'],
+        'peak_memory_mb': max(part['peak_bytes'] for part in parts) / 1e6,
+        'calls': total['calls'],
+        'calls_per_second': total['calls'] / wall,
+        'forecasts_per_second': total['forecasts'] / wall,
+        'fallback_forecasts': total['fallback_forecasts'],
+    }
+
+
+def print_report(reports: List[Dict[str, Any]]):
+    print(f"\n{'后端':<10} {'MAE':>8} {'MAPE%':>7} {'覆盖80':>7} {'覆盖95':>7} "
+          f"{'墙钟(s)':>8} {'峰值内存MB':>10} {'调用/秒':>8} {'预测/秒':>9}")
+    print("-" * 86)
+    for r in reports:
+        print(f"{r['backend']:<10} {r['mae']:>8.3f} {r['mape']:>7.2f} {r['coverage_80']:>7.2f} "
+              f"{r['coverage_95']:>7.2f} {r['wall_seconds']:>8.2f} {r['peak_memory_mb']:>10.1f} "
+              f"{r['calls_per_second']:>8.1f} {r['forecasts_per_second']:>9.1f}")
+    for r in reports:
+        if r['fallback_forecasts']:
+            print(f"⚠️  {r['backend']}: {r['fallback_forecasts']}/{r['series'] * r['origins']} 次预测"
+                  f"因请求失败改用本地预测，已从误差统计中排除")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预测后端滚动起点回测")
+    parser.add_argument("--backends", nargs='+', default=['simulated', 'ets'], choices=BACKENDS,
+                        help="参与比较的后端")
+    parser.add_argument("--series", type=int, default=120, help="合成序列数")
+    parser.add_argument("--length", type=int, default=24 * 45, help="合成序列长度（小时）")
+    parser.add_argument("--csv", default=None, help="录制序列CSV（unique_id, ds, y），替代合成序列")
+    parser.add_argument("--history-cache", default=None, help="本地历史缓存目录，替代合成序列")
+    parser.add_argument("--metric", default="battery_soh", help="从历史缓存读取的指标")
+    parser.add_argument("--horizon", type=int, default=168, help="预测时长")
+    parser.add_argument("--origins", type=int, default=4, help="每条序列的预测起点数")
+    parser.add_argument("--origin-step", type=int, default=24, help="相邻起点间隔")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认CPU核数）")
+    parser.add_argument("--chunk-size", type=int, default=50, help="每个任务的序列数")
+    parser.add_argument("--api-key", default=os.environ.get('NIXTLA_API_KEY'),
+                        help="TimeGPT API密钥")
+    parser.add_argument("--output", default=None, help="结果JSON输出路径")
+
+    args = parser.parse_args()
+
+    print("=" * 86)
+    print("预测后端滚动起点回测")
+    print("=" * 86)
+
+    if args.history_cache:
+        series = load_cached_series(args.history_cache, args.metric, min_length=args.horizon + 48)
+        print(f"[信息] 缓存序列: {len(series)} 条（{args.history_cache}, {args.metric}）")
+    elif args.csv:
+        series = load_recorded_series(args.csv, min_length=args.horizon + 48)
+        print(f"[信息] 录制序列: {len(series)} 条（{args.csv}）")
+    else:
+        start = time.perf_counter()
+        series = generate_series(args.series, args.length)
+        print(f"[信息] 合成序列: {len(series)} 条 × {args.length} 小时"
+              f"（生成耗时 {time.perf_counter() - start:.1f}s）")
+    if not series:
+        print("[错误] 没有可用的序列")
+        return 1
+
+    reports = []
+    for backend in args.backends:
+        if backend == 'timegpt' and not args.api_key:
+            print("⚠️  未提供API密钥，跳过timegpt后端")
+            continue
+        print(f"[信息] 回测后端: {backend} ...")
+        try:
+            reports.append(run_backtest(series, backend, args.horizon, args.origins,
+                                        args.origin_step, workers=args.workers,
+                                        chunk_size=args.chunk_size, api_key=args.api_key))
+        except RuntimeError as e:
+            print(f"[错误] {e}")
+            return 1
+
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
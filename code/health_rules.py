@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+健康度评分规则表
+从 config/health_score_rules.json 加载声明式扣分规则（指标、方向、阈值、斜率、上限），
+编译为向量化评估器，供单车评分和车队批量评分共用；
+同一张规则表生成对应的vmalert阈值告警规则，保证评分阈值与告警阈值不再各自漂移
+
+用法:
+    python health_rules.py            # 重新生成 alerting/rules/tractor-threshold-alerts.yml
+    python health_rules.py --check    # 只检查生成结果是否与现有文件一致
+"""
+
+import json
+import argparse
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_RULES_PATH = PROJECT_ROOT / "config" / "health_score_rules.json"
+DEFAULT_ALERT_RULES_PATH = PROJECT_ROOT / "alerting" / "rules" / "tractor-threshold-alerts.yml"
+
+# 告警分组（与 tractor-alerts.yml 中的分组节奏一致）
+ALERT_GROUPS = {
+    'critical': ('tractor_threshold_critical_alerts', '30s'),
+    'warning': ('tractor_threshold_warning_alerts', '1m'),
+    'info': ('tractor_threshold_info_alerts', '5m'),
+}
+SEVERITY_ORDER = ['info', 'warning', 'critical']
+
+
+class CompiledHealthRules:
+    """编译后的健康度规则（规则参数保存为NumPy数组，一次矩阵运算完成评分）"""
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        """
+        Args:
+            rules: 规则表中的规则列表
+        """
+        for rule in rules:
+            if rule['direction'] not in ('above', 'below'):
+                raise ValueError(f"规则 {rule['metric']} 的direction必须为above或below")
+
+        self.rules = rules
+        self.metrics = [rule['metric'] for rule in rules]
+        # 每条规则可接受的输入字段名（规范指标名 + 别名）
+        self.input_names = [[rule['metric']] + rule.get('aliases', []) for rule in rules]
+
+        self.signs = np.array([1.0 if rule['direction'] == 'above' else -1.0 for rule in rules])
+        self.thresholds = np.array([float(rule['threshold']) for rule in rules])
+        self.slopes = np.array([float(rule['slope']) for rule in rules])
+        self.caps = np.array([float(rule['cap']) for rule in rules])
+
+    def penalties(self, X: np.ndarray) -> np.ndarray:
+        """
+        计算扣分矩阵
+
+        Args:
+            X: (n, k) 指标矩阵，列顺序与规则一致，缺失值为NaN
+
+        Returns:
+            (n, k) 扣分矩阵，缺失值不扣分
+        """
+        excess = (X - self.thresholds) * self.signs
+        penalty = np.clip(excess * self.slopes, 0.0, self.caps)
+        return np.nan_to_num(penalty, nan=0.0)
+
+    def score_matrix(self, X: np.ndarray) -> np.ndarray:
+        """
+        批量计算健康度评分
+
+        Args:
+            X: (n, k) 指标矩阵
+
+        Returns:
+            长度为n的健康度评分（0-100）
+        """
+        return np.clip(100.0 - self.penalties(np.atleast_2d(X)).sum(axis=1), 0.0, 100.0)
+
+    def vector_from_metrics(self, metrics: Dict[str, float]) -> np.ndarray:
+        """将指标字典转换为按规则顺序排列的向量"""
+        vector = np.full(len(self.rules), np.nan)
+        for i, names in enumerate(self.input_names):
+            for name in names:
+                value = metrics.get(name)
+                if value is not None:
+                    try:
+                        vector[i] = float(value)
+                    except (TypeError, ValueError):
+                        pass
+                    break
+        return vector
+
+    def matrix_from_frame(self, frame: pd.DataFrame) -> np.ndarray:
+        """将DataFrame转换为按规则顺序排列的指标矩阵"""
+        X = np.full((len(frame), len(self.rules)), np.nan)
+        for i, names in enumerate(self.input_names):
+            for name in names:
+                if name in frame.columns:
+                    X[:, i] = pd.to_numeric(frame[name], errors='coerce').to_numpy(dtype=np.float64)
+                    break
+        return X
+
+    def score(self, metrics: Dict[str, float]) -> float:
+        """单车评分"""
+        return float(self.score_matrix(self.vector_from_metrics(metrics))[0])
+
+    def score_frame(self, frame: pd.DataFrame) -> np.ndarray:
+        """车队/历史批量评分（每行一个评分）"""
+        return self.score_matrix(self.matrix_from_frame(frame))
+
+
+def load_rule_table(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """加载规则表"""
+    with open(path or DEFAULT_RULES_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)['rules']
+
+
+@lru_cache(maxsize=8)
+def load_health_rules(path: Optional[str] = None) -> CompiledHealthRules:
+    """加载并编译规则表（同一路径只编译一次）"""
+    return CompiledHealthRules(load_rule_table(path))
+
+
+def _format_threshold(value: float) -> str:
+    return f"{value:g}"
+
+
+def _alert_expression(rule: Dict[str, Any], alert: Dict[str, Any]) -> str:
+    """
+    生成告警表达式
+    低级别告警遇到同指标、同方向、更严格的高级别告警时，生成区间表达式以避免重复告警
+    """
+    metric = rule['metric']
+    above = rule['direction'] == 'above'
+    threshold = alert['threshold']
+    expression = f"{metric} {'>' if above else '<'} {_format_threshold(threshold)}"
+
+    severity_rank = SEVERITY_ORDER.index(alert['severity'])
+    stricter = [
+        other['threshold'] for other in rule.get('alerts', [])
+        if SEVERITY_ORDER.index(other['severity']) > severity_rank
+        and (other['threshold'] > threshold if above else other['threshold'] < threshold)
+    ]
+    if stricter:
+        bound = min(stricter) if above else max(stricter)
+        expression += f" and {metric} {'<=' if above else '>='} {_format_threshold(bound)}"
+
+    return expression
+
+
+def generate_vmalert_rules(rules: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    由规则表生成vmalert阈值告警规则（YAML文本）
+
+    Args:
+        rules: 规则列表，默认从规则表加载
+
+    Returns:
+        YAML文本
+    """
+    if rules is None:
+        rules = load_rule_table()
+
+    grouped: Dict[str, List[str]] = {severity: [] for severity in ALERT_GROUPS}
+    for rule in rules:
+        for alert in rule.get('alerts', []):
+            threshold_text = f"{_format_threshold(alert['threshold'])}{rule['unit']}"
+            description = (f"Vehicle {{{{ $labels.vehicle_id }}}} {rule['label']} is "
+                           f"{{{{ $value }}}}{rule['unit']} (threshold: {threshold_text})")
+            grouped[alert['severity']].append("\n".join([
+                f"      - alert: {alert['alert']}",
+                f"        expr: {_alert_expression(rule, alert)}",
+                f"        for: {alert['for']}",
+                f"        labels:",
+                f"          severity: {alert['severity']}",
+                f"          category: {rule['category']}",
+                f"        annotations:",
+                f"          summary: \"{alert['summary']}\"",
+                f"          description: \"{description}\"",
+            ]))
+
+    lines = [
+        "# 由 code/health_rules.py 根据 config/health_score_rules.json 自动生成，请勿手工修改",
+        "groups:",
+    ]
+    for severity in reversed(SEVERITY_ORDER):
+        if not grouped[severity]:
+            continue
+        name, interval = ALERT_GROUPS[severity]
+        lines.append(f"  - name: {name}")
+        lines.append(f"    interval: {interval}")
+        lines.append(f"    rules:")
+        lines.append("\n\n".join(grouped[severity]))
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由健康度规则表生成vmalert阈值告警规则")
+    parser.add_argument("--rules", default=str(DEFAULT_RULES_PATH), help="规则表路径")
+    parser.add_argument("--output", default=str(DEFAULT_ALERT_RULES_PATH), help="输出的vmalert规则文件")
+    parser.add_argument("--check", action="store_true", help="只检查输出文件是否为最新")
+
+    args = parser.parse_args()
+
+    content = generate_vmalert_rules(load_rule_table(args.rules))
+    output = Path(args.output)
+
+    if args.check:
+        current = output.read_text(encoding='utf-8') if output.exists() else ''
+        if current == content:
+            print(f"✓ {output} 已是最新")
+            return 0
+        print(f"✗ {output} 与规则表不一致，请运行: python health_rules.py")
+        return 1
+
+    output.write_text(content, encoding='utf-8')
+    print(f"✓ 已生成 {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
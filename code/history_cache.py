@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+本地列式历史缓存
+按 车辆/指标/天 分区，把VictoriaMetrics的历史样本存成成对的.npy文件
+（int64毫秒时间戳 + float64值），读取时内存映射，区间读取只触及用到的天分区。
+
+- 增量同步：记录上次同步的水位线，每次只从vmselect导出水位线之后的尾部数据
+- 已封口的天分区不再改写；当天分区追加时整体重写（原子替换，最多一天的数据量）
+- 分析服务、分析引擎和预测回测优先从缓存读取历史
+
+目录结构:
+    <root>/state.json                        水位线
+    <root>/<vehicle_id>/<metric>/<YYYY-MM-DD>.ts.npy
+    <root>/<vehicle_id>/<metric>/<YYYY-MM-DD>.val.npy
+    （车辆ID和指标名经百分号编码作为目录名，可逆且不同的名字不会落到同一目录）
+
+用法:
+    python history_cache.py --root ./history_cache --lookback-days 30
+    python history_cache.py --root ./history_cache --display TRACTOR_001 battery_soh --points 800
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+from urllib.parse import quote, unquote
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from downsampling import choose_resolution, downsample_chunks, lttb
+from vm_export_reader import ExportColumnReader, columns_to_frame
+from vm_query_client import VictoriaMetricsClient, regex_selector
+
+MS_PER_DAY = 86400 * 1000
+STATE_FILE = 'state.json'
+
+
+def day_of(timestamp_ms: int) -> str:
+    """毫秒时间戳所在的UTC日期（分区名）"""
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def day_start_ms(day: str) -> int:
+    """分区名对应的UTC零点（毫秒）"""
+    return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _safe_name(name: str) -> str:
+    """
+    标签值转换为目录名（百分号编码，一一对应，可由_original_name还原）
+
+    只保留字母数字和-_.~，开头的.也编码，避免出现.、..和隐藏目录
+    """
+    encoded = quote(name, safe='')
+    return '%2E' + encoded[1:] if encoded.startswith('.') else encoded or '%'
+
+
+def _original_name(directory_name: str) -> str:
+    """目录名还原为标签值"""
+    return '' if directory_name == '%' else unquote(directory_name)
+
+
+class HistoryCache:
+    """按车辆/指标/天分区的内存映射历史缓存"""
+
+    def __init__(self, root: str, metrics: Optional[Sequence[str]] = None):
+        """
+        Args:
+            root: 缓存根目录
+            metrics: 同步的指标名（None时由sync调用方提供选择器）
+        """
+        self.root = root
+        self.metrics = list(metrics) if metrics is not None else None
+        os.makedirs(root, exist_ok=True)
+        self.state = self._load_state()
+        self.stats = {'synced_samples': 0, 'sync_requests': 0, 'partitions_written': 0,
+                      'partitions_read': 0}
+
+    # ------------------------------------------------------------------
+    # 状态（水位线）
+    # ------------------------------------------------------------------
+
+    def _load_state(self) -> Dict:
+        path = os.path.join(self.root, STATE_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'watermark_ms': None}
+
+    def _save_state(self):
+        path = os.path.join(self.root, STATE_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def watermark_ms(self) -> Optional[int]:
+        """缓存已完整覆盖到的时间（毫秒，包含）"""
+        return self.state.get('watermark_ms')
+
+    def set_watermark(self, watermark_ms: int):
+        self.state['watermark_ms'] = int(watermark_ms)
+        self._save_state()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _partition_dir(self, vehicle_id: str, metric: str) -> str:
+        return os.path.join(self.root, _safe_name(vehicle_id), _safe_name(metric))
+
+    @staticmethod
+    def _load_partition(directory: str, day: str,
+                        mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        mode = 'r' if mmap else None
+        return (np.load(os.path.join(directory, f'{day}.ts.npy'), mmap_mode=mode),
+                np.load(os.path.join(directory, f'{day}.val.npy'), mmap_mode=mode))
+
+    def _write_partition(self, directory: str, day: str,
+                         timestamps: np.ndarray, values: np.ndarray):
+        # 先写临时文件再原子替换，读者不会看到半写的分区
+        for suffix, array in (('ts', timestamps), ('val', values)):
+            path = os.path.join(directory, f'{day}.{suffix}.npy')
+            tmp_path = os.path.join(directory, f'.{day}.{suffix}.tmp.npy')
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+        self.stats['partitions_written'] += 1
+
+    def append(self, vehicle_id: str, metric: str,
+               timestamps: np.ndarray, values: np.ndarray) -> int:
+        """
+        写入一个序列的样本（按天拆分，与已有分区合并，同一时间戳保留新值）
+
+        Args:
+            vehicle_id: 车辆ID
+            metric: 指标名
+            timestamps: int64毫秒时间戳
+            values: float64样本值
+
+        Returns:
+            写入的样本数
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if not len(timestamps):
+            return 0
+        directory = self._partition_dir(vehicle_id, metric)
+        os.makedirs(directory, exist_ok=True)
+
+        day_index = timestamps // MS_PER_DAY
+        boundaries = np.flatnonzero(np.r_[True, day_index[1:] != day_index[:-1]])
+        for start, end in zip(boundaries, np.r_[boundaries[1:], len(timestamps)]):
+            day = day_of(int(timestamps[start]))
+            new_ts, new_values = timestamps[start:end], values[start:end]
+            if os.path.exists(os.path.join(directory, f'{day}.ts.npy')):
+                old_ts, old_values = self._load_partition(directory, day, mmap=False)
+                if len(old_ts) and new_ts[0] > old_ts[-1]:
+                    merged_ts = np.concatenate([old_ts, new_ts])
+                    merged_values = np.concatenate([old_values, new_values])
+                else:
+                    # 乱序或重叠：稳定排序后对相同时间戳保留最后写入的值
+                    merged_ts = np.concatenate([old_ts, new_ts])
+                    merged_values = np.concatenate([old_values, new_values])
+                    order = np.argsort(merged_ts, kind='stable')
+                    merged_ts, merged_values = merged_ts[order], merged_values[order]
+                    keep = np.r_[merged_ts[1:] != merged_ts[:-1], True]
+                    merged_ts, merged_values = merged_ts[keep], merged_values[keep]
+                new_ts, new_values = merged_ts, merged_values
+            self._write_partition(directory, day, new_ts, new_values)
+        return len(timestamps)
+
+    def ingest(self, reader: ExportColumnReader) -> int:
+        """把流式导出解析结果写入缓存，返回样本数"""
+        written = 0
+        for buffer in reader:
+            vehicle_id = buffer.labels.get('vehicle_id')
+            metric = buffer.labels.get('__name__')
+            if vehicle_id is None or metric is None:
+                continue
+            # 天分区内部需要时间有序，SeriesBuffer已保证
+            written += self.append(vehicle_id, metric, buffer.timestamps, buffer.values)
+        return written
+
+    def sync(self, client: VictoriaMetricsClient, end_ms: int, lookback_ms: int,
+             selector: Optional[str] = None, chunk_seconds: float = 86400) -> ExportColumnReader:
+        """
+        增量同步：从水位线（首次为end_ms - lookback_ms）导出到end_ms
+
+        Args:
+            client: VictoriaMetrics客户端
+            end_ms: 同步终点（毫秒，应已扣除写入可见延迟）
+            lookback_ms: 首次同步的回看时长
+            selector: 序列选择器，默认按self.metrics构造
+            chunk_seconds: 导出分段时长
+
+        Returns:
+            本次导出的解析结果（调用方可直接用于增量分析）
+        """
+        if selector is None:
+            selector = regex_selector(self.metrics, 'vehicle_id!=""')
+        start_ms = end_ms - lookback_ms if self.watermark_ms is None else self.watermark_ms + 1
+        reader = ExportColumnReader()
+        if start_ms <= end_ms:
+            reader = client.export_columns(selector, start_ms / 1000, end_ms / 1000,
+                                           chunk_seconds=chunk_seconds)
+            self.stats['sync_requests'] += 1
+            self.stats['synced_samples'] += self.ingest(reader)
+            self.set_watermark(end_ms)
+        return reader
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _vehicle_dirs(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, name)))
+
+    def vehicles(self) -> List[str]:
+        """缓存中的车辆ID（原始标签值，可直接用于查询和写回）"""
+        return sorted(_original_name(name) for name in self._vehicle_dirs())
+
+    def vehicle_metrics(self, vehicle_id: str) -> List[str]:
+        directory = os.path.join(self.root, _safe_name(vehicle_id))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(_original_name(name) for name in os.listdir(directory))
+
+    def _days(self, directory: str) -> List[str]:
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-7] for name in os.listdir(directory)
+                      if name.endswith('.ts.npy') and not name.startswith('.'))
+
+    def read(self, vehicle_id: str, metric: str,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        区间读取（包含两端）；只落在一个天分区时返回内存映射视图，不复制
+
+        Returns:
+            (int64毫秒时间戳, float64值)
+        """
+        parts = list(self.iter_partitions(vehicle_id, metric, start_ms, end_ms))
+        parts_ts = [ts for ts, _ in parts]
+        parts_values = [values for _, values in parts]
+
+        if not parts_ts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if len(parts_ts) == 1:
+            return parts_ts[0], parts_values[0]
+        return np.concatenate(parts_ts), np.concatenate(parts_values)
+
+    def iter_partitions(self, vehicle_id: str, metric: str,
+                        start_ms: Optional[int] = None,
+                        end_ms: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        按天分区逐块读取区间内的样本（内存映射视图，一次只触及一个分区）
+
+        Yields:
+            (int64毫秒时间戳, float64值)
+        """
+        directory = self._partition_dir(vehicle_id, metric)
+        days = self._days(directory)
+        if start_ms is not None:
+            days = [d for d in days if day_start_ms(d) + MS_PER_DAY > start_ms]
+        if end_ms is not None:
+            days = [d for d in days if day_start_ms(d) <= end_ms]
+
+        for day in days:
+            ts, values = self._load_partition(directory, day)
+            self.stats['partitions_read'] += 1
+            lo = 0 if start_ms is None else int(np.searchsorted(ts, start_ms, side='left'))
+            hi = len(ts) if end_ms is None else int(np.searchsorted(ts, end_ms, side='right'))
+            if hi > lo:
+                yield ts[lo:hi], values[lo:hi]
+
+    def read_downsampled(self, vehicle_id: str, metric: str, bucket_seconds: float,
+                         start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                         max_buckets: Optional[int] = None) -> pd.DataFrame:
+        """
+        按天分区分块做桶聚合，内存只与桶数有关（不加载完整历史）
+
+        Returns:
+            列为timestamp/mean/min/max/count的DataFrame
+        """
+        chunks = ((ts * 1_000_000, values)
+                  for ts, values in self.iter_partitions(vehicle_id, metric, start_ms, end_ms))
+        return downsample_chunks(chunks, bucket_seconds, max_buckets)
+
+    def read_display(self, vehicle_id: str, metric: str, max_points: int = 1000,
+                     start_ms: Optional[int] = None,
+                     end_ms: Optional[int] = None) -> pd.DataFrame:
+        """
+        用于绘图的(timestamp, value)序列：先分块聚合到至多2×max_points个桶，
+        每个桶取最小值和最大值两点（桶均值会抹平尖峰），再用LTTB选出max_points个点
+        （保留尖峰和拐点，不加载完整历史）
+        """
+        days = self._days(self._partition_dir(vehicle_id, metric))
+        if not days:
+            return pd.DataFrame(columns=['timestamp', 'value'])
+        first = day_start_ms(days[0]) if start_ms is None else start_ms
+        last = day_start_ms(days[-1]) + MS_PER_DAY if end_ms is None else end_ms
+        resolution = choose_resolution(0.0, (last - first) / 1000, max_points=2 * max_points)
+        buckets = self.read_downsampled(vehicle_id, metric, resolution, start_ms, end_ms)
+        # 最小值放在桶起点、最大值放在桶中点，按时间交错排列
+        start_ns = buckets['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        x = np.column_stack([start_ns, start_ns + int(resolution * 5e8)]).ravel()
+        y = np.column_stack([buckets['min'].to_numpy(), buckets['max'].to_numpy()]).ravel()
+        selected = lttb(x.astype(np.float64), y, max_points)
+        return pd.DataFrame({'timestamp': pd.to_datetime(x[selected]), 'value': y[selected]})
+
+    def read_frame(self, vehicle_id: str, start_ms: Optional[int] = None,
+                   end_ms: Optional[int] = None,
+                   column_map: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """
+        一辆车的宽表历史（timestamp列 + 每个指标一列）
+
+        Args:
+            vehicle_id: 车辆ID
+            start_ms: 起始时间（毫秒）
+            end_ms: 结束时间（毫秒）
+            column_map: 指标名 -> 列名（不在映射中的指标忽略；为None时用指标名作列名）
+        """
+        columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for metric in self.vehicle_metrics(vehicle_id):
+            column = metric if column_map is None else column_map.get(metric)
+            if column is None:
+                continue
+            ts, values = self.read(vehicle_id, metric, start_ms, end_ms)
+            # 多个指标映射到同一列时保留点数多的
+            if len(ts) and (column not in columns or len(ts) > len(columns[column][0])):
+                columns[column] = (ts, values)
+        if not columns:
+            return pd.DataFrame(columns=['timestamp'])
+        return columns_to_frame(columns)
+
+    def read_series_frame(self, vehicle_id: str, metric: str,
+                          start_ms: Optional[int] = None,
+                          end_ms: Optional[int] = None) -> pd.DataFrame:
+        """单个指标的(timestamp, value)两列DataFrame（预测接口的输入格式）"""
+        ts, values = self.read(vehicle_id, metric, start_ms, end_ms)
+        return pd.DataFrame({'timestamp': pd.DatetimeIndex(ts.view('datetime64[ms]')),
+                             'value': values})
+
+    def load_history(self, vehicle_id: str, end_ms: int, lookback_ms: int,
+                     column_map: Optional[Dict[str, str]] = None,
+                     client: Optional[VictoriaMetricsClient] = None) -> pd.DataFrame:
+        """
+        缓存优先读取一辆车的历史：提供client且水位线落后于end_ms时先同步缺失的尾部
+
+        Args:
+            vehicle_id: 车辆ID
+            end_ms: 历史终点（毫秒）
+            lookback_ms: 回看时长
+            column_map: 指标名 -> 列名
+            client: VictoriaMetrics客户端（None时只读缓存）
+        """
+        if client is not None and (self.watermark_ms is None or self.watermark_ms < end_ms):
+            self.sync(client, end_ms, lookback_ms)
+        return self.read_frame(vehicle_id, end_ms - lookback_ms, end_ms, column_map)
+
+    def prune(self, older_than_ms: int) -> int:
+        """删除早于指定时间的整天分区，返回删除的分区数"""
+        removed = 0
+        for vehicle_dir in self._vehicle_dirs():
+            for metric_dir in os.listdir(os.path.join(self.root, vehicle_dir)):
+                directory = os.path.join(self.root, vehicle_dir, metric_dir)
+                for day in self._days(directory):
+                    if day_start_ms(day) + MS_PER_DAY <= older_than_ms:
+                        for suffix in ('ts', 'val'):
+                            os.remove(os.path.join(directory, f'{day}.{suffix}.npy'))
+                        removed += 1
+                if not os.listdir(directory):
+                    shutil.rmtree(directory)
+            vehicle_path = os.path.join(self.root, vehicle_dir)
+            if not os.listdir(vehicle_path):
+                os.rmdir(vehicle_path)
+        return removed
+
+    def disk_usage_bytes(self) -> int:
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从VictoriaMetrics增量同步本地历史缓存")
+    parser.add_argument("--root", default="./history_cache", help="缓存目录")
+    parser.add_argument("--select-url", default=None, help="vmselect查询地址")
+    parser.add_argument("--metrics", nargs='+', default=None,
+                        help="同步的指标名（默认为分析服务使用的指标）")
+    parser.add_argument("--lookback-days", type=float, default=30.0, help="首次同步的回看天数")
+    parser.add_argument("--ingest-delay", type=int, default=30, help="写入可见延迟（秒）")
+    parser.add_argument("--retention-days", type=float, default=None, help="删除早于该天数的分区")
+    parser.add_argument("--display", nargs=2, metavar=("VEHICLE_ID", "METRIC"), default=None,
+                        help="不同步，只把一个序列降采样为绘图用的CSV（LTTB）")
+    parser.add_argument("--points", type=int, default=1000, help="绘图点数")
+    parser.add_argument("--output", default=None, help="绘图CSV输出路径（默认输出到终端）")
+
+    args = parser.parse_args()
+
+    if args.display:
+        cache = HistoryCache(args.root)
+        frame = cache.read_display(*args.display, max_points=args.points)
+        if frame.empty:
+            print(f"[错误] 缓存中没有 {args.display[0]} 的 {args.display[1]}")
+            return 1
+        if args.output:
+            frame.to_csv(args.output, index=False)
+            print(f"✓ 已导出 {len(frame)} 个点到 {args.output}")
+        else:
+            print(frame.to_csv(index=False), end='')
+        return 0
+
+    if args.metrics is None:
+        from vm_analysis_service import ANALYSIS_METRICS
+        args.metrics = sorted(ANALYSIS_METRICS)
+
+    client = VictoriaMetricsClient(args.select_url) if args.select_url else VictoriaMetricsClient()
+    cache = HistoryCache(args.root, args.metrics)
+    end_ms = int(time.time() * 1000) - args.ingest_delay * 1000
+
+    print(f"[信息] 缓存目录: {args.root}，水位线: {cache.watermark_ms}")
+    try:
+        reader = cache.sync(client, end_ms, int(args.lookback_days * MS_PER_DAY))
+    except Exception as e:
+        print(f"[错误] 同步失败: {e}")
+        return 1
+    print(f"✓ 同步完成: {len(reader.series)} 个序列，{reader.samples} 个样本")
+
+    if args.retention_days is not None:
+        removed = cache.prune(end_ms - int(args.retention_days * MS_PER_DAY))
+        print(f"[信息] 删除过期分区: {removed}")
+    print(f"[信息] 车辆数: {len(cache.vehicles())}，"
+          f"占用空间: {cache.disk_usage_bytes() / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
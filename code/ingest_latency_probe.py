@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+端到端写入延迟探针
+按固定速率发布带序号的标记样本，轮询vmselect直到每个标记可查询，按阶段输出p50/p95/p99，
+用于确定桥接服务的刷新间隔和告警规则的 for: 窗口。
+
+每个标记同时走两条路径：
+- MQTT路径: 探针发布 → Broker → 桥接服务 → vminsert → vmselect可查询
+  （探针自己也订阅同一主题，收到消息的时间即Broker投递时间）
+- 直写路径: 探针直接写入vminsert（车辆ID加 _DIRECT 后缀），作为不经过桥接服务的对照
+
+阶段划分:
+- broker:     发布 → 订阅端收到
+- bridge:     MQTT路径端到端 - broker - 直写路径端到端（桥接服务额外引入的延迟）
+- vminsert:   直写请求 → vminsert确认
+- visibility: vminsert确认 → vmselect可查询（包含vmselect的 -search.latencyOffset）
+- end_to_end: 发布 → vmselect可查询
+
+没有MQTT Broker时（本地单机版VictoriaMetrics或其他替身服务）使用 --direct，只测直写路径。
+可查询时间的分辨率为轮询间隔（--poll-interval）。
+
+用法:
+    python ingest_latency_probe.py --count 100 --rate 2
+    python ingest_latency_probe.py --direct --select-url http://localhost:8428/prometheus \\
+        --insert-url http://localhost:8428/api/v1/import/prometheus
+"""
+
+import json
+import math
+import time
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+import requests
+
+from vm_query_client import VM_INSERT_URL, VM_SELECT_URL, VictoriaMetricsClient, VMQueryError
+
+try:
+    import paho.mqtt.client as mqtt
+    MQTT_AVAILABLE = True
+except ImportError:
+    MQTT_AVAILABLE = False
+
+# 标记样本的指标名（值为标记序号，单调递增）
+PROBE_METRIC = 'latency_probe_seq'
+DEFAULT_PROBE_ID = 'LATENCY_PROBE'
+
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+# 与桥接服务订阅的主题一致
+MQTT_TOPIC = "tractor/telemetry"
+
+STAGES = ('broker', 'bridge', 'vminsert', 'visibility', 'end_to_end')
+PERCENTILES = (50, 95, 99)
+
+
+class IngestLatencyProbe:
+    """写入延迟探针（发送、订阅和轮询分别在各自线程中进行）"""
+
+    def __init__(self, client: VictoriaMetricsClient, probe_id: str = DEFAULT_PROBE_ID,
+                 use_mqtt: bool = True, mqtt_broker: str = MQTT_BROKER, mqtt_port: int = MQTT_PORT,
+                 topic: str = MQTT_TOPIC, poll_interval: float = 0.1):
+        """
+        Args:
+            client: VictoriaMetrics客户端（直写和轮询共用）
+            probe_id: 标记样本的vehicle_id
+            use_mqtt: 是否测MQTT路径（False时只测直写路径）
+            mqtt_broker: MQTT Broker地址
+            mqtt_port: MQTT Broker端口
+            topic: 发布标记的主题（桥接服务订阅的主题）
+            poll_interval: 轮询vmselect的间隔（秒）
+        """
+        self.client = client
+        self.probe_id = probe_id
+        self.direct_id = f"{probe_id}_DIRECT"
+        self.use_mqtt = use_mqtt
+        self.topic = topic
+        self.poll_interval = poll_interval
+
+        # 标记序号 -> 各时间点（Unix秒）
+        self.markers: Dict[int, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._last_seq = 0
+        self._stop = threading.Event()
+        self.stats = {'sent': 0, 'polls': 0, 'poll_errors': 0, 'write_errors': 0}
+
+        self.mqtt_client = None
+        if use_mqtt:
+            if not MQTT_AVAILABLE:
+                raise RuntimeError("paho-mqtt库未安装（pip install paho-mqtt），或使用 --direct 只测直写路径")
+            self.mqtt_client = mqtt.Client()
+            self.mqtt_client.on_connect = self._on_connect
+            self.mqtt_client.on_message = self._on_message
+            self.mqtt_client.connect(mqtt_broker, mqtt_port, 60)
+
+    # ------------------------------------------------------------------
+    # 标记的发送、接收和可见性轮询
+    # ------------------------------------------------------------------
+
+    def _next_seq(self) -> int:
+        # 以毫秒时间戳为序号：跨多次运行仍然单调递增，不需要清理旧序列
+        self._last_seq = max(self._last_seq + 1, int(time.time() * 1000))
+        return self._last_seq
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(self.topic)
+        else:
+            print(f"[错误] 连接MQTT Broker失败，返回码: {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        received = time.time()
+        try:
+            data = json.loads(msg.payload.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            return
+        if data.get('vehicle_id') != self.probe_id or PROBE_METRIC not in data:
+            return
+        with self._lock:
+            marker = self.markers.get(int(data[PROBE_METRIC]))
+            if marker is not None:
+                marker.setdefault('delivered', received)
+
+    def send_marker(self) -> int:
+        """发送一个标记（MQTT发布 + 直写），返回序号"""
+        seq = self._next_seq()
+        marker = {}
+        if self.mqtt_client is not None:
+            marker['published'] = time.time()
+            payload = json.dumps({
+                'vehicle_id': self.probe_id,
+                'timestamp': datetime.fromtimestamp(marker['published']).isoformat(),
+                PROBE_METRIC: seq,
+            })
+        with self._lock:
+            self.markers[seq] = marker
+        if self.mqtt_client is not None:
+            self.mqtt_client.publish(self.topic, payload, qos=1)
+
+        written = time.time()
+        line = f'{PROBE_METRIC}{{vehicle_id="{self.direct_id}"}} {seq} {int(written * 1000)}'
+        try:
+            ok = self.client.import_prometheus(line)
+        except (requests.RequestException, VMQueryError) as e:
+            ok = False
+            print(f"⚠️  直写标记失败: {e}")
+        acked = time.time()
+        with self._lock:
+            marker['written'] = written
+            if ok:
+                marker['acked'] = acked
+            else:
+                self.stats['write_errors'] += 1
+            self.stats['sent'] += 1
+        return seq
+
+    def poll_once(self):
+        """查询两条路径上已可见的最大序号，标记所有不超过该序号的标记为可见"""
+        expr = (f'max by (vehicle_id) (max_over_time({PROBE_METRIC}'
+                f'{{vehicle_id=~"{self.probe_id}|{self.direct_id}"}}[5m]))')
+        try:
+            # nocache=1: 跳过vmselect的查询结果缓存，否则新样本要等缓存过期才能看到
+            result = self.client.query(expr, extra_params={'nocache': 1})
+        except (requests.RequestException, VMQueryError):
+            self.stats['poll_errors'] += 1
+            return
+        now = time.time()
+        self.stats['polls'] += 1
+
+        latest = {series.get('metric', {}).get('vehicle_id'): float(series['value'][1]) for series in result}
+        with self._lock:
+            for vehicle_id, key in ((self.probe_id, 'visible'), (self.direct_id, 'visible_direct')):
+                if vehicle_id not in latest:
+                    continue
+                for seq, marker in self.markers.items():
+                    if seq <= latest[vehicle_id] and key not in marker:
+                        marker[key] = now
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            started = time.time()
+            self.poll_once()
+            self._stop.wait(max(0.0, self.poll_interval - (time.time() - started)))
+
+    def _pending(self) -> int:
+        keys = ('visible', 'visible_direct') if self.use_mqtt else ('visible_direct',)
+        with self._lock:
+            return sum(1 for marker in self.markers.values() if any(k not in marker for k in keys))
+
+    def run(self, count: int = 100, rate: float = 2.0, timeout: float = 60.0):
+        """
+        按速率发送count个标记，等待全部可查询（最后一个标记发出后最多等timeout秒）
+
+        Args:
+            count: 标记数量
+            rate: 每秒发送的标记数
+            timeout: 等待可见的超时（秒）
+        """
+        if self.mqtt_client is not None:
+            self.mqtt_client.loop_start()
+            # 等订阅生效后再发送，否则最初几个标记收不到
+            time.sleep(0.5)
+        poller = threading.Thread(target=self._poll_loop, daemon=True)
+        poller.start()
+
+        try:
+            interval = 1.0 / rate
+            started = time.time()
+            for i in range(count):
+                time.sleep(max(0.0, started + i * interval - time.time()))
+                self.send_marker()
+                if (i + 1) % max(1, int(rate * 10)) == 0:
+                    print(f"[信息] 已发送 {i + 1}/{count} 个标记，等待可见: {self._pending()}")
+
+            deadline = time.time() + timeout
+            while self._pending() and time.time() < deadline:
+                time.sleep(self.poll_interval)
+        finally:
+            self._stop.set()
+            poller.join(timeout=5)
+            if self.mqtt_client is not None:
+                self.mqtt_client.loop_stop()
+                self.mqtt_client.disconnect()
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+
+    def stage_latencies(self) -> Dict[str, np.ndarray]:
+        """各阶段的延迟（毫秒，只包含该阶段两端时间都已记录的标记）"""
+        samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        with self._lock:
+            markers = [dict(marker) for marker in self.markers.values()]
+
+        for m in markers:
+            if 'acked' in m:
+                samples['vminsert'].append(m['acked'] - m['written'])
+                if 'visible_direct' in m:
+                    samples['visibility'].append(m['visible_direct'] - m['acked'])
+            if not self.use_mqtt:
+                if 'visible_direct' in m:
+                    samples['end_to_end'].append(m['visible_direct'] - m['written'])
+                continue
+            if 'delivered' in m:
+                samples['broker'].append(m['delivered'] - m['published'])
+            if 'visible' in m:
+                samples['end_to_end'].append(m['visible'] - m['published'])
+                if 'delivered' in m and 'visible_direct' in m:
+                    direct = m['visible_direct'] - m['written']
+                    bridge = (m['visible'] - m['published']) - (m['delivered'] - m['published']) - direct
+                    samples['bridge'].append(max(0.0, bridge))
+
+        return {stage: np.asarray(values) * 1000.0 for stage, values in samples.items()}
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        各阶段的分位数
+
+        Returns:
+            {阶段: {'count', 'p50', 'p95', 'p99', 'max'}}（毫秒），没有样本的阶段省略
+        """
+        summary = {}
+        for stage, values in self.stage_latencies().items():
+            if len(values) == 0:
+                continue
+            row = {'count': float(len(values)), 'max': float(values.max())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                row[f'p{p}'] = float(value)
+            summary[stage] = row
+        return summary
+
+    def lost(self) -> Dict[str, int]:
+        """超时仍未可见的标记数"""
+        with self._lock:
+            markers = list(self.markers.values())
+        lost = {'direct': sum(1 for m in markers if 'acked' in m and 'visible_direct' not in m)}
+        if self.use_mqtt:
+            lost['not_delivered'] = sum(1 for m in markers if 'delivered' not in m)
+            lost['mqtt'] = sum(1 for m in markers if 'visible' not in m)
+        return lost
+
+
+def print_report(probe: IngestLatencyProbe, eval_interval: float = 30.0):
+    """输出分位数表和 for: 窗口建议"""
+    summary = probe.report()
+    print()
+    print("=" * 70)
+    print("写入延迟（毫秒）")
+    print("=" * 70)
+    print(f"{'阶段':<16}{'样本数':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    print("-" * 70)
+    for stage in STAGES:
+        if stage in summary:
+            row = summary[stage]
+            print(f"{stage:<18}{row['count']:>8.0f}{row['p50']:>10.1f}{row['p95']:>10.1f}"
+                  f"{row['p99']:>10.1f}{row['max']:>10.1f}")
+        else:
+            print(f"{stage:<18}{'—':>8}")
+    print("-" * 70)
+    print(f"轮询: {probe.stats['polls']} 次（间隔 {probe.poll_interval * 1000:.0f}ms，"
+          f"失败 {probe.stats['poll_errors']}），直写失败: {probe.stats['write_errors']}")
+
+    lost = probe.lost()
+    if any(lost.values()):
+        print(f"⚠️  超时未可见: {lost}")
+
+    if 'end_to_end' in summary:
+        p99 = summary['end_to_end']['p99'] / 1000
+        # 样本可查询前告警规则看不到它：for: 至少覆盖p99端到端延迟加一个评估间隔
+        minimum_for = math.ceil(p99 + eval_interval)
+        print()
+        print(f"[建议] 端到端p99为 {p99:.1f}s：")
+        print(f"  - 告警规则的 for: 窗口不应小于 {minimum_for}s（p99延迟 + {eval_interval:g}s评估间隔）")
+        print(f"  - 仪表板/分析服务读取最近数据时，时间范围终点应留出至少 {math.ceil(p99)}s 的余量")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端写入延迟探针")
+    parser.add_argument("--count", type=int, default=100, help="标记数量")
+    parser.add_argument("--rate", type=float, default=2.0, help="每秒发送的标记数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="最后一个标记发出后等待可见的秒数")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="轮询vmselect的间隔（秒）")
+    parser.add_argument("--direct", action="store_true", help="不经过MQTT，只测直写vminsert的路径")
+    parser.add_argument("--broker", default=MQTT_BROKER, help="MQTT Broker地址")
+    parser.add_argument("--port", type=int, default=MQTT_PORT, help="MQTT Broker端口")
+    parser.add_argument("--topic", default=MQTT_TOPIC, help="桥接服务订阅的主题")
+    parser.add_argument("--probe-id", default=DEFAULT_PROBE_ID, help="标记样本的vehicle_id")
+    parser.add_argument("--select-url", default=VM_SELECT_URL, help="vmselect查询地址")
+    parser.add_argument("--insert-url", default=VM_INSERT_URL, help="vminsert导入地址")
+    parser.add_argument("--eval-interval", type=float, default=30.0, help="vmalert评估间隔（秒）")
+
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("端到端写入延迟探针")
+    print("=" * 70)
+    print(f"路径: {'直写vminsert' if args.direct else f'MQTT {args.broker}:{args.port} {args.topic} + 直写对照'}")
+    print(f"标记: {args.count} 个，{args.rate:g}/s，vehicle_id={args.probe_id}")
+    print()
+
+    with VictoriaMetricsClient(select_url=args.select_url, insert_url=args.insert_url,
+                               timeout=5, retries=1, pool_maxsize=4) as client:
+        try:
+            probe = IngestLatencyProbe(client, args.probe_id, not args.direct, args.broker, args.port,
+                                       args.topic, args.poll_interval)
+        except Exception as e:
+            print(f"[错误] {e}")
+            return 1
+        probe.run(args.count, args.rate, args.timeout)
+        print_report(probe, args.eval_interval)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,11 +4,14 @@ MQTT到VictoriaMetrics数据桥接服务 - 完整版
 支持T-BOX发送的所有60+指标
 """
 
+import os
 import json
 import time
-import requests
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
+
+from vm_query_client import VM_INSERT_URL, VictoriaMetricsClient
+from telemetry_ring import DEFAULT_RING_PATH, TelemetryRingWriter
 
 try:
     import paho.mqtt.client as mqtt
@@ -22,7 +25,22 @@ except ImportError:
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "tractor/telemetry"
-VICTORIAMETRICS_URL = "http://localhost:8480/insert/0/prometheus/api/v1/import/prometheus"
+VICTORIAMETRICS_URL = VM_INSERT_URL
+
+# 写入客户端（连接复用、超时和重试统一配置）
+# 在paho的on_message回调中同步调用：不重试（带退避的重试会阻塞网络循环，
+# 消息堆积并错过keepalive），写入失败直接计入errors
+vm_client = VictoriaMetricsClient(insert_url=VICTORIAMETRICS_URL, timeout=5, retries=0)
+
+# 最近数据的共享内存环形缓冲区（同机的分析/告警进程直接读取），环境变量设为空则不发布
+TELEMETRY_RING_PATH = os.environ.get('TELEMETRY_RING_PATH', DEFAULT_RING_PATH)
+# 环形缓冲区容量：车辆/指标槽位用完后新车辆、新指标不再进入环形缓冲区（槽位不回收，重启后重建）
+TELEMETRY_RING_MAX_VEHICLES = int(os.environ.get('TELEMETRY_RING_MAX_VEHICLES', 64))
+TELEMETRY_RING_MAX_METRICS = int(os.environ.get('TELEMETRY_RING_MAX_METRICS', 128))
+TELEMETRY_RING_CAPACITY = int(os.environ.get('TELEMETRY_RING_CAPACITY', 600))
+ring_writer = None
+# 因槽位用完未进入环形缓冲区的车辆（每辆只告警一次）
+ring_dropped_vehicles = set()
 
 # 统计信息
 stats = {
@@ -48,26 +66,13 @@ def flatten_dict(d: Dict[str, Any], parent_key: str = '', sep: str = '_') -> Dic
     return dict(items)
 
 
-def convert_to_prometheus_format(data: Dict[str, Any]) -> str:
+def extract_numeric_metrics(data: Dict[str, Any]) -> Tuple[str, int, Dict[str, float]]:
     """
-    将T-BOX JSON数据转换为Prometheus格式
-    
-    输入格式:
-    {
-        "vehicle_id": "TRACTOR_001",
-        "timestamp": "2025-10-30T10:48:39.123456",
-        "engine_rpm": 1800,
-        "engine_coolant_temp": 110.5,
-        ...
-    }
+    从T-BOX JSON数据中提取车辆ID、毫秒时间戳和扁平化的数值指标
     
-    输出格式:
-    engine_rpm{vehicle_id="TRACTOR_001"} 1800 1698654519123
-    engine_coolant_temp{vehicle_id="TRACTOR_001"} 110.5 1698654519123
-    ...
+    Returns:
+        (vehicle_id, timestamp_ms, {指标名: 数值})
     """
-    lines = []
-    
     # 提取vehicle_id和timestamp
     vehicle_id = data.get('vehicle_id', 'UNKNOWN')
     timestamp_str = data.get('timestamp', datetime.now().isoformat())
@@ -82,7 +87,7 @@ def convert_to_prometheus_format(data: Dict[str, Any]) -> str:
     # 扁平化嵌套结构（如果有）
     flat_data = flatten_dict(data)
     
-    # 转换每个指标
+    metrics = {}
     for key, value in flat_data.items():
         # 跳过非数值字段
         if key in ['vehicle_id', 'timestamp', 'operation_hours']:
@@ -98,40 +103,75 @@ def convert_to_prometheus_format(data: Dict[str, Any]) -> str:
         
         # 转换为数值
         try:
-            numeric_value = float(value)
+            metrics[key] = float(value)
         except (ValueError, TypeError):
             continue
-        
-        # 生成Prometheus格式的行
-        # 格式: metric_name{label1="value1"} value timestamp
-        line = f'{key}{{vehicle_id="{vehicle_id}"}} {numeric_value} {timestamp_ms}'
-        lines.append(line)
     
-    return '\n'.join(lines)
+    return vehicle_id, timestamp_ms, metrics
+
+
+def format_prometheus_lines(vehicle_id: str, timestamp_ms: int, metrics: Dict[str, float]) -> str:
+    """数值指标转换为Prometheus文本格式"""
+    # 格式: metric_name{label1="value1"} value timestamp
+    return '\n'.join(f'{key}{{vehicle_id="{vehicle_id}"}} {value} {timestamp_ms}'
+                     for key, value in metrics.items())
+
+
+def convert_to_prometheus_format(data: Dict[str, Any]) -> str:
+    """
+    将T-BOX JSON数据转换为Prometheus格式
+    
+    输入格式:
+    {
+        "vehicle_id": "TRACTOR_001",
+        "timestamp": "2025-10-30T10:48:39.123456",
+        "engine_rpm": 1800,
+        "engine_coolant_temp": 110.5,
+        ...
+    }
+    
+    输出格式:
+    engine_rpm{vehicle_id="TRACTOR_001"} 1800 1698654519123
+    engine_coolant_temp{vehicle_id="TRACTOR_001"} 110.5 1698654519123
+    ...
+    """
+    return format_prometheus_lines(*extract_numeric_metrics(data))
 
 
 def send_to_victoriametrics(prometheus_data: str) -> bool:
     """发送数据到VictoriaMetrics"""
     try:
-        response = requests.post(
-            VICTORIAMETRICS_URL,
-            data=prometheus_data,
-            headers={'Content-Type': 'text/plain'},
-            timeout=5
-        )
-        
-        if response.status_code == 204:
+        if vm_client.import_prometheus(prometheus_data):
             return True
-        else:
-            print(f"[错误] VictoriaMetrics返回状态码: {response.status_code}")
-            print(f"[错误] 响应内容: {response.text}")
-            return False
+        print("[错误] VictoriaMetrics未确认写入")
+        return False
             
     except Exception as e:
         print(f"[错误] 发送到VictoriaMetrics失败: {e}")
         return False
 
 
+def publish_to_ring(vehicle_id: str, timestamp_ms: int, metrics: Dict[str, float]):
+    """发布到共享内存环形缓冲区，槽位用完导致丢弃时告警"""
+    dropped_metrics = ring_writer.stats['dropped_metrics']
+    if not ring_writer.publish(vehicle_id, timestamp_ms, metrics):
+        if vehicle_id not in ring_dropped_vehicles:
+            ring_dropped_vehicles.add(vehicle_id)
+            print(f"[警告] 环形缓冲区车辆槽位已满（{TELEMETRY_RING_MAX_VEHICLES}），"
+                  f"车辆 {vehicle_id} 不进入环形缓冲区（调大 TELEMETRY_RING_MAX_VEHICLES 后重启）")
+    elif ring_writer.stats['dropped_metrics'] > dropped_metrics and not dropped_metrics:
+        print(f"[警告] 环形缓冲区指标槽位已满（{TELEMETRY_RING_MAX_METRICS}），"
+              f"新指标不进入环形缓冲区（调大 TELEMETRY_RING_MAX_METRICS 后重启）")
+
+
+def ring_stats_text() -> str:
+    """环形缓冲区丢弃计数"""
+    if ring_writer is None:
+        return ""
+    return (f", 环形缓冲区丢弃: 车辆 {len(ring_dropped_vehicles)} 辆/"
+            f"{ring_writer.stats['dropped_vehicles']} 包, 指标 {ring_writer.stats['dropped_metrics']} 个")
+
+
 def on_connect(client, userdata, flags, rc):
     """MQTT连接回调"""
     if rc == 0:
@@ -154,11 +194,16 @@ def on_message(client, userdata, msg):
         stats["messages_received"] += 1
         stats["last_message_time"] = datetime.now()
         
+        # 提取数值指标，先发布到共享内存环形缓冲区（本机读者立即可见）
+        vehicle_id, timestamp_ms, metrics = extract_numeric_metrics(data)
+        if ring_writer is not None:
+            publish_to_ring(vehicle_id, timestamp_ms, metrics)
+        
         # 转换为Prometheus格式
-        prometheus_data = convert_to_prometheus_format(data)
+        prometheus_data = format_prometheus_lines(vehicle_id, timestamp_ms, metrics)
         
         # 计算指标数量
-        metric_count = len(prometheus_data.split('\n'))
+        metric_count = len(metrics)
         
         # 发送到VictoriaMetrics
         if send_to_victoriametrics(prometheus_data):
@@ -166,7 +211,8 @@ def on_message(client, userdata, msg):
             print(f"[接收] 车辆 {vehicle_id} 的数据 ({len(msg.payload)} 字节)")
             print(f"[转换] 生成 {metric_count} 个指标")
             print(f"[成功] 写入 {metric_count} 个指标到VictoriaMetrics")
-            print(f"[统计] 总消息: {stats['messages_received']}, 总指标: {stats['metrics_sent']}, 错误: {stats['errors']}")
+            print(f"[统计] 总消息: {stats['messages_received']}, 总指标: {stats['metrics_sent']}, "
+                  f"错误: {stats['errors']}{ring_stats_text()}")
             print()
         else:
             stats["errors"] += 1
@@ -192,6 +238,8 @@ def on_disconnect(client, userdata, rc):
 
 
 def main():
+    global ring_writer
+    
     print("=" * 80)
     print("  MQTT到VictoriaMetrics数据桥接服务 - 完整版")
     print("=" * 80)
@@ -199,6 +247,16 @@ def main():
     print(f"MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
     print(f"MQTT Topic: {MQTT_TOPIC}")
     print(f"VictoriaMetrics: {VICTORIAMETRICS_URL}")
+    if TELEMETRY_RING_PATH:
+        try:
+            ring_writer = TelemetryRingWriter(TELEMETRY_RING_PATH,
+                                              max_vehicles=TELEMETRY_RING_MAX_VEHICLES,
+                                              max_metrics=TELEMETRY_RING_MAX_METRICS,
+                                              capacity=TELEMETRY_RING_CAPACITY)
+            print(f"共享内存环形缓冲区: {TELEMETRY_RING_PATH}（{TELEMETRY_RING_MAX_VEHICLES} 辆车 × "
+                  f"{TELEMETRY_RING_MAX_METRICS} 个指标 × {TELEMETRY_RING_CAPACITY} 包）")
+        except OSError as e:
+            print(f"[警告] 无法创建共享内存环形缓冲区: {e}")
     print()
     print("=" * 80)
     print()
@@ -235,6 +293,10 @@ def main():
         print(f"总消息数: {stats['messages_received']}")
         print(f"总指标数: {stats['metrics_sent']}")
         print(f"错误数: {stats['errors']}")
+        if ring_writer is not None:
+            print(f"环形缓冲区丢弃: 车辆 {len(ring_dropped_vehicles)} 辆"
+                  f"（{ring_writer.stats['dropped_vehicles']} 个数据包），"
+                  f"指标 {ring_writer.stats['dropped_metrics']} 个")
         if stats['last_message_time']:
             print(f"最后消息时间: {stats['last_message_time'].strftime('%Y-%m-%d %H:%M:%S')}")
         print()
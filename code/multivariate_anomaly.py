@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+多变量异常检测
+发动机转速、扭矩、负载、油耗、冷却液温度等通道是联动变化的，
+单通道检测无法发现"各自正常、但相互关系异常"的故障。
+
+本模块维护每辆车的流式协方差估计（Chan并行合并公式，可增量更新、可合并），
+用马氏距离对整个车队的所有数据包做批量矩阵运算打分。
+不同T-BOX/模拟器上报的通道不同（例如没有engine_load），只用实际有数据的通道检测
+"""
+
+import math
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+# 默认的联动通道（油耗的上报名engine_fuel_consumption_rate在分析服务的指标映射中统一为engine_fuel_rate）
+MULTIVARIATE_CHANNELS = [
+    'engine_rpm',
+    'engine_torque',
+    'engine_load',
+    'engine_fuel_rate',
+    'engine_coolant_temp',
+]
+
+# 马氏距离至少需要的通道数
+MIN_MULTIVARIATE_CHANNELS = 2
+
+
+def available_channels(frame, channels: Sequence[str] = MULTIVARIATE_CHANNELS) -> List[str]:
+    """
+    frame中存在且至少有一个有效值的联动通道（保持channels中的顺序）
+
+    Args:
+        frame: 数据DataFrame
+        channels: 候选通道
+
+    Returns:
+        可用通道列表
+    """
+    return [c for c in channels if c in frame.columns and frame[c].notna().any()]
+
+
+def chi2_quantile(p: float, dof: int) -> float:
+    """
+    卡方分布分位数（Wilson-Hilferty近似，避免引入scipy依赖）
+
+    Args:
+        p: 概率（0-1）
+        dof: 自由度
+
+    Returns:
+        分位数
+    """
+    # 标准正态上侧分位数（Abramowitz-Stegun 26.2.23有理近似，p∈[0.5, 1)）
+    t = math.sqrt(-2.0 * math.log(1.0 - p))
+    z = t - (2.515517 + 0.802853 * t + 0.010328 * t * t) / \
+        (1.0 + 1.432788 * t + 0.189269 * t * t + 0.001308 * t ** 3)
+    h = 2.0 / (9.0 * dof)
+    return dof * (1.0 - h + z * math.sqrt(h)) ** 3
+
+
+class FleetMahalanobisDetector:
+    """车队级马氏距离检测器（每辆车独立的均值和协方差，按矩阵批量运算）"""
+
+    def __init__(self,
+                 channels: Sequence[str] = MULTIVARIATE_CHANNELS,
+                 min_samples: int = 50,
+                 confidence: float = 0.999,
+                 ridge: float = 1e-6):
+        """
+        Args:
+            channels: 参与检测的通道
+            min_samples: 车辆累计样本数达到该值后才开始打分
+            confidence: 异常判定的卡方置信度
+            ridge: 协方差矩阵对角线正则项（相对于方差的比例）
+        """
+        self.channels = list(channels)
+        self.dim = len(self.channels)
+        self.min_samples = min_samples
+        self.ridge = ridge
+        self.threshold = chi2_quantile(confidence, self.dim)
+
+        self.vehicle_index: Dict[str, int] = {}
+        self.counts = np.zeros(0)
+        self.means = np.zeros((0, self.dim))
+        self.m2 = np.zeros((0, self.dim, self.dim))
+
+        self._precision: Optional[np.ndarray] = None
+
+    def _ensure_vehicles(self, vehicle_ids: Sequence[str]) -> np.ndarray:
+        """为新车辆分配状态槽位，返回每行对应的车辆下标"""
+        new_ids = [v for v in dict.fromkeys(vehicle_ids) if v not in self.vehicle_index]
+        if new_ids:
+            for vehicle_id in new_ids:
+                self.vehicle_index[vehicle_id] = len(self.vehicle_index)
+            grow = len(new_ids)
+            self.counts = np.concatenate([self.counts, np.zeros(grow)])
+            self.means = np.concatenate([self.means, np.zeros((grow, self.dim))])
+            self.m2 = np.concatenate([self.m2, np.zeros((grow, self.dim, self.dim))])
+            self._precision = None
+        return np.fromiter((self.vehicle_index[v] for v in vehicle_ids),
+                           dtype=np.int64, count=len(vehicle_ids))
+
+    def partial_fit(self, X: np.ndarray, vehicle_ids: Sequence[str]):
+        """
+        用一批数据包增量更新每辆车的均值和协方差
+
+        Args:
+            X: (n, d) 数据矩阵，列顺序与channels一致；含NaN的行会被跳过
+            vehicle_ids: 长度为n的车辆ID序列
+        """
+        X = np.asarray(X, dtype=np.float64)
+        idx = self._ensure_vehicles(vehicle_ids)
+
+        valid = ~np.isnan(X).any(axis=1)
+        X, idx = X[valid], idx[valid]
+        if not len(X):
+            return
+
+        n_vehicles = len(self.vehicle_index)
+        n_b = np.bincount(idx, minlength=n_vehicles).astype(np.float64)
+        sums = np.zeros((n_vehicles, self.dim))
+        np.add.at(sums, idx, X)
+        outer = np.zeros((n_vehicles, self.dim, self.dim))
+        np.add.at(outer, idx, X[:, :, None] * X[:, None, :])
+
+        present = n_b > 0
+        mean_b = np.zeros_like(sums)
+        mean_b[present] = sums[present] / n_b[present, None]
+        m2_b = outer - n_b[:, None, None] * mean_b[:, :, None] * mean_b[:, None, :]
+
+        # Chan并行合并
+        n_a = self.counts
+        n = n_a + n_b
+        delta = mean_b - self.means
+        weight = np.zeros_like(n)
+        weight[present] = n_a[present] * n_b[present] / n[present]
+
+        self.means = np.where(present[:, None],
+                              self.means + delta * (n_b / np.maximum(n, 1))[:, None],
+                              self.means)
+        self.m2 = self.m2 + m2_b + weight[:, None, None] * delta[:, :, None] * delta[:, None, :]
+        self.counts = n
+        self._precision = None
+
+    def _precisions(self) -> np.ndarray:
+        """批量计算所有车辆协方差矩阵的逆（带对角正则）"""
+        if self._precision is None:
+            denominator = np.maximum(self.counts - 1, 1)[:, None, None]
+            cov = self.m2 / denominator
+            diag = np.einsum('vii->vi', cov)
+            cov = cov + np.eye(self.dim)[None] * (self.ridge * np.maximum(diag, 1e-12))[:, :, None]
+            self._precision = np.linalg.pinv(cov, hermitian=True)
+        return self._precision
+
+    def score(self, X: np.ndarray, vehicle_ids: Sequence[str]) -> np.ndarray:
+        """
+        批量计算马氏距离平方
+
+        Args:
+            X: (n, d) 数据矩阵
+            vehicle_ids: 长度为n的车辆ID序列
+
+        Returns:
+            长度为n的马氏距离平方；样本不足的车辆或含NaN的行为NaN
+        """
+        X = np.asarray(X, dtype=np.float64)
+        idx = self._ensure_vehicles(vehicle_ids)
+
+        diff = X - self.means[idx]
+        d2 = np.einsum('ni,nij,nj->n', diff, self._precisions()[idx], diff)
+
+        ready = self.counts[idx] >= self.min_samples
+        d2[~ready] = np.nan
+        return d2
+
+    def score_and_update(self, X: np.ndarray, vehicle_ids: Sequence[str]) -> np.ndarray:
+        """先打分再更新（新数据不污染自身的参考分布）"""
+        d2 = self.score(X, vehicle_ids)
+        self.partial_fit(X, vehicle_ids)
+        return d2
+
+    def is_anomaly(self, d2: np.ndarray) -> np.ndarray:
+        """马氏距离平方超过卡方阈值即判定为异常"""
+        with np.errstate(invalid='ignore'):
+            return np.nan_to_num(d2, nan=0.0) > self.threshold
+
+    def merge_fleet_baseline(self) -> Dict[str, np.ndarray]:
+        """
+        合并所有车辆的统计量得到车队级均值和协方差（无需原始数据）
+
+        Returns:
+            {'mean': (d,), 'cov': (d, d), 'count': 标量}
+        """
+        total = self.counts.sum()
+        if total == 0:
+            return {'mean': np.full(self.dim, np.nan),
+                    'cov': np.full((self.dim, self.dim), np.nan),
+                    'count': 0.0}
+        mean = (self.counts[:, None] * self.means).sum(axis=0) / total
+        delta = self.means - mean
+        m2 = self.m2.sum(axis=0) + np.einsum('v,vi,vj->ij', self.counts, delta, delta)
+        return {'mean': mean, 'cov': m2 / max(total - 1, 1), 'count': total}
+
+
+def detect_multivariate_anomalies(frame, channels: Optional[List[str]] = None,
+                                  reference_size: Optional[int] = None,
+                                  confidence: float = 0.999) -> Dict[str, Any]:
+    """
+    对单辆车的历史数据做多变量检测：用前段数据拟合，对最后一段数据打分
+
+    Args:
+        frame: 历史数据DataFrame
+        channels: 参与检测的通道，默认取MULTIVARIATE_CHANNELS中有数据的列
+        reference_size: 参考段长度，默认为总长度的80%
+        confidence: 卡方置信度
+
+    Returns:
+        {'is_anomaly': bool, 'max_distance': float, 'threshold': float, 'channels': list}
+    """
+    if channels is None:
+        channels = available_channels(frame)
+
+    if len(channels) < MIN_MULTIVARIATE_CHANNELS or len(frame) < 20:
+        return {'is_anomaly': False, 'max_distance': 0.0, 'threshold': None, 'channels': channels}
+
+    X = frame[channels].to_numpy(dtype=np.float64)
+    if reference_size is None:
+        reference_size = int(len(X) * 0.8)
+
+    detector = FleetMahalanobisDetector(channels, min_samples=min(50, reference_size),
+                                        confidence=confidence)
+    vehicle_ids = ['_'] * len(X)
+    detector.partial_fit(X[:reference_size], vehicle_ids[:reference_size])
+    d2 = detector.score(X[reference_size:], vehicle_ids[reference_size:])
+
+    max_distance = float(np.nanmax(d2)) if len(d2) and not np.all(np.isnan(d2)) else 0.0
+    return {
+        'is_anomaly': bool(detector.is_anomaly(d2).any()),
+        'max_distance': max_distance,
+        'threshold': detector.threshold,
+        'channels': channels,
+    }
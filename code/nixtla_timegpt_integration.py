@@ -6,24 +6,104 @@ Nixtla TimeGPT集成示例
 
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Iterable, Iterator
 import warnings
 warnings.filterwarnings('ignore')
 
+from robust_sketches import TDigest, robust_scale
+from result_cache import ResultCache, forecast_cache_key
+from ets_forecaster import forecast_holt_winters
+from downsampling import MODEL_MAX_POINTS, choose_resolution, downsample_frame, downsample_long_frame
+
+# TimeGPT不可用时的本地预测后端
+FALLBACK_BACKENDS = ('simulated', 'ets')
+# 预测结果的统一列名（TimeGPT结果拆分后与本地预测一致）
+FORECAST_COLUMNS = ['timestamp', 'forecast', 'lower_80', 'upper_80', 'lower_95', 'upper_95']
+
+
+def freq_delta(freq: str) -> pd.Timedelta:
+    """数据频率对应的时间步长（'D'=天，其余按小时）"""
+    return pd.Timedelta(days=1) if freq == 'D' else pd.Timedelta(hours=1)
+
+
+def forecast_frame(last_timestamp, horizon: int, freq: str,
+                   bands: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    预测值和区间拼上未来时间戳，组成统一列名的预测结果
+
+    Args:
+        last_timestamp: 历史最后一个时间戳
+        horizon: 预测时长
+        freq: 数据频率
+        bands: 一维的 {'forecast', 'lower_80', ...}
+
+    Returns:
+        列为timestamp/forecast/lower_80/upper_80/lower_95/upper_95的DataFrame
+    """
+    return pd.DataFrame({
+        'timestamp': pd.Timestamp(last_timestamp) + freq_delta(freq) * np.arange(1, horizon + 1),
+        **bands,
+    })
+
+
+def split_timegpt_forecast(forecast: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """将TimeGPT多序列预测结果按序列拆分，并统一为本地预测的列名"""
+    renamed = forecast.rename(columns={
+        'ds': 'timestamp',
+        'TimeGPT': 'forecast',
+        'TimeGPT-lo-80': 'lower_80',
+        'TimeGPT-hi-80': 'upper_80',
+        'TimeGPT-lo-95': 'lower_95',
+        'TimeGPT-hi-95': 'upper_95',
+    })
+    columns = [c for c in FORECAST_COLUMNS if c in renamed.columns]
+    return {
+        unique_id: group[columns].reset_index(drop=True)
+        for unique_id, group in renamed.groupby('unique_id', sort=False)
+    }
+
+
+def simulate_anomaly_frame(df: pd.DataFrame, threshold: float = 3.0) -> pd.DataFrame:
+    """
+    模拟异常检测（TimeGPT不可用时），结果为DataFrame
+
+    Args:
+        df: 历史数据DataFrame（时间戳列、数值列）
+        threshold: Z-score阈值
+
+    Returns:
+        timestamp/value/z_score/is_anomaly四列
+    """
+    return pd.DataFrame(NixtlaTimeGPTIntegration.simulate_anomaly_arrays(
+        df.iloc[:, 0].to_numpy(), df.iloc[:, 1].to_numpy(), threshold=threshold))
+
 
 class NixtlaTimeGPTIntegration:
     """Nixtla TimeGPT集成类"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, seed: Optional[int] = None,
+                 forecast_cache: Optional[ResultCache] = None,
+                 fallback_backend: str = 'simulated'):
         """
         初始化TimeGPT客户端
         
         Args:
             api_key: Nixtla API密钥（如果使用公共API）
+            seed: 模拟预测噪声的随机种子（固定后离线预测可复现）
+            forecast_cache: 预测/异常检测结果缓存（建议设置ttl_seconds），为None时不缓存
+            fallback_backend: TimeGPT不可用时的本地预测后端
+                              （'simulated'=趋势+季节性模拟，'ets'=Holt-Winters/ETS统计模型）
         """
+        if fallback_backend not in FALLBACK_BACKENDS:
+            raise ValueError(f"不支持的本地预测后端: {fallback_backend}，可选: {FALLBACK_BACKENDS}")
+        
         self.api_key = api_key
         self.client = None
+        self.rng = np.random.default_rng(seed)
+        self.forecast_cache = forecast_cache
+        self.fallback_backend = fallback_backend
+        # 最近一次批量预测中因TimeGPT请求失败而改用本地预测的序列标识
+        self.last_fallback_ids: List[Any] = []
         
         # 如果提供了API密钥，初始化客户端
         if api_key:
@@ -51,9 +131,15 @@ class NixtlaTimeGPTIntegration:
         Returns:
             预测结果DataFrame
         """
+        df = self._prepare_input(df, freq, horizon)
+        cache_key = self._cache_key(df, horizon, freq)
+        cached = self._cache_get('forecast', cache_key)
+        if cached is not None:
+            return cached
+        
         if self.client is None:
-            print("⚠️  TimeGPT客户端未初始化，使用模拟预测")
-            return self._simulate_forecast(df, horizon, freq)
+            print(f"⚠️  TimeGPT客户端未初始化，使用本地预测（{self.fallback_backend}）")
+            return self._cache_put('forecast', cache_key, self.fallback_forecast(df, horizon, freq))
         
         try:
             # TimeGPT需要特定的数据格式
@@ -72,63 +158,244 @@ class NixtlaTimeGPTIntegration:
                 level=[80, 95]  # 预测区间
             )
             
-            return forecast
+            return self._cache_put('forecast', cache_key, forecast)
         
         except Exception as e:
             print(f"⚠️  TimeGPT预测失败: {e}")
-            return self._simulate_forecast(df, horizon, freq)
+            return self.fallback_forecast(df, horizon, freq)
     
-    def _simulate_forecast(self, 
+    def _input_resolution(self, freq: str, horizon: int, history_seconds: float) -> float:
+        """
+        模型输入的桶宽（秒）：按预测时长和历史跨度选择分辨率（每个预测步一个桶）
+
+        模型按freq步长输出，输入不能比freq更粗；历史跨度超出模型输入上限时
+        不再加粗分辨率，而是由MODEL_MAX_POINTS截取最近的部分
+        """
+        step = freq_delta(freq).total_seconds()
+        resolution = choose_resolution(horizon * step, history_seconds,
+                                       steps_per_horizon=horizon,
+                                       max_points=MODEL_MAX_POINTS[self._backend()])
+        return min(resolution, step)
+
+    def _backend(self) -> str:
+        """当前实际使用的预测后端"""
+        return self.fallback_backend if self.client is None else 'timegpt'
+
+    def _prepare_input(self, df: pd.DataFrame, freq: str, horizon: int) -> pd.DataFrame:
+        """
+        将输入降采样到choose_resolution选出的分辨率（桶均值），并截取当前后端的最大输入长度
+        （原始1Hz数据直接送入模型既慢又不会更准）
+        """
+        if len(df) < 2:
+            return df
+        timestamps = pd.to_datetime(df.iloc[:, 0])
+        span = (timestamps.max() - timestamps.min()).total_seconds()
+        return downsample_frame(df, self._input_resolution(freq, horizon, span),
+                                MODEL_MAX_POINTS[self._backend()])
+    
+    def _cache_key(self, df: pd.DataFrame, horizon: int, freq: str):
+        """结果缓存键（后端区分真实TimeGPT结果与模拟结果）"""
+        if self.forecast_cache is None:
+            return None
+        return forecast_cache_key(df, horizon, freq, self._backend())
+    
+    def _cache_get(self, kind: str, cache_key) -> Optional[pd.DataFrame]:
+        """查询结果缓存（缓存返回副本，调用方可以直接修改）"""
+        if cache_key is None:
+            return None
+        return self.forecast_cache.get_item(kind, cache_key)
+    
+    def _cache_put(self, kind: str, cache_key, result: pd.DataFrame) -> pd.DataFrame:
+        """写入结果缓存（API调用失败后的模拟结果不经过这里，下次仍会重试API）"""
+        if cache_key is not None:
+            self.forecast_cache.put_item(kind, cache_key, result)
+        return result
+    
+    def fallback_forecast_values(self, values: np.ndarray, horizon: int,
+                                 freq: str) -> Dict[str, np.ndarray]:
+        """
+        按所选本地后端（fallback_backend）计算预测值和预测区间
+        
+        Args:
+            values: 一维序列，或右对齐的(序列数, 长度)二维矩阵
+            horizon: 预测时长
+            freq: 数据频率（'H'=小时, 'D'=天）
+            
+        Returns:
+            {'forecast', 'lower_80', 'upper_80', 'lower_95', 'upper_95'}，形状同simulate_forecast_values
+        """
+        if self.fallback_backend == 'ets':
+            return forecast_holt_winters(values, horizon, freq)
+        return self.simulate_forecast_values(values, horizon)
+    
+    def simulate_forecast_values(self,
+                                 values: np.ndarray,
+                                 horizon: int) -> Dict[str, np.ndarray]:
+        """
+        向量化的趋势+季节性模拟预测（支持多条序列堆叠的二维输入）
+        
+        Args:
+            values: 一维序列，或(序列数, 长度)的二维矩阵；
+                    长度不同的序列需右对齐，左侧缺失位置填NaN
+            horizon: 预测时长
+            
+        Returns:
+            {'forecast', 'lower_80', 'upper_80', 'lower_95', 'upper_95'}，
+            一维输入时每项形状为(horizon,)，二维输入时为(序列数, horizon)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        squeeze = values.ndim == 1
+        values = np.atleast_2d(values)
+        n_series, max_len = values.shape
+        mask = ~np.isnan(values)
+        lengths = mask.sum(axis=1)
+        
+        # 逐序列线性趋势（最小二乘斜率，对x平移不变）
+        x = np.arange(max_len, dtype=np.float64)
+        x_mean = np.where(mask, x, 0.0).sum(axis=1) / lengths
+        y_mean = np.nanmean(values, axis=1)
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        dy = np.where(mask, values - y_mean[:, None], 0.0)
+        denominator = (dx * dx).sum(axis=1)
+        trend = np.divide((dx * dy).sum(axis=1), denominator,
+                          out=np.zeros(n_series), where=denominator > 0)
+        
+        # 季节性（简化为24小时周期，不足24个点时使用全部）
+        season_len = np.minimum(lengths, 24)
+        season_start = max_len - season_len
+        steps = np.arange(horizon)
+        season_cols = season_start[:, None] + steps[None, :] % season_len[:, None]
+        seasonal = np.take_along_axis(values, season_cols, axis=1)
+        season_window = np.where(x[None, :] >= season_start[:, None], values, np.nan)
+        seasonal_component = seasonal - np.nanmean(season_window, axis=1)[:, None]
+        
+        # 预测值 = 趋势 + 季节性 + 噪声；标准差每条序列只计算一次
+        std = np.nanstd(values, axis=1)[:, None]
+        noise = self.rng.standard_normal((n_series, horizon)) * (std * 0.1)
+        forecast = (values[:, -1:] + trend[:, None] * (steps + 1)[None, :]
+                    + seasonal_component * 0.3 + noise)
+        
+        result = {
+            'forecast': forecast,
+            'lower_80': forecast - std * 1.28,
+            'upper_80': forecast + std * 1.28,
+            'lower_95': forecast - std * 1.96,
+            'upper_95': forecast + std * 1.96,
+        }
+        if squeeze:
+            result = {key: value[0] for key, value in result.items()}
+        return result
+    
+    def fallback_forecast(self,
                           df: pd.DataFrame,
                           horizon: int,
                           freq: str) -> pd.DataFrame:
         """
-        模拟预测（当TimeGPT不可用时）
-        使用简单的趋势+季节性模型
+        本地预测（当TimeGPT不可用时）
+        按fallback_backend使用简单的趋势+季节性模拟，或Holt-Winters/ETS统计模型
+        
+        Args:
+            df: 历史数据DataFrame（时间戳列、数值列）
+            horizon: 预测时长
+            freq: 数据频率
+            
+        Returns:
+            预测结果DataFrame，列为timestamp/forecast/lower_80/upper_80/lower_95/upper_95
+        """
+        values = df.iloc[:, 1].to_numpy(dtype=np.float64)
+        return forecast_frame(df.iloc[-1, 0], horizon, freq,
+                              self.fallback_forecast_values(values, horizon, freq))
+    
+    def forecast_batch_with_timegpt(self,
+                                    df: pd.DataFrame,
+                                    horizon: int = 168,
+                                    freq: str = 'H',
+                                    chunk_size: int = 500,
+                                    id_col: str = 'unique_id',
+                                    time_col: str = 'ds',
+                                    target_col: str = 'y') -> Dict[str, pd.DataFrame]:
+        """
+        批量预测多条时间序列（如全车队的SOH、冷却液温度、液压压力）
+        
+        Args:
+            df: 长格式DataFrame，包含序列标识、时间戳和目标值三列
+            horizon: 预测时长
+            freq: 数据频率（'H'=小时, 'D'=天）
+            chunk_size: 每次TimeGPT请求包含的序列数
+            id_col: 序列标识列名
+            time_col: 时间戳列名
+            target_col: 目标值列名
+            
+        Returns:
+            {序列标识: 预测结果DataFrame}，列为timestamp/forecast/lower_80/upper_80/lower_95/upper_95
+            （请求失败改用本地预测的序列记录在 self.last_fallback_ids 中）
+        """
+        self.last_fallback_ids = []
+        long_df = df[[id_col, time_col, target_col]].rename(
+            columns={id_col: 'unique_id', time_col: 'ds', target_col: 'y'}
+        )
+        long_df = long_df.sort_values(['unique_id', 'ds'], kind='mergesort')
+        ds = pd.to_datetime(long_df['ds'])
+        span = (ds.max() - ds.min()).total_seconds() if len(ds) else 0.0
+        long_df = downsample_long_frame(long_df, self._input_resolution(freq, horizon, span),
+                                        MODEL_MAX_POINTS[self._backend()])
+        series_ids = long_df['unique_id'].unique()
+        
+        if self.client is None:
+            print(f"⚠️  TimeGPT客户端未初始化，对 {len(series_ids)} 条序列使用本地预测（{self.fallback_backend}）")
+            return self._simulate_forecast_batch(long_df, horizon, freq)
+        
+        results = {}
+        for start in range(0, len(series_ids), chunk_size):
+            chunk_ids = series_ids[start:start + chunk_size]
+            chunk_df = long_df[long_df['unique_id'].isin(chunk_ids)]
+            try:
+                forecast = self.client.forecast(
+                    df=chunk_df,
+                    h=horizon,
+                    freq=freq,
+                    level=[80, 95]
+                )
+                results.update(split_timegpt_forecast(forecast))
+            except Exception as e:
+                print(f"⚠️  TimeGPT批量预测失败（序列 {start}-{start + len(chunk_ids) - 1}）: {e}")
+                self.last_fallback_ids.extend(chunk_ids)
+                results.update(self._simulate_forecast_batch(chunk_df, horizon, freq))
+        
+        return results
+    
+    def _simulate_forecast_batch(self,
+                                 long_df: pd.DataFrame,
+                                 horizon: int,
+                                 freq: str) -> Dict[str, pd.DataFrame]:
+        """
+        批量模拟预测：将所有序列右对齐到同一矩阵，
+        由本地后端一次性完成所有序列的预测
         """
-        # 提取最后的值和趋势
-        values = df.iloc[:, 1].values
-        
-        # 计算线性趋势
-        x = np.arange(len(values))
-        coeffs = np.polyfit(x, values, 1)
-        trend = coeffs[0]
-        
-        # 计算季节性（简化为24小时周期）
-        if len(values) >= 24:
-            seasonal = values[-24:]
-        else:
-            seasonal = values
-        
-        # 生成预测
-        last_timestamp = df.iloc[-1, 0]
-        if freq == 'H':
-            freq_delta = timedelta(hours=1)
-        elif freq == 'D':
-            freq_delta = timedelta(days=1)
-        else:
-            freq_delta = timedelta(hours=1)
-        
-        forecast_timestamps = [last_timestamp + freq_delta * (i + 1) for i in range(horizon)]
-        
-        # 预测值 = 趋势 + 季节性 + 噪声
-        forecast_values = []
-        for i in range(horizon):
-            trend_component = values[-1] + trend * (i + 1)
-            seasonal_component = seasonal[i % len(seasonal)] - np.mean(seasonal)
-            noise = np.random.normal(0, np.std(values) * 0.1)
-            forecast_values.append(trend_component + seasonal_component * 0.3 + noise)
-        
-        forecast_df = pd.DataFrame({
-            'timestamp': forecast_timestamps,
-            'forecast': forecast_values,
-            'lower_80': [v - np.std(values) * 1.28 for v in forecast_values],
-            'upper_80': [v + np.std(values) * 1.28 for v in forecast_values],
-            'lower_95': [v - np.std(values) * 1.96 for v in forecast_values],
-            'upper_95': [v + np.std(values) * 1.96 for v in forecast_values],
-        })
-        
-        return forecast_df
+        lengths = long_df.groupby('unique_id', sort=False).size()
+        series_ids = lengths.index.to_numpy()
+        lengths = lengths.to_numpy()
+        n_series, max_len = len(series_ids), int(lengths.max())
+        
+        # 右对齐填充：每条序列的最新值都落在最后一列，缺失位置为NaN
+        values = np.full((n_series, max_len), np.nan)
+        rows = np.repeat(np.arange(n_series), lengths)
+        offsets = np.arange(len(long_df)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cols = offsets + np.repeat(max_len - lengths, lengths)
+        values[rows, cols] = long_df['y'].to_numpy(dtype=np.float64)
+        bands = self.fallback_forecast_values(values, horizon, freq)
+        
+        offsets = freq_delta(freq) * np.arange(1, horizon + 1)
+        last_timestamps = long_df.groupby('unique_id', sort=False)['ds'].last()
+        
+        results = {}
+        for i, unique_id in enumerate(series_ids):
+            results[unique_id] = pd.DataFrame({
+                'timestamp': pd.Timestamp(last_timestamps.iloc[i]) + offsets,
+                **{key: value[i] for key, value in bands.items()},
+            })
+        
+        return results
     
     def detect_anomaly_with_timegpt(self, 
                                    df: pd.DataFrame) -> pd.DataFrame:
@@ -141,9 +408,14 @@ class NixtlaTimeGPTIntegration:
         Returns:
             异常检测结果DataFrame
         """
+        cache_key = self._cache_key(df, 0, 'H')
+        cached = self._cache_get('anomaly', cache_key)
+        if cached is not None:
+            return cached
+        
         if self.client is None:
             print("⚠️  TimeGPT客户端未初始化，使用模拟异常检测")
-            return self._simulate_anomaly_detection(df)
+            return self._cache_put('anomaly', cache_key, simulate_anomaly_frame(df))
         
         try:
             # TimeGPT异常检测
@@ -156,32 +428,101 @@ class NixtlaTimeGPTIntegration:
                 freq='H'
             )
             
-            return anomalies
+            return self._cache_put('anomaly', cache_key, anomalies)
         
         except Exception as e:
             print(f"⚠️  TimeGPT异常检测失败: {e}")
-            return self._simulate_anomaly_detection(df)
+            return simulate_anomaly_frame(df)
     
-    def _simulate_anomaly_detection(self, df: pd.DataFrame) -> pd.DataFrame:
-        """模拟异常检测"""
-        values = df.iloc[:, 1].values
-        
-        # 使用3-sigma规则
-        mean = np.mean(values)
-        std = np.std(values)
-        
-        anomalies = []
-        for i, v in enumerate(values):
-            z_score = abs((v - mean) / std) if std > 0 else 0
-            is_anomaly = z_score > 3.0
-            anomalies.append({
-                'timestamp': df.iloc[i, 0],
-                'value': v,
-                'z_score': z_score,
-                'is_anomaly': is_anomaly
-            })
+    @staticmethod
+    def simulate_anomaly_arrays(timestamps: np.ndarray,
+                                values: np.ndarray,
+                                median: Optional[float] = None,
+                                sigma: Optional[float] = None,
+                                threshold: float = 3.0) -> Dict[str, np.ndarray]:
+        """
+        列式模拟异常检测（不创建逐行对象）
+        
+        Args:
+            timestamps: 时间戳数组
+            values: 数值数组
+            median: 基线中位数，默认取values的中位数
+            sigma: 基线尺度（MAD换算的标准差），默认由values计算；
+                   为0时（平稳或量化的传感器数据）按robust_scale改用平均绝对偏差
+            threshold: Z-score阈值
+            
+        Returns:
+            {'timestamp', 'value', 'z_score', 'is_anomaly'} 四列等长数组
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if median is None:
+            median = np.median(values) if len(values) else 0.0
+        absolute = np.abs(values - median)
+        if sigma is None or not sigma > 0:
+            mean_absolute = float(np.mean(absolute)) if len(values) else 0.0
+            mad = float(np.median(absolute)) if sigma is None and len(values) else 0.0
+            sigma = robust_scale(median, mad, mean_absolute)
+        
+        # 使用中位数/MAD的3-sigma规则（均值和标准差会被异常点本身拉偏）
+        z_score = absolute / sigma
+        
+        return {
+            'timestamp': np.asarray(timestamps),
+            'value': values,
+            'z_score': z_score,
+            'is_anomaly': z_score > threshold,
+        }
+    
+    def iter_anomaly_detection(self,
+                               chunks: Iterable,
+                               median: Optional[float] = None,
+                               sigma: Optional[float] = None,
+                               threshold: float = 3.0,
+                               compression: float = 200.0) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        分块模拟异常检测：逐块读取任意长的历史数据，内存占用与总长度无关
+        
+        未给定基线时，用t-digest草图在线维护截至当前块的中位数和MAD
+        （与整段一次性计算相比，早期数据块的基线只包含已读到的数据）
         
-        return pd.DataFrame(anomalies)
+        Args:
+            chunks: 数据块迭代器，每块为(时间戳列, 数值列)的DataFrame
+                    或(timestamps, values)元组，例如 pd.read_csv(path, chunksize=...)
+            median: 固定基线中位数（与sigma同时给定时不再在线估计）
+            sigma: 固定基线尺度
+            threshold: Z-score阈值
+            compression: t-digest压缩参数
+            
+        Yields:
+            每块的列式检测结果，格式同simulate_anomaly_arrays
+        """
+        fixed_baseline = median is not None and sigma is not None
+        value_digest = TDigest(compression)
+        deviation_digest = TDigest(compression)
+        # 平均绝对偏差的累计量（MAD为0时的尺度，近似：各块相对当时的中位数）
+        absolute_sum, absolute_count = 0.0, 0
+        
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                timestamps, values = chunk.iloc[:, 0].to_numpy(), chunk.iloc[:, 1].to_numpy()
+            else:
+                timestamps, values = chunk
+            values = np.asarray(values, dtype=np.float64)
+            if not len(values):
+                continue
+            
+            if not fixed_baseline:
+                # 先并入当前块再取基线，第一块的结果与整段计算一致（近似到草图精度）
+                value_digest.update_batch(values)
+                median = value_digest.quantile(0.5)
+                absolute = np.abs(values - median)
+                deviation_digest.update_batch(absolute)
+                absolute_sum += float(absolute.sum())
+                absolute_count += len(absolute)
+                sigma = robust_scale(median, deviation_digest.quantile(0.5),
+                                     absolute_sum / absolute_count)
+            
+            yield self.simulate_anomaly_arrays(timestamps, values, median, sigma, threshold)
 
 
 def demo_nixtla_integration():
@@ -12,24 +12,39 @@ from typing import Dict, List, Any, Tuple, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
+from result_cache import ResultCache, compute_data_watermark
+from robust_sketches import robust_zscore
+from multivariate_anomaly import MIN_MULTIVARIATE_CHANNELS, available_channels, detect_multivariate_anomalies
+from health_rules import CompiledHealthRules, load_health_rules
+from downsampling import MODEL_MAX_POINTS, bucket_aggregate, choose_resolution, to_ns
+from probabilistic_rul import bootstrap_rul
+from history_cache import HistoryCache
+from telemetry_buffer import TelemetryBuffer
+
 
 class PredictiveMaintenanceEngine:
     """预测性维护分析引擎"""
     
-    def __init__(self, vehicle_id: str):
+    def __init__(self, vehicle_id: str, result_cache: Optional[ResultCache] = None,
+                 health_rules: Optional[CompiledHealthRules] = None):
         """
         初始化分析引擎
         
         Args:
             vehicle_id: 车辆ID
+            result_cache: 分析结果缓存（可在多台车辆的引擎间共享），为None时不缓存
+            health_rules: 编译后的健康度规则，默认加载 config/health_score_rules.json
         """
         self.vehicle_id = vehicle_id
         self.health_score = 100.0  # 初始健康度评分
         self.anomaly_threshold = 0.95  # 异常检测阈值
+        self.result_cache = result_cache
+        self.health_rules = health_rules or load_health_rules()
         
     def calculate_health_score(self, metrics: Dict[str, float]) -> float:
         """
         计算设备健康度评分（0-100分）
+        扣分规则来自 config/health_score_rules.json，与阈值告警规则共用同一张表
         
         Args:
             metrics: 关键指标字典
@@ -37,43 +52,19 @@ class PredictiveMaintenanceEngine:
         Returns:
             健康度评分
         """
-        score = 100.0
-        
-        # 发动机健康度
-        if 'engine_coolant_temp' in metrics:
-            temp = metrics['engine_coolant_temp']
-            if temp > 95:  # 超过95°C扣分
-                score -= min(20, (temp - 95) * 2)
-        
-        if 'engine_oil_pressure' in metrics:
-            pressure = metrics['engine_oil_pressure']
-            if pressure < 3.5:  # 低于3.5 bar扣分
-                score -= min(15, (3.5 - pressure) * 10)
-        
-        # 电池健康度
-        if 'battery_soh' in metrics:
-            soh = metrics['battery_soh']
-            if soh < 80:  # SOH低于80%扣分
-                score -= min(25, (80 - soh) * 1.5)
-        
-        if 'battery_temp_max' in metrics:
-            temp = metrics['battery_temp_max']
-            if temp > 45:  # 超过45°C扣分
-                score -= min(15, (temp - 45) * 1.5)
-        
-        # 液压系统健康度
-        if 'hydraulic_pressure' in metrics:
-            pressure = metrics['hydraulic_pressure']
-            if pressure < 150:  # 低于150 bar扣分
-                score -= min(20, (150 - pressure) * 0.5)
-        
-        # 传感器健康度
-        if 'sensor_quality_score' in metrics:
-            quality = metrics['sensor_quality_score']
-            if quality < 90:  # 低于90分扣分
-                score -= min(10, (90 - quality) * 0.5)
-        
-        return max(0, min(100, score))
+        return self.health_rules.score(metrics)
+    
+    def calculate_health_score_batch(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        批量计算健康度评分（每行一个评分，可用于整个车队或整段历史）
+        
+        Args:
+            data: 指标DataFrame，每行为一辆车或一个时间点
+            
+        Returns:
+            健康度评分数组
+        """
+        return self.health_rules.score_frame(data)
     
     def detect_anomaly_statistical(self, 
                                    time_series: pd.Series, 
@@ -111,9 +102,53 @@ class PredictiveMaintenanceEngine:
         
         return is_anomaly, anomaly_score
     
+    def detect_anomaly_robust(self, 
+                              time_series: pd.Series, 
+                              window: int = 20,
+                              threshold: float = 3.5) -> Tuple[bool, float]:
+        """
+        基于中位数/MAD的鲁棒异常检测（实时层）
+        参考窗口不包含最新值，且中位数和MAD不会被尖峰本身拉偏
+        
+        Args:
+            time_series: 时间序列数据
+            window: 参考窗口大小
+            threshold: 修正Z-score阈值
+            
+        Returns:
+            (是否异常, 异常分数)
+        """
+        if len(time_series) < window + 1:
+            return False, 0.0
+        
+        values = time_series.values.astype(np.float64)
+        z_score = float(robust_zscore(values[-1], values[-window - 1:-1]))
+        
+        return z_score > threshold, min(1.0, z_score / 5.0)
+    
+    def detect_anomaly_multivariate(self,
+                                    historical_data: pd.DataFrame,
+                                    channels: Optional[List[str]] = None) -> Tuple[bool, float]:
+        """
+        基于马氏距离的多变量异常检测（转速/扭矩/负载/油耗/温度的联动关系）
+        
+        Args:
+            historical_data: 历史数据DataFrame
+            channels: 参与检测的通道，默认取存在的联动通道
+            
+        Returns:
+            (是否异常, 异常分数)
+        """
+        result = detect_multivariate_anomalies(historical_data, channels=channels)
+        if not result['threshold']:
+            return False, 0.0
+        
+        return result['is_anomaly'], min(1.0, result['max_distance'] / (2 * result['threshold']))
+    
     def predict_remaining_useful_life(self, 
                                      degradation_series: pd.Series,
-                                     failure_threshold: float = 70.0) -> Dict[str, Any]:
+                                     failure_threshold: float = 70.0,
+                                     timestamps: Optional[pd.Series] = None) -> Dict[str, Any]:
         """
         预测剩余使用寿命（RUL）
         使用简单的线性退化模型（实际应用中应使用TimeGPT）
@@ -121,11 +156,18 @@ class PredictiveMaintenanceEngine:
         Args:
             degradation_series: 退化指标时间序列（如SOH、健康度评分）
             failure_threshold: 故障阈值
+            timestamps: 对应的时间戳；提供时先按时间桶降采样，并按实际时间（小时）拟合，
+                        否则假设每个数据点代表1小时
             
         Returns:
             RUL预测结果
         """
-        if len(degradation_series) < 10:
+        x = np.arange(len(degradation_series), dtype=np.float64)
+        y = degradation_series.values
+        if timestamps is not None and len(degradation_series) >= 2:
+            x, y = self._downsample_degradation(timestamps, y)
+        
+        if len(y) < 10:
             return {
                 'rul_days': None,
                 'confidence': 0.0,
@@ -133,8 +175,6 @@ class PredictiveMaintenanceEngine:
             }
         
         # 线性拟合
-        x = np.arange(len(degradation_series))
-        y = degradation_series.values
         
         # 最小二乘法
         coeffs = np.polyfit(x, y, 1)
@@ -148,7 +188,7 @@ class PredictiveMaintenanceEngine:
         if slope < 0:  # 退化趋势
             steps_to_failure = (failure_threshold - current_value) / slope
             if steps_to_failure > 0:
-                # 假设每个数据点代表1小时
+                # x的单位为小时
                 rul_hours = steps_to_failure
                 rul_days = rul_hours / 24
                 
@@ -173,7 +213,52 @@ class PredictiveMaintenanceEngine:
             'prediction_method': 'no_degradation_trend'
         }
     
-    def generate_maintenance_recommendation(self, 
+    @staticmethod
+    def _downsample_degradation(timestamps: pd.Series,
+                                values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按历史跨度选择分辨率做桶均值降采样，返回(距起点的小时数, 桶均值)
+        （几个月的1Hz数据降到至多MODEL_MAX_POINTS['rul']个点）
+        """
+        ts_ns = to_ns(timestamps)
+        span_seconds = (ts_ns.max() - ts_ns.min()) / 1e9
+        resolution = choose_resolution(0.0, span_seconds, max_points=MODEL_MAX_POINTS['rul'])
+        buckets = bucket_aggregate(ts_ns, np.asarray(values, dtype=np.float64), resolution)
+        hours = (buckets['bucket'] - buckets['bucket'][:1]) / 3.6e12
+        return hours, buckets['mean']
+
+    def predict_rul_distribution(self,
+                                 degradation_series: pd.Series,
+                                 failure_threshold: float = 80.0,
+                                 timestamps: Optional[pd.Series] = None,
+                                 n_samples: int = 1000,
+                                 horizon_days: float = 30.0) -> Dict[str, Any]:
+        """
+        概率化RUL预测（残差分块自助法，给出P10/P50/P90而不是单点估计）
+
+        Args:
+            degradation_series: 退化指标时间序列（如SOH）
+            failure_threshold: 故障阈值
+            timestamps: 对应的时间戳（处理方式同predict_remaining_useful_life）
+            n_samples: 自助样本数
+            horizon_days: 计算该期限内的失效概率
+
+        Returns:
+            {'rul_p10_days', 'rul_p50_days', 'rul_p90_days', 'failure_probability', ...}
+        """
+        x = np.arange(len(degradation_series), dtype=np.float64)
+        y = degradation_series.to_numpy(dtype=np.float64)
+        if timestamps is not None and len(degradation_series) >= 2:
+            x, y = self._downsample_degradation(timestamps, y)
+
+        result = bootstrap_rul(x, y, failure_threshold, n_samples=n_samples,
+                               horizon_days=horizon_days)
+        result['failure_threshold'] = failure_threshold
+        result['prediction_method'] = ('residual_block_bootstrap'
+                                       if result['rul_p50_days'] is not None else 'insufficient_data')
+        return result
+
+    def generate_maintenance_recommendation(self,
                                            health_score: float,
                                            rul_prediction: Dict[str, Any],
                                            anomalies: Dict[str, bool]) -> Dict[str, Any]:
@@ -275,6 +360,14 @@ class PredictiveMaintenanceEngine:
         Returns:
             分析结果
         """
+        # 数据水位线未变化（没有新数据）时直接返回缓存结果
+        watermark = None
+        if self.result_cache is not None:
+            watermark = compute_data_watermark(historical_data)
+            cached = self.result_cache.get(self.vehicle_id, watermark)
+            if cached is not None:
+                return cached
+        
         # 提取最新指标
         latest_metrics = historical_data.iloc[-1].to_dict()
         
@@ -285,15 +378,22 @@ class PredictiveMaintenanceEngine:
         anomalies = {}
         for column in ['engine_coolant_temp', 'battery_soh', 'hydraulic_pressure']:
             if column in historical_data.columns:
-                is_anomaly, score = self.detect_anomaly_statistical(historical_data[column])
+                is_anomaly, score = self.detect_anomaly_robust(historical_data[column])
                 anomalies[column] = is_anomaly
         
+        # 多变量异常检测（至少两个联动通道存在时才执行）
+        channels = available_channels(historical_data)
+        if len(channels) >= MIN_MULTIVARIATE_CHANNELS:
+            is_anomaly, score = self.detect_anomaly_multivariate(historical_data, channels)
+            anomalies['multivariate'] = is_anomaly
+        
         # RUL预测（以电池SOH为例）
         rul_prediction = {}
         if 'battery_soh' in historical_data.columns:
             rul_prediction = self.predict_remaining_useful_life(
                 historical_data['battery_soh'],
-                failure_threshold=80.0
+                failure_threshold=80.0,
+                timestamps=historical_data['timestamp'] if 'timestamp' in historical_data.columns else None
             )
         
         # 生成维护建议
@@ -301,12 +401,68 @@ class PredictiveMaintenanceEngine:
             health_score, rul_prediction, anomalies
         )
         
-        return {
+        result = {
             'health_score': health_score,
             'anomalies': anomalies,
             'rul_prediction': rul_prediction,
             'maintenance_recommendation': maintenance_recommendation
         }
+        
+        if self.result_cache is not None:
+            self.result_cache.put(self.vehicle_id, watermark, result)
+        
+        return result
+    
+    def analyze_from_history_cache(self,
+                                   history_cache: HistoryCache,
+                                   end_ms: int,
+                                   lookback_hours: float = 72.0,
+                                   column_map: Optional[Dict[str, str]] = None,
+                                   client=None) -> Optional[Dict[str, Any]]:
+        """
+        从本地历史缓存读取历史后分析（提供VictoriaMetrics客户端时先同步缺失的尾部）
+        
+        Args:
+            history_cache: 本地历史缓存
+            end_ms: 历史终点（毫秒）
+            lookback_hours: 回看窗口（小时）
+            column_map: 指标名 -> 分析列名
+            client: VictoriaMetricsClient，为None时只读缓存
+            
+        Returns:
+            分析结果，缓存中没有该车辆数据时返回None
+        """
+        historical_data = history_cache.load_history(
+            self.vehicle_id, end_ms, int(lookback_hours * 3600 * 1000), column_map, client
+        )
+        if historical_data.empty:
+            return None
+        return self.analyze_vehicle_health(historical_data)
+    
+    def analyze_telemetry_buffer(self,
+                                 buffer: TelemetryBuffer,
+                                 column_map: Optional[Dict[str, str]] = None,
+                                 defaults: Optional[Dict[str, float]] = None) -> Optional[Dict[str, Any]]:
+        """
+        直接分析列式遥测缓冲区（模拟器离线采集、端到端测试等场景，数据不经过VictoriaMetrics）
+        
+        Args:
+            buffer: 列式遥测缓冲区
+            column_map: 通道名 -> 分析列名（为None时通道名即列名）
+            defaults: 缓冲区中缺失的列以常数补齐
+            
+        Returns:
+            分析结果，缓冲区为空时返回None
+        """
+        if not len(buffer):
+            return None
+        return self.analyze_vehicle_health(buffer.to_frame(column_map, defaults))
+    
+    def get_last_result(self) -> Optional[Dict[str, Any]]:
+        """获取最近一次的分析结果（需启用结果缓存）"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get_latest(self.vehicle_id)
 
 
 def demo_predictive_maintenance():
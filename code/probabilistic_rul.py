@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+概率化剩余使用寿命（RUL）
+线性退化模型 + 残差分块自助法（moving-block bootstrap）：
+对拟合残差按块重抽样，闭式重算每个样本的退化斜率和当前水平，
+得到RUL的经验分布，输出P10/P50/P90分位数和指定期限内的失效概率，供备件计划使用
+
+所有自助样本在一次数组运算中完成；车队批量模式把所有车辆右对齐到同一矩阵，
+按内存预算分块处理，每个分析周期可以覆盖全车队的所有电池
+"""
+
+import math
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+
+RUL_QUANTILES = (0.1, 0.5, 0.9)
+
+
+def bootstrap_rul_batch(hours: np.ndarray,
+                        values: np.ndarray,
+                        threshold,
+                        n_samples: int = 1000,
+                        block_size: Optional[int] = None,
+                        quantiles: Sequence[float] = RUL_QUANTILES,
+                        horizon_days: float = 30.0,
+                        min_points: int = 10,
+                        seed: Optional[int] = None,
+                        max_elements: int = 20_000_000) -> Dict[str, np.ndarray]:
+    """
+    批量概率RUL（指标向下退化，跌破阈值即失效，如电池SOH）
+
+    Args:
+        hours: (车辆数, n) 距起点的小时数，右对齐，左侧缺失填NaN
+        values: (车辆数, n) 退化指标，与hours对齐
+        threshold: 失效阈值（标量或每辆车一个）
+        n_samples: 自助样本数
+        block_size: 残差块长度，默认取 n^(1/3)（保留残差的自相关，如日周期）
+        quantiles: 输出的分位数
+        horizon_days: 计算该期限内的失效概率
+        min_points: 有效点数少于该值的车辆输出NaN
+        seed: 随机种子
+        max_elements: 单次分块的数组元素上限（样本数 × 车辆数 × 长度）
+
+    Returns:
+        {'quantiles_days': (车辆数, 分位数个数)，未退化时为inf,
+         'failure_probability': (车辆数,)，horizon_days内失效的概率,
+         'slope_per_day': (车辆数,)，点估计退化速率}
+    """
+    X = np.atleast_2d(np.asarray(hours, dtype=np.float64))
+    Y = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_vehicles, n = Y.shape
+    thresholds = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (n_vehicles,))
+    rng = np.random.default_rng(seed)
+
+    valid = ~(np.isnan(X) | np.isnan(Y))
+    lengths = valid.sum(axis=1)
+    pad = n - lengths
+    count = np.maximum(lengths, 1)
+
+    # 点估计（加权最小二乘，缺失位置权重为0）
+    x_mean = np.where(valid, X, 0.0).sum(axis=1) / count
+    y_mean = np.where(valid, Y, 0.0).sum(axis=1) / count
+    dx = np.where(valid, X - x_mean[:, None], 0.0)
+    sxx = (dx * dx).sum(axis=1)
+    ok = (lengths >= min_points) & (sxx > 0)
+    sxx = np.where(ok, sxx, 1.0)
+    slope = (dx * np.where(valid, Y - y_mean[:, None], 0.0)).sum(axis=1) / sxx
+    residuals = np.where(valid, Y - (y_mean[:, None] + slope[:, None] * dx), 0.0)
+    x_last = X[:, -1]
+
+    if block_size is None:
+        block_size = max(1, int(round(max(n, 1) ** (1 / 3))))
+    n_blocks = math.ceil(n / block_size)
+    n_starts = max(n - block_size + 1, 1)
+
+    # 位置j的重抽样残差来自第k=j//L块：r*[j] = r[pad + s_k + j%L]。
+    # 斜率变化量 Σ_j dx_j·r*_j 和均值变化量 Σ_j r*_j 都可以按块拆开，
+    # 预先算出"第k块取起点s"的贡献表，每个样本只需按起点查表求和，无需生成完整的重抽样序列
+    width = n_blocks * block_size
+    dx_blocks = np.zeros((n_vehicles, width))
+    dx_blocks[:, :n] = dx
+    dx_blocks = dx_blocks.reshape(n_vehicles, n_blocks, block_size)
+    mask_blocks = np.zeros((n_vehicles, width))
+    mask_blocks[:, :n] = valid
+    mask_blocks = mask_blocks.reshape(n_vehicles, n_blocks, block_size)
+
+    quantiles_days = np.full((n_vehicles, len(quantiles)), np.nan)
+    failure_probability = np.full(n_vehicles, np.nan)
+
+    chunk = max(1, min(max_elements // max(n_blocks * n_starts, 1),
+                       max_elements // max(n_samples * n_blocks, 1)))
+    for begin in range(0, n_vehicles, chunk):
+        rows = slice(begin, begin + chunk)
+        length = np.maximum(lengths[rows], 1)
+        n_rows = len(length)
+
+        # 残差滑动窗口：windows[v, s, i] = r[pad_v + s + i]
+        all_windows = np.lib.stride_tricks.sliding_window_view(
+            residuals[rows] if n >= block_size else
+            np.pad(residuals[rows], ((0, 0), (0, block_size - n))), block_size, axis=1)
+        window_start = np.minimum(pad[rows][:, None] + np.arange(n_starts)[None, :],
+                                  all_windows.shape[1] - 1)
+        windows = np.take_along_axis(all_windows, window_start[:, :, None], axis=1)
+        slope_table = np.einsum('vki,vsi->vks', dx_blocks[rows], windows)
+        sum_table = np.einsum('vki,vsi->vks', mask_blocks[rows], windows)
+
+        # 每个样本、每块随机抽取起点（起点不越过该车的有效数据）
+        starts = rng.integers(0, np.maximum(length - block_size + 1, 1)[None, :, None],
+                              size=(n_samples, n_rows, n_blocks))
+        vehicle_index = np.arange(n_rows)[None, :, None]
+        block_index = np.arange(n_blocks)[None, None, :]
+        slope_shift = slope_table[vehicle_index, block_index, starts].sum(axis=2)
+        mean_shift = sum_table[vehicle_index, block_index, starts].sum(axis=2)
+
+        slope_star = slope[rows] + slope_shift / sxx[rows]
+        level_star = (y_mean[rows] + mean_shift / count[rows]
+                      + slope_star * (x_last[rows] - x_mean[rows]))
+
+        margin = level_star - thresholds[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rul_hours = np.where(slope_star < 0, margin / -slope_star, np.inf)
+        rul_days = np.where(margin <= 0, 0.0, rul_hours) / 24.0
+
+        quantiles_days[rows] = np.quantile(rul_days, quantiles, axis=0,
+                                           method='inverted_cdf').T
+        failure_probability[rows] = (rul_days <= horizon_days).mean(axis=0)
+
+    quantiles_days[~ok] = np.nan
+    failure_probability[~ok] = np.nan
+    return {
+        'quantiles_days': quantiles_days,
+        'failure_probability': failure_probability,
+        'slope_per_day': np.where(ok, slope * 24.0, np.nan),
+    }
+
+
+def bootstrap_rul(hours: np.ndarray, values: np.ndarray, threshold: float,
+                  n_samples: int = 1000, quantiles: Sequence[float] = RUL_QUANTILES,
+                  horizon_days: float = 30.0, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    单车概率RUL
+
+    Returns:
+        {'rul_p10_days', 'rul_p50_days', 'rul_p90_days', 'failure_probability',
+         'horizon_days', 'degradation_rate_per_day'}；数据不足时分位数为None
+    """
+    result = bootstrap_rul_batch(np.asarray(hours)[None], np.asarray(values)[None], threshold,
+                                 n_samples=n_samples, quantiles=quantiles,
+                                 horizon_days=horizon_days, seed=seed)
+    output = {}
+    for q, value in zip(quantiles, result['quantiles_days'][0]):
+        output[f'rul_p{int(round(q * 100))}_days'] = None if np.isnan(value) else float(value)
+    probability = result['failure_probability'][0]
+    output['failure_probability'] = None if np.isnan(probability) else float(probability)
+    output['horizon_days'] = horizon_days
+    rate = result['slope_per_day'][0]
+    output['degradation_rate_per_day'] = None if np.isnan(rate) else float(rate)
+    return output
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+仪表板/告警表达式的预计算（vmalert recording rules）生成器
+仪表板每个查看者每次刷新都要在查询时重新计算派生表达式（如 (engine_torque / 500) * 100 在两个面板各算一次，
+deriv(vehicle_speed[1m]) 在加速度面板和直方图中算四次，每个时间点都要扫描1分钟的原始样本）。
+本工具扫描 grafana/grafana_dashboard.json 和 alerting/rules 下的告警规则：
+
+- 去掉 vehicle_id="$vehicle_id" 过滤后，把表达式分解为 基础表达式 + 末尾的标量运算
+- 同一基础表达式的多个用法取公共的标量运算前缀作为预计算表达式（派生表达式才生成，纯指标选择器不生成）
+- 生成vmalert记录规则（所有车辆一次计算，保留vehicle_id标签），并生成读取预计算序列的仪表板
+- 按扫描的样本数估算每小时查询开销的变化
+
+用法:
+    python recording_rules.py            # 重新生成记录规则和仪表板，并输出开销估算
+    python recording_rules.py --check    # 只检查生成结果是否与现有文件一致
+"""
+
+import re
+import copy
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from vm_cache_proxy import parse_duration
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DASHBOARD_PATH = PROJECT_ROOT / "grafana" / "grafana_dashboard.json"
+DEFAULT_ALERT_RULE_PATHS = [
+    PROJECT_ROOT / "alerting" / "rules" / "tractor-alerts.yml",
+    PROJECT_ROOT / "alerting" / "rules" / "tractor-threshold-alerts.yml",
+]
+DEFAULT_RECORDING_RULES_PATH = PROJECT_ROOT / "alerting" / "rules" / "tractor-recording-rules.yml"
+DEFAULT_OUTPUT_DASHBOARD_PATH = PROJECT_ROOT / "grafana" / "grafana_dashboard_recorded.json"
+
+RECORDING_GROUP = 'tractor_recording_rules'
+# 仪表板未设置自动刷新时的记录规则评估间隔（设置了refresh时默认与之相同）
+DEFAULT_RECORD_INTERVAL = '15s'
+
+# 仪表板变量过滤（记录规则对所有车辆计算，读取时再按车辆过滤）
+VEHICLE_FILTER = 'vehicle_id="$vehicle_id"'
+
+_KEYWORDS = {'and', 'or', 'unless', 'by', 'without', 'on', 'ignoring', 'group_left',
+             'group_right', 'bool', 'offset'}
+_IDENT = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+_SELECTOR = re.compile(rf'(?<![\w:"])({_IDENT})(?![\w:])(?!\s*\()(\{{[^}}]*\}})?(\[[^\]]+\])?')
+_FUNCTION = re.compile(rf'({_IDENT})\s*\(')
+_SCALAR_TAIL = re.compile(r'\s*([*/+-])\s*(\d+(?:\.\d+)?(?:e[+-]?\d+)?)\s*$')
+_COMPARISON = re.compile(r'\s+(?:and|or|unless)\s+|\s*(?:==|!=|>=|<=|>|<)\s*(?:bool\s+)?')
+
+
+def strip_vehicle_filter(expr: str) -> str:
+    """去掉 vehicle_id="$vehicle_id" 过滤（空的{}一并去掉）"""
+    def clean(match):
+        matchers = [m.strip() for m in match.group(1).split(',')
+                    if m.strip() and m.replace(' ', '') != VEHICLE_FILTER]
+        return '{' + ', '.join(matchers) + '}' if matchers else ''
+    return re.sub(r'\{([^}]*)\}', clean, expr).strip()
+
+
+def selectors(expr: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    表达式中的指标选择器
+
+    Returns:
+        [(指标名, 区间如'1m'或None)]
+    """
+    found = []
+    for match in _SELECTOR.finditer(expr):
+        name = match.group(1)
+        if name in _KEYWORDS or re.fullmatch(r'\d.*', name):
+            continue
+        window = match.group(3)[1:-1] if match.group(3) else None
+        found.append((name, window))
+    return found
+
+
+def _unwrap(expr: str) -> str:
+    """去掉包住整个表达式的括号"""
+    while expr.startswith('(') and expr.endswith(')'):
+        depth = 0
+        for i, ch in enumerate(expr):
+            depth += ch == '('
+            depth -= ch == ')'
+            if depth == 0 and i < len(expr) - 1:
+                return expr
+        expr = expr[1:-1].strip()
+    return expr
+
+
+def decompose(expr: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    分解为 基础表达式 + 末尾的标量运算
+
+    Returns:
+        (基础表达式, [(运算符, 标量)])，如 (engine_torque / 500) * 100 -> ('engine_torque', [('/', '500'), ('*', '100')])
+    """
+    ops: List[Tuple[str, str]] = []
+    expr = _unwrap(expr)
+    while True:
+        match = _SCALAR_TAIL.search(expr)
+        if not match or not expr[:match.start()].strip():
+            return expr, ops
+        ops.insert(0, (match.group(1), match.group(2)))
+        expr = _unwrap(expr[:match.start()].strip())
+
+
+def compose(base: str, ops: List[Tuple[str, str]]) -> str:
+    """decompose的逆运算（按需加括号）"""
+    expr, previous = base, None
+    if ops and not re.fullmatch(rf'{_IDENT}(\{{[^}}]*\}})?', base) and not base.endswith(')'):
+        expr = f"({expr})"
+    for op, value in ops:
+        if op in '*/' and previous in ('+', '-'):
+            expr = f"({expr})"
+        expr = f"{expr} {op} {value}"
+        previous = op
+    return expr
+
+
+def is_derived(base: str, ops: List[Tuple[str, str]]) -> bool:
+    """值得预计算的表达式：带区间函数、多个序列间运算或标量运算"""
+    found = selectors(base)
+    return bool(ops) or len(found) > 1 or any(window for _, window in found)
+
+
+def record_name(base: str, ops: List[Tuple[str, str]]) -> str:
+    """按 level:metric:operations 约定命名，如 vehicle_id:vehicle_speed:deriv1m_scaled"""
+    found = selectors(base)
+    metric = found[0][0] if found else 'expr'
+    parts = []
+    for function in _FUNCTION.findall(base):
+        if function in _KEYWORDS:
+            continue
+        window = next((w for _, w in found if w), '')
+        parts.append(f"{function}{window}")
+    if len(found) > 1:
+        parts.append('_'.join(name for name, _ in found[1:]))
+    if ops:
+        parts.append('scaled')
+    return f"vehicle_id:{metric}:{'_'.join(parts) or 'value'}"
+
+
+def _common_prefix(op_lists: List[List[Tuple[str, str]]]) -> List[Tuple[str, str]]:
+    prefix = op_lists[0]
+    for ops in op_lists[1:]:
+        n = 0
+        while n < min(len(prefix), len(ops)) and prefix[n] == ops[n]:
+            n += 1
+        prefix = prefix[:n]
+    return prefix
+
+
+class ExpressionUse:
+    """表达式的一处使用（仪表板查询或告警规则）"""
+
+    def __init__(self, source: str, expr: str, target: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            source: 来源描述（如 "面板13 加速度" 或 "告警 LowFuelLevel"）
+            expr: 原始表达式（告警规则为比较运算的一侧）
+            target: 仪表板查询对象（改写时原地修改其expr），告警规则为None
+        """
+        self.source = source
+        self.expr = expr
+        self.target = target
+        self.base, self.ops = decompose(strip_vehicle_filter(expr))
+
+
+def dashboard_uses(dashboard: Dict[str, Any]) -> List[ExpressionUse]:
+    """仪表板中所有查询表达式"""
+    uses = []
+    for panel in dashboard.get('dashboard', dashboard).get('panels', []):
+        for target in panel.get('targets', []):
+            if target.get('expr'):
+                uses.append(ExpressionUse(f"面板{panel.get('id')} {panel.get('title', '')}",
+                                          target['expr'], target))
+    return uses
+
+
+def alert_uses(paths: List[Path]) -> List[ExpressionUse]:
+    """告警规则表达式（按比较运算、and/or/unless拆分后的各个操作数）"""
+    uses = []
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        for group in config.get('groups', []):
+            for rule in group.get('rules', []):
+                name = rule.get('alert') or rule.get('record')
+                for operand in _COMPARISON.split(str(rule.get('expr', ''))):
+                    operand = operand.strip()
+                    if operand and not re.fullmatch(r'-?\d+(\.\d+)?', operand):
+                        uses.append(ExpressionUse(f"告警 {name}", operand))
+    return uses
+
+
+def plan_recording_rules(uses: List[ExpressionUse]) -> List[Dict[str, Any]]:
+    """
+    按基础表达式分组，生成预计算规则
+
+    Returns:
+        [{'record', 'expr', 'base', 'ops', 'uses'}]，uses为可以改为读取该序列的用法
+    """
+    groups: Dict[str, List[ExpressionUse]] = {}
+    for use in uses:
+        if is_derived(use.base, use.ops):
+            groups.setdefault(use.base, []).append(use)
+
+    rules, names = [], set()
+    for base, members in groups.items():
+        ops = _common_prefix([use.ops for use in members])
+        if not is_derived(base, ops):
+            # 共同部分只是原始指标（如 x * 2 和 x * 3），预计算没有收益
+            continue
+        name = record_name(base, ops)
+        suffix = 2
+        while name in names:
+            name = f"{record_name(base, ops)}_{suffix}"
+            suffix += 1
+        names.add(name)
+        rules.append({'record': name, 'expr': compose(base, ops), 'base': base, 'ops': ops,
+                      'uses': members})
+    return rules
+
+
+def rewrite_expression(use: ExpressionUse, rule: Dict[str, Any]) -> str:
+    """用预计算序列改写表达式（保留原表达式中的车辆过滤和剩余的标量运算）"""
+    selector = rule['record'] + ('{' + VEHICLE_FILTER + '}' if VEHICLE_FILTER in use.expr.replace(' ', '') else '')
+    return compose(selector, use.ops[len(rule['ops']):])
+
+
+def rewrite_dashboard(dashboard: Dict[str, Any], rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """生成读取预计算序列的仪表板（不修改传入的dict）"""
+    rewritten = copy.deepcopy(dashboard)
+    by_base = {rule['base']: rule for rule in rules}
+    for use in dashboard_uses(rewritten):
+        rule = by_base.get(use.base)
+        if rule is not None and use.ops[:len(rule['ops'])] == rule['ops']:
+            use.target['expr'] = rewrite_expression(use, rule)
+    return rewritten
+
+
+def default_record_interval(dashboard: Dict[str, Any]) -> str:
+    """
+    记录规则评估间隔默认取仪表板的自动刷新间隔：预计算序列每个评估周期才有一个新点，
+    间隔大于刷新间隔时改写后的面板每次刷新看到的数据不变，分辨率也随之降低
+    """
+    board = dashboard.get('dashboard', dashboard)
+    return board.get('refresh') or DEFAULT_RECORD_INTERVAL
+
+
+def generate_recording_rules(rules: List[Dict[str, Any]], interval: str = DEFAULT_RECORD_INTERVAL) -> str:
+    """生成vmalert记录规则（YAML文本，格式与 tractor-threshold-alerts.yml 一致）"""
+    lines = [
+        "# 由 code/recording_rules.py 根据 grafana/grafana_dashboard.json 和告警规则自动生成，请勿手工修改",
+        "groups:",
+        f"  - name: {RECORDING_GROUP}",
+        f"    interval: {interval}",
+        "    rules:",
+    ]
+    entries = []
+    for rule in rules:
+        sources = sorted({use.source for use in rule['uses']})
+        entries.append("\n".join([
+            f"      # 使用方: {', '.join(sources)}",
+            f"      - record: {rule['record']}",
+            f"        expr: {rule['expr']}",
+        ]))
+    lines.append("\n\n".join(entries))
+    lines.append("")
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------------
+# 查询开销估算（按扫描的样本数）
+# ----------------------------------------------------------------------
+
+def range_query_cost(expr: str, window: float, step: float, sample_interval: float,
+                     recorded: Optional[Dict[str, float]] = None) -> float:
+    """
+    区间查询扫描的样本数估算
+
+    Args:
+        expr: 表达式
+        window: 查询时间范围（秒）
+        step: 查询步长（秒）
+        sample_interval: 原始数据的采样间隔（秒）
+        recorded: 预计算序列名 -> 其记录间隔（秒）
+    """
+    recorded = recorded or {}
+    points = window / step + 1
+    cost = 0.0
+    for name, range_window in selectors(expr):
+        interval = recorded.get(name, sample_interval)
+        if range_window:
+            # 每个时间点都要读取一个区间的样本
+            cost += points * parse_duration(range_window) / interval
+        else:
+            cost += window / interval
+    return cost
+
+
+def instant_cost(expr: str, sample_interval: float) -> float:
+    """单次即时计算（记录规则每次评估）扫描的样本数估算"""
+    return sum(parse_duration(window) / sample_interval if window else 1.0
+               for _, window in selectors(expr))
+
+
+def estimate_savings(dashboard: Dict[str, Any], rewritten: Dict[str, Any], rules: List[Dict[str, Any]],
+                     sample_interval: float, step: float, record_interval: float,
+                     viewers: int = 1) -> Dict[str, float]:
+    """
+    估算每辆车每小时扫描的样本数（仪表板按refresh间隔刷新，每个查看者单独计算）
+
+    Returns:
+        {'before', 'after', 'recording', 'saving', 'saving_ratio', ...}
+    """
+    board = dashboard.get('dashboard', dashboard)
+    window = parse_duration(board.get('time', {}).get('from', 'now-15m').replace('now-', '') or '15m')
+    refresh = parse_duration(board.get('refresh') or '30s')
+    refreshes = 3600 / refresh * viewers
+    recorded = {rule['record']: record_interval for rule in rules}
+
+    before = sum(range_query_cost(use.expr, window, step, sample_interval)
+                 for use in dashboard_uses(dashboard))
+    after = sum(range_query_cost(use.expr, window, step, sample_interval, recorded)
+                for use in dashboard_uses(rewritten))
+    recording = sum(instant_cost(rule['expr'], sample_interval) for rule in rules) * 3600 / record_interval
+
+    total_before = before * refreshes
+    total_after = after * refreshes + recording
+    return {
+        'window': window,
+        'refresh': refresh,
+        'viewers': viewers,
+        'record_interval': record_interval,
+        'per_refresh_before': before,
+        'per_refresh_after': after,
+        'before': total_before,
+        'after': total_after,
+        'recording': recording,
+        'saving': total_before - total_after,
+        'saving_ratio': (total_before - total_after) / total_before if total_before else 0.0,
+    }
+
+
+def print_report(uses: List[ExpressionUse], rules: List[Dict[str, Any]], rewritten: Dict[str, Any],
+                 estimate: Dict[str, float]):
+    """输出分析报告"""
+    print("\n" + "=" * 70)
+    print("仪表板/告警表达式预计算分析")
+    print("=" * 70)
+
+    counts: Dict[str, int] = {}
+    for use in uses:
+        counts[use.expr] = counts.get(use.expr, 0) + 1
+    repeated = {expr: n for expr, n in counts.items() if n > 1}
+    if repeated:
+        print("\n重复的表达式:")
+        for expr, n in sorted(repeated.items(), key=lambda item: -item[1]):
+            print(f"  {n}× {expr}")
+
+    print(f"\n记录规则 ({len(rules)}):")
+    for rule in rules:
+        print(f"  {rule['record']} = {rule['expr']}")
+        for use in rule['uses']:
+            print(f"      ← {use.source}: {use.expr}")
+
+    pending = [use for rule in rules for use in rule['uses'] if use.target is None]
+    if pending:
+        print("\n告警规则可改为读取预计算序列（告警规则文件不自动改写）:")
+        for use in pending:
+            print(f"  {use.source}: {use.expr}")
+    else:
+        print("\n告警规则均为原始指标的阈值比较，没有需要预计算的派生表达式")
+
+    print("\n改写后的仪表板查询:")
+    for use in dashboard_uses(rewritten):
+        if any(use.expr.startswith(rule['record']) for rule in rules):
+            print(f"  {use.source}: {use.expr}")
+
+    print(f"\n查询开销估算（每辆车每小时扫描的样本数，时间范围 {estimate['window']:g}s，"
+          f"刷新间隔 {estimate['refresh']:g}s，{estimate['viewers']} 个查看者）:")
+    print(f"  每次刷新: {estimate['per_refresh_before']:,.0f} -> {estimate['per_refresh_after']:,.0f}")
+    print(f"  改写前: {estimate['before']:,.0f}")
+    print(f"  改写后: {estimate['after']:,.0f}（含记录规则评估 {estimate['recording']:,.0f}）")
+    print(f"  节省: {estimate['saving']:,.0f} ({estimate['saving_ratio']:.1%})")
+
+    print(f"\n记录规则评估间隔: {estimate['record_interval']:g}s（仪表板刷新间隔 {estimate['refresh']:g}s）")
+    if estimate['record_interval'] > estimate['refresh']:
+        print(f"⚠️  预计算序列每 {estimate['record_interval']:g}s 才有一个新点，"
+              f"改写后的面板分辨率从 {estimate['refresh']:g}s 降为 {estimate['record_interval']:g}s，"
+              f"最近一段数据滞后最多 {estimate['record_interval']:g}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由仪表板和告警表达式生成vmalert记录规则")
+    parser.add_argument("--dashboard", default=str(DEFAULT_DASHBOARD_PATH), help="Grafana仪表板JSON")
+    parser.add_argument("--alerts", nargs='*', default=[str(p) for p in DEFAULT_ALERT_RULE_PATHS],
+                        help="告警规则文件")
+    parser.add_argument("--output-rules", default=str(DEFAULT_RECORDING_RULES_PATH), help="输出的记录规则文件")
+    parser.add_argument("--output-dashboard", default=str(DEFAULT_OUTPUT_DASHBOARD_PATH),
+                        help="输出的仪表板JSON")
+    parser.add_argument("--interval", default=None,
+                        help="记录规则评估间隔（默认与仪表板刷新间隔相同）")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="原始数据采样间隔（秒）")
+    parser.add_argument("--step", type=float, default=15.0, help="仪表板查询步长（秒）")
+    parser.add_argument("--viewers", type=int, default=1, help="同时打开仪表板的查看者数")
+    parser.add_argument("--check", action="store_true", help="只检查输出文件是否为最新")
+
+    args = parser.parse_args()
+
+    with open(args.dashboard, 'r', encoding='utf-8') as f:
+        dashboard = json.load(f)
+
+    if args.interval is None:
+        args.interval = default_record_interval(dashboard)
+
+    uses = dashboard_uses(dashboard) + alert_uses([Path(p) for p in args.alerts])
+    rules = plan_recording_rules(uses)
+    rewritten = rewrite_dashboard(dashboard, rules)
+    outputs = {
+        Path(args.output_rules): generate_recording_rules(rules, args.interval),
+        Path(args.output_dashboard): json.dumps(rewritten, ensure_ascii=False, indent=2) + "\n",
+    }
+
+    if args.check:
+        stale = [path for path, content in outputs.items()
+                 if not path.exists() or path.read_text(encoding='utf-8') != content]
+        for path in stale:
+            print(f"✗ {path} 与仪表板/告警规则不一致，请运行: python recording_rules.py")
+        if not stale:
+            print("✓ 记录规则和仪表板已是最新")
+        return 1 if stale else 0
+
+    for path, content in outputs.items():
+        path.write_text(content, encoding='utf-8')
+        print(f"✓ 已生成 {path}")
+
+    estimate = estimate_savings(dashboard, rewritten, rules, args.sample_interval, args.step,
+                                parse_duration(args.interval), args.viewers)
+    print_report(uses, rules, rewritten, estimate)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+分析结果缓存
+按 (车辆ID, 数据水位线) 缓存分析结果，容量有界（LRU淘汰），可选过期时间（TTL），可选持久化到磁盘
+
+数据水位线 = 最后一个样本的时间戳 + 窗口内容哈希。
+车辆没有新数据（夜间停放、无信号覆盖）时水位线不变，直接命中缓存，跳过整次分析。
+预测结果按 (序列指纹, 预测时长, 频率, 后端) 缓存，仪表板重复刷新时不再重复消耗TimeGPT调用额度
+
+车辆分析结果用 get/put（同时维护每辆车的最新结果）；其他结果（预测、异常检测、查询响应）
+用 get_item/put_item 按 (命名空间, 键) 存放，不会出现在 get_latest 中
+
+写入时存放结果的深拷贝，命中时返回深拷贝：调用方修改拿到的结果（如往DataFrame里加列）不会改动缓存
+"""
+
+import os
+import copy
+import pickle
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Hashable
+
+import pandas as pd
+
+
+def compute_data_watermark(historical_data: pd.DataFrame,
+                           timestamp_column: str = 'timestamp') -> str:
+    """
+    计算数据窗口的水位线
+
+    Args:
+        historical_data: 历史数据DataFrame
+        timestamp_column: 时间戳列名
+
+    Returns:
+        水位线字符串，格式为 "<最后时间戳>:<内容哈希>"
+    """
+    if historical_data.empty:
+        return 'empty'
+
+    if timestamp_column in historical_data.columns:
+        last_timestamp = str(historical_data[timestamp_column].iloc[-1])
+    else:
+        last_timestamp = str(historical_data.index[-1])
+
+    # 按行向量化哈希，再对哈希数组整体做摘要
+    row_hashes = pd.util.hash_pandas_object(historical_data, index=False).values
+    digest = hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+
+    return f"{last_timestamp}:{digest}"
+
+
+def compute_series_fingerprint(df: pd.DataFrame) -> str:
+    """
+    计算时间序列指纹（最后时间戳 + 长度 + 内容哈希）
+
+    Args:
+        df: 时间序列DataFrame（第一列为时间戳）
+
+    Returns:
+        指纹字符串，格式为 "<最后时间戳>:<长度>:<内容哈希>"
+    """
+    if df.empty:
+        return 'empty'
+
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    digest = hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+
+    return f"{df.iloc[-1, 0]}:{len(df)}:{digest}"
+
+
+def forecast_cache_key(df: pd.DataFrame, horizon: int, freq: str, backend: str) -> Tuple:
+    """
+    预测结果缓存键
+
+    Args:
+        df: 输入序列
+        horizon: 预测时长
+        freq: 数据频率
+        backend: 预测后端（如timegpt、simulated）
+
+    Returns:
+        (序列指纹, 预测时长, 频率, 后端)
+    """
+    return (compute_series_fingerprint(df), int(horizon), freq, backend)
+
+
+class ResultCache:
+    """LRU结果缓存（线程安全，可选TTL和磁盘持久化）"""
+
+    def __init__(self, max_entries: int = 10000, persist_path: Optional[str] = None,
+                 ttl_seconds: Optional[float] = None):
+        """
+        初始化结果缓存
+
+        Args:
+            max_entries: 最大缓存条目数，超出后淘汰最久未使用的条目
+            persist_path: 持久化文件路径，为None时只保存在内存中
+            ttl_seconds: 条目有效期（秒），为None时永不过期
+        """
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.ttl_seconds = ttl_seconds
+
+        # 键为(车辆ID, 水位线)或(None, 命名空间, 键)
+        self._entries: 'OrderedDict[Tuple, Any]' = OrderedDict()
+        self._latest: Dict[str, Tuple[str, Hashable]] = {}
+        # 条目过期时间（墙钟时间，持久化后重启仍然有效）
+        self._expires: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+        if persist_path and os.path.exists(persist_path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _item_key(namespace: str, key: Hashable) -> Tuple:
+        """通用条目的内部键（首项为None，与(车辆ID, 水位线)条目互不冲突）"""
+        return (None, namespace, key)
+
+    def get(self, vehicle_id: str, watermark: Hashable) -> Optional[Any]:
+        """
+        查询缓存
+
+        Args:
+            vehicle_id: 车辆ID
+            watermark: 数据水位线
+
+        Returns:
+            缓存的结果，未命中时返回None
+        """
+        return self._lookup((vehicle_id, watermark))
+
+    def get_item(self, namespace: str, key: Hashable) -> Optional[Any]:
+        """
+        查询通用条目
+
+        Args:
+            namespace: 命名空间（如 'forecast'、'anomaly'、'instant'）
+            key: 命名空间内的键
+
+        Returns:
+            缓存的结果，未命中时返回None
+        """
+        return self._lookup(self._item_key(namespace, key))
+
+    def _lookup(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries and self._is_expired(key):
+                self._remove(key)
+                self.stats['expirations'] += 1
+            if key not in self._entries:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            result = self._entries[key]
+        # 缓存内的对象不会被修改，拷贝放在锁外
+        return copy.deepcopy(result)
+
+    def put(self, vehicle_id: str, watermark: Hashable, result: Any):
+        """
+        写入缓存，并记录为该车辆的最新结果
+
+        Args:
+            vehicle_id: 车辆ID
+            watermark: 数据水位线
+            result: 分析结果
+        """
+        key = (vehicle_id, watermark)
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._store(key, result)
+            self._latest[vehicle_id] = key
+
+    def put_item(self, namespace: str, key: Hashable, result: Any):
+        """
+        写入通用条目（不影响任何车辆的最新结果）
+
+        Args:
+            namespace: 命名空间
+            key: 命名空间内的键
+            result: 缓存内容
+        """
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._store(self._item_key(namespace, key), result)
+
+    def _store(self, key: Tuple, result: Any):
+        """写入条目并淘汰超出容量的条目（调用方需持有锁，result为调用方不再持有的拷贝）"""
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if self.ttl_seconds is not None:
+            self._expires[key] = time.time() + self.ttl_seconds
+        self.stats['evictions'] += self._evict_overflow()
+
+    def _is_expired(self, key: Tuple) -> bool:
+        expires = self._expires.get(key)
+        return expires is not None and expires <= time.time()
+
+    def _remove(self, key: Tuple):
+        """删除条目（调用方需持有锁）"""
+        self._entries.pop(key, None)
+        self._expires.pop(key, None)
+        if key[0] is not None and self._latest.get(key[0]) == key:
+            del self._latest[key[0]]
+
+    def _evict_overflow(self) -> int:
+        """淘汰超出容量的最久未使用条目（调用方需持有锁），返回淘汰数量"""
+        evicted = 0
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            evicted += 1
+        return evicted
+
+    def purge_expired(self) -> int:
+        """清理所有过期条目，返回清理数量"""
+        with self._lock:
+            expired = [key for key in self._expires if self._is_expired(key)]
+            for key in expired:
+                self._remove(key)
+            self.stats['expirations'] += len(expired)
+        return len(expired)
+
+    def get_latest(self, vehicle_id: str) -> Optional[Any]:
+        """获取车辆最近一次的分析结果（供仪表板和API直接读取）"""
+        with self._lock:
+            key = self._latest.get(vehicle_id)
+            if key is None or self._is_expired(key):
+                return None
+            result = self._entries.get(key)
+        return copy.deepcopy(result)
+
+    def hit_rate(self) -> float:
+        """缓存命中率"""
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total > 0 else 0.0
+
+    def save(self):
+        """持久化到磁盘（先写临时文件再原子替换）"""
+        if not self.persist_path:
+            return
+
+        self.purge_expired()
+        with self._lock:
+            snapshot = {
+                'entries': list(self._entries.items()),
+                'latest': dict(self._latest),
+                'expires': dict(self._expires),
+            }
+
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.persist_path)
+
+    def load(self):
+        """从磁盘加载缓存"""
+        try:
+            with open(self.persist_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️  加载结果缓存失败: {e}")
+            return
+
+        with self._lock:
+            self._entries = OrderedDict(snapshot.get('entries', []))
+            self._latest = {
+                vehicle_id: key for vehicle_id, key in snapshot.get('latest', {}).items()
+                if key in self._entries
+            }
+            self._expires = {
+                key: expires for key, expires in snapshot.get('expires', {}).items()
+                if key in self._entries
+            }
+            self._evict_overflow()
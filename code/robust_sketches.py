@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+鲁棒流式异常检测与分位数草图
+- RollingMedianMAD: 滑动窗口中位数/MAD（修正Z-score，不受尖峰污染）
+- P2Quantile: P²算法，常数内存的单分位数流式估计
+- TDigest: 可合并的t-digest分位数草图，用于不借助原始数据合并车队基线
+
+均值/标准差会被要检测的尖峰本身拉偏（例如真实工况模拟器中_add_spike注入的尖峰），
+中位数和MAD对离群点不敏感，更适合作为异常检测的基线
+"""
+
+import math
+from typing import Dict, List, Any, Optional, Tuple, Iterable
+
+import numpy as np
+
+# MAD到标准差的换算系数（正态分布下 sigma ≈ 1.4826 * MAD）
+MAD_TO_SIGMA = 1.4826
+# 平均绝对偏差到标准差的换算系数（正态分布下 sigma ≈ 1.2533 * MeanAD）
+MEANAD_TO_SIGMA = 1.253314
+
+
+def robust_scale(center: float, mad: float, mean_absolute: float = 0.0) -> float:
+    """
+    鲁棒尺度（换算为标准差）：1.4826 × MAD
+
+    参考样本过半相同（如传感器长时间输出同一值）时MAD为0，改用平均绝对偏差；
+    参考样本完全恒定时用相对机器精度的极小尺度，任何偏离都会得到很大的分数
+
+    Args:
+        center: 中心（中位数）
+        mad: 中位数绝对偏差
+        mean_absolute: 平均绝对偏差（MAD为0时使用）
+    """
+    scale = MAD_TO_SIGMA * mad
+    if not scale > 0:
+        scale = MEANAD_TO_SIGMA * mean_absolute
+    if not scale > 0:
+        scale = np.finfo(np.float64).eps * max(abs(float(center)), 1.0)
+    return float(scale)
+
+
+def robust_zscore(values: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    计算相对参考样本的修正Z-score（基于中位数和MAD，MAD为0时的退化处理见robust_scale）
+
+    Args:
+        values: 待评估的值（标量或数组）
+        reference: 参考样本
+
+    Returns:
+        |value - median| / (1.4826 * MAD)
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    median = np.median(reference)
+    deviation = np.abs(np.asarray(values, dtype=np.float64) - median)
+    absolute = np.abs(reference - median)
+    return deviation / robust_scale(median, np.median(absolute), np.mean(absolute))
+
+
+class RollingMedianMAD:
+    """滑动窗口中位数/MAD检测器（固定大小环形缓冲区）"""
+
+    def __init__(self, window: int = 60, threshold: float = 3.5):
+        """
+        Args:
+            window: 参考窗口大小
+            threshold: 修正Z-score阈值（Iglewicz-Hoaglin建议3.5）
+        """
+        self.window = window
+        self.threshold = threshold
+        self._buffer = np.empty(window, dtype=np.float64)
+        self._count = 0
+        self._pos = 0
+
+    def _reference(self) -> np.ndarray:
+        if self._count < self.window:
+            return self._buffer[:self._count]
+        return self._buffer
+
+    def median(self) -> float:
+        reference = self._reference()
+        return float(np.median(reference)) if len(reference) else float('nan')
+
+    def mad(self) -> float:
+        reference = self._reference()
+        if not len(reference):
+            return float('nan')
+        return float(np.median(np.abs(reference - np.median(reference))))
+
+    def update(self, value: float) -> Tuple[bool, float]:
+        """
+        先用当前窗口评估新值，再将其加入窗口（新值不会污染自身的参考基线）
+
+        Returns:
+            (是否异常, 修正Z-score)
+        """
+        z_score = 0.0
+        if self._count >= self.window:
+            z_score = float(robust_zscore(value, self._buffer))
+
+        self._buffer[self._pos] = value
+        self._pos = (self._pos + 1) % self.window
+        self._count = min(self._count + 1, self.window)
+
+        return z_score > self.threshold, z_score
+
+
+class P2Quantile:
+    """
+    P²分位数估计（Jain & Chlamtac, 1985）
+    仅维护5个标记点，常数内存；不支持合并，车队级合并请使用TDigest
+    """
+
+    def __init__(self, quantile: float = 0.5):
+        self.quantile = quantile
+        p = quantile
+        self._heights: List[float] = []
+        self._positions = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self._desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self._increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+        self.count = 0
+
+    def update(self, value: float):
+        """加入一个观测值"""
+        self.count += 1
+        heights = self._heights
+
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # 找到所在区间并更新极值
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while k < 3 and value >= heights[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            self._positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        # 调整中间三个标记点
+        for i in range(1, 4):
+            d = self._desired[i] - self._positions[i]
+            if ((d >= 1 and self._positions[i + 1] - self._positions[i] > 1) or
+                    (d <= -1 and self._positions[i - 1] - self._positions[i] < -1)):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not heights[i - 1] < candidate < heights[i + 1]:
+                    candidate = self._linear(i, step)
+                heights[i] = candidate
+                self._positions[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i: int, d: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+    def value(self) -> float:
+        """当前分位数估计值"""
+        if not self._heights:
+            return float('nan')
+        if len(self._heights) < 5:
+            index = int(round(self.quantile * (len(self._heights) - 1)))
+            return self._heights[index]
+        return self._heights[2]
+
+
+class TDigest:
+    """可合并的t-digest分位数草图（merging digest，向量化压缩）"""
+
+    def __init__(self, compression: float = 100.0, buffer_size: Optional[int] = None):
+        """
+        Args:
+            compression: 压缩参数δ，质心数量约为δ量级
+            buffer_size: 输入缓冲区大小，满后触发一次压缩
+        """
+        self.compression = compression
+        self.buffer_size = buffer_size or int(5 * compression)
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self._buffer: List[float] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, value: float):
+        """加入一个观测值"""
+        self._buffer.append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self.buffer_size:
+            self._compress()
+
+    def update_batch(self, values: Iterable[float]):
+        """批量加入观测值"""
+        values = np.asarray(values if isinstance(values, np.ndarray) else list(values),
+                            dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(values, np.ones(len(values)))
+
+    def _compress(self, extra_means: Optional[np.ndarray] = None,
+                  extra_weights: Optional[np.ndarray] = None):
+        """将缓冲区与现有质心合并，按k1尺度函数重新分组"""
+        means = [self.means]
+        weights = [self.weights]
+        if self._buffer:
+            means.append(np.asarray(self._buffer, dtype=np.float64))
+            weights.append(np.ones(len(self._buffer)))
+            self._buffer = []
+        if extra_means is not None:
+            means.append(extra_means)
+            weights.append(extra_weights)
+
+        means = np.concatenate(means)
+        weights = np.concatenate(weights)
+        if not len(means):
+            return
+
+        order = np.argsort(means, kind='mergesort')
+        means = means[order]
+        weights = weights[order]
+
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        q_mid = (cumulative - weights / 2) / total
+
+        # k1尺度函数：k(q) = δ/(2π)·asin(2q-1)，同一k整数区间内的点合并为一个质心
+        k = self.compression / (2 * math.pi) * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))
+        buckets = np.floor(k).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+        merged_weights = np.add.reduceat(weights, starts)
+        merged_means = np.add.reduceat(means * weights, starts) / merged_weights
+
+        self.means = merged_means
+        self.weights = merged_weights
+
+    def merge(self, other: 'TDigest') -> 'TDigest':
+        """合并另一个草图（就地修改并返回自身）"""
+        other._compress()
+        self.count += other.count
+        if other.count > 0:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self._compress(other.means.copy(), other.weights.copy())
+        return self
+
+    def quantile(self, q):
+        """
+        查询分位数
+
+        Args:
+            q: 分位数（标量或数组，0-1）
+
+        Returns:
+            分位数估计值
+        """
+        self._compress()
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float('nan')
+
+        cumulative = np.cumsum(self.weights)
+        centers = (cumulative - self.weights / 2) / cumulative[-1]
+        xp = np.r_[0.0, centers, 1.0]
+        fp = np.r_[self.min, self.means, self.max]
+        result = np.interp(q, xp, fp)
+        return float(result) if np.ndim(result) == 0 else result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化（用于跨进程/跨车辆传输）"""
+        self._compress()
+        return {
+            'compression': self.compression,
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TDigest':
+        """反序列化"""
+        digest = cls(compression=data['compression'])
+        digest.means = np.asarray(data['means'], dtype=np.float64)
+        digest.weights = np.asarray(data['weights'], dtype=np.float64)
+        digest.count = data['count']
+        digest.min = data['min']
+        digest.max = data['max']
+        return digest
+
+
+class RobustChannelDetector:
+    """单通道鲁棒检测器：滑动中位数/MAD做实时检测，t-digest累积长期基线"""
+
+    def __init__(self, window: int = 60, threshold: float = 3.5, compression: float = 100.0):
+        self.rolling = RollingMedianMAD(window=window, threshold=threshold)
+        self.baseline = TDigest(compression=compression)
+
+    def update(self, value: float) -> Tuple[bool, float]:
+        """
+        加入一个观测值
+
+        Returns:
+            (是否异常, 异常分数0-1)
+        """
+        if value is None or np.isnan(value):
+            return False, 0.0
+        is_anomaly, z_score = self.rolling.update(value)
+        self.baseline.update(value)
+        return is_anomaly, min(1.0, z_score / 5.0)
+
+    def baseline_percentiles(self, quantiles=(0.01, 0.5, 0.99)) -> Dict[float, float]:
+        """长期基线的分位数"""
+        values = self.baseline.quantile(np.asarray(quantiles))
+        return dict(zip(quantiles, np.atleast_1d(values).tolist()))
+
+
+class RobustDetectorBank:
+    """多通道鲁棒检测器集合（每辆车一个）"""
+
+    def __init__(self, channels: List[str], window: int = 60,
+                 threshold: float = 3.5, compression: float = 100.0):
+        self.compression = compression
+        self.detectors = {
+            channel: RobustChannelDetector(window, threshold, compression)
+            for channel in channels
+        }
+
+    def update(self, metrics: Dict[str, float]) -> Dict[str, Tuple[bool, float]]:
+        """
+        用一组指标（如扁平化的数据包）更新所有通道
+
+        Returns:
+            {通道: (是否异常, 异常分数)}
+        """
+        results = {}
+        for channel, detector in self.detectors.items():
+            value = metrics.get(channel)
+            if value is None:
+                continue
+            results[channel] = detector.update(float(value))
+        return results
+
+    def baseline_digests(self) -> Dict[str, TDigest]:
+        return {channel: detector.baseline for channel, detector in self.detectors.items()}
+
+    @staticmethod
+    def merge_fleet_baselines(banks: Iterable['RobustDetectorBank'],
+                              compression: float = 100.0) -> Dict[str, TDigest]:
+        """
+        合并多辆车的基线草图，得到车队级基线（无需原始数据）
+
+        Returns:
+            {通道: 合并后的TDigest}
+        """
+        fleet: Dict[str, TDigest] = {}
+        for bank in banks:
+            for channel, digest in bank.baseline_digests().items():
+                if channel not in fleet:
+                    fleet[channel] = TDigest(compression=compression)
+                fleet[channel].merge(digest)
+        return fleet
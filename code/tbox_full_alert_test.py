@@ -6,13 +6,14 @@ T-BOX Full Alert Scenario Test
 自动测试所有告警场景，无需手动干预
 """
 
-import json
 import time
-import random
 import math
 from datetime import datetime, timezone
+import numpy as np
 import paho.mqtt.client as mqtt
 
+from telemetry_packet import PacketSchema
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -261,34 +262,46 @@ class TractorDataGenerator:
             # System
             "operation_hours": 1245.5,
         }
-    
-    def add_noise(self, value, noise_percent=2.0):
-        """添加随机噪声"""
-        if not isinstance(value, (int, float)):
-            return value
-        noise = value * (noise_percent / 100.0)
-        return value + random.uniform(-noise, noise)
+        
+        # 紧凑数据包：结构化数组中的一行，每次原地写入
+        self.schema = PacketSchema({
+            "vehicle_id": str,
+            "timestamp": datetime,
+            "running_time": int,
+            **{key: str if isinstance(value, str) else float
+               for key, value in self.base_params.items()},
+        }, tz=timezone.utc)
+        self.packets = self.schema.new_array(1)
+        self.packet = self.packets[0]
+        self.packet["vehicle_id"] = VEHICLE_ID
+        self._numeric = [k for k, v in self.base_params.items() if not isinstance(v, str)]
+        self._noise_columns = self.schema.float_index(self._numeric)
+        self._base = np.array([self.base_params[k] for k in self._numeric], dtype=np.float64)
+        self._position = {k: i for i, k in enumerate(self._numeric)}
     
     def generate(self, scenario_params):
-        """生成遥测数据"""
-        data = {
-            "vehicle_id": VEHICLE_ID,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "running_time": self.running_time,
-        }
+        """生成遥测数据（返回数据包记录）"""
+        data = self.packet
+        data["timestamp"] = time.time()
+        data["running_time"] = self.running_time
         
         # 合并基准参数和场景参数
-        params = self.base_params.copy()
-        params.update(scenario_params)
-        
-        # 添加噪声
-        for key, value in params.items():
-            if isinstance(value, (int, float)):
-                data[key] = self.add_noise(value, noise_percent=2.0)
+        params = self._base.copy()
+        for key, value in scenario_params.items():
+            if key in self._position:
+                params[self._position[key]] = value
             else:
                 data[key] = value
         
+        # 添加±2%噪声（整体向量化写入）
+        floats = self.schema.float_view(self.packets)[0]
+        floats[self._noise_columns] = params * (1 + np.random.uniform(-0.02, 0.02, len(params)))
+        
         return data
+    
+    def to_json(self, data) -> str:
+        """数据包记录序列化为JSON"""
+        return self.schema.to_json(data)
 
 # ============================================================================
 # MQTT Client
@@ -320,10 +333,9 @@ class MQTTClient:
             print(f"❌ 连接失败: {e}\n")
             return False
     
-    def publish(self, data):
-        """发布数据"""
+    def publish(self, payload: str):
+        """发布数据（已序列化的JSON）"""
         try:
-            payload = json.dumps(data, ensure_ascii=False)
             self.client.publish(MQTT_TOPIC, payload)
             return True
         except Exception as e:
@@ -409,7 +421,7 @@ def main():
                 data = data_generator.generate(scenario['params'])
                 
                 # 发送数据
-                mqtt_client.publish(data)
+                mqtt_client.publish(data_generator.to_json(data))
                 
                 # 更新进度
                 elapsed = (i + 1) * interval
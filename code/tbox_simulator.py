@@ -5,14 +5,16 @@ T-BOX数据模拟器 - 油电混动无人拖拉机预测性维护系统
 通过MQTT协议上传到云端VictoriaMetrics
 """
 
-import json
 import time
 import random
 import math
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import numpy as np
 
+from telemetry_buffer import TelemetryBuffer
+from telemetry_packet import PacketSchema
+
 try:
     import paho.mqtt.client as mqtt
     MQTT_AVAILABLE = True
@@ -22,11 +24,61 @@ except ImportError:
     print("安装命令: pip install paho-mqtt")
 
 
+# 数据包布局（与JSON结构相同，叶子为字段类型）
+PACKET_LAYOUT = {
+    'vehicle_id': str,
+    'timestamp': datetime,
+    'operation_hours': float,
+    'engine': {
+        'rpm': float, 'torque': float, 'coolant_temp': float, 'oil_pressure': float,
+        'fuel_consumption_rate': float, 'intake_air_temp': float,
+    },
+    'battery': {
+        'soc': float, 'soh': float, 'voltage': float, 'current': float, 'power': float,
+        'temp_max': float, 'temp_min': float, 'cell_voltage_max': float, 'cell_voltage_min': float,
+    },
+    'vehicle_state': {
+        'speed': float, 'acceleration': float, 'steering_angle': float,
+        'wheel_speed_fl': float, 'wheel_speed_fr': float, 'wheel_speed_rl': float,
+        'wheel_speed_rr': float, 'brake_pressure': float,
+    },
+    'transmission': {'gear': int, 'oil_temp': float, 'oil_pressure': float, 'clutch_status': int},
+    'hydraulic': {'pressure': float, 'oil_temp': float, 'flow_rate': float, 'implement_position': float},
+    'gnss': {
+        'latitude': float, 'longitude': float, 'altitude': float, 'heading': float,
+        'positioning_accuracy': float, 'satellite_count': int, 'rtk_status': str,
+    },
+    'sensor_health': {
+        'lidar_health': {'data_rate': float, 'temperature': float, 'voltage': float, 'quality_score': float},
+        'camera_health': {'frame_rate': float, 'temperature': float, 'quality_score': float},
+        'imu_health': {'drift_rate': float, 'temperature': float, 'quality_score': float},
+    },
+    'intelligent_driving': {
+        'perception': {'obstacle_count': int, 'drivable_area_confidence': float, 'processing_time_ms': float},
+        'planning': {'trajectory_quality': float, 'planning_time_ms': float},
+        'control': {'lateral_error': float, 'longitudinal_error': float, 'control_mode': str},
+        'computing': {'cpu_usage': float, 'gpu_usage': float, 'memory_usage': float, 'temperature': float},
+    },
+    'fault_logs': list,
+    'fault_modes_active': dict,
+}
+PACKET_SCHEMA = PacketSchema(PACKET_LAYOUT)
+
+
 class TractorDataSimulator:
     """拖拉机数据模拟器"""
     
-    def __init__(self, vehicle_id: str):
+    def __init__(self, vehicle_id: str, packet: Optional[np.void] = None):
+        """
+        Args:
+            vehicle_id: 车辆ID
+            packet: 数据包记录（车队模拟时传入共享数组PACKET_SCHEMA.new_array(n)中的一行，
+                    为None时单独分配）
+        """
         self.vehicle_id = vehicle_id
+        self.packet = packet if packet is not None else PACKET_SCHEMA.new_record()
+        self.packet['vehicle_id'] = vehicle_id.encode('utf-8')
+        self.fault_logs: List[Dict[str, Any]] = []
         self.timestamp = time.time()
         self.operation_hours = 0  # 累计运行小时数
         self.battery_cycles = 0  # 电池充放电循环次数
@@ -63,7 +115,7 @@ class TractorDataSimulator:
         
         return value
     
-    def generate_engine_data(self) -> Dict[str, Any]:
+    def fill_engine_data(self):
         """生成发动机数据"""
         # 基础值
         base_rpm = 1800 + 400 * math.sin(self.timestamp / 100)  # 1400-2200 rpm
@@ -75,16 +127,15 @@ class TractorDataSimulator:
         temp = self._add_fault_effect(base_temp, 'engine_degradation', 0.15)
         fuel_rate = self._add_fault_effect(base_fuel_rate, 'engine_degradation', 0.2)
         
-        return {
-            'rpm': self._add_noise(base_rpm, 0.03),
-            'torque': self._add_noise(base_torque, 0.05),
-            'coolant_temp': self._add_noise(temp, 0.02),
-            'oil_pressure': self._add_noise(4.5 + 0.5 * math.sin(self.timestamp / 120), 0.03),  # 4-5 bar
-            'fuel_consumption_rate': self._add_noise(fuel_rate, 0.04),
-            'intake_air_temp': self._add_noise(30 + 15 * math.sin(self.timestamp / 300), 0.03),
-        }
+        p = self.packet
+        p['engine_rpm'] = self._add_noise(base_rpm, 0.03)
+        p['engine_torque'] = self._add_noise(base_torque, 0.05)
+        p['engine_coolant_temp'] = self._add_noise(temp, 0.02)
+        p['engine_oil_pressure'] = self._add_noise(4.5 + 0.5 * math.sin(self.timestamp / 120), 0.03)  # 4-5 bar
+        p['engine_fuel_consumption_rate'] = self._add_noise(fuel_rate, 0.04)
+        p['engine_intake_air_temp'] = self._add_noise(30 + 15 * math.sin(self.timestamp / 300), 0.03)
     
-    def generate_battery_data(self) -> Dict[str, Any]:
+    def fill_battery_data(self):
         """生成电池系统数据"""
         # 电池SOC随时间缓慢变化
         base_soc = 50 + 30 * math.sin(self.timestamp / 500)  # 20-80%
@@ -98,120 +149,99 @@ class TractorDataSimulator:
         base_current = 50 + 30 * math.sin(self.timestamp / 100)  # -20A到80A (充放电)
         voltage = 600 + 50 * (soc / 100)  # 600-650V
         
-        return {
-            'soc': max(0, min(100, soc)),
-            'soh': soh,
-            'voltage': self._add_noise(voltage, 0.01),
-            'current': self._add_noise(base_current, 0.05),
-            'power': self._add_noise(voltage * base_current / 1000, 0.05),  # kW
-            'temp_max': self._add_noise(35 + 10 * abs(base_current) / 80, 0.03),
-            'temp_min': self._add_noise(30 + 8 * abs(base_current) / 80, 0.03),
-            'cell_voltage_max': self._add_noise(3.7, 0.005),
-            'cell_voltage_min': self._add_noise(3.6, 0.005),
-        }
+        p = self.packet
+        p['battery_soc'] = max(0, min(100, soc))
+        p['battery_soh'] = soh
+        p['battery_voltage'] = self._add_noise(voltage, 0.01)
+        p['battery_current'] = self._add_noise(base_current, 0.05)
+        p['battery_power'] = self._add_noise(voltage * base_current / 1000, 0.05)  # kW
+        p['battery_temp_max'] = self._add_noise(35 + 10 * abs(base_current) / 80, 0.03)
+        p['battery_temp_min'] = self._add_noise(30 + 8 * abs(base_current) / 80, 0.03)
+        p['battery_cell_voltage_max'] = self._add_noise(3.7, 0.005)
+        p['battery_cell_voltage_min'] = self._add_noise(3.6, 0.005)
     
-    def generate_vehicle_state(self) -> Dict[str, Any]:
+    def fill_vehicle_state(self):
         """生成车辆状态数据"""
         # 车速变化
         base_speed = 8 + 4 * abs(math.sin(self.timestamp / 150))  # 4-12 km/h
         
-        return {
-            'speed': self._add_noise(base_speed, 0.05),
-            'acceleration': self._add_noise(0.1 * math.cos(self.timestamp / 150), 0.1),
-            'steering_angle': self._add_noise(15 * math.sin(self.timestamp / 200), 0.05),
-            'wheel_speed_fl': self._add_noise(base_speed * 1.02, 0.03),
-            'wheel_speed_fr': self._add_noise(base_speed * 1.01, 0.03),
-            'wheel_speed_rl': self._add_noise(base_speed * 0.99, 0.03),
-            'wheel_speed_rr': self._add_noise(base_speed * 0.98, 0.03),
-            'brake_pressure': self._add_noise(2 + 3 * abs(math.sin(self.timestamp / 180)), 0.05),
-        }
+        p = self.packet
+        p['vehicle_state_speed'] = self._add_noise(base_speed, 0.05)
+        p['vehicle_state_acceleration'] = self._add_noise(0.1 * math.cos(self.timestamp / 150), 0.1)
+        p['vehicle_state_steering_angle'] = self._add_noise(15 * math.sin(self.timestamp / 200), 0.05)
+        p['vehicle_state_wheel_speed_fl'] = self._add_noise(base_speed * 1.02, 0.03)
+        p['vehicle_state_wheel_speed_fr'] = self._add_noise(base_speed * 1.01, 0.03)
+        p['vehicle_state_wheel_speed_rl'] = self._add_noise(base_speed * 0.99, 0.03)
+        p['vehicle_state_wheel_speed_rr'] = self._add_noise(base_speed * 0.98, 0.03)
+        p['vehicle_state_brake_pressure'] = self._add_noise(2 + 3 * abs(math.sin(self.timestamp / 180)), 0.05)
     
-    def generate_transmission_data(self) -> Dict[str, Any]:
+    def fill_transmission_data(self):
         """生成变速箱数据"""
-        return {
-            'gear': random.choice([1, 2, 3, 4]),
-            'oil_temp': self._add_noise(70 + 15 * math.sin(self.timestamp / 250), 0.03),
-            'oil_pressure': self._add_noise(6 + 2 * math.sin(self.timestamp / 180), 0.04),
-            'clutch_status': random.choice([0, 1]),  # 0=分离, 1=结合
-        }
+        p = self.packet
+        p['transmission_gear'] = random.choice([1, 2, 3, 4])
+        p['transmission_oil_temp'] = self._add_noise(70 + 15 * math.sin(self.timestamp / 250), 0.03)
+        p['transmission_oil_pressure'] = self._add_noise(6 + 2 * math.sin(self.timestamp / 180), 0.04)
+        p['transmission_clutch_status'] = random.choice([0, 1])  # 0=分离, 1=结合
     
-    def generate_hydraulic_data(self) -> Dict[str, Any]:
+    def fill_hydraulic_data(self):
         """生成液压系统数据"""
         base_pressure = 180 + 20 * math.sin(self.timestamp / 120)  # 160-200 bar
         pressure = self._add_fault_effect(base_pressure, 'hydraulic_leak', 0.3)
         
-        return {
-            'pressure': self._add_noise(pressure, 0.04),
-            'oil_temp': self._add_noise(55 + 15 * math.sin(self.timestamp / 300), 0.03),
-            'flow_rate': self._add_noise(40 + 10 * abs(math.sin(self.timestamp / 150)), 0.05),
-            'implement_position': self._add_noise(50 + 30 * math.sin(self.timestamp / 200), 0.02),
-        }
+        p = self.packet
+        p['hydraulic_pressure'] = self._add_noise(pressure, 0.04)
+        p['hydraulic_oil_temp'] = self._add_noise(55 + 15 * math.sin(self.timestamp / 300), 0.03)
+        p['hydraulic_flow_rate'] = self._add_noise(40 + 10 * abs(math.sin(self.timestamp / 150)), 0.05)
+        p['hydraulic_implement_position'] = self._add_noise(50 + 30 * math.sin(self.timestamp / 200), 0.02)
     
-    def generate_gnss_data(self) -> Dict[str, Any]:
+    def fill_gnss_data(self):
         """生成GNSS/INS定位数据"""
         # 模拟在农田中作业的轨迹
         base_lat = 39.9042 + 0.001 * math.sin(self.timestamp / 500)
         base_lon = 116.4074 + 0.001 * math.cos(self.timestamp / 500)
         
-        return {
-            'latitude': self._add_noise(base_lat, 0.00001),
-            'longitude': self._add_noise(base_lon, 0.00001),
-            'altitude': self._add_noise(50, 0.01),
-            'heading': self._add_noise(90 + 45 * math.sin(self.timestamp / 300), 0.02),
-            'positioning_accuracy': self._add_noise(0.015, 0.1),  # 1.5cm ± 10%
-            'satellite_count': random.randint(12, 20),
-            'rtk_status': random.choice(['fixed', 'float', 'single']),
-        }
+        p = self.packet
+        p['gnss_latitude'] = self._add_noise(base_lat, 0.00001)
+        p['gnss_longitude'] = self._add_noise(base_lon, 0.00001)
+        p['gnss_altitude'] = self._add_noise(50, 0.01)
+        p['gnss_heading'] = self._add_noise(90 + 45 * math.sin(self.timestamp / 300), 0.02)
+        p['gnss_positioning_accuracy'] = self._add_noise(0.015, 0.1)  # 1.5cm ± 10%
+        p['gnss_satellite_count'] = random.randint(12, 20)
+        p['gnss_rtk_status'] = random.choice([b'fixed', b'float', b'single'])
     
-    def generate_sensor_health(self) -> Dict[str, Any]:
+    def fill_sensor_health(self):
         """生成传感器健康度数据"""
         base_quality = 95
         if self.fault_modes['sensor_drift']:
             base_quality = 70 + 10 * random.random()
         
-        return {
-            'lidar_health': {
-                'data_rate': self._add_noise(200000, 0.02),  # 点/秒
-                'temperature': self._add_noise(45, 0.05),
-                'voltage': self._add_noise(12, 0.01),
-                'quality_score': self._add_noise(base_quality, 0.03),
-            },
-            'camera_health': {
-                'frame_rate': self._add_noise(30, 0.01),
-                'temperature': self._add_noise(50, 0.05),
-                'quality_score': self._add_noise(base_quality, 0.03),
-            },
-            'imu_health': {
-                'drift_rate': self._add_noise(0.01, 0.1),  # deg/h
-                'temperature': self._add_noise(40, 0.03),
-                'quality_score': self._add_noise(base_quality, 0.03),
-            },
-        }
+        p = self.packet
+        p['sensor_health_lidar_health_data_rate'] = self._add_noise(200000, 0.02)  # 点/秒
+        p['sensor_health_lidar_health_temperature'] = self._add_noise(45, 0.05)
+        p['sensor_health_lidar_health_voltage'] = self._add_noise(12, 0.01)
+        p['sensor_health_lidar_health_quality_score'] = self._add_noise(base_quality, 0.03)
+        p['sensor_health_camera_health_frame_rate'] = self._add_noise(30, 0.01)
+        p['sensor_health_camera_health_temperature'] = self._add_noise(50, 0.05)
+        p['sensor_health_camera_health_quality_score'] = self._add_noise(base_quality, 0.03)
+        p['sensor_health_imu_health_drift_rate'] = self._add_noise(0.01, 0.1)  # deg/h
+        p['sensor_health_imu_health_temperature'] = self._add_noise(40, 0.03)
+        p['sensor_health_imu_health_quality_score'] = self._add_noise(base_quality, 0.03)
     
-    def generate_intelligent_driving_data(self) -> Dict[str, Any]:
+    def fill_intelligent_driving_data(self):
         """生成智驾系统数据"""
-        return {
-            'perception': {
-                'obstacle_count': random.randint(0, 5),
-                'drivable_area_confidence': self._add_noise(0.95, 0.02),
-                'processing_time_ms': self._add_noise(50, 0.1),
-            },
-            'planning': {
-                'trajectory_quality': self._add_noise(0.92, 0.03),
-                'planning_time_ms': self._add_noise(30, 0.1),
-            },
-            'control': {
-                'lateral_error': self._add_noise(0.03, 0.2),  # 3cm
-                'longitudinal_error': self._add_noise(0.05, 0.2),  # 5cm
-                'control_mode': random.choice(['auto', 'manual', 'remote']),
-            },
-            'computing': {
-                'cpu_usage': self._add_noise(60, 0.1),  # %
-                'gpu_usage': self._add_noise(70, 0.1),  # %
-                'memory_usage': self._add_noise(65, 0.1),  # %
-                'temperature': self._add_noise(65, 0.05),  # °C
-            },
-        }
+        p = self.packet
+        p['intelligent_driving_perception_obstacle_count'] = random.randint(0, 5)
+        p['intelligent_driving_perception_drivable_area_confidence'] = self._add_noise(0.95, 0.02)
+        p['intelligent_driving_perception_processing_time_ms'] = self._add_noise(50, 0.1)
+        p['intelligent_driving_planning_trajectory_quality'] = self._add_noise(0.92, 0.03)
+        p['intelligent_driving_planning_planning_time_ms'] = self._add_noise(30, 0.1)
+        p['intelligent_driving_control_lateral_error'] = self._add_noise(0.03, 0.2)  # 3cm
+        p['intelligent_driving_control_longitudinal_error'] = self._add_noise(0.05, 0.2)  # 5cm
+        p['intelligent_driving_control_control_mode'] = random.choice([b'auto', b'manual', b'remote'])
+        p['intelligent_driving_computing_cpu_usage'] = self._add_noise(60, 0.1)  # %
+        p['intelligent_driving_computing_gpu_usage'] = self._add_noise(70, 0.1)  # %
+        p['intelligent_driving_computing_memory_usage'] = self._add_noise(65, 0.1)  # %
+        p['intelligent_driving_computing_temperature'] = self._add_noise(65, 0.05)  # °C
     
     def generate_fault_log(self) -> List[Dict[str, Any]]:
         """生成故障日志（事件驱动）"""
@@ -257,28 +287,43 @@ class TractorDataSimulator:
         if self.operation_hours > 200 and random.random() < 0.00001:
             self.fault_modes['sensor_drift'] = True
     
-    def generate_complete_data_packet(self) -> Dict[str, Any]:
-        """生成完整的数据包"""
+    def fill_packet(self) -> np.void:
+        """生成完整的数据包（原地写入self.packet并返回该记录）"""
+        p = self.packet
+        p['timestamp'] = time.time()
+        p['operation_hours'] = round(self.operation_hours, 2)
+        self.fill_engine_data()
+        self.fill_battery_data()
+        self.fill_vehicle_state()
+        self.fill_transmission_data()
+        self.fill_hydraulic_data()
+        self.fill_gnss_data()
+        self.fill_sensor_health()
+        self.fill_intelligent_driving_data()
+        self.fault_logs = self.generate_fault_log()
+        return p
+    
+    def packet_extras(self) -> Dict[str, Any]:
+        """数据包中长度不定的字段（故障日志、激活的故障模式）"""
         return {
-            'vehicle_id': self.vehicle_id,
-            'timestamp': datetime.now().isoformat(),
-            'operation_hours': round(self.operation_hours, 2),
-            'engine': self.generate_engine_data(),
-            'battery': self.generate_battery_data(),
-            'vehicle_state': self.generate_vehicle_state(),
-            'transmission': self.generate_transmission_data(),
-            'hydraulic': self.generate_hydraulic_data(),
-            'gnss': self.generate_gnss_data(),
-            'sensor_health': self.generate_sensor_health(),
-            'intelligent_driving': self.generate_intelligent_driving_data(),
-            'fault_logs': self.generate_fault_log(),
+            'fault_logs': self.fault_logs,
             'fault_modes_active': {k: v for k, v in self.fault_modes.items() if v},
         }
+    
+    def packet_json(self) -> str:
+        """当前数据包的JSON（直接由记录序列化）"""
+        return PACKET_SCHEMA.to_json(self.packet, self.packet_extras())
+    
+    def generate_complete_data_packet(self) -> Dict[str, Any]:
+        """生成完整的数据包（嵌套dict形式，兼容旧调用方）"""
+        self.fill_packet()
+        return PACKET_SCHEMA.to_dict(self.packet, self.packet_extras())
 
 
 def simulate_tbox_data_stream(vehicle_id: str, duration_seconds: int = 60, sample_rate: float = 1.0,
                               mqtt_broker: str = 'localhost', mqtt_port: int = 1883,
-                              use_mqtt: bool = True):
+                              use_mqtt: bool = True,
+                              buffer: Optional[TelemetryBuffer] = None) -> TelemetryBuffer:
     """
     模拟T-BOX数据流
     
@@ -289,8 +334,14 @@ def simulate_tbox_data_stream(vehicle_id: str, duration_seconds: int = 60, sampl
         mqtt_broker: MQTT Broker地址
         mqtt_port: MQTT Broker端口
         use_mqtt: 是否使用MQTT发送数据
+        buffer: 列式遥测缓冲区（为None时新建），离线模式下可直接交给分析引擎
+        
+    Returns:
+        采集到的全部数据（列式缓冲区）
     """
     simulator = TractorDataSimulator(vehicle_id)
+    if buffer is None:
+        buffer = TelemetryBuffer(vehicle_id, capacity=int(duration_seconds * sample_rate) + 1)
     
     # 初始化MQTT客户端
     mqtt_client = None
@@ -319,13 +370,14 @@ def simulate_tbox_data_stream(vehicle_id: str, duration_seconds: int = 60, sampl
     
     while time.time() - start_time < duration_seconds:
         # 生成数据包
-        data_packet = simulator.generate_complete_data_packet()
+        packet = simulator.fill_packet()
+        buffer.append_record(packet, PACKET_SCHEMA)
         
         # 发送到MQTT
         if mqtt_connected and mqtt_client:
             try:
                 topic = f"tractor/{vehicle_id}/data"
-                payload = json.dumps(data_packet, ensure_ascii=False)
+                payload = simulator.packet_json()
                 result = mqtt_client.publish(topic, payload, qos=0)
                 if result.rc == mqtt.MQTT_ERR_SUCCESS:
                     mqtt_status = "✓ 已发送"
@@ -337,18 +389,19 @@ def simulate_tbox_data_stream(vehicle_id: str, duration_seconds: int = 60, sampl
             mqtt_status = "- 仅控制台"
         
         # 输出到控制台
-        print(f"\n[样本 #{sample_count + 1}] 时间: {data_packet['timestamp']} {mqtt_status}")
-        print(f"运行时长: {data_packet['operation_hours']:.2f}小时")
-        print(f"发动机: RPM={data_packet['engine']['rpm']:.0f}, 温度={data_packet['engine']['coolant_temp']:.1f}°C")
-        print(f"电池: SOC={data_packet['battery']['soc']:.1f}%, SOH={data_packet['battery']['soh']:.1f}%")
-        print(f"车速: {data_packet['vehicle_state']['speed']:.1f} km/h")
-        print(f"定位: ({data_packet['gnss']['latitude']:.6f}, {data_packet['gnss']['longitude']:.6f}), 精度={data_packet['gnss']['positioning_accuracy']:.3f}m")
+        print(f"\n[样本 #{sample_count + 1}] 时间: {datetime.fromtimestamp(packet['timestamp']).isoformat()} {mqtt_status}")
+        print(f"运行时长: {packet['operation_hours']:.2f}小时")
+        print(f"发动机: RPM={packet['engine_rpm']:.0f}, 温度={packet['engine_coolant_temp']:.1f}°C")
+        print(f"电池: SOC={packet['battery_soc']:.1f}%, SOH={packet['battery_soh']:.1f}%")
+        print(f"车速: {packet['vehicle_state_speed']:.1f} km/h")
+        print(f"定位: ({packet['gnss_latitude']:.6f}, {packet['gnss_longitude']:.6f}), 精度={packet['gnss_positioning_accuracy']:.3f}m")
         
-        if data_packet['fault_logs']:
-            print(f"⚠️  故障日志: {data_packet['fault_logs']}")
+        if simulator.fault_logs:
+            print(f"⚠️  故障日志: {simulator.fault_logs}")
         
-        if data_packet['fault_modes_active']:
-            print(f"⚠️  激活的故障模式: {list(data_packet['fault_modes_active'].keys())}")
+        active_faults = [k for k, v in simulator.fault_modes.items() if v]
+        if active_faults:
+            print(f"⚠️  激活的故障模式: {active_faults}")
         
         # 更新状态
         simulator.update_state(1.0 / sample_rate)
@@ -366,6 +419,7 @@ def simulate_tbox_data_stream(vehicle_id: str, duration_seconds: int = 60, sampl
     print(f"模拟完成! 共生成 {sample_count} 个数据样本")
     print(f"累计运行时长: {simulator.operation_hours:.2f}小时")
     print(f"电池循环次数: {simulator.battery_cycles}")
+    return buffer
 
 
 if __name__ == '__main__':
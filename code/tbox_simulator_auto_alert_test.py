@@ -10,12 +10,14 @@ Features:
 - Real-time progress display
 """
 
-import json
 import time
 import random
 from datetime import datetime, timezone
+import numpy as np
 import paho.mqtt.client as mqtt
 
+from telemetry_packet import PacketSchema
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -146,6 +148,26 @@ class AutoAlertTractorSimulator:
             "system_health_score": 95.0,
         }
         
+        # Compact packet: one structured-array row filled in place every cycle
+        self.schema = PacketSchema({
+            "vehicle_id": str,
+            "timestamp": datetime,
+            "running_time": int,
+            "total_distance": float,
+            "fuel_consumption_total": float,
+            **{key: str if isinstance(value, str) else float
+               for key, value in self.normal_params.items()},
+        }, tz=timezone.utc)
+        self.packets = self.schema.new_array(1)
+        self.packet = self.packets[0]
+        self.packet["vehicle_id"] = VEHICLE_ID
+        numeric = [key for key, value in self.normal_params.items() if not isinstance(value, str)]
+        for key, value in self.normal_params.items():
+            if isinstance(value, str):
+                self.packet[key] = value
+        self._noise_columns = self.schema.float_index(numeric)
+        self._noise_base = np.array([self.normal_params[key] for key in numeric], dtype=np.float64)
+        
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print("✅ Connected to MQTT broker")
@@ -166,30 +188,23 @@ class AutoAlertTractorSimulator:
         self.client.loop_stop()
         self.client.disconnect()
         
-    def add_noise(self, value, noise_percent=2.0):
-        """Add realistic noise to sensor values"""
-        if isinstance(value, (int, float)):
-            noise = value * (noise_percent / 100.0)
-            return value + random.uniform(-noise, noise)
-        return value
-        
     def generate_telemetry(self, anomalies=None):
-        """Generate complete telemetry with optional anomalies"""
-        data = {
-            "vehicle_id": VEHICLE_ID,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "running_time": self.running_time,
-            "total_distance": self.total_distance,
-            "fuel_consumption_total": self.total_fuel_consumed,
-        }
+        """Generate complete telemetry with optional anomalies (returns the packet record)"""
+        data = self.packet
+        data["timestamp"] = time.time()
+        data["running_time"] = self.running_time
+        data["total_distance"] = self.total_distance
+        data["fuel_consumption_total"] = self.total_fuel_consumed
         
-        # Add all normal parameters with noise
-        for key, value in self.normal_params.items():
-            data[key] = self.add_noise(value, noise_percent=2.0)
+        # Add ±2% noise to all numeric parameters in one vectorized write
+        floats = self.schema.float_view(self.packets)[0]
+        floats[self._noise_columns] = self._noise_base * (
+            1 + np.random.uniform(-0.02, 0.02, len(self._noise_base)))
         
         # Apply anomalies if specified
         if anomalies:
-            data.update(anomalies)
+            for key, value in anomalies.items():
+                data[key] = value
             data["warning_count"] = len(anomalies)
         
         # Update cumulative values
@@ -201,7 +216,7 @@ class AutoAlertTractorSimulator:
         
     def send_telemetry(self, data, show_details=False):
         """Send telemetry via MQTT"""
-        payload = json.dumps(data)
+        payload = self.schema.to_json(data)
         result = self.client.publish(MQTT_TOPIC, payload, qos=1)
         
         self.message_count += 1
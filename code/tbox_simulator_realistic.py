@@ -4,15 +4,16 @@ T-BOX数据模拟器 - 真实工况版本
 生成更真实的拖拉机工作数据，包含突变、尖峰、平台期等特征
 """
 
-import json
 import time
 import random
 import math
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from enum import Enum
 import numpy as np
 
+from telemetry_packet import PacketSchema
+
 try:
     import paho.mqtt.client as mqtt
     MQTT_AVAILABLE = True
@@ -33,11 +34,55 @@ class TractorState(Enum):
     DECELERATING = 6 # 减速
 
 
+# 数据包布局（与JSON结构相同，叶子为字段类型）
+PACKET_LAYOUT = {
+    'vehicle_id': str,
+    'timestamp': datetime,
+    'unix_timestamp': float,
+    'state': str,
+    'vehicle': {'vehicle_speed': float, 'odometer': float, 'operation_hours': float, 'heading': float},
+    'engine': {
+        'rpm': float, 'torque': float, 'coolant_temp': float, 'oil_pressure': float,
+        'fuel_consumption_rate': float, 'fuel_level': float, 'intake_air_temp': float,
+    },
+    'battery': {
+        'voltage': float, 'current': float, 'soc': float, 'soh': float,
+        'temperature': float, 'charge_cycles': int,
+    },
+    'hydraulic': {
+        'system_pressure': float, 'oil_temperature': float, 'flow_rate': float,
+        'filter_pressure_drop': float,
+    },
+    'gnss': {
+        'latitude': float, 'longitude': float, 'altitude': float, 'heading': float,
+        'satellite_count': int, 'positioning_accuracy': float,
+    },
+    'autonomous': {
+        'auto_mode_enabled': bool, 'steering_angle': float, 'path_deviation': float,
+        'obstacle_distance': float, 'gnss_rtk_status': int, 'imu_pitch': float, 'imu_roll': float,
+    },
+    'sensor_health': {
+        'gps_signal_quality': float, 'can_bus_error_rate': float, 'imu_calibration_status': float,
+        'camera_visibility': float, 'lidar_point_density': float,
+    },
+    'fault_codes': list,
+}
+PACKET_SCHEMA = PacketSchema(PACKET_LAYOUT)
+
+
 class RealisticTractorSimulator:
     """真实工况拖拉机数据模拟器"""
     
-    def __init__(self, vehicle_id: str):
+    def __init__(self, vehicle_id: str, packet: Optional[np.void] = None):
+        """
+        Args:
+            vehicle_id: 车辆ID
+            packet: 数据包记录（多车模拟时为共享数组中的一行，为None时单独分配）
+        """
         self.vehicle_id = vehicle_id
+        self.packet = packet if packet is not None else PACKET_SCHEMA.new_record()
+        self.packet['vehicle_id'] = vehicle_id.encode('utf-8')
+        self.fault_codes: List[str] = []
         self.timestamp = time.time()
         self.operation_hours = 0
         self.battery_cycles = 0
@@ -191,7 +236,7 @@ class RealisticTractorSimulator:
             return value * (1 + random.uniform(-spike_range, spike_range))
         return value
     
-    def generate_vehicle_data(self) -> Dict[str, Any]:
+    def fill_vehicle_data(self):
         """生成车辆基础数据"""
         # 更新状态
         self._update_state()
@@ -213,14 +258,13 @@ class RealisticTractorSimulator:
         vehicle_speed = self._add_spike(vehicle_speed, 0.05, 0.1)
         vehicle_speed = max(0, vehicle_speed)
         
-        return {
-            'vehicle_speed': round(vehicle_speed, 2),
-            'odometer': round(self.operation_hours * 8.5, 1),  # 假设平均速度8.5km/h
-            'operation_hours': round(self.operation_hours, 1),
-            'heading': round(random.uniform(0, 360), 1),
-        }
+        p = self.packet
+        p['vehicle_vehicle_speed'] = round(vehicle_speed, 2)
+        p['vehicle_odometer'] = round(self.operation_hours * 8.5, 1)  # 假设平均速度8.5km/h
+        p['vehicle_operation_hours'] = round(self.operation_hours, 1)
+        p['vehicle_heading'] = round(random.uniform(0, 360), 1)
     
-    def generate_engine_data(self) -> Dict[str, Any]:
+    def fill_engine_data(self):
         """生成发动机数据"""
         # 使用当前值并添加噪声
         rpm = self._add_noise(self.current_values['engine_rpm'], 30)
@@ -242,17 +286,16 @@ class RealisticTractorSimulator:
         fuel_level = max(10, 100 - (self.operation_hours / 10) * 5)  # 每10小时下降5%
         fuel_level = self._add_noise(fuel_level, 1.0)
         
-        return {
-            'rpm': round(rpm, 0),
-            'torque': round(torque, 1),
-            'coolant_temp': round(coolant_temp, 1),
-            'oil_pressure': round(self._add_noise(4.5, 0.15), 2),
-            'fuel_consumption_rate': round(fuel_rate, 2),
-            'fuel_level': round(fuel_level, 1),
-            'intake_air_temp': round(self._add_noise(35, 2), 1),
-        }
+        p = self.packet
+        p['engine_rpm'] = round(rpm, 0)
+        p['engine_torque'] = round(torque, 1)
+        p['engine_coolant_temp'] = round(coolant_temp, 1)
+        p['engine_oil_pressure'] = round(self._add_noise(4.5, 0.15), 2)
+        p['engine_fuel_consumption_rate'] = round(fuel_rate, 2)
+        p['engine_fuel_level'] = round(fuel_level, 1)
+        p['engine_intake_air_temp'] = round(self._add_noise(35, 2), 1)
     
-    def generate_battery_data(self) -> Dict[str, Any]:
+    def fill_battery_data(self):
         """生成电池系统数据"""
         # 使用当前电压值并添加噪声
         voltage = self._add_noise(self.current_values['battery_voltage'], 0.15)
@@ -265,16 +308,15 @@ class RealisticTractorSimulator:
         load_factor = self.current_values['engine_rpm'] / 2200
         current = self._add_noise(30 + load_factor * 40, 5)
         
-        return {
-            'voltage': round(voltage, 2),
-            'current': round(current, 1),
-            'soc': round(soc, 1),
-            'soh': round(self._add_noise(95, 0.5), 1),
-            'temperature': round(self._add_noise(28 + load_factor * 7, 1), 1),
-            'charge_cycles': self.battery_cycles,
-        }
+        p = self.packet
+        p['battery_voltage'] = round(voltage, 2)
+        p['battery_current'] = round(current, 1)
+        p['battery_soc'] = round(soc, 1)
+        p['battery_soh'] = round(self._add_noise(95, 0.5), 1)
+        p['battery_temperature'] = round(self._add_noise(28 + load_factor * 7, 1), 1)
+        p['battery_charge_cycles'] = self.battery_cycles
     
-    def generate_hydraulic_data(self) -> Dict[str, Any]:
+    def fill_hydraulic_data(self):
         """生成液压系统数据"""
         # 液压压力基于负载
         load_factor = self.current_values['engine_torque'] / 500
@@ -282,50 +324,46 @@ class RealisticTractorSimulator:
         pressure = self._add_noise(base_pressure, 5)
         pressure = self._add_spike(pressure, 0.1, 0.1)
         
-        return {
-            'system_pressure': round(pressure, 1),
-            'oil_temperature': round(self._add_noise(55 + load_factor * 15, 2), 1),
-            'flow_rate': round(self._add_noise(40 + load_factor * 20, 2), 1),
-            'filter_pressure_drop': round(self._add_noise(0.5, 0.05), 2),
-        }
+        p = self.packet
+        p['hydraulic_system_pressure'] = round(pressure, 1)
+        p['hydraulic_oil_temperature'] = round(self._add_noise(55 + load_factor * 15, 2), 1)
+        p['hydraulic_flow_rate'] = round(self._add_noise(40 + load_factor * 20, 2), 1)
+        p['hydraulic_filter_pressure_drop'] = round(self._add_noise(0.5, 0.05), 2)
     
-    def generate_gnss_data(self) -> Dict[str, Any]:
+    def fill_gnss_data(self):
         """生成GNSS定位数据"""
-        return {
-            'latitude': round(39.9042 + random.uniform(-0.001, 0.001), 6),
-            'longitude': round(116.4074 + random.uniform(-0.001, 0.001), 6),
-            'altitude': round(50 + random.uniform(-2, 2), 1),
-            'heading': round(random.uniform(0, 360), 1),
-            'satellite_count': random.randint(10, 15),
-            'positioning_accuracy': round(random.uniform(0.01, 0.05), 3),
-        }
+        p = self.packet
+        p['gnss_latitude'] = round(39.9042 + random.uniform(-0.001, 0.001), 6)
+        p['gnss_longitude'] = round(116.4074 + random.uniform(-0.001, 0.001), 6)
+        p['gnss_altitude'] = round(50 + random.uniform(-2, 2), 1)
+        p['gnss_heading'] = round(random.uniform(0, 360), 1)
+        p['gnss_satellite_count'] = random.randint(10, 15)
+        p['gnss_positioning_accuracy'] = round(random.uniform(0.01, 0.05), 3)
     
-    def generate_autonomous_data(self) -> Dict[str, Any]:
+    def fill_autonomous_data(self):
         """生成自动驾驶数据"""
         # 自动驾驶模式基于状态
         auto_mode = self.current_state in [TractorState.WORKING, TractorState.ACCELERATING]
         
-        return {
-            'auto_mode_enabled': auto_mode,
-            'steering_angle': round(self._add_noise(0, 5), 1) if auto_mode else 0,
-            'path_deviation': round(abs(self._add_noise(0, 0.15)), 2) if auto_mode else 0,
-            'obstacle_distance': round(self._add_noise(10, 2), 1),
-            'gnss_rtk_status': random.choice([4, 5]),  # 4=RTK Fixed, 5=RTK Float
-            'imu_pitch': round(self._add_noise(0, 2), 1),
-            'imu_roll': round(self._add_noise(0, 1.5), 1),
-        }
+        p = self.packet
+        p['autonomous_auto_mode_enabled'] = auto_mode
+        p['autonomous_steering_angle'] = round(self._add_noise(0, 5), 1) if auto_mode else 0
+        p['autonomous_path_deviation'] = round(abs(self._add_noise(0, 0.15)), 2) if auto_mode else 0
+        p['autonomous_obstacle_distance'] = round(self._add_noise(10, 2), 1)
+        p['autonomous_gnss_rtk_status'] = random.choice([4, 5])  # 4=RTK Fixed, 5=RTK Float
+        p['autonomous_imu_pitch'] = round(self._add_noise(0, 2), 1)
+        p['autonomous_imu_roll'] = round(self._add_noise(0, 1.5), 1)
     
-    def generate_sensor_health(self) -> Dict[str, Any]:
+    def fill_sensor_health(self):
         """生成传感器健康度数据"""
         base_health = 95
         
-        return {
-            'gps_signal_quality': round(self._add_noise(base_health, 2), 1),
-            'can_bus_error_rate': round(abs(self._add_noise(0.1, 0.05)), 3),
-            'imu_calibration_status': round(self._add_noise(base_health, 1), 1),
-            'camera_visibility': round(self._add_noise(90, 5), 1),
-            'lidar_point_density': round(self._add_noise(85, 3), 1),
-        }
+        p = self.packet
+        p['sensor_health_gps_signal_quality'] = round(self._add_noise(base_health, 2), 1)
+        p['sensor_health_can_bus_error_rate'] = round(abs(self._add_noise(0.1, 0.05)), 3)
+        p['sensor_health_imu_calibration_status'] = round(self._add_noise(base_health, 1), 1)
+        p['sensor_health_camera_visibility'] = round(self._add_noise(90, 5), 1)
+        p['sensor_health_lidar_point_density'] = round(self._add_noise(85, 3), 1)
     
     def generate_fault_codes(self) -> List[str]:
         """生成故障码"""
@@ -343,29 +381,36 @@ class RealisticTractorSimulator:
         
         return fault_codes
     
-    def generate_complete_data(self) -> Dict[str, Any]:
-        """生成完整的T-BOX数据"""
+    def fill_packet(self) -> np.void:
+        """生成完整的T-BOX数据（原地写入self.packet并返回该记录）"""
         self.timestamp = time.time()
         self.operation_hours += 1 / 3600  # 每秒增加
         
-        data = {
-            'vehicle_id': self.vehicle_id,
-            'timestamp': datetime.now().isoformat(),
-            'unix_timestamp': self.timestamp,
-            'state': self.current_state.name,  # 添加状态信息
-            
-            # 各子系统数据
-            'vehicle': self.generate_vehicle_data(),
-            'engine': self.generate_engine_data(),
-            'battery': self.generate_battery_data(),
-            'hydraulic': self.generate_hydraulic_data(),
-            'gnss': self.generate_gnss_data(),
-            'autonomous': self.generate_autonomous_data(),
-            'sensor_health': self.generate_sensor_health(),
-            'fault_codes': self.generate_fault_codes(),
-        }
-        
-        return data
+        p = self.packet
+        p['timestamp'] = self.timestamp
+        p['unix_timestamp'] = self.timestamp
+        
+        p['state'] = self.current_state.name.encode('ascii')  # 添加状态信息
+        
+        # 各子系统数据
+        self.fill_vehicle_data()
+        self.fill_engine_data()
+        self.fill_battery_data()
+        self.fill_hydraulic_data()
+        self.fill_gnss_data()
+        self.fill_autonomous_data()
+        self.fill_sensor_health()
+        self.fault_codes = self.generate_fault_codes()
+        return p
+    
+    def packet_json(self) -> str:
+        """当前数据包的JSON（直接由记录序列化）"""
+        return PACKET_SCHEMA.to_json(self.packet, {'fault_codes': self.fault_codes})
+    
+    def generate_complete_data(self) -> Dict[str, Any]:
+        """生成完整的T-BOX数据（嵌套dict形式，兼容旧调用方）"""
+        self.fill_packet()
+        return PACKET_SCHEMA.to_dict(self.packet, {'fault_codes': self.fault_codes})
 
 
 def main():
@@ -382,8 +427,10 @@ def main():
     VEHICLE_IDS = ["TRACTOR_001", "TRACTOR_002", "TRACTOR_003"]
     PUBLISH_INTERVAL = 1  # 秒
     
-    # 创建模拟器实例
-    simulators = {vid: RealisticTractorSimulator(vid) for vid in VEHICLE_IDS}
+    # 创建模拟器实例（所有车辆的数据包共用一个结构化数组，每车一行）
+    packets = PACKET_SCHEMA.new_array(len(VEHICLE_IDS))
+    simulators = {vid: RealisticTractorSimulator(vid, packets[i])
+                  for i, vid in enumerate(VEHICLE_IDS)}
     
     # 连接MQTT
     mqtt_client = None
@@ -410,21 +457,20 @@ def main():
         while True:
             for vehicle_id, simulator in simulators.items():
                 # 生成数据
-                data = simulator.generate_complete_data()
+                data = simulator.fill_packet()
                 
                 # 发布到MQTT
                 if mqtt_client:
                     topic = f"{MQTT_TOPIC_PREFIX}/{vehicle_id}/data"
-                    payload = json.dumps(data, ensure_ascii=False)
-                    mqtt_client.publish(topic, payload)
+                    mqtt_client.publish(topic, simulator.packet_json())
                 
                 # 控制台输出（简化版）
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] {vehicle_id} | "
-                      f"状态:{data['state']:12s} | "
-                      f"速度:{data['vehicle']['vehicle_speed']:5.1f}km/h | "
-                      f"转速:{data['engine']['rpm']:4.0f}rpm | "
-                      f"扭矩:{data['engine']['torque']:5.1f}Nm | "
-                      f"电压:{data['battery']['voltage']:4.1f}V")
+                      f"状态:{simulator.current_state.name:12s} | "
+                      f"速度:{data['vehicle_vehicle_speed']:5.1f}km/h | "
+                      f"转速:{data['engine_rpm']:4.0f}rpm | "
+                      f"扭矩:{data['engine_torque']:5.1f}Nm | "
+                      f"电压:{data['battery_voltage']:4.1f}V")
             
             time.sleep(PUBLISH_INTERVAL)
             
@@ -10,15 +10,17 @@ T-BOX数据模拟器 - 支持告警测试场景
 - 实时进度显示
 """
 
-import json
 import time
 import random
 import math
 import argparse
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import numpy as np
 
+from telemetry_buffer import TelemetryBuffer
+from telemetry_packet import PacketSchema
+
 try:
     import paho.mqtt.client as mqtt
     MQTT_AVAILABLE = True
@@ -28,11 +30,46 @@ except ImportError:
     print("安装命令: pip install paho-mqtt")
 
 
+# 数据包布局（扁平结构，与告警规则中的指标名一致）
+PACKET_LAYOUT = {
+    'vehicle_id': str,
+    'timestamp': datetime,
+    'operation_hours': float,
+    # 发动机
+    'engine_rpm': float, 'engine_torque': float, 'engine_coolant_temp': float,
+    'engine_oil_pressure': float, 'engine_oil_temp': float, 'engine_fuel_rate': float,
+    'engine_air_intake_temp': float, 'engine_load': float, 'engine_throttle_position': float,
+    # 燃油
+    'fuel_level': float, 'fuel_pressure': float, 'fuel_temp': float,
+    # 电池
+    'battery_soc': float, 'battery_soh': float, 'battery_voltage': float, 'battery_current': float,
+    'battery_temp_avg': float, 'battery_temp_max': float, 'battery_temp_min': float,
+    'battery_cell_voltage_max': float, 'battery_cell_voltage_min': float,
+    'battery_cell_voltage_diff': float, 'battery_charge_cycles': int,
+    # 液压
+    'hydraulic_system_pressure': float, 'hydraulic_oil_temp': float, 'hydraulic_oil_level': float,
+    'hydraulic_pump_pressure': float, 'hydraulic_flow_rate': float,
+    # 变速箱
+    'transmission_oil_temp': float, 'transmission_oil_pressure': float, 'transmission_gear': int,
+    # 车辆状态
+    'vehicle_speed': float, 'wheel_speed_fl': float, 'wheel_speed_fr': float,
+    'wheel_speed_rl': float, 'wheel_speed_rr': float, 'steering_angle': float,
+    'brake_pressure': float,
+    # GNSS
+    'gnss_latitude': float, 'gnss_longitude': float, 'gnss_altitude': float, 'gnss_speed': float,
+    'gnss_heading': float, 'gnss_satellite_count': int, 'gnss_hdop': float, 'gnss_fix_quality': str,
+}
+PACKET_SCHEMA = PacketSchema(PACKET_LAYOUT)
+
+
 class TractorDataSimulatorWithAlerts:
     """拖拉机数据模拟器 - 支持告警测试场景"""
     
-    def __init__(self, vehicle_id: str, scenario: str = "normal"):
+    def __init__(self, vehicle_id: str, scenario: str = "normal",
+                 packet: Optional[np.void] = None):
         self.vehicle_id = vehicle_id
+        self.packet = packet if packet is not None else PACKET_SCHEMA.new_record()
+        self.packet['vehicle_id'] = vehicle_id.encode('utf-8')
         self.timestamp = time.time()
         self.operation_hours = 0
         self.battery_cycles = 0
@@ -148,7 +185,7 @@ class TractorDataSimulatorWithAlerts:
             return self._add_noise(overrides[metric_name], 0.02)
         return base_value
     
-    def generate_engine_data(self) -> Dict[str, Any]:
+    def fill_engine_data(self):
         """生成发动机数据"""
         base_rpm = 1800 + 400 * math.sin(self.timestamp / 100)
         base_torque = 350 + 50 * math.sin(self.timestamp / 80)
@@ -162,30 +199,28 @@ class TractorDataSimulatorWithAlerts:
         oil_pressure = self._apply_scenario_override("engine_oil_pressure", base_oil_pressure)
         oil_temp = self._apply_scenario_override("engine_oil_temp", base_oil_temp)
         
-        return {
-            'engine_rpm': self._add_noise(base_rpm, 0.03),
-            'engine_torque': self._add_noise(base_torque, 0.05),
-            'engine_coolant_temp': self._add_noise(coolant_temp, 0.02),
-            'engine_oil_pressure': self._add_noise(oil_pressure, 0.03),
-            'engine_oil_temp': self._add_noise(oil_temp, 0.02),
-            'engine_fuel_rate': self._add_noise(base_fuel_rate, 0.04),
-            'engine_air_intake_temp': self._add_noise(30 + 15 * math.sin(self.timestamp / 300), 0.03),
-            'engine_load': self._add_noise(60 + 20 * math.sin(self.timestamp / 150), 0.05),
-            'engine_throttle_position': self._add_noise(50 + 30 * math.sin(self.timestamp / 100), 0.03),
-        }
+        p = self.packet
+        p['engine_rpm'] = self._add_noise(base_rpm, 0.03)
+        p['engine_torque'] = self._add_noise(base_torque, 0.05)
+        p['engine_coolant_temp'] = self._add_noise(coolant_temp, 0.02)
+        p['engine_oil_pressure'] = self._add_noise(oil_pressure, 0.03)
+        p['engine_oil_temp'] = self._add_noise(oil_temp, 0.02)
+        p['engine_fuel_rate'] = self._add_noise(base_fuel_rate, 0.04)
+        p['engine_air_intake_temp'] = self._add_noise(30 + 15 * math.sin(self.timestamp / 300), 0.03)
+        p['engine_load'] = self._add_noise(60 + 20 * math.sin(self.timestamp / 150), 0.05)
+        p['engine_throttle_position'] = self._add_noise(50 + 30 * math.sin(self.timestamp / 100), 0.03)
     
-    def generate_fuel_data(self) -> Dict[str, Any]:
+    def fill_fuel_data(self):
         """生成燃油系统数据"""
         base_level = 50 + 30 * math.sin(self.timestamp / 1000)  # 缓慢变化
         fuel_level = self._apply_scenario_override("fuel_level", base_level)
         
-        return {
-            'fuel_level': max(0, min(100, self._add_noise(fuel_level, 0.01))),
-            'fuel_pressure': self._add_noise(3.5 + 0.5 * math.sin(self.timestamp / 150), 0.03),
-            'fuel_temp': self._add_noise(25 + 10 * math.sin(self.timestamp / 300), 0.02),
-        }
+        p = self.packet
+        p['fuel_level'] = max(0, min(100, self._add_noise(fuel_level, 0.01)))
+        p['fuel_pressure'] = self._add_noise(3.5 + 0.5 * math.sin(self.timestamp / 150), 0.03)
+        p['fuel_temp'] = self._add_noise(25 + 10 * math.sin(self.timestamp / 300), 0.02)
     
-    def generate_battery_data(self) -> Dict[str, Any]:
+    def fill_battery_data(self):
         """生成电池系统数据"""
         base_soc = 50 + 30 * math.sin(self.timestamp / 500)
         soc = self._apply_scenario_override("battery_soc", base_soc)
@@ -196,73 +231,68 @@ class TractorDataSimulatorWithAlerts:
         base_current = 50 + 30 * math.sin(self.timestamp / 100)
         voltage = 600 + 50 * (soc / 100)
         
-        return {
-            'battery_soc': max(0, min(100, soc)),
-            'battery_soh': soh,
-            'battery_voltage': self._add_noise(voltage, 0.01),
-            'battery_current': self._add_noise(base_current, 0.05),
-            'battery_temp_avg': self._add_noise(32 + 8 * abs(base_current) / 80, 0.03),
-            'battery_temp_max': self._add_noise(35 + 10 * abs(base_current) / 80, 0.03),
-            'battery_temp_min': self._add_noise(30 + 6 * abs(base_current) / 80, 0.03),
-            'battery_cell_voltage_max': self._add_noise(3.7, 0.005),
-            'battery_cell_voltage_min': self._add_noise(3.6, 0.005),
-            'battery_cell_voltage_diff': self._add_noise(0.05, 0.1),
-            'battery_charge_cycles': self.battery_cycles,
-        }
+        p = self.packet
+        p['battery_soc'] = max(0, min(100, soc))
+        p['battery_soh'] = soh
+        p['battery_voltage'] = self._add_noise(voltage, 0.01)
+        p['battery_current'] = self._add_noise(base_current, 0.05)
+        p['battery_temp_avg'] = self._add_noise(32 + 8 * abs(base_current) / 80, 0.03)
+        p['battery_temp_max'] = self._add_noise(35 + 10 * abs(base_current) / 80, 0.03)
+        p['battery_temp_min'] = self._add_noise(30 + 6 * abs(base_current) / 80, 0.03)
+        p['battery_cell_voltage_max'] = self._add_noise(3.7, 0.005)
+        p['battery_cell_voltage_min'] = self._add_noise(3.6, 0.005)
+        p['battery_cell_voltage_diff'] = self._add_noise(0.05, 0.1)
+        p['battery_charge_cycles'] = self.battery_cycles
     
-    def generate_hydraulic_data(self) -> Dict[str, Any]:
+    def fill_hydraulic_data(self):
         """生成液压系统数据"""
         base_pressure = 180 + 20 * math.sin(self.timestamp / 120)
         pressure = self._apply_scenario_override("hydraulic_system_pressure", base_pressure)
         
-        return {
-            'hydraulic_system_pressure': self._add_noise(pressure, 0.04),
-            'hydraulic_oil_temp': self._add_noise(55 + 15 * math.sin(self.timestamp / 300), 0.03),
-            'hydraulic_oil_level': self._add_noise(85, 0.02),
-            'hydraulic_pump_pressure': self._add_noise(pressure * 0.9, 0.04),
-            'hydraulic_flow_rate': self._add_noise(40 + 10 * abs(math.sin(self.timestamp / 150)), 0.05),
-        }
+        p = self.packet
+        p['hydraulic_system_pressure'] = self._add_noise(pressure, 0.04)
+        p['hydraulic_oil_temp'] = self._add_noise(55 + 15 * math.sin(self.timestamp / 300), 0.03)
+        p['hydraulic_oil_level'] = self._add_noise(85, 0.02)
+        p['hydraulic_pump_pressure'] = self._add_noise(pressure * 0.9, 0.04)
+        p['hydraulic_flow_rate'] = self._add_noise(40 + 10 * abs(math.sin(self.timestamp / 150)), 0.05)
     
-    def generate_transmission_data(self) -> Dict[str, Any]:
+    def fill_transmission_data(self):
         """生成变速箱数据"""
         base_temp = 70 + 15 * math.sin(self.timestamp / 250)
         temp = self._apply_scenario_override("transmission_oil_temp", base_temp)
         
-        return {
-            'transmission_oil_temp': self._add_noise(temp, 0.03),
-            'transmission_oil_pressure': self._add_noise(6 + 2 * math.sin(self.timestamp / 180), 0.04),
-            'transmission_gear': random.choice([1, 2, 3, 4]),
-        }
+        p = self.packet
+        p['transmission_oil_temp'] = self._add_noise(temp, 0.03)
+        p['transmission_oil_pressure'] = self._add_noise(6 + 2 * math.sin(self.timestamp / 180), 0.04)
+        p['transmission_gear'] = random.choice([1, 2, 3, 4])
     
-    def generate_vehicle_state(self) -> Dict[str, Any]:
+    def fill_vehicle_state(self):
         """生成车辆状态数据"""
         base_speed = 8 + 4 * abs(math.sin(self.timestamp / 150))
         
-        return {
-            'vehicle_speed': self._add_noise(base_speed, 0.05),
-            'wheel_speed_fl': self._add_noise(base_speed * 1.02, 0.03),
-            'wheel_speed_fr': self._add_noise(base_speed * 1.01, 0.03),
-            'wheel_speed_rl': self._add_noise(base_speed * 0.99, 0.03),
-            'wheel_speed_rr': self._add_noise(base_speed * 0.98, 0.03),
-            'steering_angle': self._add_noise(15 * math.sin(self.timestamp / 200), 0.05),
-            'brake_pressure': self._add_noise(2 + 3 * abs(math.sin(self.timestamp / 180)), 0.05),
-        }
+        p = self.packet
+        p['vehicle_speed'] = self._add_noise(base_speed, 0.05)
+        p['wheel_speed_fl'] = self._add_noise(base_speed * 1.02, 0.03)
+        p['wheel_speed_fr'] = self._add_noise(base_speed * 1.01, 0.03)
+        p['wheel_speed_rl'] = self._add_noise(base_speed * 0.99, 0.03)
+        p['wheel_speed_rr'] = self._add_noise(base_speed * 0.98, 0.03)
+        p['steering_angle'] = self._add_noise(15 * math.sin(self.timestamp / 200), 0.05)
+        p['brake_pressure'] = self._add_noise(2 + 3 * abs(math.sin(self.timestamp / 180)), 0.05)
     
-    def generate_gnss_data(self) -> Dict[str, Any]:
+    def fill_gnss_data(self):
         """生成GNSS定位数据"""
         base_lat = 39.9042 + 0.001 * math.sin(self.timestamp / 500)
         base_lon = 116.4074 + 0.001 * math.cos(self.timestamp / 500)
         
-        return {
-            'gnss_latitude': self._add_noise(base_lat, 0.00001),
-            'gnss_longitude': self._add_noise(base_lon, 0.00001),
-            'gnss_altitude': self._add_noise(50, 0.01),
-            'gnss_speed': self._add_noise(8, 0.05),
-            'gnss_heading': self._add_noise(90 + 45 * math.sin(self.timestamp / 300), 0.02),
-            'gnss_satellite_count': random.randint(12, 20),
-            'gnss_hdop': self._add_noise(0.8, 0.1),
-            'gnss_fix_quality': random.choice(['fixed', 'float']),
-        }
+        p = self.packet
+        p['gnss_latitude'] = self._add_noise(base_lat, 0.00001)
+        p['gnss_longitude'] = self._add_noise(base_lon, 0.00001)
+        p['gnss_altitude'] = self._add_noise(50, 0.01)
+        p['gnss_speed'] = self._add_noise(8, 0.05)
+        p['gnss_heading'] = self._add_noise(90 + 45 * math.sin(self.timestamp / 300), 0.02)
+        p['gnss_satellite_count'] = random.randint(12, 20)
+        p['gnss_hdop'] = self._add_noise(0.8, 0.1)
+        p['gnss_fix_quality'] = random.choice(['fixed', 'float'])
     
     def update_state(self, delta_time: float = 1.0):
         """更新模拟器状态"""
@@ -272,38 +302,44 @@ class TractorDataSimulatorWithAlerts:
         if random.random() < 0.0001:
             self.battery_cycles += 1
     
-    def generate_complete_data_packet(self) -> Dict[str, Any]:
-        """生成完整的数据包"""
+    def fill_packet(self) -> np.void:
+        """生成完整的数据包（原地写入self.packet并返回该记录）"""
         self.message_count += 1
         
-        data = {
-            'vehicle_id': self.vehicle_id,
-            'timestamp': datetime.now().isoformat(),
-            'operation_hours': round(self.operation_hours, 2),
-        }
+        p = self.packet
+        p['timestamp'] = time.time()
+        p['operation_hours'] = round(self.operation_hours, 2)
         
-        # 合并所有子系统数据到顶层
-        data.update(self.generate_engine_data())
-        data.update(self.generate_fuel_data())
-        data.update(self.generate_battery_data())
-        data.update(self.generate_hydraulic_data())
-        data.update(self.generate_transmission_data())
-        data.update(self.generate_vehicle_state())
-        data.update(self.generate_gnss_data())
-        
-        return data
+        # 所有子系统数据都在顶层
+        self.fill_engine_data()
+        self.fill_fuel_data()
+        self.fill_battery_data()
+        self.fill_hydraulic_data()
+        self.fill_transmission_data()
+        self.fill_vehicle_state()
+        self.fill_gnss_data()
+        return p
+    
+    def packet_json(self) -> str:
+        """当前数据包的JSON（直接由记录序列化）"""
+        return PACKET_SCHEMA.to_json(self.packet)
     
-    def print_status(self, data: Dict[str, Any]):
-        """打印当前状态"""
+    def generate_complete_data_packet(self) -> Dict[str, Any]:
+        """生成完整的数据包（dict形式，兼容旧调用方）"""
+        self.fill_packet()
+        return PACKET_SCHEMA.to_dict(self.packet)
+    
+    def print_status(self, data):
+        """打印当前状态（data为数据包记录）"""
         elapsed = time.time() - self.scenario_start_time
         timestamp = datetime.now().strftime("%H:%M:%S")
         
         # 提取关键指标
-        temp = data.get('engine_coolant_temp', 0)
-        oil = data.get('engine_oil_pressure', 0)
-        fuel = data.get('fuel_level', 0)
-        batt = data.get('battery_soc', 0)
-        speed = data.get('vehicle_speed', 0)
+        temp = data['engine_coolant_temp']
+        oil = data['engine_oil_pressure']
+        fuel = data['fuel_level']
+        batt = data['battery_soc']
+        speed = data['vehicle_speed']
         
         print(f"[{timestamp}] 📤 #{self.message_count:04d} | "
               f"Temp={temp:.1f}°C | Oil={oil:.1f}bar | Fuel={fuel:.1f}% | "
@@ -327,12 +363,12 @@ def run_normal_mode(vehicle_id: str, mqtt_broker: str, mqtt_port: int, interval:
     
     try:
         while True:
-            data = simulator.generate_complete_data_packet()
+            data = simulator.fill_packet()
             simulator.print_status(data)
             
             if client:
                 topic = f"tractor/telemetry"
-                client.publish(topic, json.dumps(data))
+                client.publish(topic, simulator.packet_json())
             
             simulator.update_state(interval)
             time.sleep(interval)
@@ -344,8 +380,17 @@ def run_normal_mode(vehicle_id: str, mqtt_broker: str, mqtt_port: int, interval:
 
 
 def run_scenario_mode(vehicle_id: str, mqtt_broker: str, mqtt_port: int, 
-                      interval: float, scenario: str):
-    """运行特定场景模式"""
+                      interval: float, scenario: str,
+                      buffer: Optional[TelemetryBuffer] = None) -> Optional[TelemetryBuffer]:
+    """
+    运行特定场景模式
+    
+    Args:
+        buffer: 收集场景数据的列式缓冲区；为None时不收集（长时间运行不会累积内存）
+    
+    Returns:
+        传入的缓冲区（含场景期间生成的全部数据，可离线回放给分析引擎），未传入时为None
+    """
     simulator = TractorDataSimulatorWithAlerts(vehicle_id, scenario)
     
     if MQTT_AVAILABLE:
@@ -366,12 +411,14 @@ def run_scenario_mode(vehicle_id: str, mqtt_broker: str, mqtt_port: int,
     
     try:
         while True:
-            data = simulator.generate_complete_data_packet()
+            data = simulator.fill_packet()
             simulator.print_status(data)
+            if buffer is not None:
+                buffer.append_record(data, PACKET_SCHEMA)
             
             if client:
                 topic = f"tractor/telemetry"
-                client.publish(topic, json.dumps(data))
+                client.publish(topic, simulator.packet_json())
             
             simulator.update_state(interval)
             time.sleep(interval)
@@ -386,6 +433,7 @@ def run_scenario_mode(vehicle_id: str, mqtt_broker: str, mqtt_port: int,
     finally:
         if client:
             client.disconnect()
+    return buffer
 
 
 def main():
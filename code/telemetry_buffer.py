@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+列式(struct-of-arrays)遥测缓冲区
+T-BOX数据包是多层嵌套的dict，整包保存时每个样本要占用几KB的Python对象，
+分析前还要再逐包遍历重建列。这里在采集时就把数据包扁平化写入按通道预分配的
+NumPy数组（一个int64毫秒时间戳数组 + 每个数值通道一个float64数组，容量按倍数增长），
+每个样本只占 8 × (通道数 + 1) 字节：
+
+- 通道名与桥接服务写入VictoriaMetrics的指标名一致（嵌套键用下划线连接，如engine_coolant_temp）
+- 新出现的通道（如某个故障模式被激活）自动增加，之前的样本为NaN
+- to_frame直接以数组视图构造DataFrame，交给分析引擎和预测器，不复制数据
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 不作为通道的字段
+SKIP_FIELDS = ('vehicle_id', 'timestamp')
+
+
+def parse_timestamp_ms(value: Any) -> int:
+    """
+    数据包时间戳转换为毫秒时间戳
+
+    Args:
+        value: ISO格式字符串、datetime或秒级数值时间戳（None为当前时间）
+    """
+    if value is None:
+        return int(datetime.now().timestamp() * 1000)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(float(value) * 1000)
+
+
+def iter_numeric_fields(data: Dict[str, Any], prefix: str = '') -> Iterator[Tuple[str, float]]:
+    """
+    遍历嵌套数据包中的数值字段（字符串、列表、None跳过；布尔值记为0/1）
+
+    Yields:
+        (扁平化通道名, 数值)
+    """
+    for key, value in data.items():
+        if not prefix and key in SKIP_FIELDS:
+            continue
+        name = f"{prefix}_{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from iter_numeric_fields(value, name)
+        elif isinstance(value, (int, float, np.number)):
+            yield name, float(value)
+
+
+class TelemetryBuffer:
+    """单辆车的列式遥测缓冲区（按时间先后追加）"""
+
+    def __init__(self, vehicle_id: Optional[str] = None, capacity: int = 1024,
+                 channels: Optional[Iterable[str]] = None, dtype=np.float64):
+        """
+        Args:
+            vehicle_id: 车辆ID（为None时取第一个数据包中的vehicle_id）
+            capacity: 初始容量（样本数）
+            channels: 预先创建的通道（其余通道在首次出现时创建）
+            dtype: 通道数组的数据类型（float32可再减半内存）
+        """
+        self.vehicle_id = vehicle_id
+        self.dtype = np.dtype(dtype)
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        self._timestamps = np.empty(self.capacity, dtype=np.int64)
+        self._columns: Dict[str, np.ndarray] = {}
+        for name in channels or ():
+            self._add_channel(name)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self._columns
+
+    @property
+    def channels(self) -> List[str]:
+        """通道名（按首次出现顺序）"""
+        return list(self._columns)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """毫秒时间戳（视图）"""
+        return self._timestamps[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        """已分配的数组字节数"""
+        return self._timestamps.nbytes + sum(c.nbytes for c in self._columns.values())
+
+    def column(self, channel: str) -> np.ndarray:
+        """单个通道的样本值（视图，缺失样本为NaN）"""
+        return self._columns[channel][:self.size]
+
+    def _add_channel(self, name: str) -> np.ndarray:
+        # 以NaN预填充：没有写入的样本（该通道在这些数据包中缺失）自然为NaN
+        column = np.full(self.capacity, np.nan, dtype=self.dtype)
+        self._columns[name] = column
+        return column
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, 2 * self.capacity)
+        timestamps = np.empty(capacity, dtype=np.int64)
+        timestamps[:self.size] = self._timestamps[:self.size]
+        self._timestamps = timestamps
+        for name, column in self._columns.items():
+            grown = np.full(capacity, np.nan, dtype=self.dtype)
+            grown[:self.size] = column[:self.size]
+            self._columns[name] = grown
+        self.capacity = capacity
+
+    def append(self, timestamp_ms: int, metrics: Dict[str, float]):
+        """
+        追加一个样本
+
+        Args:
+            timestamp_ms: 毫秒时间戳
+            metrics: {通道名: 数值}
+        """
+        self._reserve(1)
+        row = self.size
+        self._timestamps[row] = timestamp_ms
+        columns = self._columns
+        for name, value in metrics.items():
+            column = columns.get(name)
+            if column is None:
+                column = self._add_channel(name)
+            column[row] = value
+        self.size += 1
+
+    def append_packet(self, packet: Dict[str, Any]):
+        """追加一个T-BOX数据包（嵌套字段扁平化后逐通道写入，不保留数据包本身）"""
+        if self.vehicle_id is None:
+            self.vehicle_id = packet.get('vehicle_id')
+        self._reserve(1)
+        row = self.size
+        self._timestamps[row] = parse_timestamp_ms(packet.get('timestamp'))
+        columns = self._columns
+        for name, value in iter_numeric_fields(packet):
+            column = columns.get(name)
+            if column is None:
+                column = self._add_channel(name)
+            column[row] = value
+        self.size += 1
+
+    def append_record(self, record: np.void, schema):
+        """
+        追加一个结构化数据包记录（telemetry_packet.PacketSchema布局），直接按字段写入各通道
+
+        Args:
+            record: 数据包记录
+            schema: 记录对应的PacketSchema
+        """
+        if self.vehicle_id is None:
+            self.vehicle_id = record['vehicle_id'].decode('utf-8', 'ignore')
+        self._reserve(1)
+        row = self.size
+        self._timestamps[row] = int(record['timestamp'] * 1000)
+        items = record.item()
+        columns = self._columns
+        for name, index in schema.numeric_slots:
+            column = columns.get(name)
+            if column is None:
+                column = self._add_channel(name)
+            column[row] = items[index]
+        self.size += 1
+
+    def extend_packets(self, packets: Iterable[Dict[str, Any]]) -> 'TelemetryBuffer':
+        """追加多个数据包"""
+        for packet in packets:
+            self.append_packet(packet)
+        return self
+
+    def rows(self, channels: Optional[Iterable[str]] = None) -> Iterator[Tuple[int, Dict[str, float]]]:
+        """
+        逐样本遍历（用于写入VictoriaMetrics等需要按行处理的场景，NaN跳过）
+
+        Yields:
+            (毫秒时间戳, {通道名: 数值})
+        """
+        names = list(channels) if channels is not None else self.channels
+        columns = [self.column(name) for name in names]
+        for row, timestamp_ms in enumerate(self.timestamps.tolist()):
+            metrics = {}
+            for name, column in zip(names, columns):
+                value = column[row]
+                if value == value:
+                    metrics[name] = float(value)
+            yield timestamp_ms, metrics
+
+    def to_frame(self, column_map: Optional[Dict[str, str]] = None,
+                 defaults: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+        """
+        转换为分析用宽表（timestamp列 + 每个通道一列，共享底层数组）
+
+        Args:
+            column_map: 通道名 -> 列名（不在映射中的通道忽略；为None时保留全部通道）
+            defaults: 列名 -> 常数值，缓冲区中没有该列时以常数补齐
+
+        Returns:
+            DataFrame
+        """
+        if column_map is None:
+            column_map = {name: name for name in self._columns}
+        data = {'timestamp': pd.DatetimeIndex(self.timestamps.view('datetime64[ms]'))}
+        for channel, name in column_map.items():
+            if channel in self._columns and name not in data:
+                data[name] = self.column(channel)
+        for name, value in (defaults or {}).items():
+            if name not in data:
+                data[name] = np.full(self.size, value, dtype=self.dtype)
+        return pd.DataFrame(data, copy=False)
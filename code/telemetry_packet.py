@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+紧凑的T-BOX数据包表示
+模拟器原来每个数据包都要新建一棵嵌套dict（几十到上百个Python float、str和dict对象），
+再交给json.dumps，大规模车队模拟时对象分配成了主要开销。这里用NumPy结构化数组表示数据包：
+
+- PacketSchema: 由数据包布局（与JSON结构相同的嵌套dict，叶子为字段类型）生成结构化dtype，
+  并预先编译JSON、Prometheus文本模板
+- 一个数据包就是结构化数组中的一行（np.void记录，是数组的视图），模拟器原地写入字段；
+  车队模拟时所有车辆共用一个数组，每辆车一行
+- 序列化（JSON / 二进制 / Prometheus文本）直接读取记录，不再构造中间dict
+
+字段名为嵌套键用下划线连接后的扁平名（如engine_coolant_temp），
+与桥接服务写入VictoriaMetrics的指标名一致。
+"""
+
+import json
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 字符串字段的定长字节数（UTF-8编码后超出部分截断）
+STRING_BYTES = 32
+
+# Prometheus文本中不输出的字段（与桥接服务一致）
+PROMETHEUS_SKIP_FIELDS = ('vehicle_id', 'timestamp', 'operation_hours')
+
+_DTYPES = {float: 'f8', int: 'i8', bool: '?', str: f'S{STRING_BYTES}', datetime: 'f8'}
+_NUMERIC_KINDS = (float, int, bool)
+
+# 模板中数值槽位上的非有限值（repr为nan/inf），json.dumps写作NaN/Infinity
+_NON_FINITE = re.compile(r'(?<=": )(-?)(nan|inf)(?=[,}])')
+_NON_FINITE_JSON = {'nan': 'NaN', 'inf': 'Infinity'}
+
+
+class PacketSchema:
+    """数据包字段布局：结构化dtype + 预编译的序列化模板"""
+
+    def __init__(self, layout: Dict[str, Any], tz: Optional[timezone] = None):
+        """
+        Args:
+            layout: 与JSON数据包结构相同的嵌套dict，叶子为字段类型：
+                    float / int / bool / str / datetime（以秒级时间戳存储，序列化为ISO格式），
+                    list / dict 表示长度不定的附加字段（不存入数组，序列化时由extras提供）
+            tz: datetime字段序列化时使用的时区（None为本地时间，不带时区后缀）
+        """
+        self.tz = tz
+        self.fields: List[Tuple[str, Any]] = []
+        self.extra_fields: List[str] = []
+        self._json_slots: List[Tuple[str, Any]] = []
+        json_template = self._compile(layout, ())
+        names = [name for name, _ in self.fields]
+        if len(set(names)) != len(names):
+            raise ValueError("数据包布局中存在重复的扁平字段名")
+
+        # 存储顺序：float字段在前且连续，可以整体取为二维float视图做向量化写入
+        ordered = ([f for f in self.fields if f[1] is float]
+                   + [f for f in self.fields if f[1] is not float])
+        self.dtype = np.dtype([(name, _DTYPES[kind]) for name, kind in ordered])
+        self.kinds = dict(self.fields)
+        self.float_fields = [name for name, kind in ordered if kind is float]
+        self.numeric_fields = [name for name, kind in self.fields if kind in _NUMERIC_KINDS]
+
+        # JSON模板的占位符按布局顺序排列；记录item()按存储顺序，需要重排
+        storage_index = {name: i for i, (name, _) in enumerate(ordered)}
+        # (字段名, 在record.item()中的位置)，用于按通道写入TelemetryBuffer
+        self.numeric_slots = [(name, storage_index[name]) for name in self.numeric_fields]
+        self._json_template = json_template.replace('%', '%%').replace('\x00', '%s')
+        self._json_order = [storage_index[name] if kind is not None else name
+                            for name, kind in self._json_slots]
+        self._json_converters = self._converters()
+
+        # Prometheus模板：{0}=vehicle_id，{1}=毫秒时间戳，其余为各数值字段
+        prometheus_fields = [name for name in self.numeric_fields
+                             if name not in PROMETHEUS_SKIP_FIELDS]
+        self._prometheus_index = [storage_index[name] for name in prometheus_fields]
+        self._prometheus_template = '\n'.join(
+            f'{name}{{{{vehicle_id="{{0}}"}}}} {{{i + 2}{":d" if self.kinds[name] is bool else ""}}} {{1}}'
+            for i, name in enumerate(prometheus_fields)
+        )
+
+    def _compile(self, layout: Dict[str, Any], path: Tuple[str, ...]) -> str:
+        """递归生成JSON模板（\\x00为字段占位符），同时登记字段"""
+        parts = []
+        for key, kind in layout.items():
+            name = '_'.join(path + (key,))
+            if isinstance(kind, dict):
+                value = self._compile(kind, path + (key,))
+            elif kind in (list, dict):
+                self.extra_fields.append(name)
+                self._json_slots.append((name, None))
+                value = '\x00'
+            elif kind in _DTYPES:
+                self.fields.append((name, kind))
+                self._json_slots.append((name, kind))
+                value = '\x00'
+            else:
+                raise ValueError(f"不支持的字段类型: {name}={kind!r}")
+            parts.append(f'{json.dumps(key, ensure_ascii=False)}: {value}')
+        return '{' + ', '.join(parts) + '}'
+
+    def _converters(self):
+        """JSON模板中需要转换的槽位（字符串、布尔、时间）"""
+        tz = self.tz
+
+        def string(value):
+            return json.dumps(value.decode('utf-8', 'ignore'), ensure_ascii=False)
+
+        def boolean(value):
+            return 'true' if value else 'false'
+
+        def timestamp(value):
+            return '"' + datetime.fromtimestamp(value, tz).isoformat() + '"'
+
+        converters = []
+        for slot, (name, kind) in enumerate(self._json_slots):
+            if kind is str:
+                converters.append((slot, string))
+            elif kind is bool:
+                converters.append((slot, boolean))
+            elif kind is datetime:
+                converters.append((slot, timestamp))
+        return converters
+
+    # ------------------------------------------------------------------ 存储
+
+    def new_array(self, size: int = 1) -> np.ndarray:
+        """分配size个数据包（一行一个，车队模拟时每辆车一行）"""
+        return np.zeros(size, dtype=self.dtype)
+
+    def new_record(self) -> np.void:
+        """分配单个数据包记录"""
+        return self.new_array(1)[0]
+
+    def float_view(self, packets: np.ndarray) -> np.ndarray:
+        """
+        全部float字段的二维视图（行=数据包，列=float_fields），可整体向量化写入
+
+        Args:
+            packets: new_array分配的结构化数组
+        """
+        offset = self.dtype.fields[self.float_fields[0]][1] if self.float_fields else 0
+        return np.ndarray((len(packets), len(self.float_fields)), dtype=np.float64,
+                          buffer=packets, offset=offset, strides=(self.dtype.itemsize, 8))
+
+    def float_index(self, names) -> np.ndarray:
+        """字段名在float_view列中的位置"""
+        position = {name: i for i, name in enumerate(self.float_fields)}
+        return np.array([position[name] for name in names], dtype=np.intp)
+
+    # ------------------------------------------------------------------ 序列化
+
+    def to_json(self, record: np.void, extras: Optional[Dict[str, Any]] = None) -> str:
+        """
+        序列化为与原嵌套dict相同结构的JSON
+
+        Args:
+            record: 数据包记录
+            extras: 长度不定的附加字段（如故障日志列表），缺省时list为[]、dict为{}
+        """
+        items = record.item()
+        values = [items[i] if isinstance(i, int) else None for i in self._json_order]
+        for slot, convert in self._json_converters:
+            values[slot] = convert(values[slot])
+        if self.extra_fields:
+            extras = extras or {}
+            for slot, (name, kind) in enumerate(self._json_slots):
+                if kind is None:
+                    values[slot] = json.dumps(extras.get(name, []), ensure_ascii=False)
+        text = self._json_template % tuple(values)
+        if 'nan' in text or 'inf' in text:
+            text = _NON_FINITE.sub(lambda m: m.group(1) + _NON_FINITE_JSON[m.group(2)], text)
+        return text
+
+    def to_dict(self, record: np.void, extras: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """还原为嵌套dict（兼容按dict读取数据包的旧代码）"""
+        return json.loads(self.to_json(record, extras))
+
+    def to_bytes(self, packets) -> bytes:
+        """二进制序列化：每个数据包为dtype.itemsize字节的定长记录（不含extras）"""
+        return packets.tobytes()
+
+    def from_bytes(self, payload: bytes) -> np.ndarray:
+        """二进制反序列化为结构化数组（只读视图，不复制）"""
+        return np.frombuffer(payload, dtype=self.dtype)
+
+    def to_prometheus(self, record: np.void, timestamp_ms: Optional[int] = None) -> str:
+        """
+        序列化为Prometheus文本格式（数值字段，标签为vehicle_id）
+
+        Args:
+            record: 数据包记录
+            timestamp_ms: 毫秒时间戳（默认取记录的timestamp字段）
+        """
+        items = record.item()
+        if timestamp_ms is None:
+            timestamp_ms = int(record['timestamp'] * 1000)
+        vehicle_id = record['vehicle_id'].decode('utf-8', 'ignore')
+        return self._prometheus_template.format(
+            vehicle_id, timestamp_ms, *[items[i] for i in self._prometheus_index])
+
+    def to_prometheus_batch(self, packets: np.ndarray) -> str:
+        """整个车队数组序列化为一段Prometheus文本（可直接交给import_prometheus）"""
+        return '\n'.join(self.to_prometheus(record) for record in packets)
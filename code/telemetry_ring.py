@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+遥测共享内存环形缓冲区
+桥接服务把每个数据包同时写入一个内存映射文件（建议放在/dev/shm），
+同机的分析、告警、API进程直接映射同一文件读取最近几分钟的车队数据，
+不经过 vminsert → vmstorage → vmselect 的往返，也没有HTTP和复制。
+
+文件布局（固定大小，各区按64字节对齐）:
+    头部        magic、布局版本、容量参数、已注册车辆数/指标数、注册表版本号
+    车辆名表    max_vehicles × 64字节（UTF-8，超长名字见ring_name）
+    指标名表    max_metrics × 64字节
+    序列锁      每辆车一个uint64（奇数表示正在写入）
+    写入计数    每辆车一个int64（累计写入的数据包数）
+    时间戳      int64[max_vehicles, capacity]（毫秒）
+    数值        float64[max_vehicles, max_metrics, capacity]（缺失为NaN）
+
+并发模型：单写者多读者。写者写数据前把该车的序列号加1（变为奇数），写完再加1；
+读者读之前和读之后各取一次序列号，相同且为偶数才说明读到的是一致的快照，
+否则重试（seqlock）。零拷贝读取返回环形区的视图和读取时的序列号，调用方用完后
+调用is_valid确认期间没有被覆盖。依赖x86等强内存序平台上store/load不乱序。
+写者重启会原子替换整个文件，读者在refresh时按inode发现替换并重新映射。
+
+用法:
+    python telemetry_ring.py --path /dev/shm/tractor_telemetry.ring --watch 5
+"""
+
+import os
+import mmap
+import hashlib
+import time
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RING_PATH = '/dev/shm/tractor_telemetry.ring'
+
+MAGIC = int.from_bytes(b'TRING001', 'little')
+LAYOUT_VERSION = 1
+NAME_BYTES = 64
+HEADER_BYTES = 4096
+
+# 头部字段（uint64数组下标）
+_H_MAGIC, _H_VERSION, _H_MAX_VEHICLES, _H_MAX_METRICS, _H_CAPACITY, \
+    _H_N_VEHICLES, _H_N_METRICS, _H_REGISTRY_SEQ = range(8)
+
+
+def ring_name(name: str) -> str:
+    """
+    名字在名表中的存储形式：超过NAME_BYTES字节的名字在字符边界处截断并附加哈希后缀
+    （直接按字节截断可能切开多字节字符，不同的长名字也会截成同一个）
+    """
+    encoded = name.encode('utf-8')
+    if len(encoded) <= NAME_BYTES:
+        return name
+    digest = hashlib.blake2b(encoded, digest_size=4).hexdigest()
+    prefix = encoded[:NAME_BYTES - len(digest) - 1].decode('utf-8', errors='ignore')
+    return f"{prefix}~{digest}"
+
+
+def _backoff(attempt: int):
+    """重试等待：先自旋，之后让出CPU（写者可能在写入中途被调度出去）"""
+    if attempt >= 8:
+        time.sleep(0 if attempt < 64 else 0.0005)
+
+
+def _align(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _layout(max_vehicles: int, max_metrics: int, capacity: int) -> Dict[str, Tuple[int, tuple, str]]:
+    """各区的(偏移, 形状, dtype)，以及文件总大小"""
+    sections = [
+        ('vehicle_names', (max_vehicles,), f'S{NAME_BYTES}'),
+        ('metric_names', (max_metrics,), f'S{NAME_BYTES}'),
+        ('seq', (max_vehicles,), 'u8'),
+        ('head', (max_vehicles,), 'i8'),
+        ('timestamps', (max_vehicles, capacity), 'i8'),
+        ('values', (max_vehicles, max_metrics, capacity), 'f8'),
+    ]
+    layout, offset = {}, HEADER_BYTES
+    for name, shape, dtype in sections:
+        offset = _align(offset)
+        layout[name] = (offset, shape, dtype)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    layout['size'] = (_align(offset), (), '')
+    return layout
+
+
+class _RingFile:
+    """映射环形缓冲区文件并建立各区的numpy视图"""
+
+    def __init__(self, path: str, writable: bool):
+        self.path = path
+        self._file = open(path, 'r+b' if writable else 'rb')
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=access)
+        stat = os.fstat(self._file.fileno())
+        # 文件标识：写者重建文件（os.replace）后路径指向新的inode
+        self.identity = (stat.st_dev, stat.st_ino)
+
+        self.header = np.ndarray((8,), dtype='u8', buffer=self._mmap)
+        if int(self.header[_H_MAGIC]) != MAGIC or int(self.header[_H_VERSION]) != LAYOUT_VERSION:
+            self.close()
+            raise ValueError(f"不是有效的遥测环形缓冲区文件: {path}")
+
+        self.max_vehicles = int(self.header[_H_MAX_VEHICLES])
+        self.max_metrics = int(self.header[_H_MAX_METRICS])
+        self.capacity = int(self.header[_H_CAPACITY])
+        layout = _layout(self.max_vehicles, self.max_metrics, self.capacity)
+        for name, (offset, shape, dtype) in layout.items():
+            if name != 'size':
+                setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=self._mmap, offset=offset))
+
+    def close(self):
+        # 先释放所有视图再关闭映射
+        for name in ('header', 'vehicle_names', 'metric_names', 'seq', 'head', 'timestamps', 'values'):
+            self.__dict__.pop(name, None)
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+
+class TelemetryRingWriter:
+    """环形缓冲区写者（每个文件只能有一个写者，通常是桥接服务）"""
+
+    def __init__(self, path: str = DEFAULT_RING_PATH, max_vehicles: int = 64,
+                 max_metrics: int = 128, capacity: int = 600):
+        """
+        创建（或重建）环形缓冲区文件
+
+        Args:
+            path: 文件路径（/dev/shm下即为共享内存）
+            max_vehicles: 最多车辆数
+            max_metrics: 最多指标数
+            capacity: 每辆车保留的最近数据包数（1Hz时600即10分钟）
+        """
+        size = _layout(max_vehicles, max_metrics, capacity)['size'][0]
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.truncate(size)
+            header = np.zeros(8, dtype='u8')
+            header[[_H_MAGIC, _H_VERSION, _H_MAX_VEHICLES, _H_MAX_METRICS, _H_CAPACITY]] = \
+                [MAGIC, LAYOUT_VERSION, max_vehicles, max_metrics, capacity]
+            f.write(header.tobytes())
+        # 原子替换：已映射旧文件的读者在下次refresh时发现inode变化并重新映射新文件
+        os.replace(tmp_path, path)
+
+        self.ring = _RingFile(path, writable=True)
+        self.ring.values[:] = np.nan
+        self.vehicle_index: Dict[str, int] = {}
+        self.metric_index: Dict[str, int] = {}
+        self.stats = {'packets': 0, 'dropped_vehicles': 0, 'dropped_metrics': 0}
+
+    def _register(self, name: str, index: Dict[str, int], table: np.ndarray,
+                  count_field: int, limit: int) -> Optional[int]:
+        slot = index.get(name)
+        if slot is not None:
+            return slot
+        if len(index) >= limit:
+            return None
+        slot = len(index)
+        table[slot] = ring_name(name).encode('utf-8')
+        header = self.ring.header
+        # 先写名字、再发布计数，最后递增注册表版本号通知读者刷新
+        header[count_field] = slot + 1
+        header[_H_REGISTRY_SEQ] += 1
+        index[name] = slot
+        return slot
+
+    def publish(self, vehicle_id: str, timestamp_ms: int, metrics: Dict[str, float]) -> bool:
+        """
+        写入一个数据包
+
+        Args:
+            vehicle_id: 车辆ID
+            timestamp_ms: 毫秒时间戳
+            metrics: {指标名: 数值}
+
+        Returns:
+            是否写入（车辆数超出容量时丢弃）
+        """
+        ring = self.ring
+        v = self._register(vehicle_id, self.vehicle_index, ring.vehicle_names,
+                           _H_N_VEHICLES, ring.max_vehicles)
+        if v is None:
+            self.stats['dropped_vehicles'] += 1
+            return False
+
+        slots, values = [], []
+        for name, value in metrics.items():
+            m = self._register(name, self.metric_index, ring.metric_names,
+                               _H_N_METRICS, ring.max_metrics)
+            if m is None:
+                self.stats['dropped_metrics'] += 1
+                continue
+            slots.append(m)
+            values.append(value)
+
+        position = int(ring.head[v]) % ring.capacity
+        ring.seq[v] += 1                      # 奇数：写入中
+        ring.timestamps[v, position] = timestamp_ms
+        column = ring.values[v, :, position]
+        column[:] = np.nan
+        column[slots] = values
+        ring.head[v] += 1
+        ring.seq[v] += 1                      # 偶数：写入完成
+        self.stats['packets'] += 1
+        return True
+
+    def close(self):
+        self.ring.close()
+
+
+class RingView:
+    """零拷贝读取结果：环形区视图 + 读取时的序列号"""
+
+    __slots__ = ('vehicle', 'seq', 'head', 'timestamps', 'values', 'generation')
+
+    def __init__(self, vehicle: int, seq: int, head: int,
+                 timestamps: np.ndarray, values: np.ndarray, generation: int = 0):
+        self.vehicle = vehicle
+        self.generation = generation    # 读取时映射的是第几个文件（重新打开后视图失效）
+        self.seq = seq
+        self.head = head
+        self.timestamps = timestamps    # (capacity,)，环形顺序
+        self.values = values            # (指标数, capacity)，环形顺序
+
+    @property
+    def size(self) -> int:
+        return min(self.head, len(self.timestamps))
+
+
+class TelemetryRingReader:
+    """环形缓冲区读者（任意多个进程）"""
+
+    def __init__(self, path: str = DEFAULT_RING_PATH, max_retries: int = 1000):
+        """
+        Args:
+            path: 环形缓冲区文件
+            max_retries: 读到写入中的数据时的最大重试次数
+        """
+        self.path = path
+        self.ring = _RingFile(path, writable=False)
+        self.generation = 0
+        self.max_retries = max_retries
+        self._registry_seq = None
+        self.vehicle_index: Dict[str, int] = {}
+        self.metric_index: Dict[str, int] = {}
+        self.metric_names: List[str] = []
+        self.stats = {'reads': 0, 'retries': 0, 'reopens': 0}
+
+    def _reopen_if_replaced(self):
+        """写者重启后会用新文件替换路径，旧映射不再更新：发现inode变化时改为映射新文件"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if (stat.st_dev, stat.st_ino) == self.ring.identity:
+            return
+        try:
+            ring = _RingFile(self.path, writable=False)
+        except (OSError, ValueError):
+            # 新文件尚未写好头部，下次refresh再试
+            return
+        self.ring.close()
+        self.ring = ring
+        self.generation += 1
+        self._registry_seq = None
+        self.stats['reopens'] += 1
+
+    def refresh(self):
+        """文件被替换时重新映射；注册表版本变化时重新读取车辆/指标名表"""
+        self._reopen_if_replaced()
+        ring = self.ring
+        registry_seq = int(ring.header[_H_REGISTRY_SEQ])
+        if registry_seq == self._registry_seq:
+            return
+        n_vehicles = int(ring.header[_H_N_VEHICLES])
+        n_metrics = int(ring.header[_H_N_METRICS])
+        # 容错解码：其他版本的写者可能按字节截断过名字
+        self.vehicle_index = {name.decode('utf-8', errors='replace'): i
+                              for i, name in enumerate(ring.vehicle_names[:n_vehicles])}
+        self.metric_names = [name.decode('utf-8', errors='replace')
+                             for name in ring.metric_names[:n_metrics]]
+        self.metric_index = {name: i for i, name in enumerate(self.metric_names)}
+        self._registry_seq = registry_seq
+
+    def vehicles(self) -> List[str]:
+        self.refresh()
+        return list(self.vehicle_index)
+
+    def metrics(self) -> List[str]:
+        self.refresh()
+        return list(self.metric_names)
+
+    def _slot(self, vehicle_id: str) -> int:
+        self.refresh()
+        slot = self.vehicle_index.get(ring_name(vehicle_id))
+        if slot is None:
+            raise KeyError(f"环形缓冲区中没有车辆 {vehicle_id}")
+        return slot
+
+    def view(self, vehicle_id: str) -> RingView:
+        """
+        零拷贝读取一辆车的整个环形区（不等待写者，调用方用完后用is_valid校验）
+        """
+        v = self._slot(vehicle_id)
+        ring = self.ring
+        for attempt in range(self.max_retries):
+            seq = int(ring.seq[v])
+            if seq % 2 == 0:
+                break
+            self.stats['retries'] += 1
+            _backoff(attempt)
+        self.stats['reads'] += 1
+        return RingView(v, seq, int(ring.head[v]), ring.timestamps[v],
+                        ring.values[v, :len(self.metric_names)], self.generation)
+
+    def is_valid(self, view: RingView) -> bool:
+        """视图在读取之后是否未被写者修改（序列号不变且为偶数）"""
+        return (view.generation == self.generation and view.seq % 2 == 0
+                and int(self.ring.seq[view.vehicle]) == view.seq)
+
+    def read(self, vehicle_id: str, last_n: Optional[int] = None,
+             metrics: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        读取一辆车最近的数据包（一致快照，按时间升序）
+
+        Args:
+            vehicle_id: 车辆ID
+            last_n: 只取最近的若干个数据包
+            metrics: 只取这些指标（None为全部）
+
+        Returns:
+            (毫秒时间戳, 数值矩阵(指标数, 点数), 指标名列表)
+        """
+        v = self._slot(vehicle_id)
+        ring = self.ring
+        names = list(metrics) if metrics is not None else list(self.metric_names)
+        names = [name for name in names if ring_name(name) in self.metric_index]
+        rows = [self.metric_index[ring_name(name)] for name in names]
+
+        for attempt in range(self.max_retries):
+            seq_before = int(ring.seq[v])
+            if seq_before % 2:
+                self.stats['retries'] += 1
+                _backoff(attempt)
+                continue
+            head = int(ring.head[v])
+            n = min(head, ring.capacity)
+            if last_n is not None:
+                n = min(n, last_n)
+            # 最近n个位置（环形展开为升序）
+            positions = (head - n + np.arange(n)) % ring.capacity
+            timestamps = ring.timestamps[v, positions]
+            values = ring.values[v][np.ix_(rows, positions)] if rows else np.zeros((0, n))
+            if int(ring.seq[v]) == seq_before:
+                self.stats['reads'] += 1
+                return timestamps, values, names
+            self.stats['retries'] += 1
+            _backoff(attempt)
+        raise TimeoutError(f"车辆 {vehicle_id} 持续写入中，无法取得一致快照")
+
+    def read_frame(self, vehicle_id: str, since_ms: Optional[int] = None,
+                   column_map: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """
+        一辆车最近数据的宽表（timestamp列 + 每个指标一列），列名规则同历史缓存
+
+        Args:
+            vehicle_id: 车辆ID
+            since_ms: 只保留该时间之后的数据包
+            column_map: 指标名 -> 列名（不在映射中的指标忽略）
+        """
+        self.refresh()
+        if column_map is not None:
+            column_map = {ring_name(name): column for name, column in column_map.items()}
+        names = self.metric_names if column_map is None else \
+            [name for name in self.metric_names if name in column_map]
+        timestamps, values, names = self.read(vehicle_id, metrics=names)
+        keep = slice(None) if since_ms is None else timestamps > since_ms
+        data = {'timestamp': pd.DatetimeIndex(timestamps[keep].view('datetime64[ms]'))}
+        for name, row in zip(names, values[:, keep]):
+            column = name if column_map is None else column_map[name]
+            # 多个指标映射到同一列时取第一个非空值
+            data[column] = row if column not in data else np.where(np.isnan(data[column]), row, data[column])
+        return pd.DataFrame(data)
+
+    def latest(self, metric: str) -> Dict[str, float]:
+        """全车队某个指标的最新值"""
+        self.refresh()
+        if ring_name(metric) not in self.metric_index:
+            return {}
+        result = {}
+        for vehicle_id in self.vehicle_index:
+            timestamps, values, _ = self.read(vehicle_id, last_n=1, metrics=[metric])
+            if len(timestamps) and not np.isnan(values[0, 0]):
+                result[vehicle_id] = float(values[0, 0])
+        return result
+
+    def latest_frame(self) -> pd.DataFrame:
+        """每辆车最新一个数据包组成的表（每行一辆车）"""
+        rows = {}
+        for vehicle_id in self.vehicles():
+            timestamps, values, names = self.read(vehicle_id, last_n=1)
+            if len(timestamps):
+                rows[vehicle_id] = dict(zip(names, values[:, 0]), timestamp=int(timestamps[0]))
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def close(self):
+        self.ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看遥测共享内存环形缓冲区")
+    parser.add_argument("--path", default=DEFAULT_RING_PATH, help="环形缓冲区文件")
+    parser.add_argument("--watch", type=float, default=0.0, help="刷新间隔（秒，0为只显示一次）")
+
+    args = parser.parse_args()
+
+    try:
+        reader = TelemetryRingReader(args.path)
+    except (OSError, ValueError) as e:
+        print(f"[错误] 无法打开环形缓冲区: {e}")
+        return 1
+
+    from health_rules import load_health_rules
+    rules = load_health_rules()
+
+    try:
+        while True:
+            frame = reader.latest_frame()
+            print(f"[{time.strftime('%H:%M:%S')}] 车辆: {len(frame)} | 指标: {len(reader.metrics())}")
+            if not frame.empty:
+                scores = rules.score_frame(frame)
+                for vehicle_id, score in zip(frame.index, scores):
+                    print(f"  {vehicle_id:<20} 健康度 {score:6.1f}")
+            if args.watch <= 0:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
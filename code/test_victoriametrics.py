@@ -7,6 +7,11 @@ import requests
 import socket
 import time
 
+from vm_query_client import VictoriaMetricsClient, VMQueryError
+
+# 所有HTTP测试共用一个连接池（不走环境代理）
+vm_client = VictoriaMetricsClient(timeout=5, retries=0)
+
 def test_port(host, port, name):
     """测试端口是否可访问"""
     print(f"\n测试 {name} ({host}:{port})...")
@@ -26,29 +31,32 @@ def test_port(host, port, name):
         print(f"  ✗ 测试失败: {e}")
         return False
 
-def test_http_endpoint(url, name, method='GET', data=None, timeout=5):
-    """测试HTTP端点"""
+def test_http_endpoint(call, name, url, timeout=5):
+    """
+    测试HTTP端点
+    
+    Args:
+        call: 以timeout为参数、执行请求并返回结果的函数
+        name: 端点名称
+        url: 端点地址（仅用于显示）
+        timeout: 超时（秒）
+    """
     print(f"\n测试 {name}...")
     print(f"  URL: {url}")
     try:
-        if method == 'GET':
-            response = requests.get(url, timeout=timeout, proxies={'http': None, 'https': None})
-        elif method == 'POST':
-            response = requests.post(
-                url, 
-                data=data, 
-                headers={'Content-Type': 'text/plain'},
-                timeout=timeout,
-                proxies={'http': None, 'https': None}
-            )
+        vm_client.timeout = timeout
+        result = call()
         
-        print(f"  ✓ HTTP {method} 成功")
-        print(f"  状态码: {response.status_code}")
-        if len(response.text) < 200:
-            print(f"  响应: {response.text[:200]}")
+        print(f"  ✓ 请求成功")
+        text = str(result)
+        if len(text) < 200:
+            print(f"  响应: {text}")
         else:
-            print(f"  响应长度: {len(response.text)} 字节")
+            print(f"  响应长度: {len(text)} 字节")
         return True
+    except VMQueryError as e:
+        print(f"  ✗ 请求失败: {e}")
+        return False
     except requests.exceptions.Timeout:
         print(f"  ✗ 请求超时")
         return False
@@ -86,17 +94,17 @@ def main():
     
     # 测试vmselect查询接口
     test_http_endpoint(
-        "http://localhost:8481/select/0/prometheus/api/v1/query?query=up",
-        "vmselect查询接口 (GET)"
+        lambda: vm_client.query("up"),
+        "vmselect查询接口 (GET)",
+        f"{vm_client.select_url}/api/v1/query?query=up"
     )
     
     # 测试vminsert写入接口（发送测试数据）
     test_data = 'test_metric{label="value"} 123 ' + str(int(time.time() * 1000))
     result = test_http_endpoint(
-        "http://localhost:8480/insert/0/prometheus/api/v1/import/prometheus",
+        lambda: vm_client.import_prometheus(test_data),
         "vminsert写入接口 (POST)",
-        method='POST',
-        data=test_data,
+        vm_client.insert_url,
         timeout=15  # 增加超时时间
     )
     
@@ -105,8 +113,9 @@ def main():
         print("\n  等待2秒后查询测试数据...")
         time.sleep(2)
         test_http_endpoint(
-            "http://localhost:8481/select/0/prometheus/api/v1/query?query=test_metric",
-            "查询刚写入的测试数据"
+            lambda: vm_client.query("test_metric"),
+            "查询刚写入的测试数据",
+            f"{vm_client.select_url}/api/v1/query?query=test_metric"
         )
     
     # 总结
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+TimeGPT本地桩服务
+在没有外网的环境下模拟TimeGPT的预测/异常检测接口，用于验证异步客户端的
+并发、限流、重试和请求合并行为（可配置响应延迟、故障率和服务端限流）
+
+接口（简化的JSON协议）:
+    POST /forecast           {"ds": [...], "y": [...], "h": 24, "freq": "H", "level": [80, 95]}
+                             -> {"ds": [...], "TimeGPT": [...], "TimeGPT-lo-80": [...], ...}
+    POST /anomaly_detection  {"ds": [...], "y": [...], "freq": "H"}
+                             -> {"timestamp": [...], "value": [...], "z_score": [...], "is_anomaly": [...]}
+    GET  /stats              -> 请求计数
+
+用法:
+    python timegpt_stub_server.py --port 18080 --latency 0.2 --error-rate 0.1
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from nixtla_timegpt_integration import NixtlaTimeGPTIntegration
+
+
+class TimeGPTStubServer:
+    """TimeGPT桩服务（后台线程运行）"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.1, error_rate: float = 0.0,
+                 max_requests_per_second: float = 0.0, seed: int = 0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口（0表示自动分配）
+            latency: 每个请求的模拟处理延迟（秒）
+            error_rate: 随机返回503的概率
+            max_requests_per_second: 服务端限流，超出返回429（0表示不限流）
+            seed: 随机种子
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.random = random.Random(seed)
+        self.backend = NixtlaTimeGPTIntegration(seed=seed)
+
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'TimeGPTStubServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _admit(self) -> int:
+        """决定本次请求的响应状态（200/429/503）"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.max_requests_per_second > 0:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.max_requests_per_second:
+                    self.stats['throttled'] += 1
+                    return 429
+            if self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 503
+            self.stats['ok'] += 1
+            return 200
+
+    def _forecast(self, payload: dict) -> dict:
+        df = pd.DataFrame({'ds': pd.to_datetime(payload['ds']), 'y': payload['y']})
+        result = self.backend.fallback_forecast(df, int(payload['h']), payload.get('freq', 'H'))
+        response = {'ds': result['timestamp'].astype(str).tolist(),
+                    'TimeGPT': result['forecast'].tolist()}
+        for level in payload.get('level', [80, 95]):
+            response[f'TimeGPT-lo-{level}'] = result[f'lower_{level}'].tolist()
+            response[f'TimeGPT-hi-{level}'] = result[f'upper_{level}'].tolist()
+        return response
+
+    def _anomaly_detection(self, payload: dict) -> dict:
+        result = self.backend.simulate_anomaly_arrays(np.asarray(payload['ds']),
+                                                      np.asarray(payload['y'], dtype=np.float64))
+        return {
+            'timestamp': [str(ts) for ts in result['timestamp']],
+            'value': result['value'].tolist(),
+            'z_score': result['z_score'].tolist(),
+            'is_anomaly': result['is_anomaly'].tolist(),
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    self._send(200, server.stats)
+                else:
+                    self._send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                handlers = {'/forecast': server._forecast,
+                            '/anomaly_detection': server._anomaly_detection}
+                if self.path not in handlers:
+                    self._send(404, {'error': 'not found'})
+                    return
+
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._send(400, {'error': 'invalid json'})
+                    return
+
+                status = server._admit()
+                time.sleep(server.latency)
+                if status != 200:
+                    self._send(status, {'error': 'throttled' if status == 429 else 'unavailable'})
+                    return
+                try:
+                    self._send(200, handlers[self.path](payload))
+                except (KeyError, ValueError) as e:
+                    self._send(400, {'error': str(e)})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeGPT本地桩服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=18080, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.1, help="响应延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机503的概率")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="服务端限流（请求/秒，0为不限）")
+
+    args = parser.parse_args()
+
+    server = TimeGPTStubServer(args.host, args.port, args.latency, args.error_rate, args.max_rps)
+    print(f"✓ TimeGPT桩服务已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[信息] 桩服务已停止")
+        print(f"[信息] 请求统计: {server.stats}")
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+VictoriaMetrics定时分析服务
+周期性地从VictoriaMetrics批量拉取全车队数据，运行预测性维护分析引擎，
+并将健康度评分、RUL和异常标志批量写回VictoriaMetrics
+
+每个周期只发起一次多序列export查询（正则匹配所有指标、所有车辆），
+并按水位线增量拉取，只获取上次周期之后的新数据
+"""
+
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from predictive_maintenance_engine import PredictiveMaintenanceEngine
+from result_cache import ResultCache
+from multivariate_anomaly import (MIN_MULTIVARIATE_CHANNELS, MULTIVARIATE_CHANNELS,
+                                  FleetMahalanobisDetector, available_channels)
+from probabilistic_rul import RUL_QUANTILES, bootstrap_rul_batch
+from vm_query_client import VM_INSERT_URL, VM_SELECT_URL, VictoriaMetricsClient
+from vm_export_reader import ExportColumnReader
+from history_cache import HistoryCache
+
+# 分析所需的指标（VictoriaMetrics指标名 -> 分析引擎列名）
+ANALYSIS_METRICS = {
+    'engine_coolant_temp': 'engine_coolant_temp',
+    'engine_oil_pressure': 'engine_oil_pressure',
+    'battery_soh': 'battery_soh',
+    'battery_temp_max': 'battery_temp_max',
+    'hydraulic_system_pressure': 'hydraulic_pressure',
+    'hydraulic_pressure': 'hydraulic_pressure',
+    'sensor_quality_score': 'sensor_quality_score',
+    'engine_rpm': 'engine_rpm',
+    'engine_torque': 'engine_torque',
+    'engine_load': 'engine_load',
+    'engine_fuel_rate': 'engine_fuel_rate',
+    'engine_fuel_consumption_rate': 'engine_fuel_rate',
+}
+
+# 写回的结果指标
+HEALTH_SCORE_METRIC = 'tractor_health_score'
+RUL_DAYS_METRIC = 'tractor_rul_days'
+ANOMALY_METRIC = 'tractor_anomaly'
+MULTIVARIATE_SCORE_METRIC = 'tractor_multivariate_score'
+RUL_QUANTILE_METRIC = 'tractor_rul_days_quantile'
+FAILURE_PROBABILITY_METRIC = 'tractor_failure_probability_30d'
+
+# 概率RUL配置（电池SOH跌破阈值视为失效）
+RUL_FAILURE_THRESHOLD = 80.0
+RUL_HORIZON_DAYS = 30.0
+
+
+class VictoriaMetricsAnalysisService:
+    """VictoriaMetrics定时分析服务"""
+
+    def __init__(self,
+                 select_url: str = VM_SELECT_URL,
+                 insert_url: str = VM_INSERT_URL,
+                 interval_seconds: int = 300,
+                 lookback_hours: float = 72.0,
+                 ingest_delay_seconds: int = 30,
+                 timeout: int = 30,
+                 cache_size: int = 10000,
+                 cache_path: Optional[str] = None,
+                 history_cache_dir: Optional[str] = None):
+        """
+        初始化分析服务
+
+        Args:
+            select_url: vmselect的Prometheus查询地址
+            insert_url: vminsert的Prometheus导入地址
+            interval_seconds: 分析周期（秒）
+            lookback_hours: 每辆车保留的历史窗口（小时）
+            ingest_delay_seconds: 写入可见延迟，查询终点会向前回退该时长以避免漏数
+            timeout: HTTP请求超时（秒）
+            cache_size: 分析结果缓存的最大条目数
+            cache_path: 分析结果缓存的持久化路径，为None时只缓存在内存中
+            history_cache_dir: 本地历史缓存目录；启动时从缓存加载历史，只从vmselect拉取缺失的尾部
+        """
+        self.client = VictoriaMetricsClient(select_url, insert_url, timeout=timeout)
+        self.select_url = self.client.select_url
+        self.insert_url = insert_url
+        self.interval_seconds = interval_seconds
+        self.lookback_ms = int(lookback_hours * 3600 * 1000)
+        self.ingest_delay_ms = int(ingest_delay_seconds * 1000)
+        self.timeout = timeout
+
+        self.engines: Dict[str, PredictiveMaintenanceEngine] = {}
+        self.result_cache = ResultCache(max_entries=cache_size, persist_path=cache_path)
+        self.history_cache = (HistoryCache(history_cache_dir, sorted(ANALYSIS_METRICS))
+                              if history_cache_dir else None)
+        self.history: Dict[str, pd.DataFrame] = {}
+        # 每辆车最近一次的分析结果（没有新数据的车辆直接沿用）
+        self.last_results: Dict[str, Dict[str, Any]] = {}
+        # 多变量检测按通道组合分组：上报通道相同的车辆共用一个检测器
+        self.multivariate_detectors: Dict[Tuple[str, ...], FleetMahalanobisDetector] = {}
+        self.multivariate_channels: Dict[str, Tuple[str, ...]] = {}
+
+        # 水位线：上次成功拉取的时间终点（毫秒）
+        self.watermark_ms: Optional[int] = None
+
+        self.stats = {
+            'cycles': 0,
+            'samples_fetched': 0,
+            'vehicles_analyzed': 0,
+            'vehicles_unchanged': 0,
+            'metrics_written': 0,
+            'errors': 0,
+        }
+
+    def _metric_selector(self) -> str:
+        """构造覆盖所有分析指标的正则选择器"""
+        names = '|'.join(sorted(ANALYSIS_METRICS.keys()))
+        return f'{{__name__=~"{names}",vehicle_id!=""}}'
+
+    def fetch_window(self, start_ms: int, end_ms: int) -> Dict[str, pd.DataFrame]:
+        """
+        一次export调用拉取所有车辆、所有指标在时间窗口内的数据
+
+        Args:
+            start_ms: 起始时间（毫秒，包含）
+            end_ms: 结束时间（毫秒，包含）
+
+        Returns:
+            {vehicle_id: DataFrame}，DataFrame以timestamp为列、每个指标一列
+        """
+        # export接口返回JSON lines，每行一个序列（首次拉取整个回看窗口时按天分段），
+        # 直接解析为每个序列的列数组
+        reader = self.client.export_columns(self._metric_selector(), start_ms / 1000, end_ms / 1000,
+                                            chunk_seconds=86400)
+        self.stats['samples_fetched'] += reader.samples
+        if self.history_cache is not None:
+            self.history_cache.ingest(reader)
+
+        return {vehicle_id: ExportColumnReader.to_frame(columns)
+                for vehicle_id, columns in reader.by_vehicle(ANALYSIS_METRICS).items()}
+
+    def _load_cached_history(self, end_ms: int) -> Optional[int]:
+        """
+        从本地历史缓存加载回看窗口内的历史
+
+        Returns:
+            缓存水位线（毫秒），没有可用缓存时返回None
+        """
+        cache = self.history_cache
+        if cache is None or cache.watermark_ms is None or cache.watermark_ms < end_ms - self.lookback_ms:
+            return None
+
+        watermark_ms = min(cache.watermark_ms, end_ms)
+        for vehicle_id in cache.vehicles():
+            frame = cache.read_frame(vehicle_id, end_ms - self.lookback_ms, watermark_ms,
+                                     ANALYSIS_METRICS)
+            if not frame.empty:
+                self.history[vehicle_id] = frame
+        print(f"[信息] 从本地缓存加载 {len(self.history)} 辆车的历史（水位线 {watermark_ms}）")
+        return watermark_ms
+
+    def _merge_history(self, vehicle_id: str, new_data: pd.DataFrame):
+        """将新数据合并到车辆历史窗口中"""
+        if vehicle_id in self.history:
+            merged = pd.concat([self.history[vehicle_id], new_data], ignore_index=True)
+            merged = merged.drop_duplicates(subset='timestamp', keep='last')
+            self.history[vehicle_id] = merged.sort_values('timestamp').ffill().reset_index(drop=True)
+        else:
+            self.history[vehicle_id] = new_data
+
+    def _trim_history(self, end_ms: int):
+        """裁剪超出回看窗口的旧数据，窗口内已没有数据的车辆整个移除"""
+        cutoff = pd.to_datetime(end_ms - self.lookback_ms, unit='ms')
+        for vehicle_id in list(self.history):
+            history = self.history[vehicle_id]
+            if history.empty or history['timestamp'].iloc[0] < cutoff:
+                history = history[history['timestamp'] >= cutoff].reset_index(drop=True)
+            if history.empty:
+                del self.history[vehicle_id]
+                self.engines.pop(vehicle_id, None)
+                self.last_results.pop(vehicle_id, None)
+            else:
+                self.history[vehicle_id] = history
+
+    def score_multivariate(self, new_frames: Dict[str, pd.DataFrame]) -> Dict[str, float]:
+        """
+        对本周期所有车辆的新数据包做一次批量马氏距离打分，并增量更新每辆车的协方差
+
+        Args:
+            new_frames: {vehicle_id: 本周期新数据}
+
+        Returns:
+            {vehicle_id: 最大马氏距离平方 / 卡方阈值}，>1表示存在多变量异常
+        """
+        groups: Dict[Tuple[str, ...], List[str]] = {}
+        for vehicle_id, frame in new_frames.items():
+            if frame.empty:
+                continue
+            channels = self._multivariate_channels(vehicle_id, frame)
+            if len(channels) >= MIN_MULTIVARIATE_CHANNELS:
+                groups.setdefault(channels, []).append(vehicle_id)
+
+        scores = {}
+        for channels, group in groups.items():
+            detector = self.multivariate_detectors.get(channels)
+            if detector is None:
+                detector = FleetMahalanobisDetector(channels)
+                self.multivariate_detectors[channels] = detector
+
+            X = np.vstack([new_frames[v].reindex(columns=list(channels)).to_numpy(dtype=np.float64)
+                           for v in group])
+            vehicle_ids = [v for v in group for _ in range(len(new_frames[v]))]
+            d2 = detector.score_and_update(X, vehicle_ids)
+
+            series = pd.Series(d2 / detector.threshold, index=vehicle_ids)
+            for vehicle_id, score in series.groupby(level=0).max().items():
+                if not np.isnan(score):
+                    scores[vehicle_id] = float(score)
+        return scores
+
+    def _multivariate_channels(self, vehicle_id: str, frame: pd.DataFrame) -> Tuple[str, ...]:
+        """
+        车辆参与多变量检测的通道（只增不减：某个周期缺少个别指标时该周期的行被跳过，
+        不会把车辆切换到另一个检测器；出现新通道时切换，按新通道组合重新积累样本）
+        """
+        previous = self.multivariate_channels.get(vehicle_id)
+        present = set(available_channels(frame)).union(previous or ())
+        channels = tuple(c for c in MULTIVARIATE_CHANNELS if c in present)
+        if channels != previous:
+            self.multivariate_channels[vehicle_id] = channels
+            if len(channels) < MIN_MULTIVARIATE_CHANNELS:
+                print(f"[警告] 车辆 {vehicle_id} 可用的联动通道不足 {MIN_MULTIVARIATE_CHANNELS} 个"
+                      f"（{', '.join(channels) or '无'}），不参与多变量检测")
+            elif previous:
+                print(f"[信息] 车辆 {vehicle_id} 的多变量检测通道变为 {', '.join(channels)}")
+        return channels
+
+    def analyze_fleet(self, changed: Optional[Set[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        对所有有历史数据的车辆运行分析引擎
+
+        Args:
+            changed: 本周期有新数据的车辆（为None时全部重新分析）；
+                     其余车辆（停放、无信号）沿用上次的结果，不因窗口裁剪而重复分析
+
+        Returns:
+            {vehicle_id: 分析结果}
+        """
+        results = {}
+        analyzed = 0
+        for vehicle_id, historical_data in self.history.items():
+            if historical_data.empty:
+                continue
+
+            if changed is not None and vehicle_id not in changed and vehicle_id in self.last_results:
+                results[vehicle_id] = self.last_results[vehicle_id]
+                self.stats['vehicles_unchanged'] += 1
+                continue
+
+            engine = self.engines.get(vehicle_id)
+            if engine is None:
+                engine = PredictiveMaintenanceEngine(vehicle_id, result_cache=self.result_cache)
+                self.engines[vehicle_id] = engine
+
+            try:
+                results[vehicle_id] = engine.analyze_vehicle_health(historical_data)
+                self.last_results[vehicle_id] = results[vehicle_id]
+                analyzed += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"[错误] 车辆 {vehicle_id} 分析失败: {e}")
+
+        self.stats['vehicles_analyzed'] += analyzed
+        return results
+
+    def estimate_fleet_rul(self, n_samples: int = 1000) -> Dict[str, Dict[str, Any]]:
+        """
+        全车队概率RUL：各车电池SOH降采样后右对齐为一个矩阵，一次批量自助法计算
+
+        Args:
+            n_samples: 自助样本数
+
+        Returns:
+            {vehicle_id: {'quantiles': {分位数: 天数}, 'failure_probability': 概率}}
+        """
+        vehicle_ids, hours, values = [], [], []
+        for vehicle_id, historical_data in self.history.items():
+            if 'battery_soh' not in historical_data.columns or len(historical_data) < 2:
+                continue
+            soh = historical_data[['timestamp', 'battery_soh']].dropna()
+            if len(soh) < 2:
+                continue
+            x, y = PredictiveMaintenanceEngine._downsample_degradation(soh['timestamp'],
+                                                                        soh['battery_soh'].to_numpy())
+            vehicle_ids.append(vehicle_id)
+            hours.append(x)
+            values.append(y)
+
+        if not vehicle_ids:
+            return {}
+
+        width = max(len(x) for x in hours)
+        hour_matrix = np.full((len(vehicle_ids), width), np.nan)
+        value_matrix = np.full((len(vehicle_ids), width), np.nan)
+        for row, (x, y) in enumerate(zip(hours, values)):
+            hour_matrix[row, width - len(x):] = x
+            value_matrix[row, width - len(y):] = y
+
+        result = bootstrap_rul_batch(hour_matrix, value_matrix, RUL_FAILURE_THRESHOLD,
+                                     n_samples=n_samples, horizon_days=RUL_HORIZON_DAYS)
+        distribution = {}
+        for row, vehicle_id in enumerate(vehicle_ids):
+            if np.isnan(result['failure_probability'][row]):
+                continue
+            distribution[vehicle_id] = {
+                'quantiles': dict(zip(RUL_QUANTILES, result['quantiles_days'][row].tolist())),
+                'failure_probability': float(result['failure_probability'][row]),
+            }
+        return distribution
+
+    @staticmethod
+    def format_results(results: Dict[str, Dict[str, Any]], timestamp_ms: int,
+                       multivariate_scores: Optional[Dict[str, float]] = None,
+                       rul_distribution: Optional[Dict[str, Dict[str, Any]]] = None) -> List[str]:
+        """
+        将分析结果转换为Prometheus文本格式
+
+        Args:
+            results: {vehicle_id: 分析结果}
+            timestamp_ms: 写入的时间戳（毫秒）
+            multivariate_scores: {vehicle_id: 多变量异常分数}
+            rul_distribution: estimate_fleet_rul的结果（未退化即RUL无穷大的分位数不写回）
+
+        Returns:
+            Prometheus格式的行列表
+        """
+        lines = []
+        for vehicle_id, result in results.items():
+            labels = f'vehicle_id="{vehicle_id}"'
+            lines.append(f'{HEALTH_SCORE_METRIC}{{{labels}}} {float(result["health_score"])} {timestamp_ms}')
+
+            rul_days = result.get('rul_prediction', {}).get('rul_days')
+            if rul_days is not None:
+                lines.append(f'{RUL_DAYS_METRIC}{{{labels}}} {float(rul_days)} {timestamp_ms}')
+
+            for metric, is_anomaly in result.get('anomalies', {}).items():
+                lines.append(
+                    f'{ANOMALY_METRIC}{{{labels},metric="{metric}"}} {1 if is_anomaly else 0} {timestamp_ms}'
+                )
+
+        for vehicle_id, score in (multivariate_scores or {}).items():
+            lines.append(f'{MULTIVARIATE_SCORE_METRIC}{{vehicle_id="{vehicle_id}"}} {score} {timestamp_ms}')
+
+        for vehicle_id, distribution in (rul_distribution or {}).items():
+            labels = f'vehicle_id="{vehicle_id}"'
+            for quantile, days in distribution['quantiles'].items():
+                if np.isfinite(days):
+                    lines.append(f'{RUL_QUANTILE_METRIC}{{{labels},quantile="{quantile}"}} '
+                                 f'{float(days)} {timestamp_ms}')
+            lines.append(f'{FAILURE_PROBABILITY_METRIC}{{{labels}}} '
+                         f'{distribution["failure_probability"]} {timestamp_ms}')
+        return lines
+
+    def write_results(self, results: Dict[str, Dict[str, Any]], timestamp_ms: int,
+                      multivariate_scores: Optional[Dict[str, float]] = None,
+                      rul_distribution: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        """一次批量导入请求写回所有车辆的分析结果"""
+        lines = self.format_results(results, timestamp_ms, multivariate_scores, rul_distribution)
+        if not lines:
+            return True
+
+        try:
+            if self.client.import_prometheus(lines):
+                self.stats['metrics_written'] += len(lines)
+                return True
+            print("[错误] VictoriaMetrics未确认写入")
+        except Exception as e:
+            print(f"[错误] 写回VictoriaMetrics失败: {e}")
+
+        self.stats['errors'] += 1
+        return False
+
+    def run_cycle(self, now_ms: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        执行一个分析周期：增量拉取 → 分析 → 批量写回
+
+        Args:
+            now_ms: 当前时间（毫秒），默认使用系统时间
+
+        Returns:
+            本周期的分析结果
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+
+        end_ms = now_ms - self.ingest_delay_ms
+        if self.watermark_ms is None:
+            self.watermark_ms = self._load_cached_history(end_ms)
+        if self.watermark_ms is None:
+            start_ms = end_ms - self.lookback_ms
+        else:
+            start_ms = self.watermark_ms + 1
+
+        if start_ms > end_ms:
+            return {}
+
+        try:
+            new_frames = self.fetch_window(start_ms, end_ms)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"[错误] 从VictoriaMetrics拉取数据失败: {e}")
+            return {}
+
+        multivariate_scores = self.score_multivariate(new_frames)
+
+        changed = set()
+        for vehicle_id, new_data in new_frames.items():
+            if not new_data.empty:
+                self._merge_history(vehicle_id, new_data)
+                changed.add(vehicle_id)
+        self._trim_history(end_ms)
+
+        # 只有拉取成功才推进水位线，失败时下个周期会重新拉取该窗口
+        self.watermark_ms = end_ms
+        if self.history_cache is not None:
+            self.history_cache.set_watermark(end_ms)
+
+        results = self.analyze_fleet(changed)
+        try:
+            rul_distribution = self.estimate_fleet_rul()
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"[错误] 车队概率RUL计算失败: {e}")
+            rul_distribution = {}
+        self.write_results(results, end_ms, multivariate_scores, rul_distribution)
+        self.stats['cycles'] += 1
+
+        try:
+            self.result_cache.save()
+        except Exception as e:
+            print(f"[警告] 保存结果缓存失败: {e}")
+
+        return results
+
+    def run_forever(self):
+        """持续运行分析服务"""
+        print("=" * 80)
+        print("  VictoriaMetrics定时分析服务")
+        print("=" * 80)
+        print()
+        print(f"vmselect: {self.select_url}")
+        print(f"vminsert: {self.insert_url}")
+        print(f"分析周期: {self.interval_seconds}秒")
+        print(f"回看窗口: {self.lookback_ms / 3600000:.1f}小时")
+        print()
+
+        try:
+            while True:
+                cycle_start = time.time()
+                results = self.run_cycle()
+
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] 周期 #{self.stats['cycles']} | "
+                      f"车辆: {len(results)} | "
+                      f"拉取样本: {self.stats['samples_fetched']} | "
+                      f"写回指标: {self.stats['metrics_written']} | "
+                      f"缓存命中率: {self.result_cache.hit_rate():.0%} | "
+                      f"错误: {self.stats['errors']} | "
+                      f"耗时: {time.time() - cycle_start:.2f}秒")
+
+                time.sleep(max(0.0, self.interval_seconds - (time.time() - cycle_start)))
+
+        except KeyboardInterrupt:
+            print()
+            print("=" * 80)
+            print("  停止服务")
+            print("=" * 80)
+            print(f"总周期数: {self.stats['cycles']}")
+            print(f"总拉取样本: {self.stats['samples_fetched']}")
+            print(f"总写回指标: {self.stats['metrics_written']}")
+            print(f"错误数: {self.stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VictoriaMetrics定时分析服务")
+    parser.add_argument("--select-url", default=VM_SELECT_URL, help="vmselect查询地址")
+    parser.add_argument("--insert-url", default=VM_INSERT_URL, help="vminsert导入地址")
+    parser.add_argument("--interval", type=int, default=300, help="分析周期(秒)")
+    parser.add_argument("--lookback-hours", type=float, default=72.0, help="历史回看窗口(小时)")
+    parser.add_argument("--ingest-delay", type=int, default=30, help="写入可见延迟(秒)")
+    parser.add_argument("--cache-path", default=None, help="分析结果缓存持久化路径")
+    parser.add_argument("--history-cache", default=None, help="本地历史缓存目录")
+
+    args = parser.parse_args()
+
+    service = VictoriaMetricsAnalysisService(
+        select_url=args.select_url,
+        insert_url=args.insert_url,
+        interval_seconds=args.interval,
+        lookback_hours=args.lookback_hours,
+        ingest_delay_seconds=args.ingest_delay,
+        cache_path=args.cache_path,
+        history_cache_dir=args.history_cache,
+    )
+    service.run_forever()
+
+
+if __name__ == "__main__":
+    main()
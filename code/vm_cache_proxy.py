@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+vmselect缓存查询代理
+Grafana仪表板的每个面板都按$vehicle_id查询，每个打开的仪表板每次刷新都会把全部查询重新发给vmselect，
+监控大厅多块大屏同时打开时负载成倍增加。本代理放在 /select/0/prometheus 前面：
+
+- 区间查询的start/end按step对齐，不同大屏、不同刷新时刻的相同查询落到同一组时间点上
+- 区间结果按(查询, step)缓存，时间范围部分重叠时复用已缓存部分，只向vmselect拉取缺少的尾部（或头部）；
+  最近cache_offset秒内的点可能还有迟到的数据，不进入缓存，每次重新拉取
+- 相同的在途上游请求合并为一次（多块大屏同时刷新时只有一个请求到达vmselect）
+- 即时查询按时间对齐后短时缓存；其余接口（标签、序列等）透传
+- /metrics 输出Prometheus格式的命中率等指标，/stats 输出JSON统计
+
+用法:
+    python vm_cache_proxy.py --port 8482 --upstream http://localhost:8481/select/0/prometheus
+    Grafana数据源URL改为 http://<代理地址>:8482/select/0/prometheus
+"""
+
+import json
+import math
+import time
+import argparse
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from result_cache import ResultCache
+from vm_query_client import MAX_POINTS_PER_QUERY, VM_SELECT_URL, VictoriaMetricsClient, VMQueryError
+
+DEFAULT_PROXY_PORT = 8482
+
+# 最近多少秒内的点不缓存（与vmselect的-search.cacheTimestampOffset作用相同）
+DEFAULT_CACHE_OFFSET = 60
+
+# 即时查询的时间对齐粒度和缓存有效期（秒），与仪表板刷新间隔一致
+DEFAULT_INSTANT_STEP = 5
+
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+
+
+def parse_duration(value: str) -> float:
+    """解析Prometheus的step/时长参数（如 15、15s、1m、500ms），返回秒"""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, number = 0.0, ''
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == '.':
+            number += ch
+            i += 1
+            continue
+        unit = 'ms' if value.startswith('ms', i) else ch
+        if unit not in _DURATION_UNITS or not number:
+            raise ValueError(f"无法解析的时长: {value}")
+        total += float(number) * _DURATION_UNITS[unit]
+        number = ''
+        i += len(unit)
+    if number:
+        raise ValueError(f"无法解析的时长: {value}")
+    return total
+
+
+def align_range(start: float, end: float, step: float) -> Tuple[float, float]:
+    """start/end向下对齐到step的整数倍（结果点都落在同一组时间点上，才能跨请求复用）"""
+    return math.floor(start / step) * step, math.floor(end / step) * step
+
+
+class SingleFlight:
+    """在途请求合并：相同键的调用同时只执行一次，其余调用方等待同一个结果（线程安全）"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, Tuple[threading.Event, list]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        执行fn（同一键已有在途调用时等待其结果）
+
+        Args:
+            key: 请求键
+            fn: 实际执行的函数
+
+        Returns:
+            fn的返回值（fn抛出的异常同样传给所有等待方）
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = (threading.Event(), [None, None])
+                self.stats['calls'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        event, outcome = flight
+        if not leader:
+            event.wait()
+            if outcome[1] is not None:
+                raise outcome[1]
+            return outcome[0]
+
+        try:
+            outcome[0] = fn()
+            return outcome[0]
+        except BaseException as e:
+            outcome[1] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+
+class _RangeEntry:
+    """一个(查询, step)的缓存：[start, end]内的点是完整且稳定的"""
+
+    __slots__ = ('start', 'end', 'series')
+
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+        # 序列键 -> (metric, 时间戳列表, 原始[ts, "value"]点列表)
+        self.series: Dict[str, Tuple[Dict[str, str], List[float], List[list]]] = {}
+
+    def add(self, results: List[Dict[str, Any]], low: float, high: float):
+        """并入[low, high]内的点（low在已有范围之前时前插，否则追加）"""
+        for series in results:
+            metric = series.get('metric', {})
+            points = [p for p in series.get('values', []) if low <= float(p[0]) <= high]
+            if not points:
+                continue
+            key = json.dumps(metric, sort_keys=True)
+            entry = self.series.get(key)
+            if entry is None:
+                self.series[key] = (metric, [float(p[0]) for p in points], points)
+                continue
+            _, timestamps, cached = entry
+            if timestamps and high < timestamps[0]:
+                timestamps[:0] = [float(p[0]) for p in points]
+                cached[:0] = points
+            else:
+                points = [p for p in points if not timestamps or float(p[0]) > timestamps[-1]]
+                timestamps.extend(float(p[0]) for p in points)
+                cached.extend(points)
+
+    def trim(self, cutoff: float):
+        """丢弃cutoff之前的点（每个序列的缓存点数有上限）"""
+        if cutoff <= self.start:
+            return
+        for key in list(self.series):
+            _, timestamps, cached = self.series[key]
+            i = bisect_left(timestamps, cutoff)
+            del timestamps[:i]
+            del cached[:i]
+            if not timestamps:
+                del self.series[key]
+        self.start = cutoff
+
+    def points(self) -> int:
+        return sum(len(timestamps) for _, timestamps, _ in self.series.values())
+
+
+class RangeQueryCache:
+    """区间查询结果缓存（部分重叠复用 + 在途请求合并，线程安全）"""
+
+    def __init__(self, fetch: Callable[[str, float, float, float], List[Dict[str, Any]]],
+                 max_entries: int = 2000, max_points: int = MAX_POINTS_PER_QUERY,
+                 cache_offset: float = DEFAULT_CACHE_OFFSET,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            fetch: 上游区间查询函数 (query, start, end, step) -> result列表
+            max_entries: 最多缓存的(查询, step)数，超出后淘汰最久未使用的
+            max_points: 每个序列最多缓存的步数
+            cache_offset: 最近多少秒内的点不缓存
+            clock: 当前时间（测试时可替换）
+        """
+        self.fetch = fetch
+        self.max_entries = max_entries
+        self.max_points = max_points
+        self.cache_offset = cache_offset
+        self.clock = clock
+
+        self._entries: 'OrderedDict[Tuple[str, float], _RangeEntry]' = OrderedDict()
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'hits': 0,
+            'partial_hits': 0,
+            'misses': 0,
+            'upstream_requests': 0,
+            'points_fetched': 0,
+            'points_served': 0,
+            'evictions': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _fetch_coalesced(self, query: str, start: float, end: float, step: float) -> List[Dict[str, Any]]:
+        """上游区间查询（相同的在途请求合并）"""
+        def fetch():
+            result = self.fetch(query, start, end, step)
+            with self._lock:
+                self.stats['upstream_requests'] += 1
+                self.stats['points_fetched'] += sum(len(s.get('values', [])) for s in result)
+            return result
+
+        return self._flights.do((query, start, end, step), fetch)
+
+    def query_range(self, query: str, start: float, end: float, step: float
+                    ) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        区间查询（start/end需已按step对齐）
+
+        Returns:
+            (result列表, 'hit' | 'partial' | 'miss')
+        """
+        key = (query, step)
+        # 对齐到step后不超过该时间的点视为稳定，可以缓存
+        stable_end = math.floor((self.clock() - self.cache_offset) / step) * step
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if start > entry.end + step or end < entry.start - step:
+                    entry = None
+            head = (start, entry.start - step) if entry is not None and start < entry.start else None
+            tail_start = entry.end + step if entry is not None else start
+
+        if (end - start) / step + 1 > self.max_points:
+            # 超过单个序列的缓存上限，直接转发
+            outcome = 'miss'
+            result = self._fetch_coalesced(query, start, end, step)
+        elif entry is None:
+            outcome = 'miss'
+            fresh = self._fetch_coalesced(query, start, end, step)
+            with self._lock:
+                existing = self._entries.get(key)
+                # 不用更早的时间窗口覆盖正在被刷新的缓存
+                if stable_end >= start and (existing is None or existing.end < start):
+                    entry = _RangeEntry(start, min(end, stable_end))
+                    entry.add(fresh, start, entry.end)
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    self._evict()
+                else:
+                    entry = None
+                result = self._assemble(entry, fresh, start, end)
+        else:
+            outcome = 'partial' if head or tail_start <= end else 'hit'
+            head_results = self._fetch_coalesced(query, head[0], head[1], step) if head else []
+            fresh = self._fetch_coalesced(query, tail_start, end, step) if tail_start <= end else []
+            with self._lock:
+                # 其他线程可能同时扩展了同一条缓存，只并入仍然缺少的部分
+                if head and head[0] < entry.start:
+                    entry.add(head_results, head[0], min(head[1], entry.start - step))
+                    entry.start = head[0]
+                if tail_start <= end and tail_start <= entry.end + step and stable_end > entry.end:
+                    entry.add(fresh, entry.end + step, stable_end)
+                    entry.end = min(end, stable_end)
+                # 先取出本次请求的结果再裁剪：裁剪只保留最近的max_points步，可能丢掉刚拉取的头部
+                result = self._assemble(entry, fresh, start, end) if entry.start <= start else None
+                entry.trim(entry.end - (self.max_points - 1) * step)
+            if result is None:
+                # 其他线程同时裁剪掉了请求范围的开头，缓存不完整时直接转发
+                result = self._fetch_coalesced(query, start, end, step)
+
+        with self._lock:
+            self.stats[{'hit': 'hits', 'partial': 'partial_hits', 'miss': 'misses'}[outcome]] += 1
+            self.stats['points_served'] += sum(len(s['values']) for s in result)
+        return result, outcome
+
+    @staticmethod
+    def _assemble(entry: Optional[_RangeEntry], fresh: List[Dict[str, Any]],
+                  start: float, end: float) -> List[Dict[str, Any]]:
+        """缓存中[start, end]的部分 + 未缓存的最新点（调用方需持有锁）"""
+        cached_end = entry.end if entry is not None and entry.start <= start else start - 1
+        merged: Dict[str, Dict[str, Any]] = {}
+        if entry is not None:
+            for key, (metric, timestamps, cached) in entry.series.items():
+                i = bisect_left(timestamps, start)
+                j = bisect_right(timestamps, min(end, cached_end))
+                if i < j:
+                    merged[key] = {'metric': metric, 'values': cached[i:j]}
+        for series in fresh:
+            metric = series.get('metric', {})
+            points = [p for p in series.get('values', []) if cached_end < float(p[0]) <= end]
+            if not points:
+                continue
+            key = json.dumps(metric, sort_keys=True)
+            if key in merged:
+                merged[key]['values'] = merged[key]['values'] + points
+            else:
+                merged[key] = {'metric': metric, 'values': points}
+        return list(merged.values())
+
+    def _evict(self):
+        """淘汰超出容量的最久未使用条目（调用方需持有锁）"""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def cached_points(self) -> int:
+        with self._lock:
+            return sum(entry.points() for entry in self._entries.values())
+
+    def coalesced(self) -> int:
+        """被合并（没有发往上游）的请求数"""
+        return self._flights.stats['coalesced']
+
+    def hit_rate(self) -> float:
+        """完全命中 + 部分命中占全部区间查询的比例"""
+        total = self.stats['hits'] + self.stats['partial_hits'] + self.stats['misses']
+        return (self.stats['hits'] + self.stats['partial_hits']) / total if total > 0 else 0.0
+
+
+class VMCacheProxy:
+    """vmselect缓存代理（HTTP服务，后台线程或前台运行）"""
+
+    def __init__(self, upstream: str = VM_SELECT_URL, host: str = '0.0.0.0',
+                 port: int = DEFAULT_PROXY_PORT, cache_offset: float = DEFAULT_CACHE_OFFSET,
+                 instant_step: float = DEFAULT_INSTANT_STEP, max_entries: int = 2000,
+                 timeout: float = 30, client: Optional[VictoriaMetricsClient] = None):
+        """
+        Args:
+            upstream: vmselect的Prometheus API前缀
+            host: 监听地址
+            port: 监听端口（0表示自动分配）
+            cache_offset: 最近多少秒内的点不缓存
+            instant_step: 即时查询的时间对齐粒度和缓存有效期（秒）
+            max_entries: 区间缓存最多保存的(查询, step)数
+            timeout: 上游请求超时（秒）
+            client: 共享的VictoriaMetricsClient（为None时新建，连接池大小与服务线程相当）
+        """
+        self.client = client or VictoriaMetricsClient(select_url=upstream, timeout=timeout,
+                                                      pool_maxsize=32)
+        self.instant_step = instant_step
+        self.range_cache = RangeQueryCache(self.client.query_range, max_entries=max_entries,
+                                           cache_offset=cache_offset)
+        self.instant_cache = ResultCache(max_entries=max_entries, ttl_seconds=instant_step)
+        self._instant_flights = SingleFlight()
+
+        self.stats = {'requests': 0, 'range': 0, 'instant': 0, 'passthrough': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'VMCacheProxy':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.client.close()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    # ------------------------------------------------------------------
+    # 查询处理
+    # ------------------------------------------------------------------
+
+    def handle_query_range(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """/api/v1/query_range"""
+        self._count('range')
+        step = parse_duration(params['step'])
+        if step <= 0:
+            raise ValueError("step必须为正数")
+        start, end = align_range(float(params['start']), float(params['end']), step)
+        if params.get('nocache') == '1':
+            result = self.client.query_range(params['query'], start, end, step)
+        else:
+            result, _ = self.range_cache.query_range(params['query'], start, end, step)
+        return {'status': 'success', 'data': {'resultType': 'matrix', 'result': result}}
+
+    def handle_query(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """/api/v1/query（时间按instant_step对齐后短时缓存，相同的在途查询合并）"""
+        self._count('instant')
+        query = params['query']
+        at = float(params['time']) if params.get('time') else time.time()
+        at = math.floor(at / self.instant_step) * self.instant_step
+        data = self.instant_cache.get_item('instant', (query, at))
+        if data is None:
+            data = self._instant_flights.do(
+                (query, at), lambda: self.client.query_raw({'query': query, 'time': at}))
+            self.instant_cache.put_item('instant', (query, at), data)
+        return {'status': 'success', 'data': data}
+
+    def passthrough(self, method: str, path: str, params: Dict[str, List[str]]) -> Tuple[int, bytes]:
+        """其余接口原样转发"""
+        self._count('passthrough')
+        return self.client.forward(method, path, params)
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Any]:
+        """代理与缓存的统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['range_cache'] = dict(self.range_cache.stats)
+        stats['range_cache']['entries'] = len(self.range_cache)
+        stats['range_cache']['cached_points'] = self.range_cache.cached_points()
+        stats['range_cache']['coalesced'] = self.range_cache.coalesced()
+        stats['range_cache']['hit_rate'] = self.range_cache.hit_rate()
+        stats['instant_cache'] = dict(self.instant_cache.stats)
+        stats['instant_cache']['coalesced'] = self._instant_flights.stats['coalesced']
+        stats['instant_cache']['hit_rate'] = self.instant_cache.hit_rate()
+        return stats
+
+    def metrics_text(self) -> str:
+        """Prometheus文本格式的指标（可由vmagent抓取）"""
+        stats = self.snapshot()
+        rc, ic = stats['range_cache'], stats['instant_cache']
+        served = rc['points_served']
+        lines = [
+            '# TYPE vm_cache_proxy_requests_total counter',
+            *[f'vm_cache_proxy_requests_total{{type="{kind}"}} {stats[kind]}'
+              for kind in ('range', 'instant', 'passthrough')],
+            f'vm_cache_proxy_errors_total {stats["errors"]}',
+            '# TYPE vm_cache_proxy_range_lookups_total counter',
+            f'vm_cache_proxy_range_lookups_total{{result="hit"}} {rc["hits"]}',
+            f'vm_cache_proxy_range_lookups_total{{result="partial"}} {rc["partial_hits"]}',
+            f'vm_cache_proxy_range_lookups_total{{result="miss"}} {rc["misses"]}',
+            f'vm_cache_proxy_range_hit_ratio {rc["hit_rate"]:.6f}',
+            f'vm_cache_proxy_range_points_served_total {served}',
+            f'vm_cache_proxy_range_points_fetched_total {rc["points_fetched"]}',
+            f'vm_cache_proxy_range_point_reuse_ratio '
+            f'{(1 - rc["points_fetched"] / served) if served else 0.0:.6f}',
+            f'vm_cache_proxy_range_entries {rc["entries"]}',
+            f'vm_cache_proxy_range_cached_points {rc["cached_points"]}',
+            f'vm_cache_proxy_range_evictions_total {rc["evictions"]}',
+            f'vm_cache_proxy_instant_lookups_total{{result="hit"}} {ic["hits"]}',
+            f'vm_cache_proxy_instant_lookups_total{{result="miss"}} {ic["misses"]}',
+            f'vm_cache_proxy_instant_hit_ratio {ic["hit_rate"]:.6f}',
+            f'vm_cache_proxy_coalesced_total{{type="range"}} {rc["coalesced"]}',
+            f'vm_cache_proxy_coalesced_total{{type="instant"}} {ic["coalesced"]}',
+            f'vm_cache_proxy_upstream_requests_total {rc["upstream_requests"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_bytes(self, status: int, data: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send(self, status: int, body: dict):
+                self._send_bytes(status, json.dumps(body).encode('utf-8'), 'application/json')
+
+            def _error(self, status: int, error_type: str, message: str):
+                server._count('errors')
+                self._send(status, {'status': 'error', 'errorType': error_type, 'error': message})
+
+            def _handle(self, method: str):
+                parts = urlsplit(self.path)
+                params = parse_qs(parts.query)
+                if method == 'POST':
+                    length = int(self.headers.get('Content-Length', 0))
+                    params.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+
+                if parts.path == '/metrics':
+                    self._send_bytes(200, server.metrics_text().encode('utf-8'),
+                                     'text/plain; version=0.0.4')
+                    return
+                if parts.path == '/stats':
+                    self._send(200, server.snapshot())
+                    return
+                if parts.path == '/health':
+                    self._send_bytes(200, b'OK', 'text/plain')
+                    return
+
+                # 兼容 /select/0/prometheus/api/v1/... 和 /api/v1/... 两种路径
+                at = parts.path.find('/api/v1/')
+                if at < 0:
+                    self._error(404, 'not_found', f"unsupported path: {parts.path}")
+                    return
+                path = parts.path[at:]
+                server._count('requests')
+                single = {key: values[-1] for key, values in params.items()}
+                try:
+                    if path == '/api/v1/query_range':
+                        self._send(200, server.handle_query_range(single))
+                    elif path == '/api/v1/query':
+                        self._send(200, server.handle_query(single))
+                    else:
+                        status, content = server.passthrough(method, path, params)
+                        self._send_bytes(status, content, 'application/json')
+                except (KeyError, ValueError) as e:
+                    self._error(400, 'bad_data', f"invalid parameter: {e}")
+                except VMQueryError as e:
+                    self._error(e.status or 502, 'upstream', str(e))
+                except requests.RequestException as e:
+                    self._error(502, 'upstream', str(e))
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="vmselect缓存查询代理")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PROXY_PORT, help="监听端口")
+    parser.add_argument("--upstream", default=VM_SELECT_URL, help="vmselect查询地址")
+    parser.add_argument("--cache-offset", type=float, default=DEFAULT_CACHE_OFFSET,
+                        help="最近多少秒内的点不缓存")
+    parser.add_argument("--instant-step", type=float, default=DEFAULT_INSTANT_STEP,
+                        help="即时查询的时间对齐粒度和缓存有效期（秒）")
+    parser.add_argument("--max-entries", type=int, default=2000, help="区间缓存最多保存的查询数")
+
+    args = parser.parse_args()
+
+    proxy = VMCacheProxy(args.upstream, args.host, args.port, args.cache_offset,
+                         args.instant_step, args.max_entries)
+    print(f"✓ vmselect缓存代理已启动: {proxy.url}/select/0/prometheus -> {args.upstream}")
+    print(f"  指标: {proxy.url}/metrics")
+    try:
+        proxy.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[信息] 代理已停止")
+        print(f"[信息] 统计: {json.dumps(proxy.snapshot(), ensure_ascii=False)}")
+    finally:
+        proxy.httpd.server_close()
+        proxy.client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+VictoriaMetrics导出数据的流式列式解析
+/api/v1/export 返回JSON lines，一行一个序列。json.loads会先把每个样本变成Python对象，
+再转换为数组，长历史拉取时既慢又占内存。这里只用json解析很短的metric标签部分，
+values/timestamps数组直接从原始字节解析进预分配的float64/int64缓冲区：
+
+- SeriesBuffer: 单个序列的可增长列缓冲区，可限制只保留最新的max_points个点（内存有界）
+- ExportColumnReader: 逐行/逐块消费JSON lines或CSV导出（/api/v1/export/csv），
+  同一序列跨时间分段的多次返回会自动拼接并去掉重叠的样本
+- 解析结果以数组视图的形式交给分析引擎和预测器（to_series/to_frame不复制数据）
+"""
+
+import json
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# CSV导出使用的列格式（/api/v1/export/csv的format参数）
+CSV_EXPORT_FORMAT = '__name__,vehicle_id,__timestamp__:unix_ms,__value__'
+
+SeriesKey = Tuple[Tuple[str, str], ...]
+
+
+def series_key(labels: Dict[str, str]) -> SeriesKey:
+    """标签字典转换为可哈希的序列键"""
+    return tuple(sorted(labels.items()))
+
+
+class SeriesBuffer:
+    """单个序列的列式缓冲区（按时间升序追加）"""
+
+    __slots__ = ('labels', 'max_points', '_timestamps', '_values', 'size', 'dropped')
+
+    def __init__(self, labels: Dict[str, str], capacity: int = 1024,
+                 max_points: Optional[int] = None):
+        """
+        Args:
+            labels: 序列标签
+            capacity: 初始容量（点数）
+            max_points: 只保留最新的若干个点（None为不限）
+        """
+        self.labels = labels
+        self.max_points = max_points
+        if max_points is not None:
+            capacity = min(capacity, 2 * max_points)
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.dropped = 0
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """毫秒时间戳（视图）"""
+        return self._timestamps[:self.size]
+
+    @property
+    def values(self) -> np.ndarray:
+        """样本值（视图）"""
+        return self._values[:self.size]
+
+    def _compact(self):
+        """把最新的max_points个点移到缓冲区开头"""
+        if self.max_points is None or self.size <= self.max_points:
+            return
+        keep = self.max_points
+        self.dropped += self.size - keep
+        self._timestamps[:keep] = self._timestamps[self.size - keep:self.size]
+        self._values[:keep] = self._values[self.size - keep:self.size]
+        self.size = keep
+
+    def _reserve(self, extra: int):
+        if self.size + extra <= len(self._values):
+            return
+        # 有点数上限时容量保持在2*max_points以内：满了先压缩而不是扩容
+        self._compact()
+        needed = self.size + extra
+        if needed <= len(self._values):
+            return
+        capacity = max(needed, 2 * len(self._values))
+        timestamps = np.empty(capacity, dtype=np.int64)
+        values = np.empty(capacity, dtype=np.float64)
+        timestamps[:self.size] = self._timestamps[:self.size]
+        values[:self.size] = self._values[:self.size]
+        self._timestamps, self._values = timestamps, values
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray):
+        """
+        追加一段样本（时间戳不晚于已有最新时间戳的样本视为分段重叠，丢弃）
+
+        Args:
+            timestamps: int64毫秒时间戳（升序）
+            values: float64样本值
+        """
+        if self.size and len(timestamps):
+            start = int(np.searchsorted(timestamps, self._timestamps[self.size - 1], side='right'))
+            timestamps, values = timestamps[start:], values[start:]
+        if self.max_points is not None and len(values) > self.max_points:
+            self.dropped += len(values) - self.max_points
+            timestamps, values = timestamps[-self.max_points:], values[-self.max_points:]
+        n = len(values)
+        if not n:
+            return
+        self._reserve(n)
+        self._timestamps[self.size:self.size + n] = timestamps
+        self._values[self.size:self.size + n] = values
+        self.size += n
+
+    def trim(self):
+        """截取最新的max_points个点（读取前调用，保证结果有界）"""
+        self._compact()
+
+    def to_series(self) -> pd.Series:
+        """转换为以时间为索引的pd.Series（共享底层数组，不复制）"""
+        index = pd.DatetimeIndex(self.timestamps.view('datetime64[ms]'), name='timestamp')
+        return pd.Series(self.values, index=index, copy=False)
+
+
+def _parse_array(segment: bytes, dtype) -> Optional[np.ndarray]:
+    """解析形如 1,2.5,3 的数字列表；含null等非数字内容时返回None"""
+    if not segment:
+        return np.zeros(0, dtype=dtype)
+    text = segment.decode('ascii')
+    expected = text.count(',') + 1
+    try:
+        array = np.array(text.split(','), dtype=dtype)
+    except ValueError:
+        return None
+    return array if len(array) == expected else None
+
+
+def parse_export_line(line: bytes) -> Tuple[Dict[str, str], np.ndarray, np.ndarray]:
+    """
+    解析一行JSON lines导出
+
+    Returns:
+        (标签, int64毫秒时间戳, float64样本值)
+    """
+    values_at = line.find(b'"values":[')
+    timestamps_at = line.find(b'"timestamps":[')
+    metric_at = line.find(b'"metric":')
+    if min(values_at, timestamps_at, metric_at) >= 0:
+        values_end = line.find(b']', values_at)
+        timestamps_end = line.find(b']', timestamps_at)
+        values = _parse_array(line[values_at + 10:values_end], np.float64)
+        timestamps = _parse_array(line[timestamps_at + 14:timestamps_end], np.int64)
+        # 标签值中含有}时，截到第一个}的片段不是完整的标签对象（解析失败），退回完整解析
+        metric_end = line.find(b'}', metric_at)
+        if values is not None and timestamps is not None and \
+                metric_at < metric_end < min(values_at, timestamps_at):
+            try:
+                labels = json.loads(line[metric_at + 9:metric_end + 1])
+            except ValueError:
+                labels = None
+            if isinstance(labels, dict):
+                return labels, timestamps, values
+
+    # 非常规格式（字段顺序不同、含null等）时退回完整JSON解析
+    series = json.loads(line)
+    values = np.array([np.nan if v is None else v for v in series.get('values', [])],
+                      dtype=np.float64)
+    return (series.get('metric', {}),
+            np.asarray(series.get('timestamps', []), dtype=np.int64), values)
+
+
+class ExportColumnReader:
+    """流式导出解析器：把任意多行/多块导出数据拼成每个序列一组列数组"""
+
+    def __init__(self, max_points_per_series: Optional[int] = None,
+                 initial_capacity: int = 1024,
+                 metric_filter: Optional[Sequence[str]] = None):
+        """
+        Args:
+            max_points_per_series: 每个序列只保留最新的若干个点（内存有界）
+            initial_capacity: 新序列的初始容量
+            metric_filter: 只保留这些指标名（None为全部）
+        """
+        self.max_points_per_series = max_points_per_series
+        self.initial_capacity = initial_capacity
+        self.metric_filter = set(metric_filter) if metric_filter is not None else None
+        self.series: Dict[SeriesKey, SeriesBuffer] = {}
+        self.samples = 0
+        self.lines = 0
+
+    def _buffer(self, labels: Dict[str, str], size_hint: int) -> SeriesBuffer:
+        key = series_key(labels)
+        buffer = self.series.get(key)
+        if buffer is None:
+            buffer = SeriesBuffer(labels, max(self.initial_capacity, size_hint),
+                                  self.max_points_per_series)
+            self.series[key] = buffer
+        return buffer
+
+    def feed_line(self, line: bytes):
+        """消费一行JSON lines导出"""
+        if not line or not line.strip():
+            return
+        self.lines += 1
+        labels, timestamps, values = parse_export_line(line)
+        if self.metric_filter is not None and labels.get('__name__') not in self.metric_filter:
+            return
+        self.samples += len(values)
+        self._buffer(labels, len(values)).append(timestamps, values)
+
+    def read_json_lines(self, lines: Iterable[bytes]) -> 'ExportColumnReader':
+        """消费JSON lines导出（如Response.iter_lines()）"""
+        for line in lines:
+            self.feed_line(line)
+        return self
+
+    def read_csv_lines(self, lines: Iterable[bytes], batch_size: int = 65536) -> 'ExportColumnReader':
+        """
+        消费CSV导出（列格式为CSV_EXPORT_FORMAT），按批向量化解析
+        （同一序列的行需按时间先后到达，vmselect的导出即如此；批内顺序不限）
+
+        Args:
+            lines: CSV行迭代器
+            batch_size: 每批行数
+        """
+        batch = []
+        for line in lines:
+            if line:
+                batch.append(line)
+            if len(batch) >= batch_size:
+                self._feed_csv_batch(batch)
+                batch = []
+        if batch:
+            self._feed_csv_batch(batch)
+        return self
+
+    def _feed_csv_batch(self, batch: Sequence[bytes]):
+        rows = [line.rstrip(b'\r').split(b',', 3) for line in batch]
+        self.lines += len(rows)
+        names = np.array([row[0] for row in rows])
+        vehicles = np.array([row[1] for row in rows])
+        timestamps = np.array([row[2] for row in rows]).astype(np.int64)
+        values = np.array([row[3] for row in rows]).astype(np.float64)
+
+        # 按(指标, 车辆)分组，组内按时间排序后整段追加
+        order = np.lexsort((timestamps, vehicles, names))
+        names, vehicles = names[order], vehicles[order]
+        timestamps, values = timestamps[order], values[order]
+        starts = np.flatnonzero(np.r_[True, (names[1:] != names[:-1]) | (vehicles[1:] != vehicles[:-1])])
+        ends = np.r_[starts[1:], len(names)]
+        for start, end in zip(starts, ends):
+            name, vehicle_id = names[start].decode(), vehicles[start].decode()
+            if self.metric_filter is not None and name not in self.metric_filter:
+                continue
+            labels = {'__name__': name, 'vehicle_id': vehicle_id} if vehicle_id else {'__name__': name}
+            self.samples += end - start
+            self._buffer(labels, end - start).append(timestamps[start:end], values[start:end])
+
+    def __iter__(self) -> Iterator[SeriesBuffer]:
+        for buffer in self.series.values():
+            buffer.trim()
+            yield buffer
+
+    def by_vehicle(self, column_map: Optional[Dict[str, str]] = None
+                   ) -> Dict[str, Dict[str, SeriesBuffer]]:
+        """
+        按车辆分组
+
+        Args:
+            column_map: 指标名 -> 列名（不在映射中的指标忽略；为None时用指标名作列名）
+
+        Returns:
+            {vehicle_id: {列名: SeriesBuffer}}（多个指标映射到同一列时保留点数多的）
+        """
+        vehicles: Dict[str, Dict[str, SeriesBuffer]] = {}
+        for buffer in self:
+            vehicle_id = buffer.labels.get('vehicle_id')
+            name = buffer.labels.get('__name__')
+            column = name if column_map is None else column_map.get(name)
+            if vehicle_id is None or column is None:
+                continue
+            columns = vehicles.setdefault(vehicle_id, {})
+            if column not in columns or buffer.size > columns[column].size:
+                columns[column] = buffer
+        return vehicles
+
+    @staticmethod
+    def to_frame(columns: Dict[str, SeriesBuffer]) -> pd.DataFrame:
+        """一辆车的多个序列对齐为宽表（见columns_to_frame）"""
+        return columns_to_frame({name: (b.timestamps, b.values) for name, b in columns.items()})
+
+
+def columns_to_frame(columns: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> pd.DataFrame:
+    """
+    多个(毫秒时间戳, 值)列对齐为宽表（timestamp列 + 每个指标一列，前向填充）
+
+    所有列时间戳相同时直接使用原数组，否则按时间戳并集对齐
+    """
+    arrays = list(columns.values())
+    first = arrays[0][0]
+    if all(len(ts) == len(first) and np.array_equal(ts, first) for ts, _ in arrays[1:]):
+        data = {name: values for name, (_, values) in columns.items()}
+        frame = pd.DataFrame(data, index=pd.DatetimeIndex(first.view('datetime64[ms]')),
+                             copy=False)
+    else:
+        frame = pd.DataFrame({
+            name: pd.Series(values, index=pd.DatetimeIndex(ts.view('datetime64[ms]')), copy=False)
+            for name, (ts, values) in columns.items()
+        }).ffill()
+    frame.index.name = 'timestamp'
+    return frame.reset_index()
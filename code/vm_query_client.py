@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+VictoriaMetrics查询客户端
+诊断脚本、连接测试、端到端测试和分析服务共用的数据访问层：
+
+- 连接池：同一个requests.Session + HTTPAdapter复用TCP连接
+- 重试：连接错误和429/5xx按指数退避重试，统一超时
+- 压缩：查询响应gzip压缩，批量写入的请求体gzip压缩
+- 批量查询：多个指标名合并为一个 {__name__=~"a|b|c"} 正则选择器
+- 分段查询：query_range/export按时间切块，避免超出单次查询的点数上限
+"""
+
+import gzip
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from vm_export_reader import CSV_EXPORT_FORMAT, ExportColumnReader
+
+# 配置（集群版本）
+VM_SELECT_URL = "http://localhost:8481/select/0/prometheus"
+VM_INSERT_URL = "http://localhost:8480/insert/0/prometheus/api/v1/import/prometheus"
+
+# 单个正则选择器的最大长度（字符），超出时拆成多个查询
+MAX_SELECTOR_LENGTH = 4000
+
+# vmselect默认单序列最多返回30000个点，分段时留出余量
+MAX_POINTS_PER_QUERY = 10000
+
+# 小于该字节数的写入请求体不压缩
+GZIP_MIN_BYTES = 1024
+
+# 流式读取响应的块大小（字节）
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class VMQueryError(Exception):
+    """查询失败（HTTP错误或响应status不为success）"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def regex_selector(names: Sequence[str], label_filters: str = '') -> str:
+    """
+    构造按指标名正则匹配的选择器
+
+    Args:
+        names: 指标名列表
+        label_filters: 附加的标签过滤（如 'vehicle_id="T001"'）
+
+    Returns:
+        形如 {__name__=~"a|b",vehicle_id="T001"} 的选择器
+    """
+    pattern = '|'.join(re.escape(name).replace('\\', '\\\\') for name in sorted(set(names)))
+    selector = f'__name__=~"{pattern}"'
+    if label_filters:
+        selector += f',{label_filters}'
+    return f'{{{selector}}}'
+
+
+def batch_names(names: Sequence[str], max_length: int = MAX_SELECTOR_LENGTH) -> List[List[str]]:
+    """把指标名分组，使每组拼出的正则不超过max_length"""
+    batches, current, length = [], [], 0
+    for name in sorted(set(names)):
+        if current and length + len(name) + 1 > max_length:
+            batches.append(current)
+            current, length = [], 0
+        current.append(name)
+        length += len(name) + 1
+    if current:
+        batches.append(current)
+    return batches
+
+
+class VictoriaMetricsClient:
+    """VictoriaMetrics查询/写入客户端（线程安全程度同requests.Session）"""
+
+    def __init__(self,
+                 select_url: str = VM_SELECT_URL,
+                 insert_url: str = VM_INSERT_URL,
+                 timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 pool_maxsize: int = 10,
+                 compress_writes: bool = True,
+                 use_env_proxy: bool = False):
+        """
+        Args:
+            select_url: vmselect的Prometheus查询地址
+            insert_url: vminsert的Prometheus导入地址
+            timeout: 每个请求的超时（秒）
+            retries: 连接错误和429/5xx的最大重试次数
+            backoff_factor: 指数退避基数（秒）
+            pool_maxsize: 每个主机保持的连接数
+            compress_writes: 写入请求体是否gzip压缩
+            use_env_proxy: 是否使用环境变量中的代理（本地集群默认直连）
+        """
+        self.select_url = select_url.rstrip('/')
+        self.insert_url = insert_url
+        self.timeout = timeout
+        self.compress_writes = compress_writes
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # 带显式时间戳的导入是幂等的（同一时间戳的样本会被去重），POST也可以重试
+            allowed_methods=frozenset({'GET', 'POST'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.session.trust_env = use_env_proxy
+
+        self.stats = {'requests': 0, 'errors': 0, 'series': 0, 'bytes_sent': 0}
+
+    @property
+    def insert_base_url(self) -> str:
+        """vminsert根地址（用于/health）"""
+        return self.insert_url.split('/insert/')[0]
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self) -> 'VictoriaMetricsClient':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 底层请求
+    # ------------------------------------------------------------------
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        self.stats['requests'] += 1
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.stats['errors'] += 1
+            raise
+        if response.status_code >= 400:
+            self.stats['errors'] += 1
+            raise VMQueryError(f"HTTP {response.status_code}: {response.text[:200]}",
+                               response.status_code)
+        return response
+
+    def _api(self, path: str, params: Dict[str, Any]) -> Any:
+        """调用查询API并返回data字段（查询参数较长时改用POST表单）"""
+        url = f"{self.select_url}{path}"
+        if sum(len(str(v)) for v in params.values()) > 2000:
+            response = self._request('POST', url, data=params)
+        else:
+            response = self._request('GET', url, params=params)
+        body = response.json()
+        if body.get('status') != 'success':
+            raise VMQueryError(f"{body.get('errorType')}: {body.get('error')}", response.status_code)
+        return body.get('data')
+
+    def forward(self, method: str, path: str, params: Dict[str, Any]) -> Tuple[int, bytes]:
+        """
+        原样转发一个vmselect请求（供缓存代理透传未缓存的接口）
+
+        Args:
+            method: 'GET' 或 'POST'（POST时参数按表单发送）
+            path: select_url之后的路径，如 '/api/v1/labels'
+            params: 查询参数（值可以是列表，对应重复的参数）
+
+        Returns:
+            (HTTP状态码, 响应体)；状态码>=400时抛出VMQueryError
+        """
+        url = f"{self.select_url}{path}"
+        if method == 'POST':
+            response = self._request('POST', url, data=params)
+        else:
+            response = self._request('GET', url, params=params)
+        return response.status_code, response.content
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def query(self, expr: str, time: Optional[float] = None,
+              extra_params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        即时查询
+
+        Args:
+            expr: PromQL/MetricsQL表达式
+            time: 查询时间点（Unix秒），默认当前
+            extra_params: 附加的查询参数（如 {'nocache': 1} 跳过vmselect结果缓存）
+
+        Returns:
+            result列表（每项含metric和value）
+        """
+        params = dict(extra_params or {})
+        params['query'] = expr
+        if time is not None:
+            params['time'] = time
+        result = self.query_raw(params).get('result', [])
+        self.stats['series'] += len(result)
+        return result
+
+    def query_raw(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        即时查询，返回完整的data字段（含resultType，标量/字符串结果也原样返回）
+
+        Args:
+            params: /api/v1/query的参数（query、time等）
+
+        Returns:
+            {'resultType': ..., 'result': ...}
+        """
+        return self._api('/api/v1/query', params)
+
+    def query_many(self, names: Sequence[str], label_filters: str = '',
+                   time: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量查询多个指标的最新值（按正则选择器分组，每组一个请求）
+
+        Args:
+            names: 指标名列表
+            label_filters: 附加的标签过滤
+            time: 查询时间点（Unix秒）
+
+        Returns:
+            {指标名: result列表}，没有数据的指标对应空列表
+        """
+        results: Dict[str, List[Dict[str, Any]]] = {name: [] for name in names}
+        for batch in batch_names(names):
+            for series in self.query(regex_selector(batch, label_filters), time):
+                results.setdefault(series.get('metric', {}).get('__name__'), []).append(series)
+        return results
+
+    def query_range(self, expr: str, start: float, end: float, step: float,
+                    max_points: int = MAX_POINTS_PER_QUERY) -> List[Dict[str, Any]]:
+        """
+        区间查询，按max_points个步长切分时间范围后合并
+
+        Args:
+            expr: 查询表达式
+            start: 起始时间（Unix秒）
+            end: 结束时间（Unix秒）
+            step: 步长（秒）
+            max_points: 每段每条序列的最大点数
+
+        Returns:
+            result列表（每项含metric和values，values按时间升序且无重复）
+        """
+        chunk_seconds = step * max_points
+        merged: Dict[tuple, Dict[str, Any]] = {}
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + chunk_seconds - step, end)
+            data = self._api('/api/v1/query_range',
+                             {'query': expr, 'start': chunk_start, 'end': chunk_end, 'step': step})
+            for series in data.get('result', []):
+                key = tuple(sorted(series.get('metric', {}).items()))
+                entry = merged.setdefault(key, {'metric': series.get('metric', {}), 'values': []})
+                entry['values'].extend(series.get('values', []))
+            chunk_start = chunk_end + step
+
+        for entry in merged.values():
+            entry['values'] = list({point[0]: point for point in entry['values']}.values())
+            entry['values'].sort(key=lambda point: point[0])
+        self.stats['series'] += len(merged)
+        return list(merged.values())
+
+    def export_lines(self, selector: str, start: Optional[float] = None,
+                     end: Optional[float] = None, chunk_seconds: Optional[float] = None,
+                     fmt: str = 'json') -> Iterator[bytes]:
+        """
+        流式导出原始样本的未解析行，可按时间切块
+
+        Args:
+            selector: 序列选择器
+            start: 起始时间（Unix秒）
+            end: 结束时间（Unix秒）
+            chunk_seconds: 每段时长，为None时一次导出
+            fmt: 'json'（/api/v1/export，每行一个序列）或'csv'（/api/v1/export/csv，每行一个样本）
+
+        Yields:
+            原始字节行
+        """
+        path, extra = '/api/v1/export', {}
+        if fmt == 'csv':
+            path, extra = '/api/v1/export/csv', {'format': CSV_EXPORT_FORMAT}
+
+        windows = [(start, end)]
+        if chunk_seconds and start is not None and end is not None:
+            windows, chunk_start = [], start
+            while chunk_start < end:
+                windows.append((chunk_start, min(chunk_start + chunk_seconds, end)))
+                chunk_start += chunk_seconds
+
+        for window_start, window_end in windows:
+            params = {'match[]': selector, **extra}
+            if window_start is not None:
+                params['start'] = window_start
+            if window_end is not None:
+                params['end'] = window_end
+            response = self._request('GET', f"{self.select_url}{path}",
+                                     params=params, stream=True)
+            with response:
+                for line in response.iter_lines(chunk_size=STREAM_CHUNK_BYTES):
+                    if line:
+                        yield line
+
+    def export(self, selector: str, start: Optional[float] = None, end: Optional[float] = None,
+               chunk_seconds: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        流式导出原始样本（/api/v1/export，JSON lines），逐行解析为字典
+
+        Yields:
+            {'metric': {...}, 'values': [...], 'timestamps': [...]}，同一序列在不同时间段会分多次返回
+        """
+        for line in self.export_lines(selector, start, end, chunk_seconds):
+            self.stats['series'] += 1
+            yield json.loads(line)
+
+    def export_columns(self, selector: str, start: Optional[float] = None,
+                       end: Optional[float] = None, chunk_seconds: Optional[float] = None,
+                       max_points_per_series: Optional[int] = None,
+                       fmt: str = 'json') -> ExportColumnReader:
+        """
+        流式导出并直接解析为每个序列的int64/float64列数组
+
+        Args:
+            selector: 序列选择器
+            start: 起始时间（Unix秒）
+            end: 结束时间（Unix秒）
+            chunk_seconds: 每段时长
+            max_points_per_series: 每个序列只保留最新的若干个点
+            fmt: 'json'或'csv'
+
+        Returns:
+            ExportColumnReader（reader.series为 {序列键: SeriesBuffer}）
+        """
+        reader = ExportColumnReader(max_points_per_series)
+        lines = self.export_lines(selector, start, end, chunk_seconds, fmt)
+        if fmt == 'csv':
+            reader.read_csv_lines(lines)
+        else:
+            reader.read_json_lines(lines)
+        self.stats['series'] += len(reader.series)
+        return reader
+
+    def label_values(self, label: str, match: Optional[str] = None) -> List[str]:
+        """查询标签的所有取值（可用match[]限定序列）"""
+        params = {'match[]': match} if match else {}
+        return self._api(f'/api/v1/label/{label}/values', params) or []
+
+    def metric_names(self, prefix: str = '') -> List[str]:
+        """所有指标名（可按前缀过滤）"""
+        return [name for name in self.label_values('__name__') if name.startswith(prefix)]
+
+    # ------------------------------------------------------------------
+    # 写入与健康检查
+    # ------------------------------------------------------------------
+
+    def import_prometheus(self, lines) -> bool:
+        """
+        批量导入Prometheus文本格式数据
+
+        Args:
+            lines: 行列表或已拼接好的文本
+
+        Returns:
+            是否写入成功（vminsert返回204）
+        """
+        body = lines if isinstance(lines, str) else '\n'.join(lines)
+        data = body.encode('utf-8')
+        headers = {'Content-Type': 'text/plain'}
+        if self.compress_writes and len(data) >= GZIP_MIN_BYTES:
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        self.stats['bytes_sent'] += len(data)
+        response = self._request('POST', self.insert_url, data=data, headers=headers)
+        return response.status_code == 204
+
+    def health(self, component: str = 'select') -> bool:
+        """vmselect/vminsert的/health检查"""
+        base = self.insert_base_url if component == 'insert' else self.select_url.split('/select/')[0]
+        try:
+            return self._request('GET', f"{base}/health").status_code == 200
+        except (requests.RequestException, VMQueryError):
+            return False
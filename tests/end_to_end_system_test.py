@@ -17,10 +17,12 @@ from typing import Dict, List, Any
 
 # 导入自定义模块
 sys.path.append('/home/ubuntu')
-from tbox_simulator import TractorDataSimulator
-from mqtt_to_victoriametrics_bridge import MQTTToVictoriaMetricsBridge
+from tbox_simulator import PACKET_SCHEMA, TractorDataSimulator
+from mqtt_to_victoriametrics_bridge import format_prometheus_lines
 from predictive_maintenance_engine import PredictiveMaintenanceEngine
 from nixtla_timegpt_integration import NixtlaTimeGPTIntegration
+from vm_query_client import VictoriaMetricsClient, regex_selector
+from telemetry_buffer import TelemetryBuffer
 
 
 class EndToEndSystemTest:
@@ -35,11 +37,12 @@ class EndToEndSystemTest:
         """
         self.vehicle_id = vehicle_id
         self.tbox_simulator = TractorDataSimulator(vehicle_id)
-        self.data_bridge = MQTTToVictoriaMetricsBridge(vm_url="http://localhost:8480")
         self.maintenance_engine = PredictiveMaintenanceEngine(vehicle_id)
         self.timegpt_integration = NixtlaTimeGPTIntegration(api_key=None)
+        self.vm_client = VictoriaMetricsClient(timeout=5, retries=1)
         
-        self.collected_data = []
+        # 采集的数据包直接写入列式缓冲区，不保留嵌套dict
+        self.collected_data = TelemetryBuffer(vehicle_id)
         
     def test_data_collection(self, duration_seconds: int = 10, sample_rate: float = 1.0):
         """
@@ -61,8 +64,8 @@ class EndToEndSystemTest:
         
         while time.time() - start_time < duration_seconds:
             # 生成数据包
-            data_packet = self.tbox_simulator.generate_complete_data_packet()
-            self.collected_data.append(data_packet)
+            data_packet = self.tbox_simulator.fill_packet()
+            self.collected_data.append_record(data_packet, PACKET_SCHEMA)
             
             # 更新状态
             self.tbox_simulator.update_state(1.0 / sample_rate)
@@ -71,6 +74,7 @@ class EndToEndSystemTest:
             time.sleep(1.0 / sample_rate)
         
         print(f"✓ 数据采集完成: 共采集 {sample_count} 个数据包")
+        print(f"  缓冲区: {len(self.collected_data.channels)} 个通道, {self.collected_data.nbytes / 1024:.1f} KB")
         return sample_count
     
     def test_data_ingestion(self):
@@ -82,16 +86,27 @@ class EndToEndSystemTest:
         print(f"将采集的数据转换为VictoriaMetrics格式...")
         
         total_metrics = 0
-        for data_packet in self.collected_data:
-            prometheus_lines = self.data_bridge.convert_to_prometheus_format(data_packet)
-            total_metrics += len(prometheus_lines)
+        all_lines = []
+        for timestamp_ms, metrics in self.collected_data.rows():
+            total_metrics += len(metrics)
+            all_lines.append(format_prometheus_lines(self.vehicle_id, timestamp_ms, metrics))
         
         print(f"✓ 数据转换完成: 共生成 {total_metrics} 个时序指标")
         print(f"  平均每个数据包: {total_metrics / len(self.collected_data):.0f} 个指标")
         
-        # 注意: 实际写入VictoriaMetrics需要服务运行
-        print(f"\n注意: 实际写入VictoriaMetrics需要先启动服务")
-        print(f"      使用 docker-compose up -d 启动VictoriaMetrics集群")
+        # 服务运行时一次批量写入，再用一个正则查询回读
+        if not self.vm_client.health('insert'):
+            print(f"\n注意: 实际写入VictoriaMetrics需要先启动服务")
+            print(f"      使用 docker-compose up -d 启动VictoriaMetrics集群")
+            return total_metrics
+        
+        if self.vm_client.import_prometheus(all_lines):
+            print(f"✓ 已批量写入VictoriaMetrics ({self.vm_client.stats['bytes_sent']} 字节)")
+            time.sleep(2)
+            names = sorted(self.collected_data.channels)
+            series = self.vm_client.query(
+                regex_selector(names, f'vehicle_id="{self.vehicle_id}"'))
+            print(f"✓ 回读 {len(series)}/{len(names)} 个序列")
         
         return total_metrics
     
@@ -104,27 +119,13 @@ class EndToEndSystemTest:
         # 从采集的数据中提取关键指标
         print(f"从 {len(self.collected_data)} 个数据包中提取关键指标...")
         
-        timestamps = []
-        engine_temps = []
-        battery_sohs = []
-        hydraulic_pressures = []
-        
-        for data_packet in self.collected_data:
-            timestamps.append(pd.to_datetime(data_packet['timestamp']))
-            engine_temps.append(data_packet['engine']['coolant_temp'])
-            battery_sohs.append(data_packet['battery']['soh'])
-            hydraulic_pressures.append(data_packet['hydraulic']['pressure'])
-        
-        # 创建DataFrame
-        historical_data = pd.DataFrame({
-            'timestamp': timestamps,
-            'engine_coolant_temp': engine_temps,
-            'battery_soh': battery_sohs,
-            'hydraulic_pressure': hydraulic_pressures,
-            'engine_oil_pressure': [4.5] * len(timestamps),  # 简化
-            'battery_temp_max': [35] * len(timestamps),  # 简化
-            'sensor_quality_score': [95] * len(timestamps),  # 简化
-        })
+        # 通道名即分析列名，直接以缓冲区数组构造DataFrame
+        columns = ['engine_coolant_temp', 'battery_soh', 'hydraulic_pressure',
+                   'engine_oil_pressure', 'battery_temp_max']
+        historical_data = self.collected_data.to_frame(
+            {name: name for name in columns},
+            defaults={'sensor_quality_score': 95.0},  # 简化
+        )
         
         print(f"✓ 数据提取完成")
         print(f"  - 时间范围: {historical_data['timestamp'].min()} 至 {historical_data['timestamp'].max()}")
@@ -152,13 +153,9 @@ class EndToEndSystemTest:
         print("=" * 80)
         
         # 提取电池SOH数据
-        timestamps = [pd.to_datetime(d['timestamp']) for d in self.collected_data]
-        battery_sohs = [d['battery']['soh'] for d in self.collected_data]
-        
-        battery_df = pd.DataFrame({
-            'timestamp': timestamps,
-            'battery_soh': battery_sohs
-        })
+        battery_df = self.collected_data.to_frame({'battery_soh': 'battery_soh'})
+        battery_sohs = battery_df['battery_soh']
+        timestamps = battery_df['timestamp']
         
         print(f"使用TimeGPT预测未来7天的电池SOH趋势...")
         
@@ -170,7 +167,7 @@ class EndToEndSystemTest:
         
         print(f"✓ 长期预测完成")
         print(f"  - 预测时间点: {len(forecast_result)} 个")
-        print(f"  - 当前SOH: {battery_sohs[-1]:.2f}%")
+        print(f"  - 当前SOH: {battery_sohs.iloc[-1]:.2f}%")
         print(f"  - 7天后预测SOH: {forecast_result['forecast'].iloc[-1]:.2f}%")
         
         # 检查是否会跌破阈值
@@ -178,7 +175,7 @@ class EndToEndSystemTest:
         below_threshold = forecast_result[forecast_result['forecast'] < failure_threshold]
         if len(below_threshold) > 0:
             first_failure = below_threshold.iloc[0]
-            days_to_failure = (first_failure['timestamp'] - timestamps[-1]).total_seconds() / 86400
+            days_to_failure = (first_failure['timestamp'] - timestamps.iloc[-1]).total_seconds() / 86400
             print(f"  - ⚠️  预警: 预计 {days_to_failure:.1f} 天后SOH将跌破{failure_threshold}%")
         else:
             print(f"  - ✓ 预测期内SOH不会跌破{failure_threshold}%")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+模拟异常检测的退化基线测试
+平稳或量化的传感器数据MAD为0，尖峰仍须被检出（整段、分块两种模式）
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from nixtla_timegpt_integration import NixtlaTimeGPTIntegration
+from robust_sketches import RollingMedianMAD, robust_zscore
+
+
+def constant_with_spike():
+    values = np.r_[np.full(250, 80.0), 130.0]
+    return np.arange(len(values)), values
+
+
+def test_constant_series_spike_is_flagged():
+    timestamps, values = constant_with_spike()
+    result = NixtlaTimeGPTIntegration.simulate_anomaly_arrays(timestamps, values)
+    assert result['is_anomaly'].sum() == 1
+    assert result['is_anomaly'][-1]
+    assert np.isfinite(result['z_score']).all()
+
+
+def test_constant_series_without_spike_is_clean():
+    values = np.full(100, 80.0)
+    result = NixtlaTimeGPTIntegration.simulate_anomaly_arrays(np.arange(100), values)
+    assert not result['is_anomaly'].any()
+    assert (result['z_score'] == 0).all()
+
+
+def test_chunked_detection_flags_spike():
+    timestamps, values = constant_with_spike()
+    detector = NixtlaTimeGPTIntegration(seed=0)
+    chunks = [(timestamps[i:i + 60], values[i:i + 60]) for i in range(0, len(values), 60)]
+    flagged = np.concatenate([r['is_anomaly'] for r in detector.iter_anomaly_detection(chunks)])
+    assert flagged.sum() == 1 and flagged[-1]
+
+
+def test_robust_zscore_matches_detector_fallback():
+    _, values = constant_with_spike()
+    assert robust_zscore(130.0, values[:-1]) > 3.0
+    assert robust_zscore(80.0, values[:-1]) == 0.0
+
+
+def test_rolling_detector_flags_spike_on_constant_window():
+    detector = RollingMedianMAD(window=60)
+    for _ in range(60):
+        assert detector.update(80.0) == (False, 0.0)
+    is_anomaly, z_score = detector.update(130.0)
+    assert is_anomaly and np.isfinite(z_score)
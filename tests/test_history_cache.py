@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+本地历史缓存的目录命名测试
+车辆ID和指标名中的特殊字符不能让两个序列落到同一目录，读回的ID必须与写入时一致
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from history_cache import MS_PER_DAY, HistoryCache
+
+
+def test_colliding_vehicle_ids_stay_separate(tmp_path):
+    cache = HistoryCache(str(tmp_path))
+    cache.append('v/1', 'battery_soh', np.array([1000, 2000]), np.array([90.0, 89.0]))
+    cache.append('v_1', 'battery_soh', np.array([1500]), np.array([50.0]))
+
+    assert cache.vehicles() == ['v/1', 'v_1']
+    ts, values = cache.read('v/1', 'battery_soh')
+    assert ts.tolist() == [1000, 2000] and values.tolist() == [90.0, 89.0]
+    ts, values = cache.read('v_1', 'battery_soh')
+    assert ts.tolist() == [1500] and values.tolist() == [50.0]
+
+
+def test_special_names_round_trip(tmp_path):
+    cache = HistoryCache(str(tmp_path))
+    names = ['..', '.hidden', 'a%2Fb', '拖拉机 1', 'x~y']
+    for i, name in enumerate(names):
+        cache.append(name, 'vehicle_id:engine_torque:scaled', np.array([i]), np.array([float(i)]))
+
+    assert sorted(cache.vehicles()) == sorted(names)
+    assert not any(n.startswith('.') for n in os.listdir(tmp_path))
+    for i, name in enumerate(names):
+        assert cache.vehicle_metrics(name) == ['vehicle_id:engine_torque:scaled']
+        assert cache.read(name, 'vehicle_id:engine_torque:scaled')[1].tolist() == [float(i)]
+
+
+def test_prune_removes_encoded_directories(tmp_path):
+    cache = HistoryCache(str(tmp_path))
+    cache.append('v/1', 'battery_soh', np.array([1000]), np.array([90.0]))
+    cache.append('v/2', 'battery_soh', np.array([3 * MS_PER_DAY]), np.array([80.0]))
+
+    assert cache.prune(2 * MS_PER_DAY) == 1
+    assert cache.vehicles() == ['v/2']
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+多变量异常检测的通道适配测试
+不同T-BOX上报的联动通道不同（没有engine_load、油耗用engine_fuel_consumption_rate），
+分析服务应按实际存在的通道打分
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from vm_analysis_service import ANALYSIS_METRICS, VictoriaMetricsAnalysisService
+
+
+def tbox_frame(n, seed, rpm_offset=0.0):
+    rng = np.random.default_rng(seed)
+    rpm = 1800 + rng.normal(0, 50, n)
+    torque = 0.3 * rpm + rng.normal(0, 5, n)
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2025-01-01', periods=n, freq='10s'),
+        'engine_rpm': rpm + rpm_offset,
+        'engine_torque': torque,
+        'engine_fuel_rate': 0.01 * torque + rng.normal(0, 0.2, n),
+        'engine_coolant_temp': 85 + rng.normal(0, 1, n),
+    })
+
+
+def test_fuel_consumption_rate_is_mapped():
+    assert ANALYSIS_METRICS['engine_fuel_consumption_rate'] == 'engine_fuel_rate'
+
+
+def test_fleet_without_engine_load_is_scored():
+    service = VictoriaMetricsAnalysisService()
+    service.score_multivariate({'T1': tbox_frame(200, 0), 'T2': tbox_frame(200, 1)})
+    scores = service.score_multivariate({'T1': tbox_frame(20, 2), 'T2': tbox_frame(20, 3, 2000.0)})
+
+    assert set(scores) == {'T1', 'T2'}
+    assert scores['T2'] > 1.0 > scores['T1']
+    assert service.multivariate_channels['T1'] == (
+        'engine_rpm', 'engine_torque', 'engine_fuel_rate', 'engine_coolant_temp')
+
+
+def test_vehicle_without_channels_is_skipped(capsys):
+    service = VictoriaMetricsAnalysisService()
+    frame = pd.DataFrame({'timestamp': pd.date_range('2025-01-01', periods=5, freq='10s'),
+                          'battery_soh': np.full(5, 95.0)})
+    assert service.score_multivariate({'B1': frame}) == {}
+    assert '[警告] 车辆 B1' in capsys.readouterr().out
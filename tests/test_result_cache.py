@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+分析结果缓存的隔离测试
+调用方修改写入或读出的结果不能改动缓存内容
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from result_cache import ResultCache
+
+
+def test_vehicle_results_are_isolated():
+    cache = ResultCache()
+    result = {'health_score': 90.0, 'anomalies': {'battery_soh': False}}
+    cache.put('T1', 'w1', result)
+    result['anomalies']['battery_soh'] = True
+
+    hit = cache.get('T1', 'w1')
+    hit['health_score'] = 0.0
+    latest = cache.get_latest('T1')
+    latest['anomalies']['battery_soh'] = True
+
+    assert cache.get('T1', 'w1') == {'health_score': 90.0, 'anomalies': {'battery_soh': False}}
+    assert cache.get_latest('T1') == {'health_score': 90.0, 'anomalies': {'battery_soh': False}}
+
+
+def test_item_frames_are_isolated():
+    cache = ResultCache()
+    frame = pd.DataFrame({'TimeGPT': [1.0, 2.0]})
+    cache.put_item('forecast', 'k', frame)
+    frame.loc[0, 'TimeGPT'] = -1.0
+
+    hit = cache.get_item('forecast', 'k')
+    hit['extra'] = 0
+    assert cache.get_item('forecast', 'k').columns.tolist() == ['TimeGPT']
+    assert cache.get_item('forecast', 'k')['TimeGPT'].tolist() == [1.0, 2.0]
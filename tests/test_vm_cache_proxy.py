@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+vmselect缓存代理的区间缓存测试
+随机生成相互重叠、向前滚动和向后翻看的时间窗口，逐个比较代理结果与直接查询上游的结果
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+from vm_cache_proxy import RangeQueryCache, align_range
+
+VEHICLES = ('TRACTOR_001', 'TRACTOR_002', 'TRACTOR_003')
+
+
+class FakeUpstream:
+    """按step对齐生成样本的上游（值只由时间戳和车辆决定，TRACTOR_003在部分时段没有数据）"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = 0
+
+    def __call__(self, query, start, end, step):
+        self.calls += 1
+        now = self.clock()
+        results = []
+        for i, vehicle in enumerate(VEHICLES):
+            values = []
+            ts = start
+            while ts <= min(end, now):
+                if not (vehicle == 'TRACTOR_003' and int(ts // 600) % 3 == 0):
+                    values.append([ts, str((ts * (i + 1)) % 997)])
+                ts += step
+            if values:
+                results.append({'metric': {'__name__': query, 'vehicle_id': vehicle}, 'values': values})
+        return results
+
+
+def _normalize(results):
+    return sorted((series['metric']['vehicle_id'], [tuple(p) for p in series['values']]) for series in results)
+
+
+def _make_cache(max_points=100):
+    now = [1_700_000_000.0]
+    upstream = FakeUpstream(lambda: now[0])
+    cache = RangeQueryCache(upstream, max_points=max_points, cache_offset=60, clock=lambda: now[0])
+    return cache, upstream, now
+
+
+def _check(cache, upstream, query, start, end, step):
+    start, end = align_range(start, end, step)
+    result, _ = cache.query_range(query, start, end, step)
+    expected = upstream(query, start, end, step)
+    assert _normalize(result) == _normalize(expected), (start, end, step)
+
+
+def test_scroll_back_beyond_max_points():
+    """向后翻看时头部扩展超过max_points，不能因为裁剪而返回空结果"""
+    cache, upstream, now = _make_cache(max_points=100)
+    step = 10
+    _check(cache, upstream, 'engine_rpm', now[0] - 900, now[0], step)
+    _check(cache, upstream, 'engine_rpm', now[0] - 1500, now[0] - 600, step)
+
+
+def test_overlapping_and_scrolled_windows():
+    """随机的重叠、前进、后退窗口与直接查询一致"""
+    rng = random.Random(42)
+    cache, upstream, now = _make_cache(max_points=100)
+    for _ in range(3000):
+        now[0] += rng.choice([0, 5, 15, 60])
+        step = rng.choice([10, 15, 30])
+        span = rng.randint(1, 120) * step
+        back = rng.choice([0, 0, rng.randint(0, 150) * step])
+        end = now[0] - back + rng.uniform(0, step)
+        _check(cache, upstream, rng.choice(['engine_rpm', 'vehicle_speed']), end - span, end, step)
+
+
+def test_repeated_refresh_fetches_only_tail():
+    """仪表板重复刷新时只拉取缓存之后的部分"""
+    cache, upstream, now = _make_cache(max_points=1000)
+    step = 15
+    _check(cache, upstream, 'engine_rpm', now[0] - 900, now[0], step)
+    now[0] += 30
+    result, outcome = cache.query_range('engine_rpm', *align_range(now[0] - 900, now[0], step), step)
+    assert outcome == 'partial'
+    assert cache.stats['points_fetched'] < cache.stats['points_served']
+
+
+if __name__ == '__main__':
+    test_scroll_back_beyond_max_points()
+    test_overlapping_and_scrolled_windows()
+    test_repeated_refresh_fetches_only_tail()
+    print("✓ 缓存代理测试通过")